@@ -0,0 +1,183 @@
+import collections
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import model_registry
+from merge_and_import import do_merge_and_import, do_adapter_import, ensure_base_gguf, log_status, SharedMergeBase
+
+DEFAULT_NAME_TEMPLATE = "{name}:latest"
+
+
+def render_model_name(template, adapter_dir, index):
+    """
+    Fills an Ollama model name template for one adapter directory.
+    Available fields: {name} (directory name, lower-case), {index} (1-based), {parent} (parent directory name).
+    """
+    adapter_dir = os.path.abspath(adapter_dir)
+    name = os.path.basename(adapter_dir).lower().replace(" ", "-")
+    parent = os.path.basename(os.path.dirname(adapter_dir)).lower().replace(" ", "-")
+    return template.format(name=name, index=index, parent=parent)
+
+
+def read_base_model_name(final_adapter_path):
+    return model_registry.adapter_base_model(final_adapter_path)
+
+
+class ImportJob:
+    """One adapter directory to import, with its live status for the job table."""
+    def __init__(self, job_id, adapter_dir, ollama_model_name):
+        self.job_id = job_id
+        self.adapter_dir = adapter_dir
+        self.final_adapter_path = os.path.join(adapter_dir, "final_lora_adapter")
+        self.ollama_model_name = ollama_model_name
+        self.base_model = None
+        self.status = "排队中"
+        self.message = ""
+        self.started = None
+        self.finished = None
+        self.log_tail = collections.deque(maxlen=20)
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class BatchImporter:
+    """
+    Runs many adapter imports through the merge/convert/import pipeline with a bounded worker pool.
+
+    Jobs that share a base model share the expensive base work: in adapter-only mode the base GGUF is
+    converted and imported into Ollama exactly once; in full merge mode the base is loaded once
+    (SharedMergeBase), the adapters of that base are merged into it one at a time, and it is freed after
+    the last of them. Only the merges into a shared base take turns; conversion and import run in parallel.
+    """
+    def __init__(self, jobs, adapter_only=True, max_workers=2, update_callback=None, status_callback=None,
+                 cancel_event=None):
+        self.jobs = jobs
+        self.adapter_only = adapter_only
+        self.max_workers = max(1, max_workers)
+        self.update_callback = update_callback
+        self.status_callback = status_callback
+        self.cancel_event = cancel_event or threading.Event()
+        self.base_locks = collections.defaultdict(threading.Lock)
+        self.base_locks_guard = threading.Lock()
+        self.shared_bases = {}
+        self.remaining = collections.Counter() # 每个基座还未完成的完整合并任务数
+
+    def _notify(self, job):
+        if self.update_callback:
+            self.update_callback(job)
+
+    def _base_lock(self, base_model):
+        with self.base_locks_guard:
+            return self.base_locks[base_model]
+
+    def _run_job(self, job):
+        if self.cancel_event.is_set():
+            job.status = "已取消"
+            self._notify(job)
+            return job
+
+        job.started = time.time()
+        job.status = "运行中"
+        self._notify(job)
+
+        def job_status(message):
+            job.log_tail.append(message)
+            job.message = message
+            self._notify(job)
+
+        try:
+            if self.adapter_only:
+                # Build (or reuse) the shared base GGUF under the base lock, so only one job converts it.
+                with self._base_lock(job.base_model):
+                    base_gguf = ensure_base_gguf(job.base_model, job_status, cancel_event=self.cancel_event)
+                ok = base_gguf[0] is not None and do_adapter_import(
+                    job.final_adapter_path, job.ollama_model_name, job_status, cancel_event=self.cancel_event,
+                    base_gguf=base_gguf)
+            else:
+                # SharedMergeBase 只在合并期间被一个任务占用，转换与导入并行进行
+                with self.base_locks_guard:
+                    shared_base = self.shared_bases.setdefault(job.base_model, SharedMergeBase(job.base_model))
+                try:
+                    ok = do_merge_and_import(job.final_adapter_path, job.ollama_model_name, job_status,
+                                             cancel_event=self.cancel_event, shared_base=shared_base)
+                finally:
+                    with self.base_locks_guard:
+                        self.remaining[job.base_model] -= 1
+                        last = self.remaining[job.base_model] <= 0
+                    if last or self.cancel_event.is_set():
+                        shared_base.close()
+        except Exception as e:
+            job.message = str(e)
+            ok = False
+
+        job.finished = time.time()
+        if self.cancel_event.is_set() and not ok:
+            job.status = "已取消"
+        else:
+            job.status = "成功" if ok else "失败"
+        self._notify(job)
+        return job
+
+    def run(self):
+        """Runs all jobs and returns a summary dict (counts, wall time, throughput, failures)."""
+        start = time.time()
+        log_status(self.status_callback, f"批量导入开始: {len(self.jobs)} 个任务, {self.max_workers} 个并发, "
+                                         f"模式: {'仅适配器' if self.adapter_only else '完整合并'}")
+        runnable = []
+        for job in self.jobs:
+            try:
+                job.base_model = read_base_model_name(job.final_adapter_path)
+                if not job.base_model:
+                    raise ValueError("adapter_config.json 中没有 base_model_name_or_path")
+            except Exception as e:
+                # 读不到基座模型的任务直接记为失败，不参与基座的任务计数
+                job.started = job.finished = time.time()
+                job.status = "失败"
+                job.message = f"无法读取基座模型: {e}"
+                self._notify(job)
+                continue
+            runnable.append(job)
+            self.remaining[job.base_model] += 1
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch-import") as pool:
+            list(pool.map(self._run_job, runnable))
+        for shared_base in self.shared_bases.values():
+            shared_base.close()
+
+        wall_time = time.time() - start
+        succeeded = [job for job in self.jobs if job.status == "成功"]
+        failed = [job for job in self.jobs if job.status == "失败"]
+        cancelled = [job for job in self.jobs if job.status == "已取消"]
+        summary = {
+            'total': len(self.jobs),
+            'succeeded': len(succeeded),
+            'failed': len(failed),
+            'cancelled': len(cancelled),
+            'wall_time_seconds': wall_time,
+            'jobs_per_minute': len(succeeded) / wall_time * 60 if wall_time > 0 else 0.0,
+            'mean_job_seconds': sum(job.elapsed for job in succeeded) / len(succeeded) if succeeded else 0.0,
+            'base_loads': sum(shared_base.loads for shared_base in self.shared_bases.values()),
+            'failures': [{'adapter_dir': job.adapter_dir, 'model': job.ollama_model_name, 'message': job.message}
+                         for job in failed],
+        }
+        log_status(self.status_callback, format_summary(summary))
+        return summary
+
+
+def format_summary(summary):
+    lines = [
+        f"批量导入完成: 成功 {summary['succeeded']}/{summary['total']}, 失败 {summary['failed']}, "
+        f"取消 {summary['cancelled']}",
+        f"总耗时 {summary['wall_time_seconds']:.1f}s, 吞吐量 {summary['jobs_per_minute']:.2f} 个/分钟, "
+        f"平均每个任务 {summary['mean_job_seconds']:.1f}s",
+    ]
+    if summary.get('base_loads'):
+        lines.append(f"完整合并共加载基座模型 {summary['base_loads']} 次 (同一基座的适配器复用已加载的基座)")
+    for failure in summary['failures']:
+        lines.append(f"  失败: {failure['model']} ({failure['adapter_dir']}): {failure['message']}")
+    return "\n".join(lines)
@@ -0,0 +1,126 @@
+"""
+Startup benchmark: time-to-first-window of main_app.py and the import cost of each module.
+
+Every measurement runs in a fresh interpreter, so modules already imported by an earlier
+measurement cannot hide their cost.
+
+    python benchmark_startup.py [--repeat 3] [--json startup_benchmark.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODULES = [
+    "tkinter",
+    "requests",
+    "torch",
+    "transformers",
+    "peft",
+    "datasets",
+    "gradio",
+    "train_core",
+    "merge_and_import",
+    "inference_core",
+    "main_app",
+]
+
+IMPORT_SNIPPET = """
+import time, sys
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("torch", "transformers", "peft", "datasets", "gradio") if m in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+
+# 显示窗口并处理完第一轮事件后立即退出，输出从进程启动到窗口出现的时间
+FIRST_WINDOW_SNIPPET = """
+import time
+start = time.perf_counter()
+import tkinter as tk
+import main_app
+root = tk.Tk()
+app = main_app.MainApplication(root)
+app.pack(side="top", fill="both", expand=True)
+root.update()
+print(time.perf_counter() - start)
+root.destroy()
+"""
+
+
+def run_snippet(snippet):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", snippet], cwd=PROJECT_DIR, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        return None, wall, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"
+    return result.stdout.strip().splitlines()[-1], wall, None
+
+
+def measure_import(module, repeat):
+    timings, heavy, error = [], "", None
+    for _ in range(repeat):
+        output, _, error = run_snippet(IMPORT_SNIPPET.format(module=module))
+        if output is None:
+            break
+        elapsed, _, heavy = output.partition(" ")
+        timings.append(float(elapsed))
+    if not timings:
+        return {'module': module, 'error': error}
+    return {'module': module, 'median_seconds': statistics.median(timings), 'min_seconds': min(timings),
+            'heavy_modules_loaded': [m for m in heavy.split(",") if m]}
+
+
+def measure_first_window(repeat):
+    in_process, wall_times, error = [], [], None
+    for _ in range(repeat):
+        output, wall, error = run_snippet(FIRST_WINDOW_SNIPPET)
+        if output is None:
+            break
+        in_process.append(float(output))
+        wall_times.append(wall)
+    if not in_process:
+        return {'error': error}
+    return {'median_seconds': statistics.median(in_process),
+            'median_wall_seconds_including_interpreter': statistics.median(wall_times)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure GUI startup time and per-module import cost.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (the median is reported)")
+    parser.add_argument("--json", help="Optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    results = {'python': sys.version.split()[0], 'imports': [], 'first_window': None}
+
+    print(f"{'module':<20}{'median (s)':>12}{'min (s)':>10}  heavy frameworks pulled in")
+    for module in MODULES:
+        entry = measure_import(module, args.repeat)
+        results['imports'].append(entry)
+        if 'error' in entry:
+            print(f"{module:<20}{'n/a':>12}{'':>10}  {entry['error']}")
+        else:
+            print(f"{module:<20}{entry['median_seconds']:>12.3f}{entry['min_seconds']:>10.3f}  "
+                  f"{', '.join(entry['heavy_modules_loaded']) or '-'}")
+
+    results['first_window'] = measure_first_window(args.repeat)
+    if 'error' in results['first_window']:
+        print(f"\nTime to first window: n/a ({results['first_window']['error']})")
+    else:
+        print(f"\nTime to first window: {results['first_window']['median_seconds']:.3f}s "
+              f"({results['first_window']['median_wall_seconds_including_interpreter']:.3f}s including interpreter start)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
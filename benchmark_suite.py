@@ -0,0 +1,597 @@
+"""
+Hot-path benchmark suite on a randomly initialized tiny causal LM, runs on CPU in about a minute.
+
+Covered: tokenization throughput of train_core's process_func, cold vs. cached tokenizer loads and batched
+chat-template encoding of model_registry, training steps/s of start_training,
+time-to-first-token and tokens/s of inference_core.generate_response at several history lengths,
+the same for the ONNX Runtime CPU backend (onnx_backend, 1 vs. N intra-op threads) next to PyTorch on CPU,
+data-parallel training throughput and scaling efficiency over 1..N CPU processes (distributed_train, gloo),
+LoRA merge + sharded save time, ModelCatalog scan time, and how long the GUI's periodic_check spends
+draining a job that floods log lines (what the Tk loop is blocked for, and how stale lines get).
+
+    python benchmark_suite.py run [--only tokenize,train] [--quick] [--json results.json]
+    python benchmark_suite.py run --json benchmark_baseline.json          # store a baseline
+    python benchmark_suite.py compare benchmark_baseline.json results.json [--threshold 0.15]
+
+`compare` exits with 1 when a metric got worse than the baseline by more than the threshold. Metric names
+say which direction is better: *_per_s is higher-is-better, *_seconds / *_ms lower-is-better.
+A benchmark whose dependencies are missing records an 'error' instead of aborting the run.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_FILES = ["zhexuejia.jsonl", "shangganwenxue.jsonl"]
+DEFAULT_THRESHOLD = 0.15
+
+SPECIAL_TOKENS = ["<unk>", "<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+# Qwen 风格的对话模板，与训练/推理代码中使用的 apply_chat_template 行为一致
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|im_start|>{{ message['role'] }}\n{{ message['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+
+class TinyModelFixture:
+    """Builds a byte-level BPE tokenizer on the bundled datasets and a random tiny Llama, saved to work_dir."""
+    def __init__(self, work_dir, num_records=200):
+        self.work_dir = work_dir
+        self.model_dir = os.path.join(work_dir, "tiny_model")
+        self.data_path = os.path.join(work_dir, "train.jsonl")
+        self.records = self._load_records(num_records)
+        self._built = False
+
+    @staticmethod
+    def _load_records(num_records):
+        records = []
+        for name in DATA_FILES:
+            path = os.path.join(PROJECT_DIR, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+        if not records:
+            records = [{'instruction': "你是一位哲学家。", 'input': "什么是幸福？", 'output': "幸福是灵魂合乎德性的活动。"}]
+        # 数据不足时循环补齐，保证各次运行的工作量相同
+        return [records[i % len(records)] for i in range(num_records)]
+
+    def build(self):
+        if self._built:
+            return self
+        import torch
+        from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+        from transformers import PreTrainedTokenizerFast, LlamaConfig, LlamaForCausalLM
+
+        os.makedirs(self.work_dir, exist_ok=True)
+        with open(self.data_path, 'w', encoding='utf-8') as f:
+            for record in self.records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        bpe = Tokenizer(models.BPE(unk_token="<unk>"))
+        bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        bpe.decoder = decoders.ByteLevel()
+        trainer = trainers.BpeTrainer(vocab_size=2000, special_tokens=SPECIAL_TOKENS,
+                                      initial_alphabet=pre_tokenizers.ByteLevel.alphabet(), show_progress=False)
+        texts = (r.get(key, "") for r in self.records for key in ('instruction', 'input', 'output'))
+        bpe.train_from_iterator(texts, trainer)
+        tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe, unk_token="<unk>", pad_token="<|endoftext|>",
+                                            eos_token="<|im_end|>", additional_special_tokens=["<|im_start|>"])
+        tokenizer.chat_template = CHAT_TEMPLATE
+        tokenizer.save_pretrained(self.model_dir)
+
+        torch.manual_seed(0)
+        config = LlamaConfig(vocab_size=len(tokenizer), hidden_size=64, intermediate_size=176, num_hidden_layers=2,
+                             num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=4096,
+                             eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id,
+                             bos_token_id=None, tie_word_embeddings=False)
+        LlamaForCausalLM(config).save_pretrained(self.model_dir)
+        self._built = True
+        return self
+
+    def load(self):
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+        tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+        model = AutoModelForCausalLM.from_pretrained(self.model_dir)
+        model.eval()
+        return model, tokenizer
+
+
+class TimedQueue:
+    """queue.Queue stand-in that stores (perf_counter, item) for every put."""
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append((time.perf_counter(), item))
+
+    put_nowait = put
+
+
+class FirstTokenTimer:
+    """Minimal generate() streamer: generate puts the prompt once, then every new token."""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.calls = 0
+        self.first_token_at = None
+
+    def put(self, value):
+        self.calls += 1
+        if self.calls == 2 and self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def end(self):
+        pass
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# --- Benchmarks ---
+def bench_tokenize(fixture, quick):
+    from transformers import AutoTokenizer
+    from train_core import build_process_func
+
+    tokenizer = AutoTokenizer.from_pretrained(fixture.model_dir)
+    process = build_process_func(tokenizer, max_length=1024)
+    records = fixture.records[:50] if quick else fixture.records
+    process(records[0])  # 预热 (模板编译)
+    tokens = 0
+    start = time.perf_counter()
+    for record in records:
+        tokens += len(process(record)['input_ids'])
+    seconds = time.perf_counter() - start
+    return {'samples_per_s': len(records) / seconds, 'tokens_per_s': tokens / seconds}
+
+
+def bench_registry(fixture, quick):
+    import model_registry
+
+    model_registry.clear()
+    start = time.perf_counter()
+    tokenizer = model_registry.get_tokenizer(fixture.model_dir)
+    cold_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    model_registry.get_tokenizer(fixture.model_dir)
+    cached_ms = (time.perf_counter() - start) * 1000
+
+    conversations = [[{"role": "system", "content": r.get('instruction', "")}, {"role": "user", "content": r.get('input', "")},
+                      {"role": "assistant", "content": r.get('output', "")}] for r in fixture.records]
+    if quick:
+        conversations = conversations[:50]
+    start = time.perf_counter()
+    for messages in conversations:
+        tokenizer.apply_chat_template(messages, tokenize=True)
+    per_call_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    model_registry.encode_chats(tokenizer, conversations)
+    batched_seconds = time.perf_counter() - start
+    return {'tokenizer_cold_load_ms': cold_ms, 'tokenizer_cached_load_ms': cached_ms,
+            'apply_chat_template_samples_per_s': len(conversations) / per_call_seconds,
+            'encode_chats_samples_per_s': len(conversations) / batched_seconds}
+
+
+def bench_train(fixture, quick):
+    from train_core import start_training
+
+    steps = 10 if quick else 30
+    hyperparams = {'load_in_4bit': False, 'bf16': False, 'tf32': False, 'max_steps': steps, 'save_strategy': "no",
+                   'eval_split': 0, 'per_device_train_batch_size': 4, 'gradient_accumulation_steps': 1,
+                   'max_length': 256, 'warmup_ratio': 0.0}
+    output_dir = os.path.join(fixture.work_dir, "train_output")
+    progress, logs = TimedQueue(), TimedQueue()
+    start = time.perf_counter()
+    ok = start_training(fixture.model_dir, fixture.data_path, output_dir, progress, logs, hyperparams=hyperparams)
+    total = time.perf_counter() - start
+    if not ok:
+        errors = [item['error'] for _, item in progress.items if isinstance(item, dict) and 'error' in item]
+        raise RuntimeError(errors[-1] if errors else "start_training failed")
+    # 第 1 步开始之后的时间才是稳态训练速度，之前是加载与分词
+    stepped = [(t, item['step']) for t, item in progress.items if isinstance(item, dict) and item.get('step', 0) >= 1]
+    if len(stepped) < 2:
+        raise RuntimeError(f"only {len(stepped)} step events were received, cannot measure steps/s")
+    (first_time, first_step), (last_time, last_step) = stepped[0], stepped[-1]
+    return {'steps_per_s': (last_step - first_step) / max(last_time - first_time, 1e-9),
+            'setup_seconds': progress.items[0][0] - start if progress.items else total,
+            'total_seconds': total}
+
+
+def bench_train_ddp(fixture, quick):
+    """
+    Weak scaling: every process trains the same per-process batch, so N processes ideally reach N times the
+    samples/s of one. efficiency = samples/s(N) / (N * samples/s(1)).
+    """
+    from distributed_train import launch
+
+    steps, batch_size = (8, 4) if quick else (20, 4)
+    hyperparams = {'load_in_4bit': False, 'bf16': False, 'tf32': False, 'max_steps': steps, 'save_strategy': "no",
+                   'eval_split': 0, 'per_device_train_batch_size': batch_size, 'gradient_accumulation_steps': 1,
+                   'max_length': 256, 'warmup_ratio': 0.0}
+    counts = [n for n in ((1, 2) if quick else (1, 2, 4)) if n <= (os.cpu_count() or 1)]
+    results, base_rate = {}, None
+    for num_processes in counts:
+        output_dir = os.path.join(fixture.work_dir, f"train_ddp_{num_processes}p")
+        progress, logs = TimedQueue(), TimedQueue()
+        ok = launch(fixture.model_dir, fixture.data_path, output_dir, progress, logs, hyperparams=hyperparams,
+                    num_processes=num_processes)
+        if not ok:
+            errors = [item['error'] for _, item in progress.items if isinstance(item, dict) and 'error' in item]
+            raise RuntimeError(errors[-1] if errors else f"training with {num_processes} processes failed")
+        stepped = [(t, item['step']) for t, item in progress.items if isinstance(item, dict) and item.get('step', 0) >= 1]
+        if len(stepped) < 2:
+            raise RuntimeError(f"only {len(stepped)} step events were received from {num_processes} processes, "
+                               "cannot measure samples/s")
+        (first_time, first_step), (last_time, last_step) = stepped[0], stepped[-1]
+        rate = (last_step - first_step) * batch_size * num_processes / max(last_time - first_time, 1e-9)
+        base_rate = base_rate or rate
+        results[f"{num_processes}p_samples_per_s"] = rate
+        results[f"{num_processes}p_efficiency"] = rate / (num_processes * base_rate)
+    return results
+
+
+def _time_generation(generate, model, tokenizer, history_turns, quick):
+    """Median time-to-first-token (ms) and decode tokens/s of `generate` (generate_response's signature)."""
+    max_new_tokens = 16 if quick else 64
+    turn = ("请再详细解释一下这个观点。", "这个观点的核心在于理性与经验的统一，二者缺一不可。")
+    history = [turn] * history_turns
+    generate(model, tokenizer, "You are a helpful assistant.", "你好", history, max_new_tokens=2)  # 预热
+    ttfts, rates = [], []
+    for _ in range(2 if quick else 3):
+        timer = FirstTokenTimer()
+        # 随机模型可能很早生成 eos，按实际生成的 token 数计算速度
+        generate(model, tokenizer, "You are a helpful assistant.", "什么是幸福？", history,
+                 max_new_tokens=max_new_tokens, streamer=timer)
+        end = time.perf_counter()
+        first_token_at = timer.first_token_at or end
+        new_tokens = max(1, timer.calls - 1)
+        ttfts.append((first_token_at - timer.start) * 1000)
+        # 解码速度不含首 token (预填充)；只生成了一个 token 时退化为整体速度
+        if new_tokens > 1 and end > first_token_at:
+            rates.append((new_tokens - 1) / (end - first_token_at))
+        else:
+            rates.append(new_tokens / (end - timer.start))
+    return statistics.median(ttfts), statistics.median(rates)
+
+
+def bench_generate(fixture, quick):
+    from inference_core import generate_response
+
+    model, tokenizer = fixture.load()
+    results = {}
+    for history_turns in (0, 4, 16):
+        ttft, rate = _time_generation(generate_response, model, tokenizer, history_turns, quick)
+        results[f'history{history_turns}_ttft_ms'] = ttft
+        results[f'history{history_turns}_tokens_per_s'] = rate
+    return results
+
+
+def bench_onnx(fixture, quick):
+    import torch
+    import onnx_backend
+    from inference_core import generate_response
+
+    onnx_dir = os.path.join(fixture.work_dir, "tiny_onnx")
+    start = time.perf_counter()
+    onnx_backend.export_onnx(fixture.model_dir, onnx_dir)
+    results = {'export_seconds': time.perf_counter() - start}
+    model, tokenizer = fixture.load()
+    torch_threads = torch.get_num_threads()
+    # 1 个线程与 PyTorch 同等线程数两种配置，观察 intra-op 并行对小批量解码是否有益
+    variants = [('onnx_1t', 1), (f'onnx_{torch_threads}t', torch_threads)]
+    for history_turns in (0, 4):
+        torch_ttft, torch_rate = _time_generation(generate_response, model, tokenizer, history_turns, quick)
+        results[f'history{history_turns}_torch_ttft_ms'] = torch_ttft
+        results[f'history{history_turns}_torch_tokens_per_s'] = torch_rate
+        for name, threads in variants:
+            onnx_model = onnx_backend.OnnxCausalLM(onnx_dir, intra_op_threads=threads, inter_op_threads=1)
+            ttft, rate = _time_generation(onnx_backend.generate_response, onnx_model, tokenizer, history_turns, quick)
+            results[f'history{history_turns}_{name}_ttft_ms'] = ttft
+            results[f'history{history_turns}_{name}_tokens_per_s'] = rate
+            results[f'history{history_turns}_{name}_speedup'] = rate / torch_rate
+    return results
+
+
+def bench_merge(fixture, quick):
+    import torch
+    from transformers import AutoModelForCausalLM
+    from peft import LoraConfig, PeftModel, get_peft_model
+    from merge_verify import MergeVerifier
+    from model_io import save_model_sharded
+
+    # 非零初始化的 LoRA (B 不为 0)，这样合并与校验都有真实的计算量
+    adapter_dir = os.path.join(fixture.work_dir, "merge_adapter")
+    if not os.path.exists(os.path.join(adapter_dir, "adapter_config.json")):
+        torch.manual_seed(0)
+        lora = get_peft_model(AutoModelForCausalLM.from_pretrained(fixture.model_dir),
+                              LoraConfig(r=8, lora_alpha=16, target_modules=["q_proj", "k_proj", "v_proj", "o_proj"],
+                                         init_lora_weights=False, task_type="CAUSAL_LM"))
+        lora.save_pretrained(adapter_dir)
+
+    _, tokenizer = fixture.load()
+    timings = {'load_seconds': [], 'merge_seconds': [], 'verify_seconds': [], 'save_seconds': []}
+    for index in range(1 if quick else 3):
+        start = time.perf_counter()
+        model = PeftModel.from_pretrained(AutoModelForCausalLM.from_pretrained(fixture.model_dir), adapter_dir)
+        timings['load_seconds'].append(time.perf_counter() - start)
+        verifier = MergeVerifier(tokenizer)
+        verifier.before_merge(model)
+        start = time.perf_counter()
+        merged = model.merge_and_unload()
+        timings['merge_seconds'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        verifier.after_merge(merged)
+        timings['verify_seconds'].append(time.perf_counter() - start)
+        output_dir = os.path.join(fixture.work_dir, f"merged_{index}")
+        start = time.perf_counter()
+        save_model_sharded(merged, output_dir, log=lambda line: None)
+        timings['save_seconds'].append(time.perf_counter() - start)
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return {name: statistics.median(values) for name, values in timings.items()}
+
+
+def _make_catalog_tree(root, num_projects):
+    """Synthetic workspace: LoRA model directories with checkpoints, plus plain project folders."""
+    for i in range(num_projects):
+        project = os.path.join(root, f"project_{i:03d}")
+        if i % 3 == 0:
+            adapter = os.path.join(project, "final_lora_adapter")
+            os.makedirs(adapter, exist_ok=True)
+            with open(os.path.join(adapter, "adapter_config.json"), 'w', encoding='utf-8') as f:
+                json.dump({'base_model_name_or_path': "tiny/base", 'r': 8}, f)
+            for step in (10, 20):
+                os.makedirs(os.path.join(project, f"checkpoint-{step}"), exist_ok=True)
+        else:
+            for sub in ("data", "notes", os.path.join("data", "raw")):
+                os.makedirs(os.path.join(project, sub), exist_ok=True)
+
+
+def bench_catalog(fixture, quick):
+    from model_catalog import ModelCatalog
+
+    root = os.path.join(fixture.work_dir, "catalog_tree")
+    shutil.rmtree(root, ignore_errors=True)
+    _make_catalog_tree(root, 60 if quick else 300)
+    hf_home = os.path.join(fixture.work_dir, "hf_home")
+    os.makedirs(hf_home, exist_ok=True)
+    catalog_file = os.path.join(fixture.work_dir, "model_catalog.json")
+    if os.path.exists(catalog_file):
+        os.remove(catalog_file)
+
+    catalog = ModelCatalog(catalog_file=catalog_file, scan_root=root, hf_home=hf_home)
+    start = time.perf_counter()
+    catalog.refresh()
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    catalog.refresh()
+    warm = time.perf_counter() - start
+    # 新增一个 LoRA 后的增量刷新
+    _make_catalog_tree(os.path.join(root, "new"), 1)
+    start = time.perf_counter()
+    catalog.refresh()
+    incremental = time.perf_counter() - start
+    return {'cold_seconds': cold, 'warm_seconds': warm, 'incremental_seconds': incremental,
+            'lora_count': len(catalog.lora_dirs())}
+
+
+def flood_logs(count, on_event):
+    """Job target for bench_periodic_drain: emits `count` log lines carrying their send time."""
+    for index in range(count):
+        on_event('log', f"{time.time():.6f} 第 {index} 行日志")
+    return True
+
+
+def bench_periodic_drain(fixture, quick):
+    """
+    Runs a log-flooding job through JobScheduler / JobExecutor and drains it the way periodic_check does
+    (scheduler.tick() every 100 ms, each line appended to a Tk Text widget when a display is available).
+    """
+    from job_executor import JobExecutor, EVENTS
+    from job_scheduler import JobScheduler, SUCCEEDED, FAILED, CANCELLED
+    # 子进程 (spawn) 按模块名导入任务函数，作为脚本运行时 __main__.flood_logs 无法导入
+    from benchmark_suite import flood_logs as target
+
+    text = None
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+        text = tk.Text(root)
+    except Exception:
+        root = None  # 无显示器时只测量消息通道与分发的开销
+
+    lines = []
+    latencies = []
+
+    def on_log(line):
+        latencies.append(time.time() - float(line.split(" ", 1)[0]))
+        if text is not None:
+            # 与 MainApplication.append_log 相同的操作
+            text.config(state='normal')
+            text.insert('end', line + '\n')
+            text.see('end')
+            text.config(state='disabled')
+        else:
+            lines.append(line)
+
+    count = 5000 if quick else 20000
+    executor = JobExecutor()
+    scheduler = JobScheduler(executor, history_file=os.path.join(fixture.work_dir, "bench_job_history.json"))
+    try:
+        record = scheduler.submit("flood", 'convert', target, args=(count, EVENTS),
+                                  make_dispatch=lambda record: {'log': on_log})
+        tick_seconds = []
+        deadline = time.time() + 300
+        while record.status not in (SUCCEEDED, FAILED, CANCELLED) and time.time() < deadline:
+            start = time.perf_counter()
+            scheduler.tick()
+            if root is not None:
+                root.update()
+            tick_seconds.append(time.perf_counter() - start)
+            time.sleep(0.1)
+        if len(latencies) < count:
+            raise RuntimeError(f"only {len(latencies)} of {count} log lines were received")
+    finally:
+        scheduler.shutdown()
+        executor.shutdown()
+        if root is not None:
+            root.destroy()
+    busy = [t for t in tick_seconds if t > 0]
+    return {'tick_max_ms': max(busy) * 1000, 'tick_p95_ms': _percentile(busy, 0.95) * 1000,
+            'line_latency_p50_ms': _percentile(latencies, 0.5) * 1000,
+            'line_latency_p95_ms': _percentile(latencies, 0.95) * 1000,
+            'drained_lines_per_s': count / max(sum(tick_seconds), 1e-9), 'tk': text is not None}
+
+
+BENCHMARKS = {
+    'tokenize': bench_tokenize,
+    'registry': bench_registry,
+    'train': bench_train,
+    'train_ddp': bench_train_ddp,
+    'generate': bench_generate,
+    'onnx': bench_onnx,
+    'merge': bench_merge,
+    'catalog': bench_catalog,
+    'periodic_drain': bench_periodic_drain,
+}
+
+
+def run_suite(names=None, quick=False, work_dir=None, log=print):
+    names = names or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    owns_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="lora_bench_")
+    fixture = TinyModelFixture(work_dir)
+    results = {}
+    try:
+        for name in names:
+            log(f"Running {name}...")
+            start = time.perf_counter()
+            try:
+                if name not in ('catalog', 'periodic_drain'):
+                    fixture.build()
+                results[name] = BENCHMARKS[name](fixture, quick)
+            except Exception as e:
+                results[name] = {'error': f"{type(e).__name__}: {e}"}
+            log(f"  {name}: {time.perf_counter() - start:.1f}s {json.dumps(results[name], ensure_ascii=False)}")
+    finally:
+        if owns_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {'meta': environment_info(quick), 'results': results}
+
+
+def environment_info(quick):
+    info = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'quick': quick}
+    for module in ("torch", "transformers", "peft"):
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            info[module] = None
+    try:
+        import torch
+        info['torch_threads'] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+# --- Comparison ---
+def metric_direction(name):
+    """+1 if higher is better, -1 if lower is better, 0 if the metric is informational."""
+    if name.endswith('_per_s'):
+        return 1
+    if name.endswith('_seconds') or name.endswith('_ms'):
+        return -1
+    return 0
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns a list of rows {benchmark, metric, baseline, current, change, regression}; `change` is the relative
+    change in the "better" direction (negative = worse).
+    """
+    rows = []
+    for bench, metrics in current.get('results', {}).items():
+        base_metrics = baseline.get('results', {}).get(bench, {})
+        for metric, value in metrics.items():
+            direction = metric_direction(metric)
+            base_value = base_metrics.get(metric)
+            if not direction or not isinstance(value, (int, float)) or not isinstance(base_value, (int, float)) or not base_value:
+                continue
+            change = direction * (value - base_value) / abs(base_value)
+            rows.append({'benchmark': bench, 'metric': metric, 'baseline': base_value, 'current': value,
+                         'change': change, 'regression': change < -threshold})
+        if 'error' in metrics and 'error' not in base_metrics:
+            rows.append({'benchmark': bench, 'metric': 'error', 'baseline': None, 'current': metrics['error'],
+                         'change': None, 'regression': True})
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print(f"{'benchmark.metric':<42} {'baseline':>12} {'current':>12} {'change':>9}")
+    for row in rows:
+        label = f"{row['benchmark']}.{row['metric']}"
+        if row['change'] is None:
+            print(f"{label:<42} {'':>12} {str(row['current'])[:40]}  REGRESSION")
+            continue
+        flag = "  REGRESSION" if row['regression'] else ""
+        print(f"{label:<42} {row['baseline']:>12.4g} {row['current']:>12.4g} {row['change']:>+8.1%}{flag}")
+    regressions = sum(row['regression'] for row in rows)
+    print(f"{regressions} regression(s) beyond {threshold:.0%}.")
+
+
+def _load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("run", help="Run the benchmarks")
+    p.add_argument("--only", help=f"Comma-separated subset of: {', '.join(BENCHMARKS)}")
+    p.add_argument("--quick", action="store_true", help="Fewer steps and repetitions (noisier)")
+    p.add_argument("--json", help="Write the results to this file")
+    p.add_argument("--work-dir", help="Keep the tiny model and temporary files here instead of a temp dir")
+    p.add_argument("--baseline", help="Also compare against this baseline file")
+    p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    p = subparsers.add_parser("compare", help="Compare results with a stored baseline")
+    p.add_argument("baseline")
+    p.add_argument("current")
+    p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                   help="Relative change counted as a regression (default 0.15)")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        baseline, current = _load_json(args.baseline), _load_json(args.current)
+    else:
+        sys.path.insert(0, PROJECT_DIR)
+        names = [n.strip() for n in args.only.split(",") if n.strip()] if args.only else None
+        current = run_suite(names, quick=args.quick, work_dir=args.work_dir)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(current, f, ensure_ascii=False, indent=2)
+            print(f"Results written to {args.json}")
+        if not args.baseline:
+            return 0
+        baseline = _load_json(args.baseline)
+
+    rows = compare_results(baseline, current, args.threshold)
+    print_comparison(rows, args.threshold)
+    return 1 if any(row['regression'] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Token-budgeted context window for multi-turn chat.
+
+In context mode every turn used to resend the whole history, so long sessions eventually overflowed the
+model's context and made prefill (the prompt pass before the first new token) slower every turn.
+ContextWindow.fit picks the history that goes into the next prompt:
+
+- the system prompt and the new message are always kept;
+- the newest turns are kept while the prompt stays within `budget` tokens;
+- older turns are dropped ("drop"), or condensed by the model itself into a short summary that is added
+  to the system prompt ("summarize");
+- when the budget is exceeded the window moves forward until the prompt is at 3/4 of the budget, so
+  turns are dropped (and summarized, folding in the previous summary) only every few turns.
+
+Token counts are incremental: every message is counted once (cached by its text) plus a fixed per-message
+chat-template overhead measured from the tokenizer, so a turn costs nothing to re-count on later turns.
+Models without a local tokenizer (Ollama) use a character-based estimate.
+
+Settings (config.json): context_budget_tokens (default: DEFAULT_BUDGET, at most the model's context
+minus the answer length) and context_strategy ("drop" or "summarize").
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import time
+
+CONFIG_FILE = "config.json"
+DEFAULT_BUDGET = 4096
+DEFAULT_STRATEGY = "drop"
+STRATEGIES = ("drop", "summarize")
+COUNT_CACHE_SIZE = 4096
+ESTIMATED_MESSAGE_OVERHEAD = 4
+SUMMARY_MAX_TOKENS = 256
+SUMMARY_INSTRUCTION = ("Summarize the following earlier conversation in a few sentences. Keep names, facts, "
+                       "decisions and open questions; answer with the summary only.")
+SUMMARY_PREFIX = "\n\nSummary of the earlier conversation:\n"
+# 汉字、假名、谚文大约一个字一个 token，其余文本大约 4 个字符一个 token
+_WIDE_CHARS = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+
+
+def load_context_settings():
+    config = {}
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, 'r') as f:
+            config = json.load(f)
+    strategy = config.get("context_strategy", DEFAULT_STRATEGY)
+    return {'budget': int(config.get("context_budget_tokens") or DEFAULT_BUDGET),
+            'strategy': strategy if strategy in STRATEGIES else DEFAULT_STRATEGY}
+
+
+def estimate_tokens(text):
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def model_context_length(model):
+    """max_position_embeddings of a loaded model, None if unknown (e.g. Ollama)."""
+    config = getattr(model, 'config', None)
+    return getattr(config, 'max_position_embeddings', None)
+
+
+class ContextWindow:
+    """Chooses the history of the next prompt within a token budget; one instance per loaded model."""
+    def __init__(self, tokenizer=None, budget=DEFAULT_BUDGET, strategy=DEFAULT_STRATEGY, context_length=None,
+                 summarize=None):
+        self.tokenizer = tokenizer
+        self.budget = budget
+        self.strategy = strategy
+        self.context_length = context_length
+        # summarize(turns, previous_summary) -> str, used by "summarize"
+        self.summarize = summarize
+        self.counts = collections.OrderedDict()
+        # 当前对话中已移出窗口的轮次及其摘要；summarized_upto 之前的轮次已并入摘要
+        self.window_start, self.dropped, self.summary, self.summarized_upto = 0, [], "", 0
+        self.prompt_overhead, self.message_overhead = self._measure_overhead()
+
+    def _measure_overhead(self):
+        """Template tokens of the bare prompt (system + generation prompt) and of each further message."""
+        if self.tokenizer is None:
+            return ESTIMATED_MESSAGE_OVERHEAD * 2, ESTIMATED_MESSAGE_OVERHEAD
+        import model_registry
+        empty = {"role": "system", "content": ""}
+        bare, turn = model_registry.encode_chats(self.tokenizer, [
+            [empty],
+            [empty, {"role": "user", "content": ""}, {"role": "assistant", "content": ""}],
+        ], add_generation_prompt=True)
+        return len(bare), max(0, (len(turn) - len(bare)) // 2)
+
+    def count(self, text):
+        """Tokens of one message's content, cached by its text."""
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        cached = self.counts.get(key)
+        if cached is not None:
+            self.counts.move_to_end(key)
+            return cached
+        if self.tokenizer is None:
+            tokens = estimate_tokens(text)
+        else:
+            tokens = len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+        self.counts[key] = tokens
+        if len(self.counts) > COUNT_CACHE_SIZE:
+            self.counts.popitem(last=False)
+        return tokens
+
+    def turn_tokens(self, turn):
+        user_turn, assistant_turn = turn
+        return self.count(user_turn) + self.count(assistant_turn) + 2 * self.message_overhead
+
+    def effective_budget(self, max_new_tokens=0):
+        """The configured budget, capped so that prompt + answer fit the model's context."""
+        if self.context_length:
+            return max(1, min(self.budget, self.context_length - max_new_tokens))
+        return self.budget
+
+    def fit(self, system_prompt, history, message, max_new_tokens=0):
+        """
+        Returns (system_prompt, kept_history, info): the system prompt (with a summary of dropped turns
+        under "summarize"), the newest turns that fit, and {'prompt_tokens', 'budget', 'kept_turns',
+        'dropped_turns', 'summarized', 'history_tokens'}.
+        """
+        budget = self.effective_budget(max_new_tokens)
+        history = list(history)
+        if len(history) < self.window_start or history[:self.window_start] != self.dropped:
+            # 历史被清空或替换 (新会话)：重新开始
+            self.window_start, self.dropped, self.summary, self.summarized_upto = 0, [], "", 0
+        fixed = self.prompt_overhead + self.count(system_prompt) + self.count(message) + self.message_overhead
+        turn_costs = [self.turn_tokens(turn) for turn in history]
+
+        def prompt_tokens():
+            summary_tokens = self.count(SUMMARY_PREFIX + self.summary) if self.summary else 0
+            return fixed + summary_tokens + sum(turn_costs[self.window_start:])
+
+        if prompt_tokens() > budget:
+            # 一次移出到预算的 3/4 以下，之后几轮不必再移出 (摘要也不必每轮重做)
+            target = budget * 3 // 4
+            while self.window_start < len(history) and prompt_tokens() > target:
+                self.window_start += 1
+            if self.strategy == "summarize" and self.summarize is not None:
+                # 摘要本身也占预算：摘要后仍超出时再移出几轮，并把这些轮次再并入摘要一次；
+                # 之后仍未摘要的轮次留在 summarized_upto 之后，下次摘要时一并处理，不会丢失
+                for _ in range(2):
+                    pending = history[self.summarized_upto:self.window_start]
+                    if not pending:
+                        break
+                    self.summary = self.summarize(pending, self.summary)
+                    self.summarized_upto = self.window_start
+                    while self.window_start < len(history) and prompt_tokens() > budget:
+                        self.window_start += 1
+            self.dropped = history[:self.window_start]
+        if self.summary:
+            system_prompt = system_prompt + SUMMARY_PREFIX + self.summary
+        info = {'prompt_tokens': prompt_tokens(), 'budget': budget, 'kept_turns': len(history) - self.window_start,
+                'dropped_turns': self.window_start, 'summarized': bool(self.summary),
+                'history_tokens': sum(turn_costs)}
+        return system_prompt, history[self.window_start:], info
+
+
+def model_summarizer(model, tokenizer, max_new_tokens=SUMMARY_MAX_TOKENS):
+    """summarize(turns, previous_summary) for ContextWindow that asks the loaded model itself (low temperature)."""
+    from inference_core import generate_response
+
+    def summarize(turns, previous_summary=""):
+        transcript = "\n".join(f"User: {user_turn}\nAssistant: {assistant_turn}" for user_turn, assistant_turn in turns)
+        if previous_summary:
+            transcript = f"(Summary so far: {previous_summary})\n{transcript}"
+        return generate_response(model, tokenizer, SUMMARY_INSTRUCTION, transcript, [], temperature=0.3,
+                                 max_new_tokens=max_new_tokens).strip()
+
+    return summarize
+
+
+def window_for_model(model, tokenizer, budget=None, strategy=None):
+    """A ContextWindow for a loaded model with the config.json settings (arguments override them)."""
+    settings = load_context_settings()
+    strategy = strategy or settings['strategy']
+    return ContextWindow(tokenizer, budget or settings['budget'], strategy, model_context_length(model),
+                         summarize=model_summarizer(model, tokenizer))
+
+
+class TurnTimer:
+    """on_text callback that records when the first text of an answer arrives (prefill time)."""
+    def __init__(self, forward=None):
+        self.forward = forward
+        self.start = time.perf_counter()
+        self.first_text_at = None
+
+    def __call__(self, text):
+        if self.first_text_at is None:
+            self.first_text_at = time.perf_counter()
+        if self.forward is not None:
+            self.forward(text)
+
+    def stats(self):
+        end = time.perf_counter()
+        return {'prefill_seconds': (self.first_text_at or end) - self.start, 'seconds': end - self.start}
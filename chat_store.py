@@ -0,0 +1,202 @@
+"""
+SQLite store for chat sessions, so conversations survive restarts and can be searched.
+
+Tables:
+- sessions: one conversation (title, model path, LoRA adapter, created / updated time);
+- turns: one user message + answer each, with the model, system prompt and generation parameters that produced it
+  (temperature, max_new_tokens, context budget / strategy) and its measurements (prompt / new tokens,
+  prefill and total seconds);
+- turns_fts: full-text index over the messages for search across sessions (FTS5 with the trigram tokenizer,
+  so Chinese substrings match; queries shorter than three characters fall back to LIKE).
+
+Reads are paged (turns(session_id, offset, limit)), which is what the GUI's TranscriptView needs to render
+only the turns on screen. All methods are thread-safe (one connection, one lock, WAL journal).
+"""
+import os
+import sqlite3
+import threading
+import time
+
+DB_FILE = "chat_sessions.db"
+SCHEMA_VERSION = 1
+TITLE_LENGTH = 40
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    model TEXT,
+    adapter TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    user_text TEXT NOT NULL,
+    assistant_text TEXT NOT NULL,
+    model TEXT,
+    system_prompt TEXT,
+    temperature REAL,
+    max_new_tokens INTEGER,
+    context_budget INTEGER,
+    context_strategy TEXT,
+    prompt_tokens INTEGER,
+    new_tokens INTEGER,
+    prefill_seconds REAL,
+    seconds REAL,
+    created_at REAL NOT NULL,
+    UNIQUE (session_id, position)
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated_at);
+"""
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+    user_text, assistant_text, content='turns', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts(rowid, user_text, assistant_text) VALUES (new.id, new.user_text, new.assistant_text);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_fts_delete AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts(turns_fts, rowid, user_text, assistant_text)
+    VALUES ('delete', old.id, old.user_text, old.assistant_text);
+END;
+"""
+TURN_PARAMS = ('model', 'system_prompt', 'temperature', 'max_new_tokens', 'context_budget', 'context_strategy')
+TURN_STATS = ('prompt_tokens', 'new_tokens', 'prefill_seconds', 'seconds')
+
+
+class ChatStore:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA foreign_keys=ON")
+            self.connection.executescript(SCHEMA)
+            try:
+                self.connection.executescript(FTS_SCHEMA)
+                self.has_fts = True
+            except sqlite3.OperationalError:
+                # SQLite 未编译 FTS5 或版本过旧 (trigram 需要 3.34+)：搜索退化为 LIKE
+                self.has_fts = False
+            self.connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+    # --- Sessions ---
+    def create_session(self, title, model=None, adapter=None):
+        now = time.time()
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO sessions (title, model, adapter, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (title[:TITLE_LENGTH] or "新会话", model, adapter, now, now))
+            return cursor.lastrowid
+
+    def sessions(self, limit=200, offset=0):
+        """Most recently updated first, with their turn counts."""
+        return self._query(
+            "SELECT s.*, (SELECT COUNT(*) FROM turns t WHERE t.session_id = s.id) AS turn_count "
+            "FROM sessions s ORDER BY s.updated_at DESC LIMIT ? OFFSET ?", (limit, offset))
+
+    def session(self, session_id):
+        rows = self._query("SELECT * FROM sessions WHERE id = ?", (session_id,))
+        return rows[0] if rows else None
+
+    def rename_session(self, session_id, title):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE sessions SET title = ? WHERE id = ?", (title[:TITLE_LENGTH], session_id))
+
+    def delete_session(self, session_id):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self.connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    # --- Turns ---
+    def add_turn(self, session_id, user_text, assistant_text, params=None, stats=None):
+        """Appends a turn; `params` / `stats` may hold the TURN_PARAMS / TURN_STATS keys. Returns its position."""
+        params, stats = params or {}, stats or {}
+        now = time.time()
+        columns = TURN_PARAMS + TURN_STATS
+        values = [params.get(key) for key in TURN_PARAMS] + [stats.get(key) for key in TURN_STATS]
+        with self.lock, self.connection:
+            position = self.connection.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM turns WHERE session_id = ?", (session_id,)).fetchone()[0]
+            self.connection.execute(
+                f"INSERT INTO turns (session_id, position, user_text, assistant_text, created_at, {', '.join(columns)}) "
+                f"VALUES (?, ?, ?, ?, ?{', ?' * len(columns)})",
+                [session_id, position, user_text, assistant_text, now] + values)
+            self.connection.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+        return position
+
+    def turn_count(self, session_id):
+        return self._query("SELECT COUNT(*) AS n FROM turns WHERE session_id = ?", (session_id,))[0]['n']
+
+    def turns(self, session_id, offset=0, limit=50):
+        """Turns [offset, offset + limit) of a session in order."""
+        return self._query("SELECT * FROM turns WHERE session_id = ? ORDER BY position LIMIT ? OFFSET ?",
+                           (session_id, limit, offset))
+
+    def history(self, session_id):
+        """All (user, assistant) pairs of a session, for continuing it in context mode."""
+        with self.lock:
+            return [(row[0], row[1]) for row in self.connection.execute(
+                "SELECT user_text, assistant_text FROM turns WHERE session_id = ? ORDER BY position", (session_id,))]
+
+    # --- Search ---
+    def search(self, query, limit=100):
+        """Turns of all sessions whose messages contain `query`, newest first, with a short snippet."""
+        query = query.strip()
+        if not query:
+            return []
+        if self.has_fts and len(query) >= 3:
+            # 整体作为一个短语匹配，避免用户输入被解析为 FTS 查询语法
+            phrase = '"' + query.replace('"', '""') + '"'
+            return self._query(
+                "SELECT t.session_id, t.position, s.title, s.model, t.created_at, "
+                "snippet(turns_fts, -1, '【', '】', '…', 12) AS snippet "
+                "FROM turns_fts JOIN turns t ON t.id = turns_fts.rowid JOIN sessions s ON s.id = t.session_id "
+                "WHERE turns_fts MATCH ? ORDER BY t.created_at DESC LIMIT ?", (phrase, limit))
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = self._query(
+            "SELECT t.session_id, t.position, s.title, s.model, t.created_at, t.user_text, t.assistant_text "
+            "FROM turns t JOIN sessions s ON s.id = t.session_id "
+            "WHERE t.user_text LIKE ? ESCAPE '\\' OR t.assistant_text LIKE ? ESCAPE '\\' "
+            "ORDER BY t.created_at DESC LIMIT ?", (pattern, pattern, limit))
+        for row in rows:
+            row['snippet'] = _snippet(row.pop('user_text') + " / " + row.pop('assistant_text'), query)
+        return rows
+
+
+def _snippet(text, query, width=30):
+    # LIKE 对 ASCII 不区分大小写，这里同样不区分；高亮保留原文的大小写
+    index = text.casefold().find(query.casefold())
+    if index < 0 or len(text.casefold()) != len(text):
+        # 大小写折叠改变了长度 (如 "ß")，位置无法对应原文：只显示开头
+        return text[:2 * width] + ("…" if len(text) > 2 * width else "")
+    end = index + len(query)
+    start = max(0, index - width)
+    return (("…" if start else "") + text[start:index] + f"【{text[index:end]}】" + text[end:end + width]
+            + ("…" if end + width < len(text) else ""))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(path=DB_FILE):
+    """The process-wide ChatStore (opened on first use)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatStore(os.path.abspath(path))
+        return _store
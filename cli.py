@@ -0,0 +1,382 @@
+"""
+Headless command line interface on top of pipeline_api, for servers without a display.
+
+    python cli.py train --base-model Qwen/Qwen2.5-0.5B-Instruct --data zhexuejia.jsonl --output ./lora_zhexuejia
+    python cli.py train --resume ./lora_zhexuejia --data more.jsonl --output ./lora_zhexuejia_continued
+    python cli.py train --base-model Qwen/Qwen2.5-0.5B --data corpus/ --output ./lora_pretrain --set max_length=2048
+    python cli.py train --base-model Qwen/Qwen2.5-0.5B-Instruct --data zhexuejia.jsonl=0.7 --data shangganwenxue.jsonl=0.3 --output ./lora_mix
+    python cli.py train --base-model Qwen/Qwen2.5-0.5B-Instruct --data zhexuejia.jsonl --output ./lora_ddp --nproc 4
+    python cli.py pretokenize --base-model Qwen/Qwen2.5-0.5B --data corpus/ --output corpus.bin
+    python cli.py plan --base-model Qwen/Qwen2.5-0.5B-Instruct --data zhexuejia.jsonl [--calibrate]
+    python cli.py plan --merge ./lora_zhexuejia
+    python cli.py dedup --data raw.jsonl --output clean.jsonl --base-model Qwen/Qwen2.5-0.5B-Instruct --max-length 1024
+    python cli.py chat ./lora_zhexuejia --message "你好"
+    python cli.py chat ollama:my-model:latest --message "你好" --stream
+    python cli.py batch-infer ./lora_zhexuejia --input prompts.jsonl --output responses.jsonl
+    python cli.py merge ./lora_zhexuejia my-model:latest [--adapter-only]
+    python cli.py export Qwen/Qwen2.5-0.5B-Instruct qwen-base:latest
+    python cli.py export-onnx ./lora_zhexuejia ./onnx_zhexuejia --quantize
+    python cli.py bench ./lora_zhexuejia --repeat 3
+    python cli.py compare ./lora_zhexuejia ollama:my-model:latest --input heldout.jsonl --output compare.jsonl --concurrency 4
+    python cli.py sweep sweep.json
+    python cli.py eval ./lora_zhexuejia --data heldout.jsonl
+
+Progress goes to stdout as JSON lines: {"event": <kind>, "time": <unix time>, "data": <payload>}.
+The last line is {"event": "result", ...} or {"event": "error", ...}. Anything the libraries print is
+redirected to stderr so stdout stays machine-readable. Ctrl+C cancels cooperatively; press it twice to abort.
+
+`--profile timings,cprofile,torch,pyspy` (before the command) enables profiling, see profiling.py.
+"""
+import argparse
+import contextlib
+import json
+import math
+import signal
+import sys
+import threading
+import time
+
+import pipeline_api
+import profiling
+from inference_core import QUANTIZATIONS
+
+EXIT_OK, EXIT_FAILED, EXIT_CANCELLED = 0, 1, 130
+
+
+def _jsonable(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class JsonLinesWriter:
+    """Writes one JSON object per event to a stream; safe to call from several threads."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def emit(self, event, data=None, **fields):
+        line = dict(event=event, time=round(time.time(), 3), **fields)
+        if data is not None:
+            line['data'] = _jsonable(data)
+        with self.lock:
+            self.stream.write(json.dumps(line, ensure_ascii=False) + "\n")
+            self.stream.flush()
+
+    def __call__(self, kind, payload):
+        self.emit(kind, payload)
+
+
+def install_cancel_handler(cancel_event, writer):
+    def handler(signum, frame):
+        if cancel_event.is_set():
+            raise KeyboardInterrupt
+        cancel_event.set()
+        writer.emit('status', "Cancelling... press Ctrl+C again to abort immediately.")
+    signal.signal(signal.SIGINT, handler)
+
+
+# --- Commands ---
+def parse_hparams(pairs):
+    """KEY=VALUE pairs; values are parsed as JSON when possible (numbers, booleans, lists), else kept as strings."""
+    hyperparams = {}
+    for pair in pairs or []:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise pipeline_api.PipelineError(f"Expected KEY=VALUE, got '{pair}'")
+        try:
+            hyperparams[key] = json.loads(value)
+        except ValueError:
+            hyperparams[key] = value
+    return hyperparams
+
+
+def cmd_train(args, writer, cancel_event):
+    # 多个 --data 组成按权重混合的数据源 (PATH=WEIGHT)
+    data = args.data[0] if len(args.data) == 1 else ",".join(args.data)
+    return pipeline_api.train(data, args.output, base_model=args.base_model, lora_adapter_path=args.resume,
+                              on_event=writer, cancel_event=cancel_event, hyperparams=parse_hparams(args.set),
+                              eval_data_path=args.eval_data, num_processes=args.nproc, nnodes=args.nnodes,
+                              node_rank=args.node_rank, master_addr=args.master_addr, master_port=args.master_port)
+
+
+def cmd_pretokenize(args, writer, cancel_event):
+    import pretrain_data
+    try:
+        path = pretrain_data.tokenize_text_files(args.base_model, args.data, output_path=args.output,
+                                                 num_workers=args.workers, log=lambda line: writer.emit('status', line))
+    except (OSError, ValueError) as e:
+        raise pipeline_api.PipelineError(str(e))
+    return dict(pretrain_data.read_token_meta(path), token_file=path)
+
+
+def cmd_dedup(args, writer, cancel_event):
+    import data_dedup
+    try:
+        return data_dedup.dedup_dataset(args.data, args.output, base_model=args.base_model, max_length=args.max_length,
+                                        threshold=args.threshold, num_workers=args.workers,
+                                        log=lambda line: writer.emit('status', line))
+    except (OSError, ValueError) as e:
+        raise pipeline_api.PipelineError(str(e))
+
+
+def cmd_plan(args, writer, cancel_event):
+    import memory_planner
+    try:
+        if args.merge:
+            plan = memory_planner.plan_merge(pipeline_api.resolve_adapter_dir(args.merge))
+            return dict(plan, summary=memory_planner.format_merge_plan(plan))
+        if not args.data:
+            raise pipeline_api.PipelineError("--data is required to plan a training run")
+        hyperparams = parse_hparams(args.set)
+        adapter_dir = pipeline_api.resolve_adapter_dir(args.resume) if args.resume else None
+        base_model = args.base_model or pipeline_api.read_adapter_base_model(adapter_dir)
+        if args.calibrate:
+            return memory_planner.calibrate(base_model, args.data, hyperparams, on_event=writer)
+        plan = memory_planner.plan_training(base_model, args.data, hyperparams, num_processes=args.nproc,
+                                            lora_adapter_path=adapter_dir)
+        return dict(plan, summary=memory_planner.format_training_plan(plan))
+    except (OSError, ValueError, RuntimeError) as e:
+        raise pipeline_api.PipelineError(str(e))
+
+
+def cmd_chat(args, writer, cancel_event):
+    import chat_context
+
+    model, tokenizer = pipeline_api.load_model(args.model, on_event=writer)
+    window = chat_context.window_for_model(model, tokenizer, budget=args.context_budget, strategy=args.context_strategy)
+    messages = [args.message] if args.message else (line.strip() for line in sys.stdin)
+    history, turns = [], 0
+    for message in messages:
+        if not message:
+            continue
+        if cancel_event.is_set():
+            break
+        start = time.time()
+        system_prompt, kept, context = window.fit(args.system_prompt, history if args.context else (), message, 1000)
+        timer = chat_context.TurnTimer((lambda text: writer.emit('text', text)) if args.stream else None)
+        response = pipeline_api.chat(model, tokenizer, message, kept, system_prompt=system_prompt,
+                                     temperature=args.temperature, on_text=timer)
+        writer.emit('response', {'message': message, 'response': response, 'seconds': time.time() - start,
+                                 'context': dict(context, **timer.stats())})
+        if args.context:
+            history.append((message, response))
+        turns += 1
+    return {'turns': turns}
+
+
+def cmd_batch_infer(args, writer, cancel_event):
+    return pipeline_api.batch_infer(args.model, args.input, args.output, system_prompt=args.system_prompt,
+                                    temperature=args.temperature, on_event=writer, cancel_event=cancel_event)
+
+
+def cmd_merge(args, writer, cancel_event):
+    return pipeline_api.merge(args.adapter, args.ollama_name, adapter_only=args.adapter_only, on_event=writer,
+                              cancel_event=cancel_event)
+
+
+def cmd_export(args, writer, cancel_event):
+    return pipeline_api.export(args.base_model, args.ollama_name, on_event=writer, cancel_event=cancel_event)
+
+
+def cmd_export_onnx(args, writer, cancel_event):
+    return pipeline_api.export_onnx(args.model, args.output_dir, quantize=args.quantize, on_event=writer)
+
+
+def cmd_bench(args, writer, cancel_event):
+    return pipeline_api.bench_generation(args.model, prompts=args.prompt, repeat=args.repeat,
+                                         temperature=args.temperature, on_event=writer)
+
+
+def cmd_compare(args, writer, cancel_event):
+    return pipeline_api.compare_models(args.models, args.input, args.output, system_prompt=args.system_prompt,
+                                       temperature=args.temperature, max_new_tokens=args.max_new_tokens,
+                                       concurrency=args.concurrency, max_samples=args.max_samples, on_event=writer,
+                                       cancel_event=cancel_event)
+
+
+def cmd_sweep(args, writer, cancel_event):
+    import sweep
+    config = sweep.load_sweep_config(args.config)
+    if args.max_parallel:
+        config['max_parallel'] = args.max_parallel
+    runner = sweep.SweepRunner(config, on_event=writer, cancel_event=cancel_event)
+    board = runner.run()
+    return {'leaderboard': board[:args.top], 'output_dir': runner.output_dir}
+
+
+def cmd_eval(args, writer, cancel_event):
+    return pipeline_api.evaluate(args.model, args.data, batch_size=args.batch_size, max_new_tokens=args.max_new_tokens,
+                                 max_samples=args.max_samples, use_cache=not args.no_cache, on_event=writer,
+                                 quantization=args.quantization)
+
+
+def _profile_modes(value):
+    try:
+        return profiling.parse_modes(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless LoRA training, inference and Ollama export.")
+    parser.add_argument("--profile", type=_profile_modes, metavar="MODES",
+                        help=f"Comma-separated profiling modes ({', '.join(profiling.MODES)}); results go to "
+                             "<output>/profile for training and merge, ./profiles otherwise")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("train", help="Train a new LoRA or continue an existing one")
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument("--base-model", help="Hugging Face model ID or local path of the base model")
+    source.add_argument("--resume", help="Existing LoRA model directory to continue training")
+    p.add_argument("--data", required=True, action="append",
+                   help="Training data: .jsonl with instruction/input/output, or plain text (.txt/.md file, directory "
+                        "of them, or a .bin token file) for continued pretraining. Repeat as PATH=WEIGHT to mix "
+                        "several datasets by weight")
+    p.add_argument("--output", required=True, help="Output directory")
+    p.add_argument("--eval-data", help="Validation JSONL; default: none, or a split of --data with --set eval_split=0.1")
+    p.add_argument("--set", action="append", metavar="KEY=VALUE",
+                   help="Override a hyperparameter of train_core.DEFAULT_HYPERPARAMS, e.g. --set learning_rate=1e-4")
+    p.add_argument("--nproc", type=int, default=1, help="Data-parallel training processes on this node (gloo backend)")
+    p.add_argument("--nnodes", type=int, default=1, help="Number of machines of a multi-node run")
+    p.add_argument("--node-rank", type=int, default=0, help="Index of this machine (0 reports progress)")
+    p.add_argument("--master-addr", default="127.0.0.1", help="Address of node 0")
+    p.add_argument("--master-port", type=int, help="Rendezvous port (default: a free port, 29500 for multi-node)")
+    p.set_defaults(func=cmd_train)
+
+    p = subparsers.add_parser("pretokenize", help="Tokenize a plain-text corpus once into a memory-mapped token file")
+    p.add_argument("--base-model", required=True, help="Model whose tokenizer is used")
+    p.add_argument("--data", required=True, help=".txt/.md file or directory of them")
+    p.add_argument("--output", help="Token file (.bin); default: cached under ./token_cache")
+    p.add_argument("--workers", type=int, help="Tokenizer processes (default: CPU count - 1, at most 8)")
+    p.set_defaults(func=cmd_pretokenize)
+
+    p = subparsers.add_parser("plan", help="Estimate peak memory and time of a training run or merge before starting it")
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument("--base-model", help="Base model of the training run")
+    target.add_argument("--resume", help="Existing LoRA model directory to continue training")
+    target.add_argument("--merge", metavar="LORA_DIR", help="Plan merging this LoRA instead of training")
+    p.add_argument("--data", help="Training data, as for train")
+    p.add_argument("--set", action="append", metavar="KEY=VALUE", help="Hyperparameter override, as for train")
+    p.add_argument("--nproc", type=int, default=1, help="Data-parallel processes, as for train")
+    p.add_argument("--calibrate", action="store_true",
+                   help="Run a few training steps to measure speed and peak memory (stored in planner_calibration.json)")
+    p.set_defaults(func=cmd_plan)
+
+    p = subparsers.add_parser("dedup", help="Drop exact / near-duplicate, empty and over-length rows of a JSONL dataset")
+    p.add_argument("--data", required=True, help=".jsonl with instruction/input/output")
+    p.add_argument("--output", required=True, help="Cleaned .jsonl; the report goes to <output>.report.json")
+    p.add_argument("--base-model", help="Model whose tokenizer measures lengths (default: lengths in characters)")
+    p.add_argument("--max-length", type=int, help="Drop rows longer than this many tokens (needs --base-model)")
+    p.add_argument("--threshold", type=float, default=0.8, help="Estimated Jaccard similarity of near duplicates")
+    p.add_argument("--workers", type=int, help="Worker processes (default: CPU count - 1, at most 8)")
+    p.set_defaults(func=cmd_dedup)
+
+    def add_generation_args(p):
+        p.add_argument("model", help="Base model ID, LoRA model directory, ONNX export directory or ollama:<name>")
+        p.add_argument("--temperature", type=float, default=0.8)
+
+    p = subparsers.add_parser("chat", help="Chat with a model (one --message, or one message per stdin line)")
+    add_generation_args(p)
+    p.add_argument("--message", help="Single message; without it, messages are read from stdin")
+    p.add_argument("--system-prompt", default=pipeline_api.DEFAULT_SYSTEM_PROMPT)
+    p.add_argument("--no-context", dest="context", action="store_false", help="Do not send previous turns")
+    p.add_argument("--stream", action="store_true", help="Also emit the answer as 'text' events while it is generated")
+    p.add_argument("--context-budget", type=int, help="Prompt token budget (default: config.json context_budget_tokens or 4096)")
+    p.add_argument("--context-strategy", choices=["drop", "summarize"], help="What happens to turns beyond the budget")
+    p.set_defaults(func=cmd_chat)
+
+    p = subparsers.add_parser("batch-infer", help="Generate responses for every record of a JSONL file")
+    add_generation_args(p)
+    p.add_argument("--input", required=True, help="JSONL with instruction/input fields")
+    p.add_argument("--output", required=True, help="JSONL written with an added 'response' field")
+    p.add_argument("--system-prompt", help="Override the per-record instruction")
+    p.set_defaults(func=cmd_batch_infer)
+
+    p = subparsers.add_parser("merge", help="Import a trained LoRA into Ollama")
+    p.add_argument("adapter", help="LoRA model directory (or its final_lora_adapter)")
+    p.add_argument("ollama_name", help="Ollama model name, e.g. my-model:latest")
+    p.add_argument("--adapter-only", action="store_true", help="Import as FROM <base> + ADAPTER instead of merging")
+    p.set_defaults(func=cmd_merge)
+
+    p = subparsers.add_parser("export", help="Convert a Hugging Face base model to GGUF and import it into Ollama")
+    p.add_argument("base_model", help="Hugging Face model ID")
+    p.add_argument("ollama_name", help="Ollama model name")
+    p.set_defaults(func=cmd_export)
+
+    p = subparsers.add_parser("export-onnx", help="Export a (merged) model to ONNX with KV cache for ONNX Runtime CPU serving")
+    p.add_argument("model", help="LoRA model directory (merged first), merged model directory or Hugging Face model ID")
+    p.add_argument("output_dir", help="Export directory; load it with chat / bench / batch-infer like any model")
+    p.add_argument("--quantize", action="store_true", help="Also quantize the weights to int8 (dynamic quantization)")
+    p.set_defaults(func=cmd_export_onnx)
+
+    p = subparsers.add_parser("bench", help="Measure generation latency and tokens/s")
+    add_generation_args(p)
+    p.add_argument("--prompt", action="append", help="Prompt to benchmark (repeatable)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=cmd_bench)
+
+    p = subparsers.add_parser("compare", help="Side-by-side latency and answers of several models on the same records")
+    p.add_argument("models", nargs="+", help="Models to compare, e.g. ./lora_xxx ollama:my-model:latest")
+    p.add_argument("--input", required=True, help="JSONL in the training format (instruction / input)")
+    p.add_argument("--output", help="Write each record with every model's answer to this JSONL file")
+    p.add_argument("--system-prompt", help="Override the records' instruction")
+    p.add_argument("--temperature", type=float, default=0.8)
+    p.add_argument("--max-new-tokens", type=int, default=512)
+    p.add_argument("--concurrency", type=int, default=1, help="Requests in flight at once for ollama: models")
+    p.add_argument("--max-samples", type=int, help="Only use the first N records")
+    p.set_defaults(func=cmd_compare)
+
+    p = subparsers.add_parser("sweep", help="Hyperparameter sweep (see sweep.py for the config format)")
+    p.add_argument("config", help="Sweep config JSON")
+    p.add_argument("--max-parallel", type=int, help="Override the number of trials running at once")
+    p.add_argument("--top", type=int, default=5, help="Leaderboard entries to include in the result line")
+    p.set_defaults(func=cmd_sweep)
+
+    p = subparsers.add_parser("eval", help="Perplexity and generation metrics of a LoRA vs. its base model")
+    p.add_argument("model", help="LoRA model directory")
+    p.add_argument("--data", required=True, help="Held-out JSONL in the training format")
+    p.add_argument("--batch-size", type=int, default=4)
+    p.add_argument("--max-new-tokens", type=int, default=256, help="0 skips the generation metrics")
+    p.add_argument("--max-samples", type=int, help="Only evaluate the first N records")
+    p.add_argument("--no-cache", action="store_true", help="Recompute the base model baseline")
+    p.add_argument("--quantization", choices=QUANTIZATIONS,
+                   help="How to load the base model (default: 4bit on CUDA, float32 on CPU)")
+    p.set_defaults(func=cmd_eval)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        profiling.set_modes(args.profile)
+    writer = JsonLinesWriter(sys.stdout)
+    cancel_event = threading.Event()
+    install_cancel_handler(cancel_event, writer)
+
+    # 库代码中的 print 输出到 stderr，stdout 只保留 JSON lines
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            result = args.func(args, writer, cancel_event)
+        except pipeline_api.PipelineError as e:
+            writer.emit('error', message=str(e))
+            return EXIT_FAILED
+        except KeyboardInterrupt:
+            writer.emit('error', message="aborted")
+            return EXIT_CANCELLED
+
+    if cancel_event.is_set() or (isinstance(result, dict) and result.get('cancelled')):
+        writer.emit('cancelled', result)
+        return EXIT_CANCELLED
+    writer.emit('result', result)
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+import asyncio
+import codecs
+import collections
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+# --- Progress patterns for the external tools we drive ---
+# convert_hf_to_gguf.py (older versions): "[  12/291] Writing tensor blk.0.attn_q.weight ..."
+TENSOR_INDEX_RE = re.compile(r"\[\s*(\d+)\s*/\s*(\d+)\s*\]")
+# convert_hf_to_gguf.py: "gguf: loading model part 'model-00001-of-00004.safetensors'"
+MODEL_PART_RE = re.compile(r"loading model part '.*?(\d+)-of-(\d+)")
+# convert_hf_to_gguf.py (newer versions, tqdm): "Writing:  45%|████▌     | 6.80G/15.2G [00:41<00:51, 164Mbyte/s]"
+WRITING_RE = re.compile(
+    r"Writing:\s*(\d+)%.*?([\d.]+)\s*([kKMGT]?)(?:i?B|byte)?\s*/\s*([\d.]+)\s*([kKMGT]?)"
+)
+# ollama create: "copying file sha256:... 45%", "transferring model data 45%"
+PERCENT_RE = re.compile(r"(\d{1,3})%")
+# Lines that must always reach the user, regardless of throttling.
+IMPORTANT_RE = re.compile(r"error|exception|traceback|warning|failed|success", re.IGNORECASE)
+
+UNIT_MULTIPLIERS = {"": 1, "k": 1e3, "K": 1e3, "M": 1e6, "G": 1e9, "T": 1e12}
+
+
+def parse_progress_line(line, stage=None):
+    """
+    Parses a single output line of convert_hf_to_gguf.py / ollama create.
+    Returns a progress event dict, or None if the line carries no progress information.
+    """
+    match = WRITING_RE.search(line)
+    if match:
+        written = float(match.group(2)) * UNIT_MULTIPLIERS[match.group(3)]
+        total = float(match.group(4)) * UNIT_MULTIPLIERS[match.group(5)]
+        return {
+            'stage': stage, 'kind': 'bytes', 'progress': float(match.group(1)),
+            'bytes_written': int(written), 'bytes_total': int(total),
+        }
+
+    match = TENSOR_INDEX_RE.search(line)
+    if match:
+        current, total = int(match.group(1)), int(match.group(2))
+        if total > 0:
+            return {
+                'stage': stage, 'kind': 'tensor', 'progress': current / total * 100,
+                'current': current, 'total': total,
+            }
+
+    match = MODEL_PART_RE.search(line)
+    if match:
+        current, total = int(match.group(1)), int(match.group(2))
+        if total > 0:
+            return {
+                'stage': stage, 'kind': 'part', 'progress': current / total * 100,
+                'current': current, 'total': total,
+            }
+
+    match = PERCENT_RE.search(line)
+    if match and stage == 'import':
+        return {'stage': stage, 'kind': 'percent', 'progress': float(min(int(match.group(1)), 100))}
+
+    return None
+
+
+class LogThrottle:
+    """
+    Rate-limits log forwarding to the UI: at most `max_lines` ordinary lines per `interval` seconds.
+    Important lines (errors, warnings, success) are always forwarded; suppressed lines are counted
+    and reported in a single summary line so a flood of output can never stall the Tk main loop.
+    """
+    def __init__(self, emit, interval=0.5, max_lines=20):
+        self.emit = emit
+        self.interval = interval
+        self.max_lines = max_lines
+        self.window_start = time.monotonic()
+        self.sent_in_window = 0
+        self.suppressed = 0
+
+    def push(self, line):
+        now = time.monotonic()
+        if now - self.window_start >= self.interval:
+            self.flush()
+            self.window_start = now
+            self.sent_in_window = 0
+
+        if IMPORTANT_RE.search(line) or self.sent_in_window < self.max_lines:
+            self.sent_in_window += 1
+            self.emit(line)
+        else:
+            self.suppressed += 1
+
+    def flush(self):
+        if self.suppressed:
+            self.emit(f"... ({self.suppressed} lines of output suppressed)")
+            self.suppressed = 0
+
+
+class ProgressThrottle:
+    """Forwards progress events at most once per `interval` seconds, always keeping the latest one."""
+    def __init__(self, emit, interval=0.2):
+        self.emit = emit
+        self.interval = interval
+        self.last_sent = 0.0
+        self.pending = None
+
+    def push(self, event):
+        now = time.monotonic()
+        if now - self.last_sent >= self.interval:
+            self.last_sent = now
+            self.pending = None
+            self.emit(event)
+        else:
+            self.pending = event
+
+    def flush(self):
+        if self.pending is not None:
+            self.emit(self.pending)
+            self.pending = None
+
+
+def _split_lines(buffer):
+    """Splits on both '\\n' and '\\r' so tqdm carriage-return updates become separate lines."""
+    parts = re.split(r"[\r\n]", buffer)
+    return parts[:-1], parts[-1]
+
+
+def _kill_process_group(process):
+    """Kills the process and all of its children."""
+    if process.returncode is not None:
+        return
+    try:
+        if sys.platform == "win32":
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+    except (ProcessLookupError, OSError):
+        pass
+
+
+async def run_command_async(command, log_callback, progress_callback=None, cwd=None, timeout=None,
+                            cancel_event=None, stage=None, encoding='utf-8'):
+    """
+    Runs a command in its own process group, streaming and parsing its output.
+
+    - log_callback(str): receives throttled output lines.
+    - progress_callback(dict): receives throttled progress events (see parse_progress_line).
+    - timeout: seconds before the whole process group is killed.
+    - cancel_event: a threading.Event; when set, the process group is killed.
+
+    Returns the exit code. A killed process returns a negative code, as subprocess does.
+    """
+    kwargs = {}
+    if sys.platform == "win32":
+        kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        cwd=cwd,
+        **kwargs
+    )
+
+    logs = LogThrottle(log_callback)
+    progress = ProgressThrottle(progress_callback) if progress_callback else None
+    tail = collections.deque(maxlen=50)
+    start_time = time.monotonic()
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    buffer = ""
+    reason = None
+
+    try:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                reason = "cancelled"
+                break
+            if timeout is not None and time.monotonic() - start_time > timeout:
+                reason = f"timed out after {timeout}s"
+                break
+
+            try:
+                chunk = await asyncio.wait_for(process.stdout.read(65536), timeout=0.2)
+            except asyncio.TimeoutError:
+                continue
+            if not chunk:
+                break
+
+            buffer += decoder.decode(chunk)
+            lines, buffer = _split_lines(buffer)
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                tail.append(line)
+                event = parse_progress_line(line, stage)
+                if event is not None and progress is not None:
+                    progress.push(event)
+                    # Pure progress lines (tqdm redraws) are not worth logging.
+                    if event['kind'] in ('bytes', 'percent'):
+                        continue
+                logs.push(line)
+
+        if buffer.strip():
+            tail.append(buffer.strip())
+            logs.push(buffer.strip())
+    except asyncio.CancelledError:
+        reason = "cancelled"
+        raise
+    finally:
+        if reason is not None:
+            _kill_process_group(process)
+        logs.flush()
+        if progress is not None:
+            progress.flush()
+
+    # The process may outlive its output (e.g. it closed stdout), so the wait is bounded by the
+    # same timeout and cancel_event as the read loop.
+    while True:
+        if reason is None and cancel_event is not None and cancel_event.is_set():
+            reason = "cancelled"
+        if reason is None and timeout is not None and time.monotonic() - start_time > timeout:
+            reason = f"timed out after {timeout}s"
+        if reason is not None:
+            _kill_process_group(process)
+        wait = 0.2
+        if reason is None and timeout is not None:
+            wait = min(wait, max(0.0, timeout - (time.monotonic() - start_time)))
+        try:
+            exit_code = await asyncio.wait_for(process.wait(), timeout=wait)
+            break
+        except asyncio.TimeoutError:
+            continue
+        except asyncio.CancelledError:
+            _kill_process_group(process)
+            raise
+    if reason is not None:
+        log_callback(f"Command {reason}, process group killed.")
+    elif exit_code != 0 and tail:
+        # Make sure the user sees the lines that led to the failure, even if they were throttled.
+        log_callback("Last output lines:\n" + "\n".join(tail))
+    return exit_code
+
+
+def run_command_blocking(command, log_callback, **kwargs):
+    """Synchronous wrapper around run_command_async, for use from worker threads."""
+    return asyncio.run(run_command_async(command, log_callback, **kwargs))
@@ -0,0 +1,347 @@
+"""
+Dedup and quality pre-pass for instruction data (JSONL with instruction / input / output), run before
+tokenization (train_core.process_func).
+
+- rows without an `output` are dropped;
+- exact duplicates: hash of the normalized instruction + input + output (case and whitespace folded);
+- near duplicates: MinHash signatures of character 5-grams (works for Chinese without word segmentation)
+  with LSH banding; candidate pairs are confirmed by their signature agreement (estimated Jaccard) and the
+  first row of every cluster is kept;
+- with a tokenizer, the token length of every row (chat template included) goes into a histogram, and rows
+  longer than max_length are dropped instead of being silently truncated during training.
+
+Signatures are computed for whole batches at once with NumPy (all shingles of a batch hashed by all
+permutations in one array operation, then reduced per row), in several worker processes. The file is
+streamed twice (signatures, then writing the kept rows); only hashes and signatures stay in memory
+(num_perm * 4 bytes per row).
+
+    python cli.py dedup --data raw.jsonl --output clean.jsonl --base-model Qwen/Qwen2.5-0.5B-Instruct --max-length 1024
+
+The report (counts, length histogram, near-duplicate examples) is written to <output>.report.json.
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import time
+
+import model_registry
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NGRAM = 5
+ROWS_PER_TASK = 2000
+SHINGLES_PER_BATCH = 1 << 16 # 每次向量化计算的 shingle 数上限 (num_perm * 该值 * 8 字节)
+_MERSENNE_PRIME = (1 << 61) - 1
+HISTOGRAM_EDGES = [0, 128, 256, 512, 1024, 2048, 4096, 8192]
+DEDUP_CACHE_DIR = "./token_cache/dedup"
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(record):
+    text = "\n".join(str(record.get(key) or "") for key in ('instruction', 'input', 'output'))
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def choose_bands(num_perm, threshold):
+    """Band count b (dividing num_perm) whose LSH threshold (1/b)^(1/r) is closest to `threshold`."""
+    candidates = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(candidates, key=lambda b: abs((1 / b) ** (b / num_perm) - threshold))
+
+
+def permutations(num_perm, seed=1):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    # a < 2^31 且哈希值 < 2^32，a * x + b 不会超出 uint64
+    a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(texts, a, b, ngram=DEFAULT_NGRAM):
+    """(len(texts), num_perm) uint32 MinHash signatures of the texts' character n-gram sets."""
+    import numpy as np
+    from eval_harness import char_codes, ngram_ids
+
+    num_perm = len(a)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    start = 0
+    while start < len(texts):
+        shingle_sets, total, end = [], 0, start
+        while end < len(texts) and (total < SHINGLES_PER_BATCH or end == start):
+            codes = char_codes(texts[end])
+            ids = ngram_ids(codes, ngram) if len(codes) >= ngram else ngram_ids(codes, max(1, len(codes)))
+            if not len(ids):
+                ids = np.zeros(1, dtype=np.uint64) # 空文本
+            ids = np.unique((ids >> np.uint64(32)) ^ (ids & np.uint64(0xFFFFFFFF)))
+            shingle_sets.append(ids)
+            total += len(ids)
+            end += 1
+        shingles = np.concatenate(shingle_sets)
+        offsets = np.cumsum([0] + [len(s) for s in shingle_sets[:-1]])
+        with np.errstate(over='ignore'):
+            hashed = (a[:, None] * shingles[None, :] + b[:, None]) % np.uint64(_MERSENNE_PRIME)
+        # 每行所有 shingle 上的最小值: 按行的起始偏移分段归约
+        signatures[start:end] = (np.minimum.reduceat(hashed, offsets, axis=1).T & np.uint64(0xFFFFFFFF))
+        start = end
+    return signatures
+
+
+# --- Worker processes ---
+_worker = {}
+
+
+def _init_worker(num_perm, ngram, base_model):
+    _worker['a'], _worker['b'] = permutations(num_perm)
+    _worker['ngram'] = ngram
+    _worker['tokenizer'] = None
+    if base_model:
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+        tokenizer = model_registry.get_tokenizer(base_model)
+        _worker['tokenizer'] = tokenizer
+        _worker['template_tokens'] = template_overhead(tokenizer)
+
+
+def template_overhead(tokenizer):
+    """Tokens the chat template adds around system / user / assistant content."""
+    messages = [{"role": "system", "content": ""}, {"role": "user", "content": ""},
+                {"role": "assistant", "content": ""}]
+    return len(model_registry.encode_chats(tokenizer, [messages])[0])
+
+
+def _process_rows(records):
+    """Exact-dedup hashes, MinHash signatures and lengths (tokens, or characters without a tokenizer)."""
+    import numpy as np
+
+    texts = [normalize_text(record) for record in records]
+    hashes = [hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest() for text in texts]
+    signatures = minhash_signatures(texts, _worker['a'], _worker['b'], _worker['ngram'])
+    tokenizer = _worker['tokenizer']
+    if tokenizer is None:
+        lengths = np.array([sum(len(str(r.get(k) or "")) for k in ('instruction', 'input', 'output')) for r in records])
+    else:
+        lengths = np.full(len(records), _worker['template_tokens'], dtype=np.int64)
+        for key in ('instruction', 'input', 'output'):
+            encoded = tokenizer([str(r.get(key) or "") for r in records], add_special_tokens=False)['input_ids']
+            lengths += np.array([len(ids) for ids in encoded], dtype=np.int64)
+    empty = [not str(record.get('output') or "").strip() for record in records]
+    return hashes, signatures, lengths, empty
+
+
+def _read_batches(path, rows_per_task):
+    batch = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                batch.append(json.loads(line))
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {e}")
+            if len(batch) >= rows_per_task:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+# --- LSH ---
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = x
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while x != root:
+            self.parent[x], x = root, self.parent.get(x, x)
+        return root
+
+    def union(self, x, y):
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            # 根总是较小的行号，即保留最先出现的一行
+            self.parent[max(rx, ry)] = min(rx, ry)
+
+
+def find_near_duplicates(signatures, candidates, bands, threshold):
+    """
+    Maps each near-duplicate row (index into `candidates`) to the row it duplicates, using LSH buckets per band
+    and confirming pairs whose signatures agree on at least `threshold` of the permutations.
+    """
+    import numpy as np
+
+    rows = signatures.shape[1] // bands
+    sigs = signatures[candidates]
+    union = _UnionFind()
+    similarity = {}
+    for band in range(bands):
+        block = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+        keys = block.view(np.dtype((np.void, block.dtype.itemsize * rows))).ravel()
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        group_rep = order[np.repeat(starts, np.diff(np.r_[starts, len(order)]))]
+        members = order
+        mask = members != group_rep
+        if not mask.any():
+            continue
+        members, reps = members[mask], group_rep[mask]
+        agreement = (sigs[members] == sigs[reps]).mean(axis=1)
+        for member, rep, score in zip(members[agreement >= threshold].tolist(), reps[agreement >= threshold].tolist(),
+                                      agreement[agreement >= threshold].tolist()):
+            union.union(member, rep)
+            similarity.setdefault(max(member, rep), (min(member, rep), score))
+    duplicates = {}
+    for member in list(union.parent):
+        root = union.find(member)
+        if root != member:
+            duplicates[member] = (root, similarity.get(member, (root, None))[1])
+    return duplicates
+
+
+def length_histogram(lengths, unit):
+    import numpy as np
+    edges = HISTOGRAM_EDGES + [max(int(lengths.max()) + 1 if len(lengths) else 1, HISTOGRAM_EDGES[-1] + 1)]
+    counts, _ = np.histogram(lengths, bins=edges)
+    bins = [{'from': edges[i], 'to': edges[i + 1] if i + 2 < len(edges) else None, 'count': int(c)}
+            for i, c in enumerate(counts)]
+    percentiles = {f"p{p}": float(np.percentile(lengths, p)) for p in (50, 90, 99)} if len(lengths) else {}
+    return {'unit': unit, 'bins': bins, 'max': int(lengths.max()) if len(lengths) else 0, **percentiles}
+
+
+def dedup_dataset(data_path, output_path, base_model=None, max_length=None, threshold=DEFAULT_THRESHOLD,
+                  num_perm=DEFAULT_NUM_PERM, ngram=DEFAULT_NGRAM, num_workers=None, report_path=None, log=print):
+    """
+    Writes the rows of `data_path` that survive the pre-pass to `output_path` and returns the report dict
+    (also written to `report_path`, default <output_path>.report.json).
+    `max_length` (tokens, needs `base_model`) drops over-length rows.
+    """
+    import multiprocessing
+    import numpy as np
+
+    if max_length and not base_model:
+        raise ValueError("按 token 长度过滤 (max_length) 需要指定 base_model 以加载分词器")
+    start = time.time()
+    num_workers = num_workers or max(1, min(8, (os.cpu_count() or 2) - 1))
+    if num_workers > 1 and multiprocessing.current_process().daemon:
+        num_workers = 1 # 在任务子进程中不能再创建进程池
+    bands = choose_bands(num_perm, threshold)
+    log(f"去重预处理: {data_path} ({num_workers} 个进程，MinHash {num_perm} 个排列，{bands} 个分段)")
+
+    # 第 1 遍: 哈希、签名与长度 (按顺序收集，在途任务数有上限)
+    hashes, signature_parts, length_parts, empty_parts = [], [], [], []
+
+    def collect(result):
+        batch_hashes, signatures, lengths, empty = result
+        hashes.extend(batch_hashes)
+        signature_parts.append(signatures)
+        length_parts.append(lengths)
+        empty_parts.append(np.array(empty, dtype=bool))
+        if len(hashes) % (ROWS_PER_TASK * 50) < ROWS_PER_TASK:
+            log(f"已处理 {len(hashes)} 行...")
+
+    batches = _read_batches(data_path, ROWS_PER_TASK)
+    if num_workers == 1:
+        _init_worker(num_perm, ngram, base_model)
+        for batch in batches:
+            collect(_process_rows(batch))
+    else:
+        pool = multiprocessing.get_context("spawn").Pool(num_workers, initializer=_init_worker,
+                                                        initargs=(num_perm, ngram, base_model))
+        try:
+            pending = collections.deque()
+            for batch in batches:
+                pending.append(pool.apply_async(_process_rows, (batch,)))
+                if len(pending) >= 2 * num_workers:
+                    collect(pending.popleft().get())
+            while pending:
+                collect(pending.popleft().get())
+        finally:
+            pool.terminate()
+            pool.join()
+
+    total = len(hashes)
+    if not total:
+        raise ValueError(f"数据文件为空: {data_path}")
+    signatures = np.concatenate(signature_parts)
+    lengths = np.concatenate(length_parts)
+    empty = np.concatenate(empty_parts)
+    signature_seconds = time.time() - start
+
+    drop_reason = {}
+    for index in np.flatnonzero(empty).tolist():
+        drop_reason[index] = 'empty_output'
+    if max_length:
+        for index in np.flatnonzero(lengths > max_length).tolist():
+            drop_reason.setdefault(index, 'over_length')
+    first_seen = {}
+    for index, digest in enumerate(hashes):
+        if index in drop_reason:
+            continue
+        if digest in first_seen:
+            drop_reason[index] = 'exact_duplicate'
+        else:
+            first_seen[digest] = index
+
+    # 近似重复只在剩余的行之间查找
+    candidates = np.array(sorted(first_seen.values()), dtype=np.int64)
+    near = find_near_duplicates(signatures, candidates, bands, threshold)
+    examples = []
+    for member, (root, score) in sorted(near.items()):
+        drop_reason[int(candidates[member])] = 'near_duplicate'
+        if len(examples) < 20:
+            examples.append({'dropped_row': int(candidates[member]) + 1, 'kept_row': int(candidates[root]) + 1,
+                             'estimated_jaccard': score})
+
+    # 第 2 遍: 写出保留的行
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    temp_path = output_path + ".tmp"
+    index = 0
+    with open(data_path, 'r', encoding='utf-8') as source, open(temp_path, 'w', encoding='utf-8') as out:
+        for line in source:
+            if not line.strip():
+                continue
+            if index not in drop_reason:
+                out.write(line if line.endswith("\n") else line + "\n")
+            index += 1
+    os.replace(temp_path, output_path)
+
+    reasons = collections.Counter(drop_reason.values())
+    kept_mask = np.ones(total, dtype=bool)
+    kept_mask[list(drop_reason)] = False
+    seconds = time.time() - start
+    report = {
+        'data_path': data_path, 'output_path': output_path, 'base_model': base_model, 'max_length': max_length,
+        'total_rows': total, 'kept_rows': int(kept_mask.sum()),
+        'dropped': {reason: reasons.get(reason, 0)
+                    for reason in ('empty_output', 'over_length', 'exact_duplicate', 'near_duplicate')},
+        'settings': {'threshold': threshold, 'num_perm': num_perm, 'bands': bands, 'ngram': ngram},
+        'length_histogram': length_histogram(lengths, 'tokens' if base_model else 'chars'),
+        'kept_length_histogram': length_histogram(lengths[kept_mask], 'tokens' if base_model else 'chars'),
+        'near_duplicate_examples': examples,
+        'seconds': seconds, 'signature_seconds': signature_seconds, 'rows_per_s': total / max(seconds, 1e-9),
+    }
+    report_path = report_path or output_path + ".report.json"
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    log(f"去重完成: {total} 行 -> 保留 {report['kept_rows']} 行 ({json.dumps(report['dropped'], ensure_ascii=False)})，"
+        f"用时 {seconds:.1f}s，报告: {report_path}")
+    return report
+
+
+def cached_dedup(data_path, base_model=None, max_length=None, cache_dir=DEDUP_CACHE_DIR, log=print, **settings):
+    """Runs dedup_dataset once per file version and settings; returns the path of the cleaned JSONL."""
+    stat = os.stat(data_path)
+    key = hashlib.sha1(json.dumps([os.path.abspath(data_path), stat.st_size, stat.st_mtime_ns, base_model, max_length,
+                                   sorted(settings.items())]).encode('utf-8')).hexdigest()[:16]
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", os.path.splitext(os.path.basename(data_path))[0])
+    output_path = os.path.join(cache_dir, f"{slug}-{key}.jsonl")
+    if os.path.exists(output_path) and os.path.exists(output_path + ".report.json"):
+        log(f"复用去重结果: {output_path}")
+        return output_path
+    dedup_dataset(data_path, output_path, base_model=base_model, max_length=max_length, log=log, **settings)
+    return output_path
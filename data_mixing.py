@@ -0,0 +1,255 @@
+"""
+Training on several datasets mixed by weight.
+
+A mixture is given as "a.jsonl=0.7,b.jsonl=0.3" (weights need not sum to 1; a missing weight means 1),
+as a list of (path, weight) pairs or as a {path: weight} dict. Every source is tokenized once into its own
+cache (./token_cache/chat for JSONL, the pretrain_data token files for plain text), independent of the
+weights, so re-running with other weights only rebuilds the sampling schedule.
+
+MixtureDataset does not concatenate the sources: it draws a schedule of (source, row) index pairs and reads
+each row from its memory-mapped source on access. SourceAccountingCollator counts the tokens each source
+actually contributes to the batches; they show up in the progress events, the trainer log history
+(tokens/<name>) and training_summary.json.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+
+import data_dedup
+import model_registry
+import pretrain_data
+
+CHAT_CACHE_DIR = os.path.join(pretrain_data.TOKEN_CACHE_DIR, "chat")
+_WEIGHT_PATTERN = re.compile(r"^(.*)=\s*([0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)\s*$")
+
+
+def parse_mixture(data):
+    """
+    Returns [(path, weight), ...] for a mixture spec, or None when `data` is a single plain path.
+    Raises ValueError for negative or all-zero weights.
+    """
+    if isinstance(data, dict):
+        items = list(data.items())
+    elif isinstance(data, (list, tuple)):
+        items = [_parse_item(item) if isinstance(item, str) else (item[0], item[1]) for item in data]
+    elif isinstance(data, str) and ("," in data or _WEIGHT_PATTERN.match(data)):
+        items = [_parse_item(part) for part in data.split(",") if part.strip()]
+    else:
+        return None
+    items = [(str(path).strip(), float(weight)) for path, weight in items]
+    if any(weight < 0 for _, weight in items) or not any(weight > 0 for _, weight in items):
+        raise ValueError(f"数据源权重必须非负且不能全为 0: {items}")
+    return [(path, weight) for path, weight in items if weight > 0]
+
+
+def _parse_item(text):
+    match = _WEIGHT_PATTERN.match(text.strip())
+    return (match.group(1), float(match.group(2))) if match else (text.strip(), 1.0)
+
+
+def format_mixture(items):
+    return ",".join(f"{path}={weight:g}" for path, weight in items)
+
+
+def source_names(paths):
+    """Short unique names (file name without extension) used in logs and metrics."""
+    names = []
+    for path in paths:
+        base = os.path.splitext(os.path.basename(os.path.normpath(path)))[0] or "source"
+        name, suffix = base, 2
+        while name in names:
+            name, suffix = f"{base}_{suffix}", suffix + 1
+        names.append(name)
+    return names
+
+
+def mixture_format(items, data_format="auto"):
+    """'text' or 'chat' for the whole mixture; sources of both kinds cannot be mixed."""
+    if data_format != "auto":
+        return data_format
+    kinds = {"text" if pretrain_data.is_text_data(path) else "chat" for path, _ in items}
+    if len(kinds) > 1:
+        raise ValueError("不能混合纯文本语料与指令 (JSONL) 数据集")
+    return kinds.pop()
+
+
+def load_source_dataset(base_model_name, tokenizer, path, max_length, cache_dir=CHAT_CACHE_DIR, log=print):
+    """Tokenized (memory-mapped) dataset of one JSONL source, cached per tokenizer, max_length and file version."""
+    from datasets import load_dataset, load_from_disk
+    from train_core import tokenize_dataset
+
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{base_model_name}|{max_length}|{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+                       .encode('utf-8')).hexdigest()[:16]
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", os.path.splitext(os.path.basename(path))[0])
+    target = os.path.join(cache_dir, f"{slug}-{key}")
+    if os.path.isdir(target):
+        log(f"复用已分词的数据源: {target}")
+        return load_from_disk(target)
+
+    raw_dataset = load_dataset("json", data_files=path, split="train")
+    temp_dir = f"{target}.tmp{os.getpid()}"
+    tokenize_dataset(raw_dataset, tokenizer, max_length).save_to_disk(temp_dir)
+    try:
+        os.replace(temp_dir, target)
+    except OSError:
+        # 另一个训练任务 (如超参数搜索的并行 trial) 已经写好了同一个缓存
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    log(f"数据源已分词并缓存: {target} ({len(raw_dataset)} 条)")
+    return load_from_disk(target)
+
+
+def prepare_sources(base_model_name, items, max_length, tokenize_workers=None, dedup=False, log=print):
+    """Fills the per-source caches up front (e.g. once before the trials of a sweep start)."""
+    if mixture_format(items) == "text":
+        for path, _ in items:
+            pretrain_data.tokenize_text_files(base_model_name, path, num_workers=tokenize_workers, log=log)
+        return
+    tokenizer = model_registry.get_tokenizer(base_model_name)
+    for path, _ in items:
+        if dedup:
+            path = data_dedup.cached_dedup(path, base_model_name, max_length, log=log)
+        load_source_dataset(base_model_name, tokenizer, path, max_length, log=log)
+
+
+class MixtureDataset:
+    """
+    Map-style dataset sampling `num_samples` rows from the sources with probabilities proportional to the
+    weights (default: as many samples as all sources together). Each source is walked in shuffled order and
+    repeated when its quota exceeds its size. Only two index arrays are held in memory.
+    """
+    def __init__(self, sources, names, weights, num_samples=None, seed=42):
+        import numpy as np
+
+        sizes = [len(source) for source in sources]
+        empty = [name for name, size in zip(names, sizes) if size == 0]
+        if empty:
+            raise ValueError(f"数据源为空: {', '.join(empty)}")
+        probabilities = np.asarray(weights, dtype=np.float64)
+        probabilities /= probabilities.sum()
+        num_samples = int(num_samples or sum(sizes))
+
+        rng = np.random.default_rng(seed)
+        counts = rng.multinomial(num_samples, probabilities)
+        self.source_ids = np.repeat(np.arange(len(sources), dtype=np.int32), counts)
+        rng.shuffle(self.source_ids)
+        self.row_ids = np.empty(num_samples, dtype=np.int64)
+        for index, (count, size) in enumerate(zip(counts, sizes)):
+            if count:
+                repeats = -(-count // size)
+                self.row_ids[self.source_ids == index] = np.concatenate(
+                    [rng.permutation(size) for _ in range(repeats)])[:count]
+
+        self.sources = sources
+        self.names = list(names)
+        self.samples = dict(zip(self.names, counts.tolist()))
+        # 每个数据源在一个 epoch 中被重复的次数 (>1 表示过采样)
+        self.passes = {name: count / size for name, count, size in zip(self.names, counts.tolist(), sizes)}
+
+    def __len__(self):
+        return len(self.source_ids)
+
+    def __getitem__(self, index):
+        source = int(self.source_ids[index])
+        item = dict(self.sources[source][int(self.row_ids[index])])
+        item['source'] = source
+        return item
+
+
+class SourceAccountingCollator:
+    """Wraps a data collator: strips the 'source' field and counts tokens / loss tokens per source."""
+    def __init__(self, collator, names):
+        self.collator = collator
+        self.names = list(names)
+        self.tokens = dict.fromkeys(self.names, 0)
+        self.loss_tokens = dict.fromkeys(self.names, 0)
+
+    def __call__(self, features):
+        for feature in features:
+            source = feature.pop('source', None)
+            if source is None:
+                continue # 验证集样本不计入
+            name = self.names[source]
+            self.tokens[name] += len(feature['input_ids'])
+            labels = feature.get('labels')
+            if labels is None:
+                self.loss_tokens[name] += len(feature['input_ids'])
+            elif hasattr(labels, 'ne'):
+                self.loss_tokens[name] += int(labels.ne(-100).sum())
+            else:
+                self.loss_tokens[name] += sum(1 for label in labels if label != -100)
+        return self.collator(features)
+
+    def snapshot(self):
+        return {'source_tokens': dict(self.tokens), 'source_loss_tokens': dict(self.loss_tokens)}
+
+    def describe(self):
+        total = sum(self.loss_tokens.values()) or 1
+        return ", ".join(f"{name} {count} ({count / total:.1%})" for name, count in self.loss_tokens.items())
+
+
+def source_tokens_callback(collator, logger=logging):
+    """TrainerCallback adding tokens/<source> to the trainer logs and logging the split once per epoch."""
+    from transformers.trainer_callback import TrainerCallback
+
+    class SourceTokensCallback(TrainerCallback):
+        def on_log(self, args, state, control, logs=None, **kwargs):
+            if logs is not None and 'loss' in logs:
+                logs.update({f"tokens/{name}": count for name, count in collator.loss_tokens.items()})
+
+        def on_epoch_end(self, args, state, control, **kwargs):
+            logger.info(f"各数据源已训练的 tokens: {collator.describe()}")
+
+    return SourceTokensCallback()
+
+
+def build_mixture(items, base_model_name, tokenizer, hp, text_data, eval_data_path=None, logger=logging):
+    """
+    (MixtureDataset, eval_dataset). Without `eval_data_path` every source contributes its own validation split
+    (hp eval_split), so the validation loss covers all sources regardless of the weights.
+    """
+    from train_core import split_eval_dataset
+
+    paths = [path for path, _ in items]
+    weights = [weight for _, weight in items]
+    names = source_names(paths)
+    source_hp = dict(hp, eval_split=0) if eval_data_path else hp
+    train_parts, eval_parts = [], []
+    for path, name in zip(paths, names):
+        if text_data:
+            token_path = pretrain_data.tokenize_text_files(base_model_name, path, num_workers=hp['tokenize_workers'],
+                                                           log=logger.info)
+            train_part, eval_part = pretrain_data.window_datasets(token_path, hp['max_length'], source_hp['eval_split'])
+        else:
+            if hp['dedup']:
+                path = data_dedup.cached_dedup(path, base_model_name, hp['max_length'], log=logger.info)
+            dataset = load_source_dataset(base_model_name, tokenizer, path, hp['max_length'], log=logger.info)
+            train_part, eval_part = split_eval_dataset(dataset, tokenizer, source_hp, None, logger)
+        train_parts.append(train_part)
+        if eval_part is not None:
+            eval_parts.append(eval_part)
+
+    mixture = MixtureDataset(train_parts, names, weights, hp['mix_samples'], hp['seed'])
+    for name, weight, part in zip(names, weights, train_parts):
+        logger.info(f"数据源 {name}: {len(part)} 条，权重 {weight:g}，每 epoch 抽样 {mixture.samples[name]} 条 "
+                    f"({mixture.passes[name]:.2f} 遍)")
+
+    if eval_data_path:
+        if text_data:
+            eval_token_path = pretrain_data.tokenize_text_files(base_model_name, eval_data_path,
+                                                                num_workers=hp['tokenize_workers'], log=logger.info)
+            eval_dataset = pretrain_data.TokenWindowDataset(eval_token_path, hp['max_length'],
+                                                            end=pretrain_data.MAX_EVAL_WINDOWS)
+        else:
+            eval_dataset = split_eval_dataset(train_parts[0], tokenizer, hp, eval_data_path, logger)[1]
+    elif not eval_parts:
+        eval_dataset = None
+    elif text_data:
+        from torch.utils.data import ConcatDataset
+        eval_dataset = ConcatDataset(eval_parts)
+    else:
+        from datasets import concatenate_datasets
+        eval_dataset = concatenate_datasets(eval_parts)
+    return mixture, eval_dataset
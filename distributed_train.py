@@ -0,0 +1,376 @@
+"""
+Data-parallel LoRA training over several processes with torch.distributed (gloo backend), on one machine
+or across several.
+
+`launch` takes the same arguments as train_core.start_training plus the process layout. It tokenizes the
+data once (the ranks then only read the shared cache), starts one worker process per rank with the usual
+torch.distributed environment (RANK, LOCAL_RANK, WORLD_SIZE, MASTER_ADDR, MASTER_PORT) and runs
+start_training in each of them. Inside start_training the Trainer shards every epoch across the ranks
+(DistributedSampler) and averages the gradients; the final adapter and training_summary.json are written by
+rank 0 only.
+
+Ranks report through JSON lines on stdout. The lines of rank 0 become the progress / log events of the job;
+every rank's output is also kept in <output_dir>/ddp_rank<N>.log. The progress events carry metrics
+gathered from all ranks (summed tokens/s and the rate of every rank), so the GUI shows the whole job.
+Cancel and pause go through a control file read by rank 0 and broadcast to the other ranks between steps,
+so all ranks stop at the same step.
+
+Several machines: run the same command on each with --nnodes, --node-rank and the address of node 0:
+
+    python cli.py train --base-model ... --data d.jsonl --output ./lora_ddp --nproc 4 --nnodes 2 --node-rank 0 --master-addr 10.0.0.1
+    python cli.py train --base-model ... --data d.jsonl --output ./lora_ddp --nproc 4 --nnodes 2 --node-rank 1 --master-addr 10.0.0.1
+"""
+import json
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+BACKEND = "gloo"
+DEFAULT_MASTER_PORT = 29500
+EVENT_PREFIX = "@@lora-event "
+SPEC_FILE = "ddp_job.json"
+CONTROL_FILE = "ddp_control"
+STOP_GRACE_SECONDS = 10
+
+
+# --- Inside a rank ---
+def world_info():
+    """(rank, local_rank, world_size) set by the launcher; (0, 0, 1) for ordinary single-process training."""
+    return (int(os.environ.get("RANK", 0)), int(os.environ.get("LOCAL_RANK", 0)),
+            int(os.environ.get("WORLD_SIZE", 1)))
+
+
+def init_process_group():
+    import torch.distributed as dist
+    if not dist.is_initialized():
+        dist.init_process_group(backend=BACKEND) # 地址与端口来自环境变量 (env://)
+
+
+def device_map():
+    """Whole model on this rank's device (device_map="auto" would spread one model over all GPUs)."""
+    import torch
+    if torch.cuda.is_available():
+        return {"": f"cuda:{world_info()[1] % torch.cuda.device_count()}"}
+    return {"": "cpu"}
+
+
+def training_args():
+    """Extra TrainingArguments for a distributed run."""
+    # LoRA 只训练适配器参数，冻结的基座参数不参与梯度同步，无需查找未使用的参数
+    return {'ddp_backend': BACKEND, 'ddp_find_unused_parameters': False}
+
+
+class TokenCounter:
+    """Wraps a data collator and counts the samples and non-padding tokens this rank processes."""
+    def __init__(self, collator):
+        self.collator = collator
+        self.samples = 0
+        self.tokens = 0
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        self.samples += len(features)
+        mask = batch.get('attention_mask')
+        self.tokens += int(mask.sum()) if mask is not None else int(batch['input_ids'].numel())
+        return batch
+
+
+def reduce_counts(snapshot):
+    """Sums a {group: {name: count}} snapshot (e.g. tokens per data source) over all ranks. Collective."""
+    import torch
+    import torch.distributed as dist
+
+    keys = [(group, name) for group, counts in snapshot.items() for name in counts]
+    values = torch.tensor([snapshot[group][name] for group, name in keys], dtype=torch.float64)
+    dist.all_reduce(values)
+    reduced = {group: {} for group in snapshot}
+    for (group, name), value in zip(keys, values.tolist()):
+        reduced[group][name] = int(value)
+    return reduced
+
+
+def rank_metrics(counter, snapshot=None):
+    """
+    extra_metrics for ProgressCallback: throughput of every rank gathered on all ranks (plus the optional
+    per-source snapshot summed over ranks). Collective, which works because every rank's ProgressCallback
+    runs at the same step.
+    """
+    import torch
+    import torch.distributed as dist
+
+    start = time.time()
+
+    def metrics():
+        local = torch.tensor([counter.samples, counter.tokens, time.time() - start], dtype=torch.float64)
+        gathered = [torch.zeros_like(local) for _ in range(dist.get_world_size())]
+        dist.all_gather(gathered, local)
+        rows = torch.stack(gathered).tolist()
+        elapsed = max(max(row[2] for row in rows), 1e-9)
+        data = {'world_size': len(rows), 'samples': int(sum(row[0] for row in rows)),
+                'tokens': int(sum(row[1] for row in rows)),
+                'tokens_per_s': sum(row[1] for row in rows) / elapsed,
+                'rank_tokens_per_s': [row[1] / max(row[2], 1e-9) for row in rows]}
+        if snapshot is not None:
+            data.update(reduce_counts(snapshot()))
+        return data
+
+    return metrics
+
+
+class ControlFlag:
+    """Event-like view of the launcher's control file ("cancel" / "pause"); read by rank 0 only."""
+    def __init__(self, path, word):
+        self.path = path
+        self.word = word
+
+    def is_set(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return f.read().strip() == self.word
+        except OSError:
+            return False
+
+
+class ControlSync:
+    """
+    Broadcasts rank 0's cancel / pause state after every step. While paused all ranks wait here together;
+    on cancel `self.cancel` is set on every rank, for the ControlCallback that follows it.
+    """
+    def __init__(self, cancel_event=None, pause_event=None):
+        self.cancel_event = cancel_event
+        self.pause_event = pause_event
+        self.cancel = threading.Event()
+
+    def _state(self):
+        import torch
+        import torch.distributed as dist
+        state = torch.zeros(2, dtype=torch.int64)
+        if dist.get_rank() == 0:
+            state[0] = int(self.cancel_event is not None and self.cancel_event.is_set())
+            state[1] = int(self.pause_event is not None and self.pause_event.is_set())
+        dist.broadcast(state, src=0)
+        return state.tolist()
+
+    def callback(self):
+        from transformers.trainer_callback import TrainerCallback
+        sync = self
+
+        class ControlSyncCallback(TrainerCallback):
+            def on_step_end(self, args, state, control, **kwargs):
+                cancelled, paused = sync._state()
+                while paused and not cancelled:
+                    time.sleep(0.5)
+                    cancelled, paused = sync._state()
+                if cancelled:
+                    sync.cancel.set()
+
+        return ControlSyncCallback()
+
+
+class _EventWriter:
+    """Queue-like sink writing (kind, payload) events as JSON lines to stdout for the launcher."""
+    _lock = threading.Lock()
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def put(self, item):
+        line = EVENT_PREFIX + json.dumps({'kind': self.kind, 'data': item}, ensure_ascii=False, default=str)
+        with self._lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    put_nowait = put
+
+
+def run_worker(spec_path):
+    """Entry point of one rank (started by `launch`)."""
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    from train_core import start_training
+
+    rank = world_info()[0]
+    control_path = os.path.join(spec['output_dir'], CONTROL_FILE)
+    ok = start_training(
+        spec['base_model'], spec['data_path'], spec['output_dir'], _EventWriter('progress'), _EventWriter('log'),
+        spec['lora_adapter_path'],
+        cancel_event=ControlFlag(control_path, "cancel") if rank == 0 else None,
+        pause_event=ControlFlag(control_path, "pause") if rank == 0 else None,
+        hyperparams=spec['hyperparams'], tokenized_data_path=spec['tokenized_data_path'],
+        eval_data_path=spec['eval_data_path'])
+    import torch.distributed as dist
+    if dist.is_initialized():
+        dist.destroy_process_group()
+    return 0 if ok else 1
+
+
+# --- Launcher ---
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_shared_data(base_model_name, data_path, output_dir, hp, tokenized_data_path=None, log=print):
+    """
+    Tokenizes the data once before the ranks start, so they neither tokenize N times nor race on the
+    caches. Returns the tokenized_data_path for the ranks (None when they read per-source caches).
+    """
+    import data_dedup
+    import data_mixing
+    import pretrain_data
+    from train_core import prepare_tokenized_dataset, resolve_data_format
+
+    if tokenized_data_path:
+        return tokenized_data_path
+    mixture = data_mixing.parse_mixture(data_path)
+    if mixture:
+        data_mixing.prepare_sources(base_model_name, mixture, hp['max_length'], hp['tokenize_workers'],
+                                    dedup=hp['dedup'], log=log)
+        return None
+    if resolve_data_format(data_path, None, hp['data_format']) == "text":
+        return pretrain_data.tokenize_text_files(base_model_name, data_path, num_workers=hp['tokenize_workers'], log=log)
+    if hp['dedup']:
+        data_path = data_dedup.cached_dedup(data_path, base_model_name, hp['max_length'], log=log)
+    path = os.path.join(output_dir, "ddp_tokenized")
+    shutil.rmtree(path, ignore_errors=True)
+    log("正在为所有进程统一分词训练数据...")
+    return prepare_tokenized_dataset(base_model_name, data_path, path, hp['max_length'])
+
+
+def _write_control(path, word):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(word)
+    os.replace(temp_path, path)
+
+
+def launch(base_model_name, data_path, output_dir, progress_queue, log_queue, lora_adapter_path=None,
+           cancel_event=None, pause_event=None, hyperparams=None, tokenized_data_path=None, eval_data_path=None,
+           num_processes=2, nnodes=1, node_rank=0, master_addr="127.0.0.1", master_port=None):
+    """
+    Runs start_training as `num_processes` ranks on this node (of `nnodes`). Same queues, events and
+    return value (True on success) as start_training. Only node 0 reports progress.
+    """
+    from train_core import resolve_hyperparams
+
+    hp = resolve_hyperparams(hyperparams)
+    world_size = num_processes * nnodes
+    os.makedirs(output_dir, exist_ok=True)
+    try:
+        tokenized_data_path = prepare_shared_data(base_model_name, data_path, output_dir, hp, tokenized_data_path,
+                                                  log=log_queue.put)
+    except Exception as e:
+        progress_queue.put({'progress': -1, 'error': f"数据准备失败: {e}"})
+        return False
+
+    spec_path = os.path.join(output_dir, SPEC_FILE)
+    with open(spec_path, 'w', encoding='utf-8') as f:
+        json.dump({'base_model': base_model_name, 'data_path': data_path, 'output_dir': output_dir,
+                   'lora_adapter_path': lora_adapter_path, 'hyperparams': hyperparams or {},
+                   'tokenized_data_path': tokenized_data_path, 'eval_data_path': eval_data_path}, f,
+                  ensure_ascii=False, indent=2)
+    control_path = os.path.join(output_dir, CONTROL_FILE)
+    _write_control(control_path, "")
+
+    master_port = master_port or (free_port() if nnodes == 1 else DEFAULT_MASTER_PORT)
+    # 每个进程分到一份 CPU 线程，避免 N 个进程各自占满所有核心
+    threads = str(max(1, (os.cpu_count() or 1) // num_processes))
+    lines = queue.Queue()
+    processes, log_files = [], []
+    log_queue.put(f"启动数据并行训练: {world_size} 个进程 (本机 {num_processes} 个，{BACKEND}，"
+                  f"{master_addr}:{master_port})")
+    for local_rank in range(num_processes):
+        rank = node_rank * num_processes + local_rank
+        env = dict(os.environ, RANK=str(rank), LOCAL_RANK=str(local_rank), WORLD_SIZE=str(world_size),
+                   LOCAL_WORLD_SIZE=str(num_processes), MASTER_ADDR=master_addr, MASTER_PORT=str(master_port),
+                   TOKENIZERS_PARALLELISM="false", PYTHONIOENCODING="utf-8")
+        env.setdefault("OMP_NUM_THREADS", threads)
+        process = subprocess.Popen([sys.executable, "-u", os.path.abspath(__file__), spec_path], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8',
+                                   errors='replace', bufsize=1)
+        log_file = open(os.path.join(output_dir, f"ddp_rank{rank}.log"), 'w', encoding='utf-8')
+        threading.Thread(target=_read_lines, args=(process, rank, lines, log_file), daemon=True).start()
+        processes.append((rank, process))
+        log_files.append(log_file)
+
+    errors = {}
+    control = ""
+    stop_at = None
+    try:
+        while True:
+            _forward_lines(lines, progress_queue, log_queue, errors)
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            wanted = "cancel" if cancelled else ("pause" if pause_event is not None and pause_event.is_set() else "")
+            if wanted != control:
+                _write_control(control_path, wanted)
+                control = wanted
+            codes = [process.poll() for _, process in processes]
+            if all(code is not None for code in codes):
+                break
+            failed = any(code not in (None, 0) for code in codes)
+            # 某个进程失败 (其余进程会卡在集合通信中)，或非 0 号节点被取消 (收不到 0 号进程的广播) 时结束本机进程
+            if stop_at is None and (failed or (cancelled and node_rank != 0)):
+                stop_at = time.time() + STOP_GRACE_SECONDS
+            if stop_at is not None and time.time() > stop_at:
+                for _, process in processes:
+                    if process.poll() is None:
+                        process.kill()
+            time.sleep(0.2)
+    finally:
+        for _, process in processes:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        time.sleep(0.1)
+        _forward_lines(lines, progress_queue, log_queue, errors)
+        for log_file in log_files:
+            log_file.close()
+
+    failed = [(rank, process.returncode) for rank, process in processes if process.returncode != 0]
+    if not failed:
+        return True
+    if cancel_event is not None and cancel_event.is_set():
+        return False
+    if 0 not in errors:
+        rank, code = failed[0]
+        message = errors.get(rank) or f"进程 rank {rank} 异常退出 (返回码 {code})，详见 ddp_rank{rank}.log"
+        progress_queue.put({'progress': -1, 'error': message})
+    return False
+
+
+def _read_lines(process, rank, lines, log_file):
+    for line in process.stdout:
+        log_file.write(line)
+        log_file.flush()
+        lines.put((rank, line.rstrip("\n")))
+
+
+def _forward_lines(lines, progress_queue, log_queue, errors):
+    """Passes rank 0's events on; of the other ranks only errors are kept (their output is in the log files)."""
+    while True:
+        try:
+            rank, line = lines.get_nowait()
+        except queue.Empty:
+            return
+        # stderr 合并在 stdout 中：tqdm 的 \r 重绘没有换行，事件可能跟在同一行的进度条后面
+        index = line.find(EVENT_PREFIX)
+        text = (line if index < 0 else line[:index]).split("\r")[-1].strip()
+        if rank == 0 and text:
+            log_queue.put(text) # 库直接打印的输出
+        if index < 0:
+            continue
+        event = json.loads(line[index + len(EVENT_PREFIX):])
+        if event['kind'] == 'progress' and isinstance(event['data'], dict) and 'error' in event['data']:
+            errors.setdefault(rank, f"rank {rank}: {event['data']['error']}")
+        if rank == 0:
+            (progress_queue if event['kind'] == 'progress' else log_queue).put(event['data'])
+
+
+if __name__ == "__main__":
+    sys.exit(run_worker(sys.argv[1]))
@@ -0,0 +1,316 @@
+"""
+Evaluation harness for trained LoRA adapters.
+
+Takes held-out data in the training format (instruction / input / output) and computes:
+- perplexity on the `output` tokens only, with the same prompt masking as training (train_core.build_process_func),
+  in length-sorted, padded batches;
+- generation metrics against `output` from greedy decoding: exact match, character-level BLEU-4 and
+  ROUGE-1/2/L F1 (character level, so Chinese needs no word segmentation).
+
+The base model's results are cached in eval_cache/, keyed by base model, eval file content and settings, so
+evaluating another adapter of the same base only runs the adapter. When the cache is cold, the baseline is
+computed with the adapter disabled on the already loaded model instead of loading the base model twice.
+Results are written next to final_lora_adapter: eval_results.json and eval_generations.jsonl.
+
+numpy / torch are imported lazily like everywhere else in the project.
+"""
+import hashlib
+import json
+import math
+import os
+import time
+
+ADAPTER_SUBDIR = "final_lora_adapter"
+EVAL_RESULTS_FILE = "eval_results.json"
+EVAL_GENERATIONS_FILE = "eval_generations.jsonl"
+EVAL_CACHE_DIR = "./eval_cache"
+CACHE_VERSION = 1
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15 # 64 位乘法哈希，用于把字符 n-gram 编码为一个整数
+
+
+# --- Metrics (vectorized with numpy) ---
+def char_codes(text):
+    """Unicode code points of a string as a uint64 array."""
+    import numpy as np
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+
+
+def ngram_ids(codes, n):
+    """One uint64 id per character n-gram (polynomial hash, wrapping arithmetic)."""
+    import numpy as np
+    if len(codes) < n:
+        return np.empty(0, dtype=np.uint64)
+    ids = codes[:len(codes) - n + 1].copy()
+    with np.errstate(over='ignore'):
+        for k in range(1, n):
+            ids = ids * np.uint64(_HASH_MULTIPLIER) + codes[k:len(codes) - n + 1 + k]
+    return ids
+
+
+def ngram_matches(hyp_codes, ref_codes, n):
+    """Clipped n-gram matches (as in BLEU) plus the hypothesis and reference n-gram totals."""
+    import numpy as np
+    hyp_ids, ref_ids = ngram_ids(hyp_codes, n), ngram_ids(ref_codes, n)
+    if not len(hyp_ids) or not len(ref_ids):
+        return 0, len(hyp_ids), len(ref_ids)
+    hyp_unique, hyp_counts = np.unique(hyp_ids, return_counts=True)
+    ref_unique, ref_counts = np.unique(ref_ids, return_counts=True)
+    _, hyp_index, ref_index = np.intersect1d(hyp_unique, ref_unique, assume_unique=True, return_indices=True)
+    matches = int(np.minimum(hyp_counts[hyp_index], ref_counts[ref_index]).sum())
+    return matches, len(hyp_ids), len(ref_ids)
+
+
+def lcs_length(a, b):
+    """Longest common subsequence length, bit-parallel (Allison-Dix / Hyyrö): O(len(a) * len(b) / wordsize)."""
+    if not a or not b:
+        return 0
+    masks = {}
+    for i, ch in enumerate(a):
+        masks[ch] = masks.get(ch, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    v = full
+    for ch in b:
+        u = v & masks.get(ch, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count("1")
+
+
+def _f1(matches, hyp_total, ref_total):
+    if not matches:
+        return 0.0
+    precision, recall = matches / hyp_total, matches / ref_total
+    return 2 * precision * recall / (precision + recall)
+
+
+def score_generations(predictions, references, max_n=4):
+    """
+    Corpus-level character BLEU-4 (with brevity penalty), mean character ROUGE-1/2/L F1 and exact match.
+    Returns (summary dict, per-sample list).
+    """
+    import numpy as np
+
+    matches, totals = np.zeros(max_n), np.zeros(max_n)
+    hyp_length = ref_length = 0
+    per_sample = []
+    for prediction, reference in zip(predictions, references):
+        prediction, reference = prediction.strip(), reference.strip()
+        hyp, ref = char_codes(prediction), char_codes(reference)
+        hyp_length += len(hyp)
+        ref_length += len(ref)
+        sample = {'exact_match': float(prediction == reference)}
+        for n in range(1, max_n + 1):
+            m, h, r = ngram_matches(hyp, ref, n)
+            matches[n - 1] += m
+            totals[n - 1] += h
+            if n <= 2:
+                sample[f'rouge{n}_f'] = _f1(m, h, r)
+        sample['rougeL_f'] = _f1(lcs_length(prediction, reference), len(prediction), len(reference))
+        per_sample.append(sample)
+
+    if not per_sample:
+        return {}, []
+    if np.all(matches > 0):
+        log_precision = np.mean(np.log(matches / totals))
+        brevity_penalty = 1.0 if hyp_length > ref_length else math.exp(1 - ref_length / max(hyp_length, 1))
+        bleu = brevity_penalty * math.exp(log_precision)
+    else:
+        bleu = 0.0
+    summary = {'bleu4_char': bleu, 'samples': len(per_sample)}
+    for key in ('exact_match', 'rouge1_f', 'rouge2_f', 'rougeL_f'):
+        summary[key] = float(np.mean([sample[key] for sample in per_sample]))
+    return summary, per_sample
+
+
+# --- Model side ---
+def _length_sorted_batches(lengths, batch_size):
+    """Indices grouped into batches of similar length (longest first), so padding stays small."""
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def batched_perplexity(model, tokenizer, records, batch_size=4, max_length=1024):
+    """Perplexity over the output tokens only (prompt tokens are masked with -100 exactly as in training)."""
+    import torch
+    import torch.nn.functional as F
+    from train_core import build_process_func
+
+    process_func = build_process_func(tokenizer, max_length)
+    examples = [process_func(record) for record in records]
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    device = next(model.parameters()).device
+
+    total_nll, total_tokens = 0.0, 0
+    with torch.inference_mode():
+        for batch in _length_sorted_batches([len(e['input_ids']) for e in examples], batch_size):
+            width = max(len(examples[i]['input_ids']) for i in batch)
+            input_ids = torch.full((len(batch), width), pad_id, dtype=torch.long)
+            labels = torch.full((len(batch), width), -100, dtype=torch.long)
+            attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+            for row, i in enumerate(batch):
+                length = len(examples[i]['input_ids'])
+                input_ids[row, :length] = examples[i]['input_ids']
+                labels[row, :length] = examples[i]['labels']
+                attention_mask[row, :length] = 1
+            input_ids, labels, attention_mask = input_ids.to(device), labels.to(device), attention_mask.to(device)
+
+            logits = model(input_ids=input_ids, attention_mask=attention_mask).logits[:, :-1].float()
+            targets = labels[:, 1:]
+            nll = F.cross_entropy(logits.reshape(-1, logits.size(-1)), targets.reshape(-1), ignore_index=-100,
+                                  reduction='sum')
+            total_nll += nll.item()
+            total_tokens += int((targets != -100).sum().item())
+
+    mean_nll = total_nll / max(total_tokens, 1)
+    return {'perplexity': math.exp(mean_nll), 'mean_nll': mean_nll, 'tokens': total_tokens}
+
+
+def generate_batch(model, tokenizer, records, max_new_tokens=256, batch_size=8):
+    """Greedy (deterministic) generation for every record, in left-padded, length-sorted batches."""
+    import torch
+
+    prompts = [tokenizer.apply_chat_template(
+        [{"role": "system", "content": r['instruction']}, {"role": "user", "content": r['input']}],
+        tokenize=False, add_generation_prompt=True) for r in records]
+    encoded = [tokenizer(prompt, add_special_tokens=False)['input_ids'] for prompt in prompts]
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    device = next(model.parameters()).device
+
+    outputs = [None] * len(records)
+    with torch.inference_mode():
+        for batch in _length_sorted_batches([len(ids) for ids in encoded], batch_size):
+            width = max(len(encoded[i]) for i in batch)
+            input_ids = torch.full((len(batch), width), pad_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+            for row, i in enumerate(batch):
+                input_ids[row, width - len(encoded[i]):] = torch.tensor(encoded[i])
+                attention_mask[row, width - len(encoded[i]):] = 1
+            generated = model.generate(
+                input_ids=input_ids.to(device),
+                attention_mask=attention_mask.to(device),
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=pad_id,
+                eos_token_id=tokenizer.eos_token_id,
+            )
+            for row, i in enumerate(batch):
+                outputs[i] = tokenizer.decode(generated[row, width:], skip_special_tokens=True)
+    return outputs
+
+
+def run_model_eval(model, tokenizer, records, settings, on_status=None):
+    on_status = on_status or _no_status
+    start = time.time()
+    on_status("Computing perplexity on output tokens...")
+    result = batched_perplexity(model, tokenizer, records, settings['batch_size'], settings['max_length'])
+    generations = None
+    if settings['max_new_tokens'] > 0:
+        on_status(f"Generating {len(records)} responses (greedy, max {settings['max_new_tokens']} new tokens)...")
+        generations = generate_batch(model, tokenizer, records, settings['max_new_tokens'], settings['batch_size'])
+        summary, _ = score_generations(generations, [r['output'] for r in records])
+        result.update(summary)
+    result['seconds'] = time.time() - start
+    return result, generations
+
+
+def _no_status(line):
+    pass
+
+
+# --- Baseline cache ---
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def baseline_cache_path(base_model, eval_path, settings, cache_dir=EVAL_CACHE_DIR):
+    key = json.dumps({'version': CACHE_VERSION, 'base_model': base_model, 'data': _file_sha256(eval_path),
+                      'settings': settings}, sort_keys=True)
+    slug = base_model.strip("/\\").replace("/", "--").replace("\\", "--").replace(":", "_")
+    return os.path.join(cache_dir, f"{slug}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.json")
+
+
+def load_eval_records(eval_path, max_samples=None):
+    from pipeline_api import read_jsonl
+    records = [r for r in read_jsonl(eval_path) if r.get('output')]
+    for r in records:
+        r.setdefault('instruction', "")
+        r.setdefault('input', "")
+    return records[:max_samples] if max_samples else records
+
+
+def evaluate_adapter(model_dir, eval_path, batch_size=4, max_new_tokens=256, max_length=1024, max_samples=None,
+                     use_cache=True, cache_dir=EVAL_CACHE_DIR, quantization=None, on_status=None):
+    """
+    Evaluates the LoRA in `model_dir` (the directory containing final_lora_adapter) and its base model on
+    `eval_path`. `max_new_tokens=0` skips generation metrics. `quantization` is how the base model is loaded
+    (inference_core.QUANTIZATIONS; default 4bit on CUDA, float32 on CPU) and is part of the baseline cache key.
+    Returns the results dict, which is also written to <model_dir>/eval_results.json.
+    """
+    import pipeline_api
+    import inference_core
+
+    on_status = on_status or _no_status
+    quantization = quantization or inference_core.default_quantization()
+
+    adapter_dir = pipeline_api.resolve_adapter_dir(model_dir)
+    if os.path.basename(os.path.normpath(adapter_dir)) == ADAPTER_SUBDIR:
+        model_dir = os.path.dirname(os.path.normpath(adapter_dir))
+    base_model = pipeline_api.read_adapter_base_model(adapter_dir)
+    records = load_eval_records(eval_path, max_samples)
+    if not records:
+        raise pipeline_api.PipelineError(f"No records with an 'output' field in {eval_path}")
+    settings = {'batch_size': batch_size, 'max_new_tokens': max_new_tokens, 'max_length': max_length,
+                'max_samples': max_samples, 'quantization': quantization}
+    # batch_size 只影响速度，不影响结果，因此不参与缓存键
+    cache_settings = {k: v for k, v in settings.items() if k != 'batch_size'}
+    cache_path = baseline_cache_path(base_model, eval_path, cache_settings, cache_dir)
+
+    baseline = None
+    if use_cache and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        on_status(f"Using cached baseline for {base_model}: {cache_path}")
+
+    on_status(f"Loading {adapter_dir}...")
+    model, tokenizer = pipeline_api.load_model(adapter_dir, on_event=lambda kind, line: on_status(line),
+                                               quantization=quantization)
+    on_status(f"Evaluating adapter on {len(records)} records...")
+    adapter_result, adapter_generations = run_model_eval(model, tokenizer, records, settings, on_status)
+
+    if baseline is None:
+        on_status(f"Evaluating base model {base_model} (adapter disabled)...")
+        with model.disable_adapter():
+            base_result, base_generations = run_model_eval(model, tokenizer, records, settings, on_status)
+        baseline = {'base_model': base_model, 'result': base_result, 'generations': base_generations,
+                    'created_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+        if use_cache:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump(baseline, f, ensure_ascii=False)
+
+    base_result = baseline['result']
+    delta = {key: adapter_result[key] - base_result[key] for key in adapter_result
+             if key in base_result and isinstance(adapter_result[key], float) and key != 'seconds'}
+    results = {
+        'adapter_dir': adapter_dir,
+        'base_model': base_model,
+        'eval_data': os.path.abspath(eval_path),
+        'settings': settings,
+        'evaluated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'adapter': adapter_result,
+        'base': base_result,
+        'delta': delta,
+    }
+    with open(os.path.join(model_dir, EVAL_RESULTS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    if adapter_generations is not None:
+        base_generations = baseline.get('generations') or [None] * len(records)
+        with open(os.path.join(model_dir, EVAL_GENERATIONS_FILE), 'w', encoding='utf-8') as f:
+            for record, adapter_text, base_text in zip(records, adapter_generations, base_generations):
+                f.write(json.dumps(dict(record, adapter_response=adapter_text, base_response=base_text),
+                                   ensure_ascii=False) + "\n")
+    on_status(f"Results written to {os.path.join(model_dir, EVAL_RESULTS_FILE)}")
+    return results
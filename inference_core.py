@@ -1,32 +1,50 @@
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-from peft import PeftModel, PeftConfig
 import time
 import os
-import gradio as gr
-import requests
-from requests.exceptions import ConnectionError, Timeout
+import profiling
+import model_registry
+# torch / transformers / peft / gradio 在各函数中延迟导入，保证 GUI 启动时无需加载这些重量级框架
 
+# 加载精度: 4bit / 8bit (bitsandbytes 量化，需要 CUDA) 或不量化的 float16 / bfloat16 / float32
+QUANTIZATIONS = ("4bit", "8bit", "float16", "bfloat16", "float32")
+DEFAULT_QUANTIZATION = "4bit"
 
-def load_model_and_tokenizer(model_path, status_queue):
+
+def default_quantization():
+    """4-bit on CUDA, full precision (float32) on CPU, where bitsandbytes quantization is unavailable."""
+    import torch
+    return DEFAULT_QUANTIZATION if torch.cuda.is_available() else "float32"
+
+
+
+def load_model_and_tokenizer(model_path, status_queue, quantization=DEFAULT_QUANTIZATION):
     """
     加载模型和分词器。
+    quantization 为 QUANTIZATIONS 之一，决定基础模型的量化方式或精度 (ONNX / Ollama 模型忽略此参数)。
     如果 model_path 指向一个 LoRA 适配器目录，则加载基础模型并应用适配器。
     如果 model_path 是一个 Hugging Face 模型ID，则直接加载该基座模型。
+    如果 model_path 是 onnx_backend 导出的 ONNX 目录，则用 ONNX Runtime 在 CPU 上加载。
+    如果 model_path 形如 "ollama:<模型名>"，则通过本地 Ollama 服务的 HTTP 接口对话 (不加载权重)。
     通过队列报告加载状态。
     """
+    import onnx_backend
+    import ollama_backend
+    if onnx_backend.is_onnx_model_dir(model_path):
+        return onnx_backend.load_model_and_tokenizer(model_path, status_queue)
+    if ollama_backend.is_ollama_model(model_path):
+        return ollama_backend.load_model_and_tokenizer(model_path, status_queue)
     try:
+        import torch
+        from transformers import AutoModelForCausalLM, BitsAndBytesConfig
+        from peft import PeftModel
+        from requests.exceptions import ConnectionError, Timeout
+
         is_lora_adapter = os.path.exists(os.path.join(model_path, 'adapter_config.json'))
         base_model_name = model_path
         
         if is_lora_adapter:
             status_queue.put(f"检测到 LoRA 适配器: {model_path}")
-            # 使用本地文件读取而不是 from_pretrained 来避免网络请求
-            import json
-            config_path = os.path.join(model_path, 'adapter_config.json')
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config_data = json.load(f)
-            base_model_name = config_data.get("base_model_name_or_path", model_path)
+            # 使用本地文件读取而不是 from_pretrained 来避免网络请求 (同一进程内缓存)
+            base_model_name = model_registry.adapter_base_model(model_path) or model_path
             status_queue.put(f"基础模型为: {base_model_name}")
         else:
             status_queue.put(f"准备直接加载基座模型: {model_path}")
@@ -35,47 +53,36 @@ def load_model_and_tokenizer(model_path, status_queue):
         status_queue.put("正在加载分词器...")
         tokenizer_path = model_path if is_lora_adapter else base_model_name
         
-        # 添加重试机制
-        tokenizer = None
-        for attempt in range(3):
-            try:
-                tokenizer = AutoTokenizer.from_pretrained(tokenizer_path, trust_remote_code=True, local_files_only=True)
-                break
-            except (ConnectionError, Timeout) as e:
-                status_queue.put(f"网络连接错误 (尝试 {attempt + 1}/3): {str(e)}")
-                if attempt < 2:  # 不是最后一次尝试
-                    time.sleep(2 ** attempt)  # 指数退避
-                else:
-                    raise  # 最后一次尝试失败，重新抛出异常
-            except Exception as e:
-                # 其他非网络错误直接抛出
-                raise
-        
-        if tokenizer is None:
-            raise Exception("无法加载分词器")
-            
-        if tokenizer.pad_token is None:
-            tokenizer.pad_token = tokenizer.eos_token
+        # 网络错误重试 3 次 (指数退避)；同一进程再次加载时直接复用
+        tokenizer = model_registry.get_tokenizer(tokenizer_path, local_files_only=True, retries=3,
+                                                 on_retry=status_queue.put)
         status_queue.put("分词器加载成功。")
 
         # 3. 配置量化
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.bfloat16
-        )
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"未知的量化方式: {quantization} (可选: {', '.join(QUANTIZATIONS)})")
+        if quantization == "4bit":
+            load_kwargs = {'quantization_config': BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16
+            ), 'device_map': "auto"}
+        elif quantization == "8bit":
+            load_kwargs = {'quantization_config': BitsAndBytesConfig(load_in_8bit=True), 'device_map': "auto"}
+        else:
+            load_kwargs = {'torch_dtype': getattr(torch, quantization),
+                           'device_map': "auto" if torch.cuda.is_available() else None}
 
         # 4. 加载基础模型
-        status_queue.put("正在加载量化的基础模型 (可能需要几分钟)...")
+        status_queue.put(f"正在加载基础模型 ({quantization}，可能需要几分钟)...")
         model = None
         for attempt in range(3):
             try:
                 model = AutoModelForCausalLM.from_pretrained(
                     base_model_name,
-                    quantization_config=bnb_config,
                     trust_remote_code=True,
-                    device_map="auto",
-                    local_files_only=True
+                    local_files_only=True,
+                    **load_kwargs
                 )
                 break
             except (ConnectionError, Timeout) as e:
@@ -110,10 +117,37 @@ def load_model_and_tokenizer(model_path, status_queue):
         status_queue.put(traceback.format_exc())
         return None, None
 
-def generate_response(model, tokenizer, instruction, input_text, history, temperature=0.8):
+def text_streamer(tokenizer, on_text):
+    """transformers 流式输出对象：把新生成的文本片段 (不含提示) 逐段交给 on_text。"""
+    from transformers import TextStreamer
+
+    class CallbackStreamer(TextStreamer):
+        def on_finalized_text(self, text, stream_end=False):
+            if text:
+                on_text(text)
+
+    return CallbackStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+
+def generate_response(model, tokenizer, instruction, input_text, history, temperature=0.8, max_new_tokens=1000,
+                      streamer=None, on_text=None):
     """
     使用加载好的模型和分词器生成响应。
+    streamer: 可选的 transformers 流式输出对象 (put/end)，用于逐 token 输出或测量首 token 延迟。
+    on_text: 可选回调，生成过程中逐段收到回复文本 (所有后端均支持，包括 Ollama)。
     """
+    if getattr(model, 'backend', None) == "ollama":
+        import ollama_backend
+        return ollama_backend.generate_response(model, tokenizer, instruction, input_text, history, temperature,
+                                                max_new_tokens, on_text)
+    if on_text is not None and streamer is None:
+        streamer = text_streamer(tokenizer, on_text)
+    if getattr(model, 'backend', None) == "onnx":
+        import onnx_backend
+        return onnx_backend.generate_response(model, tokenizer, instruction, input_text, history, temperature,
+                                              max_new_tokens, streamer)
+    import torch
+
     messages = [{"role": "system", "content": instruction}]
     
     for user_turn, assistant_turn in history:
@@ -131,12 +165,14 @@ def generate_response(model, tokenizer, instruction, input_text, history, temper
         return_tensors="pt"
     ).to(device)
 
-    with torch.no_grad():
+    prof = profiling.session(profiling.profile_dir("inference"), "generate")
+    with prof, torch.no_grad(), prof.stage("generate", trace=True):
         # 明确传递 attention_mask 以避免警告
         outputs = model.generate(
             input_ids=model_inputs,
             attention_mask=torch.ones_like(model_inputs), # 明确传递 attention_mask
-            max_new_tokens=1000,
+            max_new_tokens=max_new_tokens,
+            streamer=streamer,
             pad_token_id=tokenizer.eos_token_id,
             eos_token_id=tokenizer.eos_token_id,
             do_sample=True,
@@ -175,6 +211,7 @@ def start_gradio_interface(model, tokenizer, system_prompt, status_callback):
         return response
 
     try:
+        import gradio as gr
         from threading import Thread
         
         def launch_and_share():
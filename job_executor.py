@@ -0,0 +1,388 @@
+"""
+Process-based job executor.
+
+Training, merge/convert and model-load jobs run in child processes (spawn context, so CUDA state is never
+inherited) and talk to the GUI over one compact message channel per job: every message is a
+`(kind, payload)` tuple, e.g. ('progress', {...}), ('log', str), ('status', str), ('done', result).
+A crash or OOM in a job only kills its child process; the GUI sees an 'error' / 'exit' message.
+
+Job functions keep their existing signatures: pass the marker objects below in place of the queues and
+callbacks, and the child replaces them with writers that forward to the channel.
+"""
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+
+_mp = multiprocessing.get_context("spawn")
+
+
+class ChannelRef:
+    """Placeholder for a queue / callback argument; replaced in the child by a ChannelWriter of this kind."""
+    def __init__(self, kind):
+        self.kind = kind
+
+
+class ControlRef:
+    """Placeholder for the job's cancel or pause event."""
+    def __init__(self, name):
+        self.name = name
+
+
+PROGRESS = ChannelRef('progress')        # train_core.start_training progress_queue
+LOG = ChannelRef('log')                  # train_core.start_training log_queue
+STATUS = ChannelRef('status')            # status_callback / status_queue of merge, convert, model load
+TASK_PROGRESS = ChannelRef('task_progress')  # progress_callback of merge / convert
+EVENTS = ChannelRef(None)                # on_event(kind, payload) of pipeline_api functions
+CANCEL_EVENT = ControlRef('cancel')
+PAUSE_EVENT = ControlRef('pause')
+
+
+class ChannelWriter:
+    """Child-side stand-in for a queue.Queue (put) or a callback (call)."""
+    def __init__(self, channel, kind):
+        self.channel = channel
+        self.kind = kind
+
+    def put(self, item):
+        self.channel.put((self.kind, item))
+
+    put_nowait = put
+
+    def __call__(self, item):
+        self.channel.put((self.kind, item))
+
+
+class EventWriter:
+    """Child-side `on_event(kind, payload)` callback: the event kind becomes the channel message kind."""
+    def __init__(self, channel):
+        self.channel = channel
+
+    def __call__(self, kind, payload):
+        self.channel.put((kind, payload))
+
+
+def _resolve(value, channel, events):
+    if isinstance(value, ChannelRef):
+        return EventWriter(channel) if value.kind is None else ChannelWriter(channel, value.kind)
+    if isinstance(value, ControlRef):
+        return events[value.name]
+    return value
+
+
+def _job_main(target, args, kwargs, channel, cancel_event, pause_event):
+    """Child process entry point."""
+    events = {'cancel': cancel_event, 'pause': pause_event}
+    try:
+        args = [_resolve(a, channel, events) for a in args]
+        kwargs = {k: _resolve(v, channel, events) for k, v in kwargs.items()}
+        result = target(*args, **kwargs)
+        channel.put(('done', result))
+    except BaseException:
+        channel.put(('error', traceback.format_exc()))
+
+
+class ProcessJob:
+    """A job running in a child process. Mirrors the bits of threading.Thread the GUI uses (is_alive)."""
+    _ids = itertools.count(1)
+
+    def __init__(self, name, target, args=(), kwargs=None):
+        self.job_id = next(self._ids)
+        self.name = name
+        self.channel = _mp.Queue()
+        self.cancel_event = _mp.Event()
+        self.pause_event = _mp.Event()
+        self.process = _mp.Process(
+            target=_job_main,
+            args=(target, tuple(args), dict(kwargs or {}), self.channel, self.cancel_event, self.pause_event),
+            name=f"job-{self.job_id}-{name}",
+            daemon=True
+        )
+        self.finished = False
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.kill_deadline = None
+
+    def start(self):
+        self.started_at = time.time()
+        self.process.start()
+        return self
+
+    def is_alive(self):
+        return not self.finished
+
+    def cancel(self, grace_seconds=15.0):
+        """Asks the job to stop cooperatively; the process is killed if it is still running after the grace period."""
+        self.cancel_event.set()
+        self.pause_event.clear()
+        if self.kill_deadline is None:
+            self.kill_deadline = time.time() + grace_seconds
+
+    def pause(self):
+        self.pause_event.set()
+
+    def resume(self):
+        self.pause_event.clear()
+
+    @property
+    def paused(self):
+        return self.pause_event.is_set()
+
+    def _drain(self, dispatch, max_messages):
+        handled = 0
+        while handled < max_messages:
+            try:
+                kind, payload = self.channel.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            if kind == 'done':
+                self.result = payload
+                self._finish()
+            elif kind == 'error':
+                self.error = payload
+                self._finish()
+            handler = dispatch.get(kind)
+            if handler is not None:
+                handler(payload)
+        return handled
+
+    def poll(self, dispatch, max_messages=500):
+        """
+        Forwards up to `max_messages` channel messages to `dispatch[kind](payload)`.
+        The budget keeps one Tk tick short even when a job floods the channel.
+        Also detects crashed children and enforces the cancel grace period.
+        """
+        handled = self._drain(dispatch, max_messages)
+        if self.finished:
+            return handled
+
+        if self.kill_deadline is not None and time.time() > self.kill_deadline and self.process.is_alive():
+            self.process.kill()
+
+        if not self.process.is_alive() and self.process.exitcode is not None:
+            # The child may have queued its final messages right before exiting.
+            handled += self._drain(dispatch, max_messages)
+            if not self.finished and self.channel.empty():
+                if self.cancel_event.is_set():
+                    self.error = "任务已取消"
+                else:
+                    self.error = f"子进程异常退出 (exit code {self.process.exitcode})，可能是显存/内存不足导致崩溃。"
+                self._finish()
+                handler = dispatch.get('exit')
+                if handler is not None:
+                    handler(self.error)
+        return handled
+
+    def _finish(self):
+        self.finished = True
+
+    def join(self, timeout=5.0):
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(1.0)
+        self.channel.close()
+        self.channel.join_thread()
+
+
+def _inference_worker_main(model_path, requests, channel):
+    """Child process entry point of InferenceWorker: loads the model once, then serves requests."""
+    status = ChannelWriter(channel, 'status')
+    try:
+        import pipeline_api
+        import chat_context
+        from inference_core import start_gradio_interface
+        try:
+            model, tokenizer = pipeline_api.load_model(model_path, on_event=EventWriter(channel))
+        except pipeline_api.PipelineError:
+            channel.put(('loaded', False))
+            return
+        # 上下文窗口按 token 预算选择要发送的历史；每轮的 token 数缓存在其中
+        window = chat_context.window_for_model(model, tokenizer)
+        channel.put(('loaded', True))
+
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            kind, request_id, payload = request
+            try:
+                if kind == 'generate':
+                    window.budget = payload.get('context_budget') or window.budget
+                    window.strategy = payload.get('context_strategy') or window.strategy
+                    system_prompt, history, info = window.fit(payload['instruction'], payload['history'],
+                                                              payload['input_text'], payload['max_new_tokens'])
+                    # 回复逐段发回 GUI，边生成边显示；首段文本到达的时间即预填充耗时
+                    timer = chat_context.TurnTimer(lambda text: channel.put(('text', (request_id, text))))
+                    response = pipeline_api.chat(model, tokenizer, payload['input_text'], history,
+                                                 system_prompt=system_prompt, temperature=payload['temperature'],
+                                                 max_new_tokens=payload['max_new_tokens'], on_text=timer)
+                    info.update(timer.stats(), new_tokens=pipeline_api.count_new_tokens(model, tokenizer, response))
+                    channel.put(('chat_stats', (request_id, info)))
+                    channel.put(('response', (request_id, payload['input_text'], response)))
+                elif kind == 'share':
+                    start_gradio_interface(model, tokenizer, payload['system_prompt'], status)
+                    channel.put(('response', (request_id, None, None)))
+            except Exception as e:
+                channel.put(('request_error', (request_id, f"{e}\n{traceback.format_exc()}")))
+    except BaseException:
+        channel.put(('error', traceback.format_exc()))
+
+
+class PendingRequest:
+    """Handle for one request to an InferenceWorker; is_alive() until the answer arrives."""
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.done = False
+
+    def is_alive(self):
+        return not self.done
+
+
+class InferenceWorker:
+    """
+    Holds a loaded model in a child process. The model never crosses the process boundary: the GUI sends
+    generate / share requests over a request queue and receives the answers on the message channel.
+
+    It also has the parts of the ProcessJob interface the scheduler uses (poll, finished, cancel, join, ...),
+    so a loaded model is a scheduled job that holds its resources until the worker exits.
+    """
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.requests = _mp.Queue()
+        self.channel = _mp.Queue()
+        self.process = _mp.Process(target=_inference_worker_main, args=(model_path, self.requests, self.channel),
+                                   name="inference-worker", daemon=True)
+        self.loaded = False
+        self.load_request = PendingRequest(0)
+        self.pending = {}
+        self._ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.kill_deadline = None
+        self.result = None
+        self.error = None
+
+    def start(self):
+        self.process.start()
+        return self.load_request
+
+    def _submit(self, kind, payload):
+        with self.lock:
+            request = PendingRequest(next(self._ids))
+            self.pending[request.request_id] = request
+        self.requests.put((kind, request.request_id, payload))
+        return request
+
+    def generate(self, instruction, input_text, history, temperature=0.8, max_new_tokens=1000, context_budget=None,
+                 context_strategy=None):
+        return self._submit('generate', {'instruction': instruction, 'input_text': input_text,
+                                         'history': list(history), 'temperature': temperature,
+                                         'max_new_tokens': max_new_tokens, 'context_budget': context_budget,
+                                         'context_strategy': context_strategy})
+
+    def share(self, system_prompt):
+        return self._submit('share', {'system_prompt': system_prompt})
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def poll(self, dispatch, max_messages=500):
+        handled = 0
+        while handled < max_messages:
+            try:
+                kind, payload = self.channel.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            if kind == 'loaded':
+                self.loaded = payload
+                self.load_request.done = True
+                if not payload:
+                    self.result = False
+            elif kind in ('response', 'request_error'):
+                request = self.pending.pop(payload[0], None)
+                if request is not None:
+                    request.done = True
+            handler = dispatch.get(kind)
+            if handler is not None:
+                handler(payload)
+
+        if self.kill_deadline is not None and time.time() > self.kill_deadline and self.process.is_alive():
+            self.process.kill()
+
+        if not self.process.is_alive() and self.process.exitcode not in (None, 0):
+            if self.error is None:
+                self.error = f"推理进程异常退出 (exit code {self.process.exitcode})"
+            # 推理进程崩溃：结束所有等待中的请求
+            for request in [self.load_request] + list(self.pending.values()):
+                if not request.done:
+                    request.done = True
+                    handler = dispatch.get('exit')
+                    if handler is not None:
+                        handler(f"推理进程异常退出 (exit code {self.process.exitcode})")
+            self.pending.clear()
+        return handled
+
+    def stop(self, timeout=5.0):
+        if self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(1.0)
+
+    # --- ProcessJob interface for the scheduler ---
+    @property
+    def finished(self):
+        return self.process.exitcode is not None
+
+    paused = False
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def cancel(self, grace_seconds=15.0):
+        """Unloads the model: asks the worker to exit after the current request, killing it after the grace period."""
+        self.cancel_event.set()
+        if self.kill_deadline is None:
+            self.kill_deadline = time.time() + grace_seconds
+            if self.process.is_alive():
+                self.requests.put(None)
+
+    def join(self, timeout=5.0):
+        self.stop(timeout)
+
+
+class JobExecutor:
+    """Starts ProcessJobs and tears them down cleanly."""
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, name, target, args=(), kwargs=None):
+        job = ProcessJob(name, target, args, kwargs).start()
+        self.jobs.append(job)
+        return job
+
+    def poll(self, dispatch, max_messages=500):
+        for job in list(self.jobs):
+            job.poll(dispatch, max_messages)
+            if job.finished:
+                job.join(timeout=1.0)
+                self.jobs.remove(job)
+
+    def shutdown(self, grace_seconds=5.0):
+        for job in self.jobs:
+            job.cancel(grace_seconds)
+        deadline = time.time() + grace_seconds
+        for job in self.jobs:
+            job.process.join(max(0.0, deadline - time.time()))
+            job.join(timeout=0.5)
+        self.jobs.clear()
@@ -0,0 +1,254 @@
+"""
+Job scheduler on top of job_executor: a priority queue with per-resource concurrency limits and a
+persistent job history.
+
+Each job declares the resources it needs (e.g. {'train': 1}); a queued job starts as soon as all of
+its resources are below their limits, higher priority first, then oldest first. `tick()` is called
+from the Tk main loop and never blocks.
+
+A loaded chat model is a job too ('inference'): its InferenceWorker holds the resources until the model
+is unloaded, so only one inference model is loaded at a time and a local model waits for the GPU like
+a training run does.
+"""
+import itertools
+import json
+import os
+import time
+
+JOB_HISTORY_FILE = "job_history.json"
+MAX_HISTORY = 200
+
+# 默认并发限制: 同时只运行一个占用 GPU 的任务 (训练、合并、评估、校准、本地推理模型)，CPU 上的转换可并行若干个，
+# 推理模型同时只加载一个
+DEFAULT_LIMITS = {'train': 1, 'convert': 2, 'inference': 1}
+DEFAULT_RESOURCES = {
+    'train': {'train': 1},
+    'merge': {'train': 1}, # 合并以 fp16 加载完整基座 (device_map="auto")，与训练争用显存
+    'convert': {'convert': 1},
+    'eval': {'train': 1}, # 评估同样占用 GPU
+    'calibrate': {'train': 1}, # 资源预估的校准训练
+    'inference': {'inference': 1, 'train': 1}, # 本地模型加载后一直占用显存 (Ollama / ONNX 模型只占 inference)
+}
+DEFAULT_PRIORITIES = {'train': 0, 'merge': 5, 'convert': 5, 'eval': 3, 'calibrate': 3, 'inference': 5}
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED, INTERRUPTED = "排队中", "运行中", "成功", "失败", "已取消", "已中断"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class JobRecord:
+    """One scheduled job: its spec, its live ProcessJob once started, and its history fields."""
+    def __init__(self, job_id, name, kind, target=None, args=(), kwargs=None, priority=None, resources=None,
+                 make_dispatch=None, on_finished=None, start=None):
+        self.job_id = job_id
+        self.name = name
+        self.kind = kind
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.priority = DEFAULT_PRIORITIES.get(kind, 0) if priority is None else priority
+        self.resources = resources or DEFAULT_RESOURCES.get(kind, {})
+        self.make_dispatch = make_dispatch
+        self.on_finished = on_finished
+        self.start = start
+        self.status = QUEUED
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process_job = None
+        self.dispatch = None
+        self.failed_flag = False
+
+    @property
+    def duration(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def mark_failed(self, message=None):
+        """Lets a dispatch handler flag a failure reported through the channel (e.g. an 'ERROR:' status line)."""
+        self.failed_flag = True
+        if message and not self.error:
+            self.error = message
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id, 'name': self.name, 'kind': self.kind, 'priority': self.priority,
+            'status': self.status, 'error': (self.error or "")[-2000:],
+            'submitted_at': self.submitted_at, 'started_at': self.started_at, 'finished_at': self.finished_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls(data['job_id'], data['name'], data['kind'], priority=data.get('priority', 0))
+        record.status = data['status']
+        record.error = data.get('error') or None
+        record.submitted_at = data.get('submitted_at')
+        record.started_at = data.get('started_at')
+        record.finished_at = data.get('finished_at')
+        return record
+
+
+class JobScheduler:
+    def __init__(self, executor, limits=None, history_file=JOB_HISTORY_FILE):
+        self.executor = executor
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.history_file = history_file
+        self.records = []
+        self._load_history()
+        next_id = max((r.job_id for r in self.records), default=0) + 1
+        self._ids = itertools.count(next_id)
+        self.changed = True
+
+    # --- Persistence ---
+    def _load_history(self):
+        if not os.path.exists(self.history_file):
+            return
+        try:
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                self.records = [JobRecord.from_dict(d) for d in json.load(f)]
+        except (OSError, ValueError, KeyError):
+            self.records = []
+        # 上次退出时仍在排队或运行的任务无法恢复
+        for record in self.records:
+            if record.status in ACTIVE_STATES:
+                record.status = INTERRUPTED
+
+    def save_history(self):
+        data = [r.to_dict() for r in self.records[-MAX_HISTORY:]]
+        temp_path = self.history_file + ".tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.history_file)
+        except OSError as e:
+            print(f"Warning: could not save job history: {e}")
+
+    # --- Queue operations ---
+    def submit(self, name, kind, target, args=(), kwargs=None, priority=None, resources=None, make_dispatch=None,
+               on_finished=None, start=None):
+        """
+        Queues a job. `make_dispatch(record)` returns the channel dispatch dict once the job starts;
+        `on_finished(record)` is called when it ends. `start(record)`, if given, starts the job instead of
+        executor.submit(target) and returns an object with the ProcessJob interface (e.g. an InferenceWorker).
+        """
+        record = JobRecord(next(self._ids), name, kind, target, args, kwargs, priority, resources, make_dispatch,
+                           on_finished, start)
+        self.records.append(record)
+        self.changed = True
+        self.save_history()
+        return record
+
+    def get(self, job_id):
+        return next((r for r in self.records if r.job_id == job_id), None)
+
+    def cancel(self, job_id):
+        record = self.get(job_id)
+        if record is None:
+            return
+        if record.status == QUEUED:
+            record.status = CANCELLED
+            record.finished_at = time.time()
+            self.changed = True
+            self.save_history()
+            if record.on_finished:
+                record.on_finished(record)
+        elif record.status == RUNNING:
+            record.process_job.cancel()
+
+    def set_priority(self, job_id, priority):
+        record = self.get(job_id)
+        if record is not None and record.status == QUEUED:
+            record.priority = priority
+            self.changed = True
+
+    def clear_history(self):
+        self.records = [r for r in self.records if r.status in ACTIVE_STATES]
+        self.changed = True
+        self.save_history()
+
+    def running(self):
+        return [r for r in self.records if r.status == RUNNING]
+
+    def queued(self):
+        return [r for r in self.records if r.status == QUEUED]
+
+    def usage(self):
+        used = {}
+        for record in self.running():
+            for resource, amount in record.resources.items():
+                used[resource] = used.get(resource, 0) + amount
+        return used
+
+    def _fits(self, record, used):
+        return all(used.get(res, 0) + amount <= self.limits.get(res, 1) for res, amount in record.resources.items())
+
+    # --- Main loop ---
+    def tick(self, max_messages=500):
+        """Polls running jobs, finalizes finished ones and starts queued jobs that fit. Call from the Tk loop."""
+        for record in self.running():
+            record.process_job.poll(record.dispatch, max_messages)
+            if record.process_job.finished:
+                self._finalize(record)
+
+        used = self.usage()
+        for record in sorted(self.queued(), key=lambda r: (-r.priority, r.submitted_at)):
+            if self._fits(record, used):
+                self._start(record)
+                for resource, amount in record.resources.items():
+                    used[resource] = used.get(resource, 0) + amount
+
+    def _start(self, record):
+        record.dispatch = record.make_dispatch(record) if record.make_dispatch else {}
+        if record.start is not None:
+            record.process_job = record.start(record)
+        else:
+            record.process_job = self.executor.submit(record.name, record.target, record.args, record.kwargs)
+        record.status = RUNNING
+        record.started_at = time.time()
+        self.changed = True
+        self.save_history()
+
+    def _finalize(self, record):
+        job = record.process_job
+        job.join(timeout=1.0)
+        if job in self.executor.jobs:
+            self.executor.jobs.remove(job)
+        record.finished_at = time.time()
+        if job.cancel_event.is_set():
+            record.status = CANCELLED
+        elif job.error or record.failed_flag or job.result is False:
+            record.status = FAILED
+            record.error = record.error or job.error
+        else:
+            record.status = SUCCEEDED
+        self.changed = True
+        self.save_history()
+        if record.on_finished:
+            record.on_finished(record)
+
+    def shutdown(self, grace_seconds=5.0):
+        """
+        Cancels the running jobs, waits up to `grace_seconds` for their processes to exit and kills the rest.
+        Jobs that stopped in time are recorded as cancelled, killed ones as interrupted.
+        """
+        running = self.running()
+        for record in running:
+            record.process_job.cancel(grace_seconds)
+        deadline = time.time() + grace_seconds
+        for record in running:
+            job = record.process_job
+            if job.process.is_alive():
+                job.process.join(max(0.0, deadline - time.time()))
+            killed = job.process.is_alive()
+            job.join(timeout=1.0)  # 仍未退出的进程在这里被强制结束
+            if job in self.executor.jobs:
+                self.executor.jobs.remove(job)
+            record.finished_at = time.time()
+            if killed:
+                record.status = INTERRUPTED
+                record.error = record.error or f"退出时 {grace_seconds:.0f}s 内未结束，已强制终止"
+            else:
+                record.status = CANCELLED
+        self.changed = True
+        self.save_history()
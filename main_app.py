@@ -5,11 +5,24 @@ import queue
 import time
 import os
 import json
-from train_core import start_training, get_local_lora_base_models, get_existing_lora_dirs
-from merge_and_import import do_merge_and_import, convert_base_model_to_ollama
-from inference_core import load_model_and_tokenizer, generate_response, start_gradio_interface
+import importlib
+import sqlite3
+# 核心模块在导入时不会加载 torch / transformers 等重量级框架，它们在首次训练、推理或合并时才加载
+import pipeline_api
+import profiling
+import data_mixing
+import memory_planner
+import chat_context
+import chat_store
+from transcript_view import TranscriptView
+from job_executor import JobExecutor, InferenceWorker, EVENTS, CANCEL_EVENT, PAUSE_EVENT
+from job_scheduler import JobScheduler, QUEUED, RUNNING, SUCCEEDED, CANCELLED
+from model_catalog import get_catalog
+from batch_import import BatchImporter, ImportJob, render_model_name, format_summary, DEFAULT_NAME_TEMPLATE
 
 CONFIG_FILE = "config.json"
+# 窗口显示后在后台线程中预先导入的重量级框架 (config.json 中 "warm_imports": false 可关闭)
+WARMUP_MODULES = ["torch", "transformers", "peft", "datasets"]
 
 class MainApplication(tk.Frame):
     def __init__(self, parent, *args, **kwargs):
@@ -20,19 +33,37 @@ class MainApplication(tk.Frame):
 
         self.config = self.load_config()
         self.interactive_widgets = []
+        # 性能分析设置通过环境变量传给之后启动的训练/合并/推理子进程
+        if "profiling" in self.config:
+            profiling.set_modes(self.config["profiling"])
 
         # --- Queues for threading ---
-        self.progress_queue = queue.Queue()
-        self.log_queue = queue.Queue()
         self.status_queue = queue.Queue()
         self.response_queue = queue.Queue()
+        self.task_progress_queue = queue.Queue()
 
         # --- Internal State ---
+        # active_thread 只用于推理 (加载/生成/分享)；训练、合并、转换由任务调度器排队执行
         self.active_thread = None
+        self.batch_thread = None
+        self.batch_cancel_event = threading.Event()
+        self.batch_update_queue = queue.Queue()
+        self.catalog = get_catalog()
+        self.catalog_queue = queue.Queue()
+        # 启动训练/合并前在后台线程中计算的资源预估 (memory_planner)，结果由 periodic_check 处理
+        self.preflight_queue = queue.Queue()
+        self.catalog_refreshing = False
         self.selected_data_file = tk.StringVar()
-        self.inference_model = None
-        self.inference_tokenizer = None
+        # 训练、合并、转换在子进程中运行；推理模型驻留在独立的推理进程中
+        self.executor = JobExecutor()
+        self.scheduler = JobScheduler(self.executor, limits=self.config.get("job_limits"))
+        self.inference_worker = None
         self.chat_history = []
+        # 对话保存在 chat_sessions.db 中；第一轮回复保存时才创建会话
+        self.chat_store = chat_store.get_store()
+        self.chat_session_id = None
+        self.pending_turn_params = None
+        self.inference_model_path = self.inference_adapter_path = None
 
         # --- Main PanedWindow for resizable layout ---
         self.main_paned_window = ttk.PanedWindow(self, orient=tk.VERTICAL)
@@ -46,11 +77,13 @@ class MainApplication(tk.Frame):
         self.tab_train = ttk.Frame(self.notebook, padding="10")
         self.tab_manage = ttk.Frame(self.notebook, padding="10")
         self.tab_inference = ttk.Frame(self.notebook, padding="10")
+        self.tab_jobs = ttk.Frame(self.notebook, padding="10")
         self.tab_settings = ttk.Frame(self.notebook, padding="10")
 
         self.notebook.add(self.tab_train, text="训练 (Train)")
         self.notebook.add(self.tab_manage, text="模型管理 (Manage)")
         self.notebook.add(self.tab_inference, text="推理 (Inference)")
+        self.notebook.add(self.tab_jobs, text="任务 (Jobs)")
         self.notebook.add(self.tab_settings, text="设置 (Settings)")
 
         # --- Bottom Frame for Logs and Progress ---
@@ -63,9 +96,9 @@ class MainApplication(tk.Frame):
         self.progress_frame.pack(fill=tk.X, expand=False, padx=10, pady=(5,0))
 
         self.status_label = ttk.Label(self.progress_frame, text="状态: 空闲")
-        self.status_label.pack(fill=tk.X, expand=True, padx=5, pady=2)
+        self.status_label.pack(side=tk.TOP, fill=tk.X, expand=True, padx=5, pady=2)
         self.progress_bar = ttk.Progressbar(self.progress_frame, orient="horizontal", length=100, mode="determinate")
-        self.progress_bar.pack(fill=tk.X, expand=True, padx=5, pady=2)
+        self.progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5, pady=2)
 
         # --- Log Viewer ---
         self.log_frame = ttk.LabelFrame(self.bottom_frame, text="实时日志", padding="5")
@@ -77,11 +110,19 @@ class MainApplication(tk.Frame):
         self.create_train_tab_content()
         self.create_manage_tab_content()
         self.create_inference_tab_content()
+        self.create_jobs_tab_content()
         self.create_settings_tab_content()
 
+        # --- Model lists come from the persistent catalog; rescan it in the background ---
+        self.request_catalog_refresh()
+
         # --- Start periodic check for thread queues ---
         self.parent.after(100, self.periodic_check)
 
+        # --- Warm heavy imports in the background once the window is shown ---
+        if self.config.get("warm_imports", True):
+            self.parent.after(500, self.start_import_warmup)
+
     def load_config(self):
         if os.path.exists(CONFIG_FILE):
             with open(CONFIG_FILE, 'r') as f:
@@ -92,6 +133,16 @@ class MainApplication(tk.Frame):
         with open(CONFIG_FILE, 'w') as f:
             json.dump(self.config, f, indent=4)
 
+    def start_import_warmup(self):
+        def warmup():
+            for module_name in WARMUP_MODULES:
+                try:
+                    importlib.import_module(module_name)
+                except Exception as e:
+                    # 预热失败不影响使用，真正用到时会再次导入并报告错误
+                    self.status_queue.put(f"预热导入 {module_name} 失败: {e}")
+        threading.Thread(target=warmup, daemon=True).start()
+
     def add_interactive_widget(self, widget):
         self.interactive_widgets.append(widget)
 
@@ -117,7 +168,7 @@ class MainApplication(tk.Frame):
         self.model_select_label.pack(side=tk.LEFT, padx=(0, 5))
         self.model_select_combobox = ttk.Combobox(self.model_select_frame, state="normal", width=60)
         self.model_select_combobox.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
-        self.model_refresh_button = ttk.Button(self.model_select_frame, text="刷新", command=self.refresh_model_lists)
+        self.model_refresh_button = ttk.Button(self.model_select_frame, text="刷新", command=self.request_catalog_refresh)
         self.model_refresh_button.pack(side=tk.RIGHT, padx=5)
         self.add_interactive_widget(self.model_select_combobox)
         self.add_interactive_widget(self.model_refresh_button)
@@ -143,9 +194,24 @@ class MainApplication(tk.Frame):
         self.output_dir_entry.pack(fill=tk.X, expand=True, padx=5)
         self.add_interactive_widget(self.output_dir_entry)
 
-        self.start_train_button = ttk.Button(train_frame, text="开始训练", command=self.start_training_thread, style="Accent.TButton")
-        self.start_train_button.pack(pady=20, ipady=5)
+        parallel_frame = ttk.Frame(data_output_frame)
+        parallel_frame.pack(fill=tk.X, expand=False, pady=5)
+        ttk.Label(parallel_frame, text="并行进程数:").pack(side=tk.LEFT, padx=(0, 5))
+        self.num_processes_var = tk.IntVar(value=1)
+        num_processes_spinbox = ttk.Spinbox(parallel_frame, from_=1, to=max(1, os.cpu_count() or 1), width=5,
+                                            textvariable=self.num_processes_var)
+        num_processes_spinbox.pack(side=tk.LEFT, padx=5)
+        ttk.Label(parallel_frame, text="(>1 时按数据并行在多个进程中训练，gloo 后端)").pack(side=tk.LEFT, padx=5)
+        self.add_interactive_widget(num_processes_spinbox)
+
+        train_buttons_frame = ttk.Frame(train_frame)
+        train_buttons_frame.pack(pady=20)
+        self.start_train_button = ttk.Button(train_buttons_frame, text="开始训练", command=self.start_training_thread, style="Accent.TButton")
+        self.start_train_button.pack(side=tk.LEFT, padx=5, ipady=5)
         self.add_interactive_widget(self.start_train_button)
+        calibrate_button = ttk.Button(train_buttons_frame, text="校准资源预估", command=self.start_calibration_job)
+        calibrate_button.pack(side=tk.LEFT, padx=5, ipady=5)
+        self.add_interactive_widget(calibrate_button)
 
         self.on_train_mode_change()
 
@@ -162,15 +228,38 @@ class MainApplication(tk.Frame):
         merge_model_label.pack(side=tk.LEFT, padx=(0, 5))
         self.merge_model_combobox = ttk.Combobox(merge_model_frame, state="readonly", width=60)
         self.merge_model_combobox.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
-        self.merge_refresh_button = ttk.Button(merge_model_frame, text="刷新", command=self.refresh_merge_model_list)
+        self.merge_refresh_button = ttk.Button(merge_model_frame, text="刷新", command=self.request_catalog_refresh)
         self.merge_refresh_button.pack(side=tk.RIGHT, padx=5)
         self.add_interactive_widget(self.merge_model_combobox)
         self.add_interactive_widget(self.merge_refresh_button)
+        self.merge_model_combobox.bind("<<ComboboxSelected>>", lambda event: self.show_lora_metadata())
+
+        self.merge_model_info_label = ttk.Label(merge_frame, text="", foreground="gray")
+        self.merge_model_info_label.pack(fill=tk.X, expand=True, padx=5)
+
+        self.adapter_only_var = tk.BooleanVar(value=False)
+        adapter_only_check = ttk.Checkbutton(merge_frame, text="仅导入适配器 (FROM 基座 + ADAPTER，复用基座 GGUF 缓存，不生成完整合并模型)", variable=self.adapter_only_var)
+        adapter_only_check.pack(anchor='w', pady=(5, 0))
+        self.add_interactive_widget(adapter_only_check)
 
         merge_button = ttk.Button(merge_frame, text="开始合并与导入", command=self.start_merge_and_import_thread, style="Accent.TButton")
         merge_button.pack(pady=10)
         self.add_interactive_widget(merge_button)
 
+        eval_button = ttk.Button(merge_frame, text="评估所选 LoRA...", command=self.start_evaluation_job)
+        eval_button.pack(pady=(0, 10))
+
+        onnx_button = ttk.Button(merge_frame, text="导出 ONNX (CPU 推理)...", command=self.start_onnx_export_job)
+        onnx_button.pack(pady=(0, 10))
+        self.add_interactive_widget(onnx_button)
+
+        compare_button = ttk.Button(merge_frame, text="与 Ollama 中的模型对比...", command=self.start_compare_job)
+        compare_button.pack(pady=(0, 10))
+
+        # 批量导入不占用 active_thread，因此不加入 interactive_widgets
+        batch_button = ttk.Button(merge_frame, text="批量导入...", command=self.open_batch_import_dialog)
+        batch_button.pack(pady=(0, 10))
+
         convert_frame = ttk.LabelFrame(manage_frame, text="2. 转换基座模型到 Ollama", padding="10")
         convert_frame.pack(fill=tk.X, expand=False, pady=5)
         
@@ -195,7 +284,7 @@ class MainApplication(tk.Frame):
 
         self.inference_model_combobox = ttk.Combobox(model_frame, state="readonly", width=60)
         self.inference_model_combobox.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
-        self.inference_refresh_button = ttk.Button(model_frame, text="刷新", command=self.refresh_inference_model_list)
+        self.inference_refresh_button = ttk.Button(model_frame, text="刷新", command=self.request_catalog_refresh)
         self.inference_refresh_button.pack(side=tk.LEFT, padx=5)
         self.load_inference_model_button = ttk.Button(model_frame, text="加载模型", command=self.load_inference_model_thread, style="Accent.TButton")
         self.load_inference_model_button.pack(side=tk.RIGHT, padx=5)
@@ -218,13 +307,19 @@ class MainApplication(tk.Frame):
         chat_frame = ttk.LabelFrame(inference_frame, text="3. 对话", padding="10")
         chat_frame.pack(fill=tk.BOTH, expand=True)
 
-        self.chat_history_text = scrolledtext.ScrolledText(chat_frame, state='disabled', wrap=tk.WORD, height=15)
-        self.chat_history_text.pack(fill=tk.BOTH, expand=True, pady=5)
-        self.chat_history_text.tag_config('user_style', foreground="#0078d4", font=("Segoe UI", 10, "bold"))
+        # 只渲染可见附近的轮次，其余按需从会话库中读取，长对话也不会拖慢界面
+        self.transcript = TranscriptView(chat_frame, height=15)
+        self.transcript.pack(fill=tk.BOTH, expand=True, pady=5)
+        self.transcript.tag_config('user_style', foreground="#0078d4", font=("Segoe UI", 10, "bold"))
         # Use a theme-aware color for the model response
         style = ttk.Style()
         model_fg_color = style.lookup('TLabel', 'foreground')
-        self.chat_history_text.tag_config('model_style', foreground=model_fg_color, font=("Segoe UI", 10, "bold"))
+        self.transcript.tag_config('model_style', foreground=model_fg_color, font=("Segoe UI", 10, "bold"))
+
+        # 上下文 token 数与每轮预填充耗时 (推理进程每轮回报)
+        self.context_stats_label = ttk.Label(chat_frame, text="", foreground="gray")
+        self.context_stats_label.pack(fill=tk.X, expand=False)
+        self.last_context_stats = None
 
         action_frame = ttk.Frame(chat_frame)
         action_frame.pack(fill=tk.X, expand=False, pady=(5, 0))
@@ -232,6 +327,7 @@ class MainApplication(tk.Frame):
         self.user_input_text = scrolledtext.ScrolledText(action_frame, height=4, wrap=tk.WORD)
         self.user_input_text.pack(fill=tk.BOTH, expand=True, side=tk.LEFT, padx=(0, 10))
         self.add_interactive_widget(self.user_input_text)
+        self.user_input_text.bind("<KeyRelease>", lambda event: self.update_context_stats_label())
 
         controls_frame = ttk.Frame(action_frame)
         controls_frame.pack(side=tk.RIGHT, anchor='n')
@@ -245,12 +341,59 @@ class MainApplication(tk.Frame):
         context_check.pack(pady=5, anchor='w')
         self.add_interactive_widget(context_check)
 
-        clear_history_button = ttk.Button(controls_frame, text="清空", command=self.clear_chat_history)
+        context_settings = chat_context.load_context_settings()
+        budget_frame = ttk.Frame(controls_frame)
+        budget_frame.pack(anchor='w')
+        ttk.Label(budget_frame, text="预算:").pack(side=tk.LEFT)
+        self.context_budget_var = tk.IntVar(value=context_settings['budget'])
+        budget_spinbox = ttk.Spinbox(budget_frame, from_=256, to=131072, increment=256, width=7,
+                                     textvariable=self.context_budget_var)
+        budget_spinbox.pack(side=tk.LEFT)
+        self.add_interactive_widget(budget_spinbox)
+        self.context_summarize_var = tk.BooleanVar(value=context_settings['strategy'] == "summarize")
+        summarize_check = ttk.Checkbutton(controls_frame, text="摘要旧对话", variable=self.context_summarize_var)
+        summarize_check.pack(pady=5, anchor='w')
+        self.add_interactive_widget(summarize_check)
+
+        clear_history_button = ttk.Button(controls_frame, text="新会话", command=self.clear_chat_history)
         clear_history_button.pack(fill=tk.X, expand=True)
         self.add_interactive_widget(clear_history_button)
+        sessions_button = ttk.Button(controls_frame, text="历史会话...", command=self.open_chat_sessions_dialog)
+        sessions_button.pack(fill=tk.X, expand=True, pady=(5, 0))
+        self.add_interactive_widget(sessions_button)
 
         self.refresh_inference_model_list()
 
+    def create_jobs_tab_content(self):
+        jobs_frame = ttk.Frame(self.tab_jobs)
+        jobs_frame.pack(fill=tk.BOTH, expand=True)
+
+        limits_text = ", ".join(f"{resource}: {limit}" for resource, limit in self.scheduler.limits.items())
+        ttk.Label(jobs_frame, text=f"并发限制 ({limits_text})，推理模型同时只加载一个。高优先级任务先开始。", foreground="gray").pack(anchor='w', pady=(0, 5))
+
+        table_frame = ttk.Frame(jobs_frame)
+        table_frame.pack(fill=tk.BOTH, expand=True)
+        columns = ("id", "name", "kind", "priority", "status", "submitted", "duration", "error")
+        self.jobs_table = ttk.Treeview(table_frame, columns=columns, show="headings", height=12)
+        for column, heading, width in zip(columns, ("#", "任务", "类型", "优先级", "状态", "提交时间", "耗时", "错误"),
+                                          (40, 220, 60, 60, 70, 130, 70, 250)):
+            self.jobs_table.heading(column, text=heading)
+            self.jobs_table.column(column, width=width, anchor='w')
+        jobs_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.jobs_table.yview)
+        self.jobs_table.configure(yscrollcommand=jobs_scrollbar.set)
+        self.jobs_table.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        jobs_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        buttons_frame = ttk.Frame(jobs_frame)
+        buttons_frame.pack(fill=tk.X, expand=False, pady=5)
+        ttk.Button(buttons_frame, text="取消", command=self.cancel_selected_job).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="暂停/继续", command=self.toggle_pause_selected_job).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="优先级 +", command=lambda: self.change_selected_job_priority(1)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="优先级 -", command=lambda: self.change_selected_job_priority(-1)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="清除历史", command=self.scheduler.clear_history).pack(side=tk.RIGHT, padx=5)
+
+        self.refresh_jobs_table()
+
     def create_settings_tab_content(self):
         settings_frame = ttk.Frame(self.tab_settings)
         settings_frame.pack(fill=tk.X, expand=False, pady=5)
@@ -268,6 +411,28 @@ class MainApplication(tk.Frame):
         self.add_interactive_widget(self.llama_cpp_path_entry)
         self.add_interactive_widget(browse_llama_button)
 
+        scratch_frame = ttk.LabelFrame(settings_frame, text="合并模型临时目录 (可选, 建议 tmpfs/NVMe)", padding="10")
+        scratch_frame.pack(fill=tk.X, expand=True, pady=(10, 0))
+        self.scratch_dir_entry = ttk.Entry(scratch_frame, width=70)
+        self.scratch_dir_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.scratch_dir_entry.insert(0, self.config.get("scratch_dir", ""))
+        browse_scratch_button = ttk.Button(scratch_frame, text="浏览...", command=self.browse_scratch_dir)
+        browse_scratch_button.pack(side=tk.LEFT, padx=5)
+        self.add_interactive_widget(self.scratch_dir_entry)
+        self.add_interactive_widget(browse_scratch_button)
+
+        profiling_frame = ttk.LabelFrame(settings_frame, text="性能分析 (Profiling, 对之后启动的任务生效)", padding="10")
+        profiling_frame.pack(fill=tk.X, expand=True, pady=(10, 0))
+        enabled = profiling.enabled_modes()
+        self.profiling_vars = {}
+        labels = {"timings": "阶段耗时", "cprofile": "cProfile", "torch": "torch.profiler 轨迹", "pyspy": "py-spy 采样"}
+        for mode in profiling.MODES:
+            self.profiling_vars[mode] = tk.BooleanVar(value=mode in enabled)
+            check = ttk.Checkbutton(profiling_frame, text=labels[mode], variable=self.profiling_vars[mode])
+            check.pack(side=tk.LEFT, padx=5)
+            self.add_interactive_widget(check)
+        ttk.Label(profiling_frame, text="结果写入训练/LoRA 目录下的 profile 或 ./profiles").pack(side=tk.LEFT, padx=10)
+
         save_button = ttk.Button(settings_frame, text="保存设置", command=self.save_settings, style="Accent.TButton")
         save_button.pack(pady=20)
         self.add_interactive_widget(save_button)
@@ -281,19 +446,11 @@ class MainApplication(tk.Frame):
                 pass
         # Special handling for share_model_button
         if hasattr(self, 'share_model_button'):
-            if busy or self.inference_model is None:
+            if busy or not self.inference_ready():
                 self.share_model_button.config(state=tk.DISABLED)
             else:
                 self.share_model_button.config(state=tk.NORMAL)
 
-    def update_chat_display(self, role, text):
-        self.chat_history_text.config(state='normal')
-        style_tag = f'{role}_style'
-        self.chat_history_text.insert(tk.END, f"{role.capitalize()}:\n", style_tag)
-        self.chat_history_text.insert(tk.END, f"{text}\n\n")
-        self.chat_history_text.config(state='disabled')
-        self.chat_history_text.yview(tk.END)
-
     def on_train_mode_change(self):
         mode = self.train_mode.get()
         if mode == "new":
@@ -309,53 +466,53 @@ class MainApplication(tk.Frame):
         self.refresh_model_lists()
 
     def refresh_model_lists(self):
-        self.model_refresh_button.config(state=tk.DISABLED)
+        # 只读取模型目录索引，不访问文件系统，可以直接在 Tk 主线程调用
         mode = self.train_mode.get()
         if mode == "new":
-            self.model_select_combobox.set("正在扫描本地基座模型...")
-            models, error = get_local_lora_base_models()
-            if error:
-                messagebox.showerror("错误", error)
-                self.model_select_combobox.set("扫描失败")
-                self.model_select_combobox['values'] = []
-            else:
-                self.model_select_combobox['values'] = models
-                if models:
-                    self.model_select_combobox.set(models[0])
-                else:
-                    self.model_select_combobox.set("未找到本地缓存的基座模型")
+            models = self.catalog.base_models()
+            empty_text = "未找到本地缓存的基座模型"
         else: # continue
-            self.model_select_combobox.set("正在扫描本地已训练 LoRA 模型...")
-            models, error = get_existing_lora_dirs()
-            if error:
-                messagebox.showerror("错误", error)
-                self.model_select_combobox.set("扫描失败")
-                self.model_select_combobox['values'] = []
-            elif not models:
-                self.model_select_combobox.set("未找到本地已训练 LoRA 模型")
-                self.model_select_combobox['values'] = []
-            else:
-                self.model_select_combobox['values'] = models
-                self.model_select_combobox.set(models[0])
-        self.model_refresh_button.config(state=tk.NORMAL)
+            models = self.catalog.lora_dirs()
+            empty_text = "未找到本地已训练 LoRA 模型"
+        self.set_combobox_models(self.model_select_combobox, models, empty_text)
 
     def browse_file(self):
-        file_path = filedialog.askopenfilename(
-            title="选择数据集文件",
-            filetypes=(("JSONL files", "*.jsonl"), ("All files", "*.*" ))
+        file_paths = filedialog.askopenfilenames(
+            title="选择数据集文件 (可多选按权重混合；JSONL 指令数据，或 .txt/.md 纯文本用于继续预训练)",
+            filetypes=(("JSONL files", "*.jsonl"), ("Text corpora", "*.txt *.md"), ("Token files", "*.bin"), ("All files", "*.*" ))
         )
-        if file_path:
-            self.selected_data_file.set(file_path)
-            self.data_path_label.config(text=file_path)
+        if file_paths:
+            file_path = file_paths[0]
+            if len(file_paths) > 1:
+                # 多个数据集: 询问各自的抽样权重，保存为 "a.jsonl=0.7,b.jsonl=0.3" 形式的混合描述
+                names = "、".join(os.path.basename(p) for p in file_paths)
+                weights_text = simpledialog.askstring(
+                    "数据集权重", f"按顺序输入各数据集的抽样权重 (逗号分隔):\n{names}",
+                    initialvalue=",".join("1" for _ in file_paths), parent=self)
+                if weights_text is None:
+                    return
+                try:
+                    weights = [float(w) for w in weights_text.replace("，", ",").split(",")]
+                    if len(weights) != len(file_paths):
+                        raise ValueError(f"需要 {len(file_paths)} 个权重")
+                    spec = data_mixing.format_mixture(list(zip(file_paths, weights)))
+                    data_mixing.parse_mixture(spec)
+                except ValueError as e:
+                    messagebox.showerror("错误", f"权重无效: {e}")
+                    return
+            else:
+                spec = file_path
+            self.selected_data_file.set(spec)
+            self.data_path_label.config(text=spec if len(file_paths) == 1 else
+                                        "混合: " + ", ".join(f"{os.path.basename(p)}={w:g}" for p, w in zip(file_paths, weights)))
             filename = os.path.basename(file_path).split('.')[0]
             mode = self.train_mode.get()
             suffix = "finetuned" if mode == "new" else "continued"
             self.output_dir_entry.delete(0, tk.END)
             self.output_dir_entry.insert(0, f"./lora_{filename}_{suffix}")
 
-    def start_training_thread(self):
-        if self.is_busy("训练"): return
-
+    def collect_training_request(self):
+        """Validated (base_model_name, lora_adapter_path, data_path, output_dir) from the training tab, or None."""
         mode = self.train_mode.get()
         model_path = self.model_select_combobox.get().strip()
         data_path = self.selected_data_file.get()
@@ -382,45 +539,123 @@ class MainApplication(tk.Frame):
                 messagebox.showerror("错误", f"在 '{model_path}' 中未找到有效的 'final_lora_adapter' 子目录或其配置文件。")
                 return
             try:
-                with open(os.path.join(lora_adapter_path, "adapter_config.json"), 'r') as f:
-                    config = json.load(f)
-                    base_model_name = config.get("base_model_name_or_path")
-                if not base_model_name:
-                    raise ValueError("无法获取基座模型名称")
+                base_model_name = pipeline_api.read_adapter_base_model(lora_adapter_path)
             except Exception as e:
                 messagebox.showerror("错误", f"读取LoRA适配器配置失败: {e}")
                 return
+        return base_model_name, lora_adapter_path, data_path, output_dir
 
-        self.set_ui_busy(True)
-        self.clear_logs()
-        self.status_label.config(text=f"状态: 准备开始训练...")
+    def start_training_thread(self):
+        request = self.collect_training_request()
+        if request is None:
+            return
+        base_model_name, lora_adapter_path, data_path, output_dir = request
+        try:
+            num_processes = max(1, int(self.num_processes_var.get()))
+        except (tk.TclError, ValueError):
+            messagebox.showerror("错误", "并行进程数必须是正整数！")
+            return
 
-        self.active_thread = threading.Thread(
-            target=start_training,
-            args=(base_model_name, data_path, output_dir, self.progress_queue, self.log_queue, lora_adapter_path),
-            daemon=True
-        )
-        self.active_thread.start()
+        def submit(hyperparams=None):
+            # 训练在子进程中运行：与 GUI 不争抢 GIL，可取消/暂停，CUDA/OOM 崩溃也不会拖垮整个应用
+            self.submit_job(
+                f"训练 {os.path.basename(os.path.normpath(output_dir))}", "train", pipeline_api.train,
+                args=(data_path, output_dir),
+                kwargs={'base_model': base_model_name, 'lora_adapter_path': lora_adapter_path, 'on_event': EVENTS,
+                        'cancel_event': CANCEL_EVENT, 'pause_event': PAUSE_EVENT, 'num_processes': num_processes,
+                        'hyperparams': hyperparams}
+            )
+
+        def on_plan(plan):
+            summary = memory_planner.format_training_plan(plan)
+            self.append_log(f"[资源预估] {summary}")
+            if plan['fits']:
+                submit()
+                return
+            if plan['suggestion']:
+                answer = messagebox.askyesnocancel(
+                    "内存可能不足", f"{summary}\n\n是: 使用建议的配置训练\n否: 仍按当前配置训练\n取消: 不启动训练")
+                if answer is None:
+                    return
+                submit(plan['suggestion'] if answer else None)
+            elif messagebox.askokcancel("内存可能不足", f"{summary}\n\n仍要启动训练吗？"):
+                submit()
+
+        self.status_label.config(text="状态: 正在预估训练所需的内存与时间...")
+        self.run_preflight(lambda: memory_planner.plan_training(base_model_name, data_path, num_processes=num_processes,
+                                                                lora_adapter_path=lora_adapter_path),
+                           on_plan, on_error=lambda e: submit())
+
+    def run_preflight(self, compute, on_done, on_error):
+        """Runs a planner function in a background thread; periodic_check calls on_done / on_error with its result."""
+        def worker():
+            try:
+                result = compute()
+            except Exception as e:
+                self.preflight_queue.put((on_error, e, f"资源预估失败，直接启动: {e}"))
+            else:
+                self.preflight_queue.put((on_done, result, None))
+        threading.Thread(target=worker, daemon=True).start()
+
+    def start_calibration_job(self):
+        request = self.collect_training_request()
+        if request is None:
+            return
+        base_model_name, _, data_path, _ = request
+        self.submit_job(f"校准 {os.path.basename(base_model_name.rstrip('/'))}", "calibrate", memory_planner.calibrate,
+                        args=(base_model_name, data_path), kwargs={'on_event': EVENTS})
 
     def refresh_merge_model_list(self):
-        self.merge_refresh_button.config(state=tk.DISABLED)
-        self.merge_model_combobox.set("正在扫描本地已训练 LoRA 模型...")
-        models, error = get_existing_lora_dirs()
-        if error:
-            messagebox.showerror("错误", error)
-            self.merge_model_combobox.set("扫描失败")
-            self.merge_model_combobox['values'] = []
+        self.set_combobox_models(self.merge_model_combobox, self.catalog.lora_dirs(), "未找到本地已训练 LoRA 模型")
+        self.show_lora_metadata()
+
+    def show_lora_metadata(self):
+        metadata = self.catalog.lora_metadata(self.merge_model_combobox.get().strip())
+        if not metadata:
+            self.merge_model_info_label.config(text="")
+            return
+        loss = metadata.get('final_loss')
+        self.merge_model_info_label.config(text=(
+            f"基座: {metadata.get('base_model')} | r={metadata.get('lora_r')} | "
+            f"适配器大小: {metadata.get('adapter_size_bytes', 0) / 1e6:.1f} MB | 训练时间: {metadata.get('trained_at')} | "
+            f"最终 Loss: {loss if loss is not None else 'N/A'}"
+        ))
+
+    def refresh_all_model_lists(self):
+        self.refresh_model_lists()
+        self.refresh_merge_model_list()
+        self.refresh_inference_model_list()
+
+    def set_combobox_models(self, combobox, models, empty_text):
+        current = combobox.get().strip()
+        if (self.catalog_refreshing or self.catalog.is_empty) and not models:
+            combobox.set("正在扫描本地模型...")
+            combobox['values'] = []
         elif not models:
-            self.merge_model_combobox.set("未找到本地已训练 LoRA 模型")
-            self.merge_model_combobox['values'] = []
+            combobox.set(empty_text)
+            combobox['values'] = []
         else:
-            self.merge_model_combobox['values'] = models
-            self.merge_model_combobox.set(models[0])
-        self.merge_refresh_button.config(state=tk.NORMAL)
+            combobox['values'] = models
+            # 后台刷新后保留用户当前的选择
+            combobox.set(current if current in models else models[0])
 
-    def start_merge_and_import_thread(self):
-        if self.is_busy("合并"): return
+    def request_catalog_refresh(self):
+        if self.catalog_refreshing:
+            return
+        self.catalog_refreshing = True
+        for button in (self.model_refresh_button, self.merge_refresh_button, self.inference_refresh_button):
+            button.config(state=tk.DISABLED)
+        self.catalog.refresh_async(callback=self.catalog_queue.put)
+
+    def on_catalog_refreshed(self, seconds):
+        self.catalog_refreshing = False
+        for button in (self.model_refresh_button, self.merge_refresh_button, self.inference_refresh_button):
+            button.config(state=tk.NORMAL)
+        self.refresh_all_model_lists()
+        if seconds is not None:
+            self.status_label.config(text=f"状态: 模型列表已刷新 ({len(self.catalog.lora_dirs())} 个 LoRA, 用时 {seconds:.2f}s)")
 
+    def start_merge_and_import_thread(self):
         adapter_dir = self.merge_model_combobox.get().strip()
         if not adapter_dir or "扫描失败" in adapter_dir or "未找到" in adapter_dir:
             messagebox.showerror("错误", "请先选择一个有效的本地已训练 LoRA 模型进行合并！")
@@ -435,20 +670,220 @@ class MainApplication(tk.Frame):
         if not ollama_model_name:
             return
 
-        self.set_ui_busy(True)
-        self.clear_logs()
-        self.status_label.config(text="状态: 正在合并与导入模型...")
+        adapter_only = self.adapter_only_var.get()
+
+        def submit(_=None):
+            # 只导入适配器时不加载基座模型，按 CPU 上的转换任务调度
+            self.submit_job(
+                f"{'导入适配器' if adapter_only else '合并导入'} {ollama_model_name}",
+                "convert" if adapter_only else "merge", pipeline_api.merge,
+                args=(final_adapter_path, ollama_model_name),
+                kwargs={'adapter_only': adapter_only, 'on_event': EVENTS, 'cancel_event': CANCEL_EVENT}
+            )
+
+        def on_plan(plan):
+            summary = memory_planner.format_merge_plan(plan)
+            self.append_log(f"[资源预估] {summary}")
+            if plan['fits'] or messagebox.askokcancel("资源可能不足", f"{summary}\n\n仍要开始合并吗？"):
+                submit()
+
+        if adapter_only:
+            submit() # 只导入适配器，不加载完整模型
+            return
+        self.run_preflight(lambda: memory_planner.plan_merge(final_adapter_path, self.config.get("scratch_dir") or None),
+                           on_plan, on_error=submit)
 
-        self.active_thread = threading.Thread(
-            target=do_merge_and_import,
-            args=(final_adapter_path, ollama_model_name, self.status_queue.put),
-            daemon=True
+    def start_onnx_export_job(self):
+        model_dir = self.merge_model_combobox.get().strip()
+        if not self.catalog.lora_metadata(model_dir):
+            messagebox.showerror("错误", "请先选择一个有效的本地已训练 LoRA 模型进行导出！")
+            return
+        output_dir = filedialog.askdirectory(title="选择 ONNX 导出目录 (导出后刷新即可在推理页加载)")
+        if not output_dir:
+            return
+        quantize = messagebox.askyesno("int8 量化", "是否同时导出 int8 量化的模型？(体积约为 1/4，CPU 推理更快，精度略有下降)")
+        self.submit_job(
+            f"导出 ONNX {os.path.basename(model_dir)}", "convert", pipeline_api.export_onnx,
+            args=(model_dir, output_dir),
+            kwargs={'quantize': quantize, 'on_event': EVENTS}
         )
-        self.active_thread.start()
 
-    def start_convert_base_model_thread(self):
-        if self.is_busy("转换"): return
+    def start_evaluation_job(self):
+        model_dir = self.merge_model_combobox.get().strip()
+        if not self.catalog.lora_metadata(model_dir):
+            messagebox.showerror("错误", "请先选择一个有效的本地已训练 LoRA 模型进行评估！")
+            return
+        eval_path = filedialog.askopenfilename(
+            title="选择评估数据集 (与训练数据格式相同，不应包含训练样本)",
+            filetypes=(("JSONL files", "*.jsonl"), ("All files", "*.*"))
+        )
+        if not eval_path:
+            return
+        self.submit_job(
+            f"评估 {os.path.basename(model_dir)}", "eval", pipeline_api.evaluate,
+            args=(model_dir, eval_path),
+            kwargs={'on_event': EVENTS}
+        )
+
+    def start_compare_job(self):
+        model_dir = self.merge_model_combobox.get().strip()
+        if not self.catalog.lora_metadata(model_dir):
+            messagebox.showerror("错误", "请先选择一个有效的本地已训练 LoRA 模型进行对比！")
+            return
+        # 默认对比该 LoRA 上次合并导入 Ollama 时使用的模型名
+        default_name = ""
+        try:
+            with open(os.path.join(model_dir, "merge_manifest.json"), 'r', encoding='utf-8') as f:
+                default_name = json.load(f).get("ollama_model_name") or ""
+        except (OSError, ValueError):
+            pass
+        ollama_name = simpledialog.askstring("Ollama 模型", "要对比的 Ollama 模型名称 (如 my-model:latest):",
+                                             initialvalue=default_name, parent=self.parent)
+        if not ollama_name:
+            return
+        prompts_path = filedialog.askopenfilename(
+            title="选择对比用的提示数据 (与训练数据格式相同)",
+            filetypes=(("JSONL files", "*.jsonl"), ("All files", "*.*"))
+        )
+        if not prompts_path:
+            return
+        output_path = os.path.join(model_dir, f"compare_{ollama_name.replace(':', '_').replace('/', '_')}.jsonl")
+        self.submit_job(
+            f"对比 {os.path.basename(model_dir)} / {ollama_name}", "eval", pipeline_api.compare_models,
+            args=([model_dir, "ollama:" + ollama_name.strip()], prompts_path, output_path),
+            kwargs={'max_samples': 50, 'concurrency': 4, 'on_event': EVENTS, 'cancel_event': CANCEL_EVENT}
+        )
+
+    def show_compare_results(self, result):
+        lines = []
+        for model, summary in (result or {}).get('models', {}).items():
+            lines.append(f"{model}\n  延迟中位数 {summary['median_latency_seconds']:.2f}s, 首段文本 {summary['median_ttft_seconds']:.2f}s, "
+                         f"{summary['median_tokens_per_s']:.1f} tokens/s (并发 {summary['concurrency']}, 总吞吐 "
+                         f"{summary['aggregate_tokens_per_s']:.1f} tokens/s)")
+        messagebox.showinfo("对比结果", "\n".join(lines) + f"\n\n逐条回答: {(result or {}).get('output_path')}")
+
+    def show_eval_results(self, model_dir):
+        from eval_harness import EVAL_RESULTS_FILE
+        try:
+            with open(os.path.join(model_dir, EVAL_RESULTS_FILE), 'r', encoding='utf-8') as f:
+                results = json.load(f)
+        except (OSError, ValueError):
+            return
+        lines = []
+        for key in ('perplexity', 'exact_match', 'bleu4_char', 'rougeL_f'):
+            if key in results['adapter']:
+                lines.append(f"{key}: {results['adapter'][key]:.4f} (基座 {results['base'].get(key, float('nan')):.4f})")
+        messagebox.showinfo("评估结果", f"{results['adapter_dir']}\n\n" + "\n".join(lines))
+
+    def open_batch_import_dialog(self):
+        if self.batch_thread and self.batch_thread.is_alive():
+            self.batch_window.deiconify()
+            self.batch_window.lift()
+            return
+
+        models = self.catalog.lora_dirs()
+        if not models:
+            messagebox.showerror("错误", "未找到本地已训练 LoRA 模型")
+            return
+
+        if getattr(self, 'batch_window', None) is not None:
+            self.batch_window.destroy()
+        self.batch_window = tk.Toplevel(self.parent)
+        self.batch_window.title("批量导入 LoRA 到 Ollama")
+        self.batch_window.geometry("800x600")
+        # 关闭窗口只是隐藏，批量任务在后台继续运行
+        self.batch_window.protocol("WM_DELETE_WINDOW", self.batch_window.withdraw)
+
+        select_frame = ttk.LabelFrame(self.batch_window, text="1. 选择 LoRA 模型目录 (可多选)", padding="10")
+        select_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.batch_listbox = tk.Listbox(select_frame, selectmode=tk.EXTENDED, height=8)
+        self.batch_listbox.pack(fill=tk.BOTH, expand=True)
+        for model_dir in models:
+            self.batch_listbox.insert(tk.END, model_dir)
+        self.batch_listbox.select_set(0, tk.END)
+
+        options_frame = ttk.LabelFrame(self.batch_window, text="2. 选项", padding="10")
+        options_frame.pack(fill=tk.X, expand=False, padx=10, pady=5)
+        ttk.Label(options_frame, text="名称模板 ({name} {parent} {index}):").pack(side=tk.LEFT, padx=(0, 5))
+        self.batch_template_entry = ttk.Entry(options_frame, width=25)
+        self.batch_template_entry.insert(0, DEFAULT_NAME_TEMPLATE)
+        self.batch_template_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Label(options_frame, text="并发数:").pack(side=tk.LEFT, padx=(10, 5))
+        self.batch_workers_spinbox = ttk.Spinbox(options_frame, from_=1, to=8, width=4)
+        self.batch_workers_spinbox.set(2)
+        self.batch_workers_spinbox.pack(side=tk.LEFT, padx=5)
+        self.batch_adapter_only_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="仅导入适配器", variable=self.batch_adapter_only_var).pack(side=tk.LEFT, padx=10)
+
+        buttons_frame = ttk.Frame(self.batch_window)
+        buttons_frame.pack(fill=tk.X, expand=False, padx=10)
+        self.batch_start_button = ttk.Button(buttons_frame, text="开始批量导入", command=self.start_batch_import, style="Accent.TButton")
+        self.batch_start_button.pack(side=tk.LEFT, pady=5)
+        ttk.Button(buttons_frame, text="取消剩余任务", command=self.batch_cancel_event.set).pack(side=tk.LEFT, padx=10, pady=5)
+
+        table_frame = ttk.LabelFrame(self.batch_window, text="3. 任务状态", padding="10")
+        table_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        columns = ("model", "status", "elapsed", "message")
+        self.batch_table = ttk.Treeview(table_frame, columns=columns, show="headings", height=8)
+        for column, heading, width in zip(columns, ("Ollama 名称", "状态", "耗时", "最新消息"), (180, 70, 70, 400)):
+            self.batch_table.heading(column, text=heading)
+            self.batch_table.column(column, width=width, anchor='w')
+        self.batch_table.pack(fill=tk.BOTH, expand=True)
+
+    def start_batch_import(self):
+        selected = [self.batch_listbox.get(i) for i in self.batch_listbox.curselection()]
+        if not selected:
+            messagebox.showerror("错误", "请至少选择一个 LoRA 模型目录！", parent=self.batch_window)
+            return
+        template = self.batch_template_entry.get().strip() or DEFAULT_NAME_TEMPLATE
+        try:
+            jobs = [ImportJob(str(i), model_dir, render_model_name(template, model_dir, i))
+                    for i, model_dir in enumerate(selected, start=1)]
+            max_workers = int(self.batch_workers_spinbox.get())
+        except (KeyError, IndexError, ValueError) as e:
+            messagebox.showerror("错误", f"名称模板或并发数无效: {e}", parent=self.batch_window)
+            return
+
+        self.batch_table.delete(*self.batch_table.get_children())
+        for job in jobs:
+            self.batch_table.insert("", tk.END, iid=job.job_id, values=(job.ollama_model_name, job.status, "", job.adapter_dir))
+        self.batch_start_button.config(state=tk.DISABLED)
+        self.batch_cancel_event.clear()
+
+        importer = BatchImporter(
+            jobs,
+            adapter_only=self.batch_adapter_only_var.get(),
+            max_workers=max_workers,
+            update_callback=self.batch_update_queue.put,
+            cancel_event=self.batch_cancel_event
+        )
+
+        def run_batch():
+            summary = importer.run()
+            self.batch_update_queue.put(summary)
+
+        self.batch_thread = threading.Thread(target=run_batch, daemon=True)
+        self.batch_thread.start()
 
+    def drain_batch_updates(self):
+        latest_jobs = {}
+        summary = None
+        while not self.batch_update_queue.empty():
+            item = self.batch_update_queue.get_nowait()
+            if isinstance(item, ImportJob):
+                latest_jobs[item.job_id] = item
+            else:
+                summary = item
+        for job in latest_jobs.values():
+            if self.batch_table.exists(job.job_id):
+                self.batch_table.item(job.job_id, values=(job.ollama_model_name, job.status, f"{job.elapsed:.0f}s", job.message))
+        if summary is not None:
+            summary_text = format_summary(summary)
+            self.append_log(summary_text)
+            self.batch_start_button.config(state=tk.NORMAL)
+            messagebox.showinfo("批量导入完成", summary_text)
+
+    def start_convert_base_model_thread(self):
         current_model = self.model_select_combobox.get().strip()
         if "扫描失败" in current_model or "未找到" in current_model:
             current_model = ""
@@ -468,37 +903,16 @@ class MainApplication(tk.Frame):
         if not ollama_model_name:
             return
 
-        self.set_ui_busy(True)
-        self.clear_logs()
-        self.status_label.config(text=f"状态: 正在转换基座模型 {base_model_id}...")
-
-        self.active_thread = threading.Thread(
-            target=convert_base_model_to_ollama,
-            args=(base_model_id, ollama_model_name, self.status_queue.put),
-            daemon=True
+        self.submit_job(
+            f"转换 {base_model_id}", "convert", pipeline_api.export,
+            args=(base_model_id, ollama_model_name),
+            kwargs={'on_event': EVENTS, 'cancel_event': CANCEL_EVENT}
         )
-        self.active_thread.start()
 
     def refresh_inference_model_list(self):
-        self.inference_refresh_button.config(state=tk.DISABLED)
-        self.inference_model_combobox.set("正在扫描所有可用模型...")
-        
-        base_models, error1 = get_local_lora_base_models()
-        lora_models, error2 = get_existing_lora_dirs()
-        
-        all_models = []
-        if not error1:
-            all_models.extend(base_models)
-        if not error2:
-            all_models.extend(lora_models)
-
-        if not all_models:
-            self.inference_model_combobox.set("未找到任何可用模型")
-            self.inference_model_combobox['values'] = []
-        else:
-            self.inference_model_combobox['values'] = sorted(list(set(all_models)))
-            self.inference_model_combobox.set(all_models[0])
-        self.inference_refresh_button.config(state=tk.NORMAL)
+        all_models = sorted(set(self.catalog.base_models()) | set(self.catalog.lora_dirs()) | set(self.catalog.onnx_dirs())
+                            | set(self.catalog.ollama_models()))
+        self.set_combobox_models(self.inference_model_combobox, all_models, "未找到任何可用模型")
 
     def load_inference_model_thread(self):
         if self.is_busy("加载模型"): return
@@ -513,29 +927,94 @@ class MainApplication(tk.Frame):
         self.status_label.config(text=f"状态: 正在加载模型 {os.path.basename(model_path)}...")
         self.progress_bar.start()
 
-        self.active_thread = threading.Thread(
-            target=self.load_inference_model,
-            args=(model_path,),
-            daemon=True
-        )
-        self.active_thread.start()
-
-    def load_inference_model(self, model_path):
         adapter_path = os.path.join(model_path, "final_lora_adapter")
         if not os.path.exists(adapter_path):
             adapter_path = model_path
 
-        self.inference_model, self.inference_tokenizer = load_model_and_tokenizer(adapter_path, self.status_queue)
-        if self.inference_model is None:
-            self.status_queue.put("ERROR: 模型加载失败，请检查日志。")
-            self.share_model_button.config(state=tk.DISABLED) # Disable share button on failure
+        # 换模型时先结束旧的推理进程，释放显存 (调度器随后结束它的任务，释放资源)
+        if self.inference_worker is not None:
+            self.inference_worker.stop()
+        self.inference_model_name = os.path.basename(model_path)
+        self.inference_model_path = model_path
+        self.inference_adapter_path = adapter_path if adapter_path != model_path else None
+        worker = self.inference_worker = InferenceWorker(adapter_path)
+        self.active_thread = worker.load_request
+
+        # 加载的模型作为 'inference' 任务调度: 同时只加载一个；本地模型与训练等 GPU 任务争用 'train' 资源
+        import onnx_backend
+        import ollama_backend
+        resources = None
+        if onnx_backend.is_onnx_model_dir(adapter_path) or ollama_backend.is_ollama_model(adapter_path):
+            resources = {'inference': 1}
+        record = self.scheduler.submit(f"推理模型 {self.inference_model_name}", "inference", None, resources=resources,
+                                       make_dispatch=lambda record: self.inference_dispatch(),
+                                       on_finished=lambda record: self.on_inference_finished(record, worker),
+                                       start=lambda record: self.start_inference_worker(worker))
+        if record.status == QUEUED and self.scheduler.running():
+            self.status_label.config(text=f"状态: 等待 GPU 空闲后加载 {self.inference_model_name} (任务 #{record.job_id})...")
+        self.refresh_jobs_table()
+
+    def start_inference_worker(self, worker):
+        worker.start()
+        return worker
+
+    def inference_dispatch(self):
+        return {
+            'status': self.status_queue.put,
+            'loaded': self.on_inference_loaded,
+            'text': self.on_inference_text,
+            'chat_stats': self.on_chat_stats,
+            'response': self.on_inference_response,
+            'request_error': self.on_inference_request_error,
+            'error': lambda tb: self.status_queue.put(f"ERROR: 推理进程出错:\n{tb}"),
+            'exit': self.on_inference_worker_exit,
+        }
+
+    def on_inference_finished(self, record, worker):
+        """The inference job ended: the model was unloaded, replaced, failed to load, crashed or never started."""
+        if self.inference_worker is not worker:
+            return # 已换成别的模型，或失败已由 on_inference_loaded / on_inference_worker_exit 处理
+        self.inference_worker = None
+        if record.status == CANCELLED:
+            worker.load_request.done = True
+            self.set_ui_busy(False)
+            self.progress_bar.stop()
+            self.status_label.config(text=f"状态: 已卸载模型 {self.inference_model_name}"
+                                          if record.process_job is not None else "状态: 已取消加载模型")
+
+    def inference_ready(self):
+        return self.inference_worker is not None and self.inference_worker.loaded
+
+    def on_inference_loaded(self, ok):
+        if ok:
+            self.status_queue.put(f"SUCCESS: 模型 {self.inference_model_name} 加载成功！")
         else:
-            self.status_queue.put(f"SUCCESS: 模型 {os.path.basename(model_path)} 加载成功！")
-            self.share_model_button.config(state=tk.NORMAL) # Enable share button on success
+            self.inference_worker.stop()
+            self.inference_worker = None
+            self.status_queue.put("ERROR: 模型加载失败，请检查日志。")
+
+    def on_inference_text(self, payload):
+        _, text = payload
+        # 流式显示：回复标题在发送时已写入，之后直接追加
+        self.transcript.append_text(text)
+
+    def on_inference_request_error(self, payload):
+        self.transcript.abort_turn()
+        self.pending_turn_params = None
+        self.status_queue.put(f"ERROR: 生成失败: {payload[1]}")
+
+    def on_inference_response(self, payload):
+        request_id, user_message, response = payload
+        if user_message is not None: # 分享请求没有回复内容
+            self.response_queue.put((request_id, user_message, response))
+
+    def on_inference_worker_exit(self, message):
+        self.inference_worker = None
+        self.status_queue.put(f"ERROR: {message}")
 
     def start_gradio_share_thread(self):
         if self.is_busy("分享模型"): return
-        if self.inference_model is None or self.inference_tokenizer is None:
+        if not self.inference_ready():
             messagebox.showerror("错误", "请先成功加载一个模型才能分享！")
             return
 
@@ -546,17 +1025,12 @@ class MainApplication(tk.Frame):
         self.status_label.config(text="状态: 正在启动 Gradio 服务并分享模型...")
         self.progress_bar.start()
 
-        # Gradio 启动后会阻塞，所以必须在新线程中运行
-        self.active_thread = threading.Thread(
-            target=start_gradio_interface,
-            args=(self.inference_model, self.inference_tokenizer, system_prompt, self.status_queue.put),
-            daemon=True
-        )
-        self.active_thread.start()
+        # Gradio 服务在持有模型的推理进程中启动
+        self.active_thread = self.inference_worker.share(system_prompt)
 
     def send_message_thread(self):
         if self.is_busy("生成回复"): return
-        if self.inference_model is None:
+        if not self.inference_ready():
             messagebox.showerror("错误", "请先成功加载一个模型！")
             return
 
@@ -565,7 +1039,7 @@ class MainApplication(tk.Frame):
             messagebox.showwarning("警告", "请输入内容！")
             return
 
-        self.update_chat_display("user", user_message)
+        self.transcript.begin_turn(user_message)
         self.user_input_text.delete("1.0", tk.END)
 
         self.set_ui_busy(True)
@@ -574,24 +1048,186 @@ class MainApplication(tk.Frame):
 
         history_to_send = self.chat_history if self.context_mode_var.get() else []
         system_prompt = self.system_prompt_entry.get().strip()
-
-        self.active_thread = threading.Thread(
-            target=self.run_generation,
-            args=(system_prompt, user_message, history_to_send),
-            daemon=True
-        )
-        self.active_thread.start()
-
-    def run_generation(self, instruction, input_text, history):
-        response = generate_response(self.inference_model, self.inference_tokenizer, instruction, input_text, history)
-        self.response_queue.put((input_text, response))
+        context_budget, context_strategy = self.context_settings()
+        # 与回复一起保存到会话库 (InferenceWorker.generate 的默认温度与回复长度)
+        self.pending_turn_params = {'model': self.inference_model_path, 'system_prompt': system_prompt,
+                                    'temperature': 0.8, 'max_new_tokens': 1000,
+                                    'context_budget': context_budget if history_to_send else None,
+                                    'context_strategy': context_strategy if history_to_send else None}
+
+        self.active_thread = self.inference_worker.generate(system_prompt, user_message, history_to_send,
+                                                            context_budget=context_budget,
+                                                            context_strategy=context_strategy)
+
+    def context_settings(self):
+        """Context budget / strategy from the inference tab; saved to config.json when they change."""
+        try:
+            budget = max(256, int(self.context_budget_var.get()))
+        except (tk.TclError, ValueError):
+            budget = chat_context.DEFAULT_BUDGET
+        strategy = "summarize" if self.context_summarize_var.get() else "drop"
+        if (self.config.get("context_budget_tokens"), self.config.get("context_strategy")) != (budget, strategy):
+            self.config["context_budget_tokens"], self.config["context_strategy"] = budget, strategy
+            self.save_config()
+        return budget, strategy
+
+    def on_chat_stats(self, payload):
+        _, stats = payload
+        self.last_context_stats = stats
+        self.update_context_stats_label()
+
+    def update_context_stats_label(self):
+        parts = []
+        typed = self.user_input_text.get("1.0", tk.END).strip()
+        if typed:
+            parts.append(f"当前输入约 {chat_context.estimate_tokens(typed)} tokens")
+        stats = self.last_context_stats
+        if stats:
+            window = f"上一轮提示 {stats['prompt_tokens']}/{stats['budget']} tokens (保留 {stats['kept_turns']} 轮"
+            if stats['dropped_turns']:
+                window += f"，{'摘要' if stats['summarized'] else '移出'}更早的 {stats['dropped_turns']} 轮"
+            parts.append(window + ")")
+            parts.append(f"预填充 {stats['prefill_seconds']:.2f}s")
+            parts.append(f"生成 {stats['new_tokens']} tokens / {stats['seconds']:.1f}s")
+        self.context_stats_label.config(text=" · ".join(parts))
 
     def clear_chat_history(self):
+        if self.is_busy("生成回复"): return
         self.chat_history = []
-        self.chat_history_text.config(state='normal')
-        self.chat_history_text.delete(1.0, tk.END)
-        self.chat_history_text.config(state='disabled')
-        messagebox.showinfo("操作成功", "对话历史已清空。")
+        self.chat_session_id = None
+        self.transcript.clear()
+        self.last_context_stats = None
+        self.update_context_stats_label()
+        messagebox.showinfo("操作成功", "已开始新会话，之前的对话已保存在“历史会话”中。")
+
+    def save_chat_turn(self, user_message, model_response):
+        """Stores a finished turn in the current session (created on its first turn); False if that failed."""
+        stats = self.last_context_stats or {}
+        try:
+            if self.chat_session_id is None:
+                self.chat_session_id = self.chat_store.create_session(
+                    " ".join(user_message.split()), self.inference_model_path, self.inference_adapter_path)
+                self.transcript.attach(*self.chat_session_source(self.chat_session_id))
+            self.chat_store.add_turn(self.chat_session_id, user_message, model_response,
+                                     params=self.pending_turn_params, stats=stats)
+            return True
+        except sqlite3.Error as e:
+            self.append_log(f"保存对话失败: {e}")
+            return False
+
+    def chat_session_source(self, session_id):
+        """(fetch, count) of a stored session for TranscriptView."""
+        return (lambda offset, limit: self.chat_store.turns(session_id, offset, limit),
+                lambda: self.chat_store.turn_count(session_id))
+
+    def open_chat_session(self, session_id, position=None):
+        if self.is_busy("生成回复"): return
+        self.chat_session_id = session_id
+        self.chat_history = self.chat_store.history(session_id)
+        self.transcript.set_source(*self.chat_session_source(session_id), position=position)
+        self.last_context_stats = None
+        self.update_context_stats_label()
+        session = self.chat_store.session(session_id)
+        if session and session['model'] and session['model'] != self.inference_model_path:
+            self.append_log(f"会话 “{session['title']}” 使用的模型是 {session['model']}，继续对话将使用当前加载的模型。")
+
+    def open_chat_sessions_dialog(self):
+        window = tk.Toplevel(self.parent)
+        window.title("历史会话")
+        window.geometry("760x480")
+
+        search_frame = ttk.Frame(window, padding="10")
+        search_frame.pack(fill=tk.X)
+        ttk.Label(search_frame, text="搜索:").pack(side=tk.LEFT)
+        query_var = tk.StringVar()
+        query_entry = ttk.Entry(search_frame, textvariable=query_var)
+        query_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+
+        table_frame = ttk.Frame(window, padding=(10, 0))
+        table_frame.pack(fill=tk.BOTH, expand=True)
+        columns = ("title", "model", "turns", "updated")
+        table = ttk.Treeview(table_frame, columns=columns, show="headings")
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=table.yview)
+        table.configure(yscrollcommand=scrollbar.set)
+        table.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        rows = {}  # Treeview 行 -> (会话 id, 轮次)
+
+        def show_sessions():
+            table.delete(*table.get_children())
+            rows.clear()
+            for heading, column, width in (("标题", "title", 300), ("模型", "model", 220), ("轮数", "turns", 60),
+                                           ("更新时间", "updated", 140)):
+                table.heading(column, text=heading)
+                table.column(column, width=width, anchor='w')
+            for session in self.chat_store.sessions():
+                item = table.insert("", tk.END, values=(
+                    session['title'], os.path.basename(session['model'] or ""), session['turn_count'],
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(session['updated_at']))))
+                rows[item] = (session['id'], None)
+
+        def show_search_results(*_):
+            query = query_var.get().strip()
+            if not query:
+                show_sessions()
+                return
+            table.delete(*table.get_children())
+            rows.clear()
+            for heading, column, width in (("会话", "title", 180), ("匹配内容", "model", 400), ("轮次", "turns", 50),
+                                           ("时间", "updated", 130)):
+                table.heading(column, text=heading)
+                table.column(column, width=width, anchor='w')
+            for hit in self.chat_store.search(query):
+                item = table.insert("", tk.END, values=(
+                    hit['title'], " ".join(hit['snippet'].split()), hit['position'] + 1,
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(hit['created_at']))))
+                rows[item] = (hit['session_id'], hit['position'])
+
+        def selected():
+            selection = table.selection()
+            return rows.get(selection[0]) if selection else None
+
+        def open_selected(*_):
+            target = selected()
+            if target is not None:
+                self.open_chat_session(*target)
+                window.destroy()
+
+        def delete_selected():
+            target = selected()
+            if target is None or (target[0] == self.chat_session_id and self.is_busy("生成回复")):
+                return
+            if not messagebox.askyesno("确认", "删除这个会话的全部对话？", parent=window):
+                return
+            self.chat_store.delete_session(target[0])
+            if target[0] == self.chat_session_id:
+                self.chat_session_id = None
+                self.chat_history = []
+                self.transcript.clear()
+            show_search_results()
+
+        def rename_selected():
+            target = selected()
+            if target is None:
+                return
+            title = simpledialog.askstring("重命名", "新的会话标题:", parent=window)
+            if title and title.strip():
+                self.chat_store.rename_session(target[0], title.strip())
+                show_search_results()
+
+        query_entry.bind("<Return>", show_search_results)
+        ttk.Button(search_frame, text="搜索", command=show_search_results).pack(side=tk.LEFT)
+        table.bind("<Double-1>", open_selected)
+
+        buttons_frame = ttk.Frame(window, padding="10")
+        buttons_frame.pack(fill=tk.X)
+        ttk.Button(buttons_frame, text="打开", command=open_selected, style="Accent.TButton").pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="重命名", command=rename_selected).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons_frame, text="删除", command=delete_selected).pack(side=tk.LEFT, padx=5)
+        ttk.Label(buttons_frame, text="双击打开；搜索匹配所有会话中的消息", foreground="gray").pack(side=tk.RIGHT)
+
+        show_sessions()
+        query_entry.focus_set()
 
     def browse_llama_cpp_path(self):
         dir_path = filedialog.askdirectory(title="选择 llama.cpp 仓库的根目录")
@@ -599,33 +1235,28 @@ class MainApplication(tk.Frame):
             self.llama_cpp_path_entry.delete(0, tk.END)
             self.llama_cpp_path_entry.insert(0, dir_path)
 
+    def browse_scratch_dir(self):
+        dir_path = filedialog.askdirectory(title="选择用于临时合并模型的高速目录")
+        if dir_path:
+            self.scratch_dir_entry.delete(0, tk.END)
+            self.scratch_dir_entry.insert(0, dir_path)
+
     def save_settings(self):
         self.config["llama_cpp_path"] = self.llama_cpp_path_entry.get().strip()
+        self.config["scratch_dir"] = self.scratch_dir_entry.get().strip()
+        self.config["profiling"] = [mode for mode, var in self.profiling_vars.items() if var.get()]
+        profiling.set_modes(self.config["profiling"])
         self.save_config()
         messagebox.showinfo("成功", "设置已保存！")
 
     def periodic_check(self):
-        # Check training progress queue
-        while not self.progress_queue.empty():
-            data = self.progress_queue.get_nowait()
-            if 'error' in data:
-                messagebox.showerror("训练失败", f"发生错误: {data['error']}")
-                self.set_ui_busy(False)
-                return
+        # Poll scheduled jobs (bounded per tick) and start queued jobs whose resources are free
+        self.scheduler.tick()
+        # 状态变化时立即刷新任务列表；有任务运行时每秒刷新一次耗时
+        if self.scheduler.changed or (self.scheduler.running() and time.time() - self.jobs_table_refreshed_at > 1.0):
+            self.refresh_jobs_table()
 
-            self.progress_bar.stop()
-            self.progress_bar['value'] = data['progress']
-            loss = data.get('loss', 'N/A')
-            eta_seconds = data.get('eta_seconds', float('inf'))
-            eta_str = "计算中..." if eta_seconds == float('inf') else time.strftime('%H:%M:%S', time.gmtime(eta_seconds))
-            status_text = f"进度: {data['progress']:.2f}% | 当前 Loss: {loss} | 预计剩余时间: {eta_str}"
-            self.status_label.config(text=status_text)
-            
-            if data.get('done'):
-                messagebox.showinfo("成功", "训练已成功完成！")
-                self.set_ui_busy(False)
-
-        # Check general status queue (for merge, convert, model loading)
+        # Check general status queue (for model loading, generation, sharing)
         while not self.status_queue.empty():
             log_entry = self.status_queue.get_nowait()
             # 注意：不要在这里调用self.append_log，因为在某些条件下会重复添加
@@ -660,22 +1291,186 @@ class MainApplication(tk.Frame):
                 # 其他消息也添加到日志中
                 self.append_log(log_entry)
 
+        # Check subprocess progress queue (GGUF conversion, Ollama import)
+        latest_event = None
+        while not self.task_progress_queue.empty():
+            latest_event = self.task_progress_queue.get_nowait()
+        if latest_event is not None:
+            self.update_task_progress(latest_event)
+
         # Check inference response queue
         while not self.response_queue.empty():
-            user_message, model_response = self.response_queue.get_nowait()
-            self.update_chat_display("model", model_response)
+            _, user_message, model_response = self.response_queue.get_nowait()
+            # 先保存再结束这一轮：之后滚动时已渲染的轮次会从会话库中重新读取
+            stored = self.save_chat_turn(user_message, model_response)
+            self.transcript.finish_turn(model_response, stored=stored)
+            self.pending_turn_params = None
             if self.context_mode_var.get():
                 self.chat_history.append((user_message, model_response))
             self.set_ui_busy(False)
             self.progress_bar.stop()
             self.status_label.config(text="状态: 空闲")
 
-        # Check log queue
-        while not self.log_queue.empty():
-            self.append_log(self.log_queue.get_nowait())
+        # Check background catalog refresh
+        while not self.catalog_queue.empty():
+            self.on_catalog_refreshed(self.catalog_queue.get_nowait())
+        while not self.preflight_queue.empty():
+            callback, result, message = self.preflight_queue.get_nowait()
+            if message:
+                self.append_log(message)
+            callback(result)
+
+        # Check batch import updates
+        if not self.batch_update_queue.empty():
+            self.drain_batch_updates()
 
         self.parent.after(100, self.periodic_check)
 
+    def update_task_progress(self, event):
+        self.progress_bar.stop()
+        self.progress_bar.config(mode="determinate")
+        self.progress_bar['value'] = event['progress']
+        stage_name = {"convert": "GGUF 转换", "import": "Ollama 导入"}.get(event.get('stage'), "任务")
+        if event['kind'] == 'bytes':
+            detail = f"{event['bytes_written'] / 1e9:.2f}/{event['bytes_total'] / 1e9:.2f} GB"
+        elif event['kind'] in ('tensor', 'part'):
+            detail = f"{event['current']}/{event['total']}"
+        else:
+            detail = ""
+        self.status_label.config(text=f"状态: {stage_name} {event['progress']:.1f}% {detail}")
+
+    # --- Scheduled jobs (training, merge, convert) ---
+    def submit_job(self, name, kind, target, args=(), kwargs=None):
+        record = self.scheduler.submit(name, kind, target, args, kwargs, make_dispatch=self.make_job_dispatch,
+                                       on_finished=self.on_job_finished)
+        if self.scheduler.running() or len(self.scheduler.queued()) > 1:
+            self.append_log(f"[{name}] 已加入任务队列 (#{record.job_id})")
+        self.status_label.config(text=f"状态: 任务已提交: {name}")
+        self.refresh_jobs_table()
+        return record
+
+    def make_job_dispatch(self, record):
+        """Routes one job's channel messages; several jobs can run at once, so log lines get the job name."""
+        prefix = f"[{record.name}]"
+
+        def on_status(entry):
+            self.append_log(f"{prefix} {entry}")
+            self.status_label.config(text=f"状态: {prefix} {entry}")
+            if "ERROR:" in entry:
+                record.mark_failed(entry)
+
+        def on_progress(data):
+            if 'error' in data:
+                record.mark_failed(data['error'])
+                return
+            if 'eval_loss' in data:
+                best = data.get('best_eval_loss')
+                self.append_log(f"{prefix} 第 {data.get('step')} 步验证损失: {data['eval_loss']:.4f}"
+                                + (f" (最佳 {best:.4f})" if best is not None else ""))
+                return
+            self.progress_bar.stop()
+            self.progress_bar['value'] = data['progress']
+            loss = data.get('loss', 'N/A')
+            eta_seconds = data.get('eta_seconds', float('inf'))
+            eta_str = "计算中..." if eta_seconds == float('inf') else time.strftime('%H:%M:%S', time.gmtime(eta_seconds))
+            # 数据并行训练时附带所有进程汇总的吞吐量
+            parallel = f" | {data['world_size']} 进程 {data['tokens_per_s']:.0f} tokens/s" if 'world_size' in data else ""
+            self.status_label.config(text=f"{prefix} 进度: {data['progress']:.2f}% | 当前 Loss: {loss} | 预计剩余时间: {eta_str}{parallel}")
+
+        self.append_log(f"{prefix} 开始运行")
+        return {
+            'progress': on_progress,
+            'log': lambda line: self.append_log(f"{prefix} {line}"),
+            'status': on_status,
+            'task_progress': self.task_progress_queue.put,
+            'error': lambda tb: record.mark_failed(f"子进程任务失败:\n{tb}"),
+            'exit': record.mark_failed,
+        }
+
+    def on_job_finished(self, record):
+        self.append_log(f"[{record.name}] {record.status} (用时 {record.duration:.0f}s)")
+        self.progress_bar.stop()
+        if record.status == SUCCEEDED and record.target is pipeline_api.compare_models:
+            self.show_compare_results(record.process_job.result if record.process_job is not None else None)
+        elif record.status == SUCCEEDED and record.kind == 'eval':
+            self.show_eval_results(record.args[0])
+        elif record.status == SUCCEEDED and record.kind == 'calibrate':
+            result = record.process_job.result if record.process_job is not None else None
+            messagebox.showinfo("校准完成", (result or {}).get('summary', "校准结果已保存，之后启动训练时会用于预估。"))
+        elif record.status == SUCCEEDED:
+            messagebox.showinfo("成功", f"任务已完成: {record.name}")
+            if record.kind in ('train', 'merge', 'convert'):
+                self.request_catalog_refresh() # 让新训练的 LoRA / 导出的 ONNX 模型出现在模型列表中
+        elif record.status == CANCELLED:
+            self.status_label.config(text=f"状态: 任务已取消: {record.name}")
+        else:
+            messagebox.showerror("失败", f"任务失败: {record.name}\n{(record.error or '')[-1500:]}")
+        if not self.scheduler.running():
+            self.status_label.config(text="状态: 空闲")
+
+    def refresh_jobs_table(self):
+        self.scheduler.changed = False
+        self.jobs_table_refreshed_at = time.time()
+        selected = self.jobs_table.selection()
+        self.jobs_table.delete(*self.jobs_table.get_children())
+        for record in reversed(self.scheduler.records):
+            status = record.status
+            if status == RUNNING and record.process_job.paused:
+                status = "已暂停"
+            submitted = time.strftime('%m-%d %H:%M:%S', time.localtime(record.submitted_at)) if record.submitted_at else ""
+            error = (record.error or "").strip().splitlines()[-1:] or [""]
+            self.jobs_table.insert("", tk.END, iid=str(record.job_id), values=(
+                record.job_id, record.name, record.kind, record.priority, status, submitted,
+                f"{record.duration:.0f}s" if record.started_at else "", error[0]
+            ))
+        existing = [iid for iid in selected if self.jobs_table.exists(iid)]
+        if existing:
+            self.jobs_table.selection_set(existing)
+
+    def selected_job(self):
+        selection = self.jobs_table.selection()
+        if not selection:
+            messagebox.showwarning("警告", "请先在任务列表中选择一个任务。")
+            return None
+        return self.scheduler.get(int(selection[0]))
+
+    def cancel_selected_job(self):
+        record = self.selected_job()
+        if record is None or record.status not in (QUEUED, RUNNING):
+            return
+        # 运行中的任务先协作取消，超时后强制结束子进程
+        self.scheduler.cancel(record.job_id)
+        self.status_label.config(text=f"状态: 正在取消 {record.name}...")
+        self.refresh_jobs_table()
+
+    def toggle_pause_selected_job(self):
+        record = self.selected_job()
+        if record is None or record.status != RUNNING:
+            return
+        job = record.process_job
+        if job.paused:
+            job.resume()
+            self.status_label.config(text=f"状态: 已恢复 {record.name}")
+        else:
+            job.pause()
+            self.status_label.config(text=f"状态: 已暂停 {record.name} (当前训练步结束后生效)")
+        self.refresh_jobs_table()
+
+    def change_selected_job_priority(self, delta):
+        record = self.selected_job()
+        if record is None or record.status != QUEUED:
+            return
+        self.scheduler.set_priority(record.job_id, record.priority + delta)
+        self.refresh_jobs_table()
+
+    def on_close(self):
+        # 干净地结束所有子进程，避免残留的训练/推理进程继续占用显存
+        self.scheduler.shutdown()
+        self.executor.shutdown()
+        if self.inference_worker is not None:
+            self.inference_worker.stop()
+        self.parent.destroy()
+
     def is_busy(self, task_name="任务"):
         is_alive = self.active_thread and self.active_thread.is_alive()
         if is_alive:
@@ -703,5 +1498,7 @@ if __name__ == "__main__":
     except tk.TclError:
         print("Azure theme not found, using default.")
 
-    MainApplication(root).pack(side="top", fill="both", expand=True)
+    app = MainApplication(root)
+    app.pack(side="top", fill="both", expand=True)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
     root.mainloop()
\ No newline at end of file
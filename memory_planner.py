@@ -0,0 +1,487 @@
+"""
+Pre-flight memory and time planner for training and merge jobs.
+
+Training OOMs tend to happen minutes in, after the dataset is mapped and the model quantized; a merge can
+run out of memory halfway. The planner estimates the peak up front from:
+
+- the base model's config.json (parameter counts per layer, vocabulary, hidden sizes),
+- the LoRA settings (r, target modules) or an existing adapter's adapter_config.json,
+- the token-length distribution of a sample of the training data (chat template included),
+- the batch size, max_length, 4-bit / bf16 and the number of data-parallel processes,
+
+split into weights, LoRA parameters, optimizer states, activations and logits, and compares it with the
+free GPU memory (nvidia-smi) or RAM. When it does not fit, it proposes overrides that do (4-bit, smaller
+per-device batch with more gradient accumulation so the effective batch stays the same, shorter
+max_length, gradient checkpointing is implied by 4-bit).
+
+The expected training time needs a calibration: `calibrate` runs a few real training steps, measures
+seconds per token and the actual peak memory, and stores them in planner_calibration.json. Later plans
+for the same model and device use the measured speed and scale their memory estimate by the measured /
+estimated ratio. Merges record their own timings there as well.
+
+Heavy libraries are not imported: the plan only needs the tokenizer (transformers) and nvidia-smi, so the
+GUI can run it before it launches a job.
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import model_registry
+
+CALIBRATION_FILE = "planner_calibration.json"
+SAMPLE_ROWS = 2000
+CALIBRATION_STEPS = 6
+# 可用内存中留给碎片与其他进程的余量
+USABLE_FRACTION = 0.9
+CUDA_CONTEXT_BYTES = 512 * 1024 ** 2
+FRAGMENTATION = 1.1
+# bitsandbytes nf4: 每个参数 4 bit，另加每 64 个参数一个分块缩放因子
+NF4_BYTES_PER_PARAM = 0.5 * (1 + 4 / 64)
+GIB = 1024 ** 3
+
+
+# --- Inputs ---
+def load_model_config(model_name):
+    """config.json of a local model directory or a Hugging Face model (from the hub cache if downloaded)."""
+    config = model_registry.get_config_dict(model_name)
+    # 多模态模型的语言部分在 text_config 中
+    return dict(config, **config.get('text_config', {}))
+
+
+def model_shape(config):
+    hidden = config['hidden_size']
+    heads = config['num_attention_heads']
+    head_dim = config.get('head_dim') or hidden // heads
+    return {
+        'hidden_size': hidden,
+        'intermediate_size': config.get('intermediate_size', 4 * hidden),
+        'num_layers': config['num_hidden_layers'],
+        'num_heads': heads,
+        'num_kv_heads': config.get('num_key_value_heads', heads),
+        'head_dim': head_dim,
+        'vocab_size': config['vocab_size'],
+        'tied_embeddings': config.get('tie_word_embeddings', False),
+    }
+
+
+def linear_shapes(shape):
+    """(in_features, out_features) of the projections of one decoder layer, by module name."""
+    h, i = shape['hidden_size'], shape['intermediate_size']
+    q, kv = shape['num_heads'] * shape['head_dim'], shape['num_kv_heads'] * shape['head_dim']
+    return {'q_proj': (h, q), 'k_proj': (h, kv), 'v_proj': (h, kv), 'o_proj': (q, h),
+            'gate_proj': (h, i), 'up_proj': (h, i), 'down_proj': (i, h)}
+
+
+def parameter_counts(shape, lora_r=16, target_modules=()):
+    """Parameters of the decoder projections, of everything else (embeddings, head, norms) and of the LoRA."""
+    layers = shape['num_layers']
+    projections = linear_shapes(shape)
+    linear = layers * sum(n_in * n_out for n_in, n_out in projections.values())
+    embeddings = shape['vocab_size'] * shape['hidden_size'] * (1 if shape['tied_embeddings'] else 2)
+    other = embeddings + (2 * layers + 1) * shape['hidden_size']
+    lora = layers * sum(lora_r * (n_in + n_out) for name, (n_in, n_out) in projections.items() if name in target_modules)
+    return {'linear': linear, 'other': other, 'total': linear + other, 'lora': lora}
+
+
+def count_rows(path):
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def _sample_records(path, sample_rows):
+    """About `sample_rows` records spread evenly over the file."""
+    total = count_rows(path)
+    step = max(1, total // sample_rows)
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        index = 0
+        for line in f:
+            if not line.strip():
+                continue
+            if index % step == 0 and len(records) < sample_rows:
+                records.append(json.loads(line))
+            index += 1
+    return records, total
+
+
+def length_distribution(data_path, tokenizer, max_length, sample_rows=SAMPLE_ROWS):
+    """
+    Token lengths (chat template included, before truncation) of a sample of the training data, plus the
+    number of rows. Plain text trains on full max_length windows.
+    """
+    import data_mixing
+    import pretrain_data
+
+    mixture = data_mixing.parse_mixture(data_path)
+    paths = [path for path, _ in mixture] if mixture else [data_path]
+    if any(pretrain_data.is_text_data(path) for path in paths):
+        tokens = 0
+        for path in paths:
+            if path.lower().endswith(pretrain_data.TOKEN_FILE_SUFFIX):
+                tokens += pretrain_data.read_token_meta(path)['num_tokens']
+            else:
+                # 未分词的语料按约 3 字节一个 token 粗略估计
+                tokens += sum(os.path.getsize(f) for f in pretrain_data.list_text_files(path)) // 3
+        return {'rows': max(1, tokens // max_length), 'mean': max_length, 'p50': max_length, 'p95': max_length,
+                'max': max_length, 'over_length': 0.0, 'sampled': 0}
+
+    lengths, rows = [], 0
+    for path in paths:
+        records, total = _sample_records(path, max(1, sample_rows // len(paths)))
+        rows += total
+        conversations = [[{"role": "system", "content": record.get('instruction') or ""},
+                          {"role": "user", "content": record.get('input') or ""},
+                          {"role": "assistant", "content": record.get('output') or ""}] for record in records]
+        lengths.extend(len(ids) for ids in model_registry.encode_chats(tokenizer, conversations))
+    if not lengths:
+        raise ValueError(f"训练数据为空: {data_path}")
+    lengths.sort()
+
+    def percentile(fraction):
+        return lengths[min(len(lengths) - 1, int(fraction * len(lengths)))]
+
+    truncated = [min(length, max_length) for length in lengths]
+    return {'rows': rows, 'mean': sum(truncated) / len(truncated), 'p50': percentile(0.5), 'p95': percentile(0.95),
+            'max': lengths[-1], 'over_length': sum(1 for length in lengths if length > max_length) / len(lengths),
+            'sampled': len(lengths)}
+
+
+def available_memory():
+    """Free memory of the training device: the first GPU (via nvidia-smi, no torch import) or RAM."""
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", "--query-gpu=name,memory.total,memory.free", "--format=csv,noheader,nounits"],
+            capture_output=True, text=True, timeout=10, check=True).stdout
+        name, total, free = [part.strip() for part in output.strip().splitlines()[0].split(",")]
+        return {'device': "cuda", 'name': name, 'total_bytes': int(total) * 1024 ** 2,
+                'free_bytes': int(free) * 1024 ** 2}
+    except (OSError, subprocess.SubprocessError, ValueError, IndexError):
+        pass
+    return dict(system_memory(), device="cpu", name="CPU")
+
+
+def system_memory():
+    total = free = None
+    try:
+        with open("/proc/meminfo", 'r', encoding='utf-8') as f:
+            info = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in f}
+        total, free = info['MemTotal'], info.get('MemAvailable', info['MemFree'])
+    except (OSError, KeyError, ValueError, IndexError):
+        try:
+            total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+            free = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+        except (ValueError, OSError, AttributeError):
+            pass
+    return {'total_bytes': total, 'free_bytes': free}
+
+
+# --- Calibration store ---
+def _calibration_key(base_model_name, device, load_in_4bit, bf16):
+    return f"{base_model_name}|{device}|4bit={bool(load_in_4bit)}|bf16={bool(bf16)}"
+
+
+def load_calibrations(path=CALIBRATION_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _store_calibration(section, key, entry, path=CALIBRATION_FILE):
+    calibrations = load_calibrations(path)
+    calibrations.setdefault(section, {})[key] = dict(entry, measured_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(calibrations, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+# --- Training ---
+def estimate_training_memory(shape, hp, lengths, device="cuda"):
+    """
+    Peak bytes per training process, by component. Mirrors start_training: the model is loaded in float32
+    unless quantized; 4-bit loading goes through prepare_model_for_kbit_training, which keeps the remaining
+    parameters in float32 and turns on gradient checkpointing.
+    """
+    load_in_4bit = device == "cuda" if hp['load_in_4bit'] is None else hp['load_in_4bit']
+    bf16 = device == "cuda" if hp['bf16'] is None else hp['bf16']
+    params = parameter_counts(shape, hp['lora_r'], hp['target_modules'])
+    h, i, layers = shape['hidden_size'], shape['intermediate_size'], shape['num_layers']
+
+    if load_in_4bit:
+        weights = params['linear'] * NF4_BYTES_PER_PARAM + params['other'] * 4
+    else:
+        weights = params['total'] * 4
+    # LoRA 参数 fp32: 参数 + 梯度 + AdamW 的两个动量
+    lora = params['lora'] * 4 * 2
+    optimizer = params['lora'] * 4 * 2
+
+    # DataCollatorForSeq2Seq 按批次内最长样本补齐，峰值出现在含最长样本的批次
+    batch = hp['per_device_train_batch_size']
+    seq = min(hp['max_length'], lengths['max'])
+    element = 2 if bf16 else 4
+    # 每层保存的激活 (注意力输入/输出、QKV、MLP 中间结果等，SDPA 不保存注意力矩阵)
+    per_layer = batch * seq * (10 * h + 4 * i) * element
+    if load_in_4bit:
+        # 梯度检查点: 每层只保留输入，反向时重算一层
+        activations = layers * batch * seq * h * element + per_layer
+    else:
+        activations = layers * per_layer
+    # logits 被转换为 float32，交叉熵的梯度同样大小
+    logits = batch * seq * shape['vocab_size'] * 4 * 2
+    peak = (weights + lora + optimizer + activations + logits) * FRAGMENTATION
+    if device == "cuda":
+        peak += CUDA_CONTEXT_BYTES
+    return {'weights': weights, 'lora_params': lora, 'optimizer': optimizer, 'activations': activations,
+            'logits': logits, 'peak': peak, 'load_in_4bit': load_in_4bit, 'bf16': bf16,
+            'gradient_checkpointing': load_in_4bit, 'peak_sequence_length': seq,
+            'lora_parameter_count': params['lora'], 'parameter_count': params['total']}
+
+
+def training_tokens(hp, lengths, num_processes=1):
+    """Tokens the whole run trains on (all processes together) and the number of optimizer steps."""
+    rows = hp['mix_samples'] or lengths['rows']
+    rows = rows * (1 - hp['eval_split']) if hp['eval_split'] and rows >= 10 else rows
+    samples_per_step = hp['per_device_train_batch_size'] * hp['gradient_accumulation_steps'] * num_processes
+    steps = hp['max_steps'] if hp['max_steps'] > 0 else max(1, int(rows * hp['num_train_epochs'] / samples_per_step))
+    return steps * samples_per_step * lengths['mean'], steps
+
+
+def suggest_training_overrides(shape, hp, lengths, device, budget):
+    """Overrides (a dict) under which the estimate fits `budget` bytes, or None when none was found."""
+    overrides = {}
+
+    def fits(candidate):
+        return estimate_training_memory(shape, dict(hp, **candidate), lengths, device)['peak'] <= budget
+
+    if device == "cuda" and hp['load_in_4bit'] is False:
+        overrides['load_in_4bit'] = True
+        if fits(overrides):
+            return overrides
+    # 减小每卡批大小并相应增加梯度累积，等效批大小不变
+    batch, accumulation = hp['per_device_train_batch_size'], hp['gradient_accumulation_steps']
+    while batch > 1:
+        batch //= 2
+        accumulation *= 2
+        overrides.update(per_device_train_batch_size=batch, gradient_accumulation_steps=accumulation)
+        if fits(overrides):
+            return overrides
+    # 最后缩短 max_length (以 2 的幂递减，不低于 128)
+    max_length = hp['max_length']
+    while max_length > 128:
+        max_length //= 2
+        overrides['max_length'] = max_length
+        if fits(overrides):
+            return overrides
+    return None
+
+
+def plan_training(base_model_name, data_path, hyperparams=None, num_processes=1, lora_adapter_path=None,
+                  tokenizer=None, memory=None):
+    """
+    Memory / time plan of a training run, same arguments as pipeline_api.train. Returns a dict with the
+    estimate, the available memory, 'fits', 'suggestion' (hyperparameter overrides, or None), the expected
+    step / total time when a calibration exists, and 'warnings'.
+    """
+    from train_core import resolve_hyperparams
+
+    hp = resolve_hyperparams(hyperparams)
+    if lora_adapter_path:
+        adapter = model_registry.get_adapter_config(lora_adapter_path)
+        hp['lora_r'] = adapter.get('r', hp['lora_r'])
+        hp['target_modules'] = adapter.get('target_modules') or hp['target_modules']
+    shape = model_shape(load_model_config(base_model_name))
+    if tokenizer is None:
+        tokenizer = model_registry.get_tokenizer(base_model_name)
+    lengths = length_distribution(data_path, tokenizer, hp['max_length'])
+    memory = memory or available_memory()
+    device = memory['device']
+    estimate = estimate_training_memory(shape, hp, lengths, device)
+
+    calibration = load_calibrations().get('training', {}).get(
+        _calibration_key(base_model_name, device, estimate['load_in_4bit'], estimate['bf16']))
+    ratio = 1.0
+    if calibration and calibration.get('measured_peak_bytes') and calibration.get('estimated_peak_bytes'):
+        ratio = calibration['measured_peak_bytes'] / calibration['estimated_peak_bytes']
+    # CPU 上多个进程共享同一块内存
+    processes_on_device = num_processes if device == "cpu" else 1
+    peak = estimate['peak'] * ratio * processes_on_device
+    budget = (memory['free_bytes'] or 0) * USABLE_FRACTION
+    fits = not memory['free_bytes'] or peak <= budget
+
+    warnings = []
+    if lengths['over_length']:
+        warnings.append(f"{lengths['over_length']:.1%} 的样本超过 max_length={hp['max_length']}，将被截断 "
+                        f"(最长 {lengths['max']} tokens)；可先用 dedup 预处理丢弃它们")
+    suggestion = None
+    if not fits:
+        suggestion = suggest_training_overrides(shape, hp, lengths, device, budget / ratio / processes_on_device)
+        if suggestion is None:
+            warnings.append("即使使用 4-bit、批大小 1 与更短的 max_length 也无法装入可用内存")
+
+    tokens, steps = training_tokens(hp, lengths, num_processes)
+    plan = {'base_model': base_model_name, 'device': memory, 'estimate': estimate, 'calibration_ratio': ratio,
+            'peak_bytes': peak, 'budget_bytes': budget, 'fits': fits, 'suggestion': suggestion,
+            'lengths': lengths, 'steps': steps, 'tokens': tokens, 'num_processes': num_processes,
+            'warnings': warnings, 'step_seconds': None, 'total_seconds': None}
+    if calibration:
+        # 校准得到的是单进程每 token 的耗时；多进程按理想的线性加速估计
+        total = tokens * calibration['seconds_per_token'] / num_processes
+        plan.update(total_seconds=total, step_seconds=total / steps, calibrated_at=calibration['measured_at'])
+    return plan
+
+
+def calibrate(base_model_name, data_path, hyperparams=None, steps=CALIBRATION_STEPS, on_event=None):
+    """
+    Runs `steps` real training steps (in this process, in a temporary directory) and records seconds per
+    token and the peak memory for this model and device. Returns the plan computed with the new calibration.
+    """
+    import torch
+    from train_core import resolve_hyperparams, start_training
+
+    def emit(kind, payload):
+        if on_event is not None:
+            on_event(kind, payload)
+
+    hp = resolve_hyperparams(hyperparams)
+    tokenizer = model_registry.get_tokenizer(base_model_name)
+    lengths = length_distribution(data_path, tokenizer, hp['max_length'])
+    memory = available_memory()
+    device = memory['device']
+    shape = model_shape(load_model_config(base_model_name))
+    estimate = estimate_training_memory(shape, hp, lengths, device)
+
+    events = []
+
+    class Progress:
+        def put(self, item):
+            events.append((time.perf_counter(), item))
+            emit('progress', item)
+
+    class Log:
+        def put(self, line):
+            emit('log', line)
+
+    calibration_hp = dict(hyperparams or {}, max_steps=steps, save_strategy="no", eval_split=0)
+    if device == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+    emit('status', f"校准: 训练 {steps} 步以测量速度与内存...")
+    with tempfile.TemporaryDirectory(prefix="lora_calibrate_") as output_dir:
+        ok = start_training(base_model_name, data_path, output_dir, Progress(), Log(), hyperparams=calibration_hp)
+    if not ok:
+        errors = [item['error'] for _, item in events if isinstance(item, dict) and 'error' in item]
+        raise RuntimeError(errors[-1] if errors else "校准训练失败")
+
+    # 第 1 步之前是加载与分词；之后的步数才反映稳态速度
+    stepped = [(t, item['step']) for t, item in events if isinstance(item, dict) and item.get('step', 0) >= 1]
+    if len(stepped) < 2:
+        raise RuntimeError("校准步数不足，无法测量速度")
+    (first_time, first_step), (last_time, last_step) = stepped[0], stepped[-1]
+    step_seconds = (last_time - first_time) / max(1, last_step - first_step)
+    tokens_per_step = hp['per_device_train_batch_size'] * hp['gradient_accumulation_steps'] * lengths['mean']
+    if device == "cuda":
+        measured_peak = torch.cuda.max_memory_allocated() + CUDA_CONTEXT_BYTES
+    else:
+        import resource
+        # Linux 上 ru_maxrss 以 KB 为单位 (包含 Python 与库本身)
+        measured_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    _store_calibration('training', _calibration_key(base_model_name, device, estimate['load_in_4bit'], estimate['bf16']), {
+        'seconds_per_token': step_seconds / tokens_per_step, 'step_seconds': step_seconds,
+        'tokens_per_step': tokens_per_step, 'measured_peak_bytes': measured_peak,
+        'estimated_peak_bytes': estimate['peak'], 'hyperparams': hyperparams or {}})
+    plan = plan_training(base_model_name, data_path, hyperparams, tokenizer=tokenizer, memory=memory)
+    summary = format_training_plan(plan)
+    emit('status', summary)
+    return dict(plan, summary=summary)
+
+
+def format_training_plan(plan):
+    estimate = plan['estimate']
+    device = plan['device']
+    parts = ", ".join(f"{label} {estimate[key] / GIB:.2f}"
+                      for key, label in (('weights', "权重"), ('lora_params', "LoRA"), ('optimizer', "优化器"),
+                                         ('activations', "激活"), ('logits', "logits")))
+    lines = [f"预计峰值内存 {plan['peak_bytes'] / GIB:.2f} GiB ({parts} GiB)"
+             + (f"，已按校准结果 ×{plan['calibration_ratio']:.2f}" if plan['calibration_ratio'] != 1.0 else ""),
+             f"可用: {device['name']} 空闲 {(device['free_bytes'] or 0) / GIB:.2f} GiB"
+             + (f" / 共 {device['total_bytes'] / GIB:.2f} GiB" if device['total_bytes'] else ""),
+             f"样本长度 (tokens): 中位 {plan['lengths']['p50']}，p95 {plan['lengths']['p95']}，最长 {plan['lengths']['max']}；"
+             f"{plan['steps']} 步，约 {plan['tokens'] / 1e6:.2f}M tokens"]
+    if plan['total_seconds'] is not None:
+        lines.append(f"预计每步 {plan['step_seconds']:.2f}s，总计约 {format_duration(plan['total_seconds'])} "
+                     f"(校准于 {plan['calibrated_at']})")
+    else:
+        lines.append("预计耗时: 未校准 (先运行一次校准以测量本机速度)")
+    if not plan['fits']:
+        lines.append("内存不足！" + (f"建议: {json.dumps(plan['suggestion'], ensure_ascii=False)}" if plan['suggestion'] else ""))
+    lines.extend(plan['warnings'])
+    return "\n".join(lines)
+
+
+def format_duration(seconds):
+    return time.strftime('%H:%M:%S', time.gmtime(seconds)) if seconds < 86400 else f"{seconds / 86400:.1f} 天"
+
+
+# --- Merge ---
+def plan_merge(adapter_dir, scratch_dir=None, memory=None):
+    """
+    Memory, disk and time plan of do_merge_and_import: the base model in float16 with the adapter merged
+    in place, the merged safetensors and the f16 GGUF in the temporary directory.
+    """
+    adapter = model_registry.get_adapter_config(adapter_dir)
+    base_model_name = adapter['base_model_name_or_path']
+    shape = model_shape(load_model_config(base_model_name))
+    params = parameter_counts(shape, adapter.get('r', 16), adapter.get('target_modules') or ())
+    memory = memory or available_memory()
+    ram = system_memory()
+
+    # float16 权重；合并前 PeftModel 额外持有适配器，保存时分片的写线程可能复制部分张量
+    peak = (params['total'] * 2 + params['lora'] * 4) * FRAGMENTATION
+    disk_needed = params['total'] * 2 * 2 # merged safetensors + f16 GGUF
+    disk_dir = scratch_dir or tempfile.gettempdir()
+    disk_free = shutil.disk_usage(disk_dir).free
+
+    warnings = []
+    if memory['device'] == "cuda" and peak > memory['free_bytes'] * USABLE_FRACTION:
+        if ram['free_bytes'] and peak > memory['free_bytes'] + ram['free_bytes'] * USABLE_FRACTION:
+            warnings.append("显存与内存都不足，device_map=\"auto\" 会把部分权重卸载到磁盘，合并会非常慢")
+        else:
+            warnings.append("显存不足，部分权重会卸载到内存 (device_map=\"auto\")，合并会变慢")
+    elif memory['device'] == "cpu" and ram['free_bytes'] and peak > ram['free_bytes'] * USABLE_FRACTION:
+        warnings.append("内存不足，部分权重会卸载到磁盘，合并会非常慢；可关闭其他程序或改用仅导入适配器")
+    if disk_needed > disk_free:
+        warnings.append(f"临时目录 {disk_dir} 剩余空间不足 (需要约 {disk_needed / GIB:.1f} GiB)")
+
+    plan = {'base_model': base_model_name, 'device': memory, 'peak_bytes': peak, 'disk_bytes': disk_needed,
+            'disk_free_bytes': disk_free, 'disk_dir': disk_dir, 'parameter_count': params['total'],
+            'fits': not warnings, 'warnings': warnings, 'total_seconds': None}
+    record = load_calibrations().get('merge', {}).get(f"{memory['device']}")
+    if record:
+        # 以往合并按参数量线性换算
+        plan['total_seconds'] = record['seconds_per_billion'] * params['total'] / 1e9
+    return plan
+
+
+def record_merge(base_model_name, timings):
+    """Called after a merge; stores its speed (seconds per billion parameters) for later merge plans."""
+    try:
+        params = parameter_counts(model_shape(load_model_config(base_model_name)))['total']
+        seconds = sum(value for key, value in timings.items() if key.endswith("_seconds"))
+        _store_calibration('merge', available_memory()['device'],
+                           {'seconds_per_billion': seconds / (params / 1e9), 'base_model': base_model_name,
+                            'timings': timings})
+    except Exception:
+        pass # 记录失败不影响合并本身
+
+
+def format_merge_plan(plan):
+    lines = [f"预计合并峰值内存 {plan['peak_bytes'] / GIB:.2f} GiB (基座 {plan['parameter_count'] / 1e9:.2f}B 参数，float16)，"
+             f"临时磁盘约 {plan['disk_bytes'] / GIB:.1f} GiB (剩余 {plan['disk_free_bytes'] / GIB:.1f} GiB)"]
+    if plan['total_seconds'] is not None:
+        lines.append(f"按以往合并速度估计耗时约 {format_duration(plan['total_seconds'])}")
+    lines.extend(plan['warnings'])
+    return "\n".join(lines)
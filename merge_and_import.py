@@ -1,6 +1,3 @@
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel, PeftConfig
 import os
 import argparse
 import subprocess
@@ -8,8 +5,29 @@ import tempfile
 import shutil
 import sys
 import json
+import threading
+import time
+from command_runner import run_command_blocking
+from model_io import load_io_settings, scratch_temp_dir, save_model_sharded, measure_reload_throughput
+import profiling
+import memory_planner
+import model_registry
+
+# torch / transformers / peft (and merge_verify, which needs torch) are imported lazily inside the
+# functions that use them, so importing this module from the GUI stays cheap.
 
 CONFIG_FILE = "config.json"
+DEFAULT_GGUF_CACHE_DIR = "./gguf_cache"
+# GGUF 转换 / ollama create 卡住时在这些秒数后终止 (config.json 中设为 0 表示不限制)
+DEFAULT_CONVERT_TIMEOUT = 6 * 3600
+DEFAULT_IMPORT_TIMEOUT = 2 * 3600
+
+def load_config():
+    """Loads config.json, returning an empty dict if it does not exist."""
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, 'r') as f:
+            return json.load(f)
+    return {}
 
 def get_llama_cpp_path(status_callback=None):
     """
@@ -37,7 +55,8 @@ def get_llama_cpp_path(status_callback=None):
             if status_callback: log_status(status_callback, f"Auto-detected llama.cpp at: {path}. Saving to config.json.")
             # Auto-save the found path to config for future use
             try:
-                config_data = {"llama_cpp_path": path}
+                config_data = load_config()
+                config_data["llama_cpp_path"] = path
                 with open(CONFIG_FILE, 'w') as f:
                     json.dump(config_data, f, indent=4)
             except Exception as e:
@@ -48,35 +67,78 @@ def get_llama_cpp_path(status_callback=None):
 
 # ... (The rest of the file remains the same, but all calls to the old get_llama_cpp_path will now use the new logic) ...
 
+def command_timeout(stage):
+    """
+    Seconds after which a 'convert' (convert_*_to_gguf.py) or 'import' (ollama create) command is killed,
+    from config.json's convert_timeout_seconds / import_timeout_seconds; null = no limit.
+    Raises ValueError for a non-numeric or non-positive value.
+    """
+    key, default = {'convert': ("convert_timeout_seconds", DEFAULT_CONVERT_TIMEOUT),
+                    'import': ("import_timeout_seconds", DEFAULT_IMPORT_TIMEOUT)}[stage]
+    seconds = load_config().get(key, default)
+    if seconds is None:
+        return None
+    try:
+        if isinstance(seconds, bool):
+            raise ValueError
+        value = float(seconds)
+    except (TypeError, ValueError):
+        raise ValueError(f"config.json 中的 {key} 必须是正数 (秒) 或 null (不限制): {seconds!r}")
+    if not value > 0:
+        raise ValueError(f"config.json 中的 {key} 必须大于 0 (不限制请设为 null): {seconds!r}")
+    return value
+
 def log_status(callback, message):
     """Helper to send status updates to the UI or print to console."""
     print(message)
     if callback:
         callback(message)
 
-def run_command(command, callback, cwd=None):
-    """Runs a shell command and streams its output."""
+def run_command(command, callback, cwd=None, progress_callback=None, timeout=None, cancel_event=None, stage=None):
+    """
+    Runs a shell command and streams its output.
+    Output is parsed into progress events and log forwarding is throttled (see command_runner).
+    """
     log_status(callback, f"Executing command: {' '.join(command)}")
-    process = subprocess.Popen(
+    return run_command_blocking(
         command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        encoding='utf-8',
-        errors='replace',
-        cwd=cwd # Set the working directory for the command
+        lambda line: log_status(callback, line),
+        progress_callback=progress_callback,
+        cwd=cwd, # Set the working directory for the command
+        timeout=timeout,
+        cancel_event=cancel_event,
+        stage=stage
+    ) # Return the exit code
+
+def write_job_manifest(path, manifest):
+    """Writes the per-job manifest (stage timings, verification results) as JSON."""
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=4, ensure_ascii=False)
+    except OSError as e:
+        print(f"Warning: could not write job manifest {path}: {e}")
+
+def save_model_for_conversion(model, tokenizer, output_dir, status_callback=None):
+    """
+    Saves a model as parallel safetensors shards (settings from config.json) and reports MB/s
+    for the save and for a read-back pass that warms the cache for the GGUF converter.
+    """
+    settings = load_io_settings()
+    save_stats = save_model_sharded(
+        model, output_dir,
+        shard_size_mb=settings['shard_size_mb'],
+        num_threads=settings['num_threads'],
+        log=lambda message: log_status(status_callback, message)
     )
-    
-    while True:
-        output = process.stdout.readline()
-        if output == '' and process.poll() is not None:
-            break
-        if output:
-            log_status(callback, output.strip())
-            
-    return process.poll() # Return the exit code
+    tokenizer.save_pretrained(output_dir)
+    log_status(status_callback, f"Model saved: {save_stats['bytes'] / 1e9:.2f} GB in {save_stats['seconds']:.1f}s "
+                                f"({save_stats['mb_per_s']:.0f} MB/s).")
+    reload_stats = measure_reload_throughput(output_dir, num_threads=settings['num_threads'])
+    log_status(status_callback, f"Reload check: {reload_stats['bytes'] / 1e9:.2f} GB in {reload_stats['seconds']:.1f}s "
+                                f"({reload_stats['mb_per_s']:.0f} MB/s).")
+    return save_stats, reload_stats
 
-def convert_base_model_to_ollama(base_model_id, ollama_model_name, status_callback=None):
+def convert_base_model_to_ollama(base_model_id, ollama_model_name, status_callback=None, progress_callback=None, cancel_event=None):
     """
     Downloads a base Hugging Face model, converts it to GGUF, and imports it into Ollama.
     """
@@ -90,20 +152,20 @@ def convert_base_model_to_ollama(base_model_id, ollama_model_name, status_callba
             return False
         convert_script = os.path.join(llama_cpp_path, 'convert_hf_to_gguf.py')
 
-        # --- 2. Use a temporary directory for all artifacts ---
-        with tempfile.TemporaryDirectory() as temp_dir:
+        # --- 2. Use a temporary directory (on the scratch volume, if configured) for all artifacts ---
+        with scratch_temp_dir(load_io_settings()['scratch_dir']) as temp_dir:
             log_status(status_callback, f"Step 2: Using temporary directory: {temp_dir}")
             hf_model_path = os.path.join(temp_dir, "hf_model")
 
             # --- 3. Download/Load model from Hugging Face and save it locally ---
             log_status(status_callback, f"Step 3: Downloading/loading model '{base_model_id}' from Hugging Face...")
             try:
-                tokenizer = AutoTokenizer.from_pretrained(base_model_id, trust_remote_code=True)
+                from transformers import AutoModelForCausalLM
+                tokenizer = model_registry.get_tokenizer(base_model_id)
                 model = AutoModelForCausalLM.from_pretrained(base_model_id, trust_remote_code=True)
                 
                 log_status(status_callback, "Saving model to temporary local path...")
-                model.save_pretrained(hf_model_path)
-                tokenizer.save_pretrained(hf_model_path)
+                save_model_for_conversion(model, tokenizer, hf_model_path, status_callback)
                 log_status(status_callback, "Model saved successfully.")
             except Exception as e:
                 log_status(status_callback, f"ERROR: Failed to download or save model from Hugging Face: {e}")
@@ -119,7 +181,8 @@ def convert_base_model_to_ollama(base_model_id, ollama_model_name, status_callba
                 '--outtype', 'f16'
             ]
             
-            exit_code = run_command(convert_command, status_callback)
+            exit_code = run_command(convert_command, status_callback, progress_callback=progress_callback,
+                                    timeout=command_timeout('convert'), cancel_event=cancel_event, stage='convert')
             if exit_code != 0:
                 log_status(status_callback, f"ERROR: GGUF conversion failed with exit code {exit_code}.")
                 return False
@@ -139,7 +202,8 @@ def convert_base_model_to_ollama(base_model_id, ollama_model_name, status_callba
                 'ollama', 'create', ollama_model_name, '-f', 'Modelfile'
             ]
             
-            exit_code = run_command(import_command, status_callback, cwd=temp_dir)
+            exit_code = run_command(import_command, status_callback, cwd=temp_dir, progress_callback=progress_callback,
+                                    timeout=command_timeout('import'), cancel_event=cancel_event, stage='import')
             
             if exit_code != 0:
                 log_status(status_callback, f"ERROR: Ollama import failed with exit code {exit_code}.")
@@ -154,10 +218,129 @@ def convert_base_model_to_ollama(base_model_id, ollama_model_name, status_callba
         log_status(status_callback, traceback.format_exc())
         return False
 
-def do_merge_and_import(adapter_dir, ollama_model_name, status_callback=None):
+def load_merge_base(base_model_name, offload_dir):
+    """Tokenizer and fp16 base model for a merge (device_map="auto", overflow offloaded to offload_dir)."""
+    import torch
+    from transformers import AutoModelForCausalLM
+    tokenizer = model_registry.get_tokenizer(base_model_name)
+    base_model = AutoModelForCausalLM.from_pretrained(
+        base_model_name,
+        trust_remote_code=True,
+        torch_dtype=torch.float16,
+        device_map="auto",
+        offload_folder=offload_dir
+    )
+    return tokenizer, base_model
+
+class SharedMergeBase:
+    """
+    A base model loaded once and reused to merge several adapters in turn (batch import, full merge mode).
+
+    merge_and_unload writes the merged weights into the base in place, so the weights of the LoRA target
+    layers are copied to CPU before each merge and written back afterwards. When that is not possible
+    (adapters with modules_to_save, target weights offloaded to disk) the base is dropped and the next
+    merge loads it again. The base belongs to one merge at a time, from acquire() until release(); other
+    threads wait in acquire(), while everything after release (GGUF conversion, ollama create) runs in parallel.
+    """
+    def __init__(self, base_model_name):
+        self.base_model_name = base_model_name
+        self.tokenizer = self.model = None
+        self.temp_dir = None
+        self.saved = None
+        self.touched = False
+        self.loads = 0
+        self.lock = threading.Lock()
+        self.owner = None  # 持有基座的线程
+
+    def acquire(self):
+        """(tokenizer, base model, reused), loading the base on first use; blocks while another merge holds it."""
+        self.lock.acquire()
+        self.owner = threading.get_ident()
+        try:
+            if self.model is not None:
+                return self.tokenizer, self.model, True
+            if self.temp_dir is None:
+                self.temp_dir = scratch_temp_dir(load_io_settings()['scratch_dir'])
+            self.tokenizer, self.model = load_merge_base(self.base_model_name, os.path.join(self.temp_dir.name, "offload_cache"))
+            self.loads += 1
+            return self.tokenizer, self.model, False
+        except BaseException:
+            self.owner = None
+            self.lock.release()
+            raise
+
+    def wrap(self, adapter_dir, offload_dir):
+        """PeftModel of the adapter on the shared base, with the weights the merge will change saved."""
+        from peft import PeftModel
+        self.touched = True
+        model_with_lora = PeftModel.from_pretrained(self.model, adapter_dir, device_map="auto", offload_folder=offload_dir)
+        self.saved = None
+        if not model_with_lora.peft_config[model_with_lora.active_adapter].modules_to_save:
+            saved = {}
+            for name, module in model_with_lora.base_model.model.named_modules():
+                if hasattr(module, 'base_layer') and hasattr(module, 'lora_A'):
+                    weight = module.base_layer.weight
+                    if weight.device.type == "meta":
+                        saved = None
+                        break
+                    saved[name] = weight.detach().to("cpu", copy=True)
+            self.saved = saved
+        return model_with_lora
+
+    def release(self, merged_model=None):
+        """
+        Restores the base after a merge (drops it if it cannot be restored or the merge did not finish) and
+        hands it to the next merge. A no-op unless the calling thread holds the base.
+        """
+        if self.owner != threading.get_ident():
+            return
+        try:
+            if self.touched:
+                self._restore(merged_model)
+        finally:
+            self.owner = None
+            self.lock.release()
+
+    def _restore(self, merged_model):
+        self.touched = False
+        saved, self.saved = self.saved, None
+        if saved is not None and merged_model is self.model:
+            import torch
+            with torch.no_grad():
+                for name, weight in saved.items():
+                    target = self.model.get_submodule(name).weight
+                    target.copy_(weight.to(target.device))
+            return
+        self.model = None
+        self._free_memory()
+
+    def close(self):
+        with self.lock:
+            self.tokenizer = self.model = self.saved = None
+            self._free_memory()
+            if self.temp_dir is not None:
+                self.temp_dir.cleanup()
+                self.temp_dir = None
+
+    @staticmethod
+    def _free_memory():
+        import gc
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+def do_merge_and_import(adapter_dir, ollama_model_name, status_callback=None, progress_callback=None, cancel_event=None,
+                        shared_base=None):
     """
     Main logic for merging, converting, and importing the model.
+    With `shared_base` (a SharedMergeBase of the adapter's base model) the base is not loaded again.
     """
+    # Opt-in profiling (no-op unless enabled), written next to merge_manifest.json
+    prof = profiling.session(os.path.join(os.path.dirname(os.path.abspath(adapter_dir)), "profile"), "merge").start()
     try:
         # --- 1. Get llama.cpp path from config ---
         log_status(status_callback, "Step 1: Finding llama.cpp path...")
@@ -170,40 +353,107 @@ def do_merge_and_import(adapter_dir, ollama_model_name, status_callback=None):
 
         # --- 2. Load Base Model and Merge LoRA ---
         log_status(status_callback, "Step 2: Loading base model and merging LoRA adapter...")
-        config = PeftConfig.from_pretrained(adapter_dir)
-        base_model_name = config.base_model_name_or_path
+        from peft import PeftModel
+        from merge_verify import MergeVerifier, check_tokenizer_matches, check_base_fingerprint
+        base_model_name = model_registry.adapter_base_model(adapter_dir)
         
         log_status(status_callback, f"Base model: {base_model_name}")
-        # --- 3. Save Merged Model to a Temporary Directory ---
-        with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            merge_plan = memory_planner.plan_merge(adapter_dir, load_io_settings()['scratch_dir'])
+            log_status(status_callback, "Pre-flight: " + memory_planner.format_merge_plan(merge_plan).replace("\n", " | "))
+        except Exception as e:
+            log_status(status_callback, f"Pre-flight estimate unavailable: {e}")
+
+        # 任务清单写在 LoRA 模型目录 (final_lora_adapter 的上一级) 中
+        manifest_path = os.path.join(os.path.dirname(os.path.abspath(adapter_dir)), "merge_manifest.json")
+        manifest = {
+            "adapter_dir": os.path.abspath(adapter_dir),
+            "base_model": base_model_name,
+            "ollama_model_name": ollama_model_name,
+            "started_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "timings": {},
+        }
+
+        # 合并与校验都基于加载的基座，只有训练时记录的基座指纹能发现 base_model_name_or_path 指错了模型
+        manifest["base_fingerprint"] = check_base_fingerprint(adapter_dir, base_model_name)
+        if manifest["base_fingerprint"]["ok"] is False:
+            write_job_manifest(manifest_path, manifest)
+            log_status(status_callback, f"ERROR: Base model '{base_model_name}' is not the model the adapter was trained on "
+                                        f"(differs in: {', '.join(manifest['base_fingerprint']['mismatches'])}). "
+                                        f"Check base_model_name_or_path in adapter_config.json.")
+            return False
+        if manifest["base_fingerprint"]["ok"] is None:
+            log_status(status_callback, f"Warning: base model identity not verified ({manifest['base_fingerprint'].get('reason', 'nothing to compare')}).")
+        stage_start = time.time()
+
+        # --- 3. Save Merged Model to a Temporary Directory (on the scratch volume, if configured) ---
+        with scratch_temp_dir(load_io_settings()['scratch_dir']) as temp_dir:
             offload_dir = os.path.join(temp_dir, "offload_cache")
             os.makedirs(offload_dir, exist_ok=True)
 
             log_status(status_callback, f"Step 3: Saving merged model to temporary directory: {temp_dir}")
             
             log_status(status_callback, "Loading tokenizer and model (this may take a while)...")
-            tokenizer = AutoTokenizer.from_pretrained(base_model_name, trust_remote_code=True)
-            base_model = AutoModelForCausalLM.from_pretrained(
-                base_model_name,
-                trust_remote_code=True,
-                torch_dtype=torch.float16,
-                device_map="auto",
-                offload_folder=offload_dir
-            )
+            with prof.stage("load_model"):
+                if shared_base is not None:
+                    tokenizer, base_model, base_reused = shared_base.acquire()
+                else:
+                    (tokenizer, base_model), base_reused = load_merge_base(base_model_name, offload_dir), False
+            manifest["timings"]["load_seconds"] = time.time() - stage_start
+            manifest["base_reused"] = base_reused
             
-            log_status(status_callback, "基础模型加载成功。")
+            log_status(status_callback, "基础模型已在内存中，直接复用。" if base_reused else "基础模型加载成功。")
+
+            # Guard against a wrong base_model_name_or_path: the adapter carries its training tokenizer.
+            if os.path.exists(os.path.join(adapter_dir, "tokenizer_config.json")):
+                adapter_tokenizer = model_registry.get_tokenizer(adapter_dir)
+                manifest["tokenizer_check"] = check_tokenizer_matches(adapter_tokenizer, tokenizer)
+                if not manifest["tokenizer_check"]["ok"]:
+                    write_job_manifest(manifest_path, manifest)
+                    log_status(status_callback, f"ERROR: Adapter tokenizer does not match base model '{base_model_name}' "
+                                                f"({manifest['tokenizer_check']}). Check base_model_name_or_path in adapter_config.json.")
+                    return False
             
             log_status(status_callback, "Applying LoRA adapter and merging...")
-            model_with_lora = PeftModel.from_pretrained(base_model, adapter_dir, device_map="auto", offload_folder=offload_dir)
-            merged_model = model_with_lora.merge_and_unload()
+            stage_start = time.time()
+            with prof.stage("merge", trace=True):
+                if shared_base is not None:
+                    model_with_lora = shared_base.wrap(adapter_dir, offload_dir)
+                else:
+                    model_with_lora = PeftModel.from_pretrained(base_model, adapter_dir, device_map="auto", offload_folder=offload_dir)
+                verifier = MergeVerifier(tokenizer)
+                verifier.before_merge(model_with_lora)
+                merged_model = model_with_lora.merge_and_unload()
+            manifest["timings"]["merge_seconds"] = time.time() - stage_start
             log_status(status_callback, "Merge complete.")
 
+            log_status(status_callback, "Verifying merged weights against W + scale·B@A and reference logits...")
+            stage_start = time.time()
+            with prof.stage("verify"):
+                verification = verifier.after_merge(merged_model)
+            manifest["verification"] = verification
+            manifest["timings"]["verify_seconds"] = time.time() - stage_start
+            log_status(status_callback, f"Verification: {verification['layers_checked']} layers checked, "
+                                        f"max relative error {verification['max_relative_error']}.")
+            if not verification['logits_ok']:
+                log_status(status_callback, "Warning: merged model logits differ noticeably from the PeftModel.")
+            if not verification['ok']:
+                write_job_manifest(manifest_path, manifest)
+                log_status(status_callback, f"ERROR: Merge verification failed: {'; '.join(verification['problems'])}. See {manifest_path}.")
+                return False
+
             merged_model_path = os.path.join(temp_dir, 'merged_model')
-            merged_model.save_pretrained(merged_model_path)
-            tokenizer.save_pretrained(merged_model_path)
+            with prof.stage("save"):
+                save_stats, reload_stats = save_model_for_conversion(merged_model, tokenizer, merged_model_path, status_callback)
+            if shared_base is not None:
+                # 合并后的权重已保存，恢复共享基座供同一基座的下一个适配器使用
+                shared_base.release(merged_model)
+            manifest["save"] = save_stats
+            manifest["reload"] = reload_stats
             
             # --- 4. Convert to GGUF ---
             log_status(status_callback, "Step 4: Converting merged model to GGUF format...")
+            stage_start = time.time()
             gguf_output_path = os.path.join(temp_dir, f"{ollama_model_name}.gguf")
             
             convert_command = [
@@ -212,8 +462,12 @@ def do_merge_and_import(adapter_dir, ollama_model_name, status_callback=None):
                 '--outtype', 'f16'
             ]
             
-            exit_code = run_command(convert_command, status_callback)
+            with prof.stage("convert"):
+                exit_code = run_command(convert_command, status_callback, progress_callback=progress_callback,
+                                        timeout=command_timeout('convert'), cancel_event=cancel_event, stage='convert')
+            manifest["timings"]["convert_seconds"] = time.time() - stage_start
             if exit_code != 0:
+                write_job_manifest(manifest_path, manifest)
                 log_status(status_callback, f"ERROR: GGUF conversion failed with exit code {exit_code}.")
                 return False
             log_status(status_callback, "GGUF conversion successful.")
@@ -228,16 +482,25 @@ def do_merge_and_import(adapter_dir, ollama_model_name, status_callback=None):
 
             # --- 6. Import into Ollama ---
             log_status(status_callback, f"Step 6: Importing model '{ollama_model_name}' into Ollama...")
+            stage_start = time.time()
             import_command = [
                 'ollama', 'create', ollama_model_name, '-f', 'Modelfile'
             ]
             
-            exit_code = run_command(import_command, status_callback, cwd=temp_dir)
+            with prof.stage("import"):
+                exit_code = run_command(import_command, status_callback, cwd=temp_dir, progress_callback=progress_callback,
+                                        timeout=command_timeout('import'), cancel_event=cancel_event, stage='import')
+            manifest["timings"]["import_seconds"] = time.time() - stage_start
             
             if exit_code != 0:
+                write_job_manifest(manifest_path, manifest)
                 log_status(status_callback, f"ERROR: Ollama import failed with exit code {exit_code}.")
                 return False
 
+        manifest["finished_at"] = time.strftime('%Y-%m-%d %H:%M:%S')
+        write_job_manifest(manifest_path, manifest)
+        if not manifest["base_reused"]:
+            memory_planner.record_merge(base_model_name, manifest["timings"]) # 复用基座时没有加载耗时，不计入合并速度
         log_status(status_callback, f"SUCCESS: Model '{ollama_model_name}' has been successfully imported into Ollama!")
         return True
 
@@ -246,9 +509,179 @@ def do_merge_and_import(adapter_dir, ollama_model_name, status_callback=None):
         import traceback
         log_status(status_callback, traceback.format_exc())
         return False
+    finally:
+        if shared_base is not None:
+            shared_base.release() # 合并未完成时丢弃可能已被修改的基座
+        prof.close()
+
+def get_gguf_cache_dir():
+    """
+    Returns the shared cache directory for base model GGUF files (config key 'gguf_cache_dir').
+    """
+    cache_dir = load_config().get("gguf_cache_dir") or DEFAULT_GGUF_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.abspath(cache_dir)
+
+def resolve_local_model_dir(model_id):
+    """
+    Resolves a Hugging Face model ID (or a local directory) to a local directory containing config.json.
+    Only the local HF cache is used, nothing is downloaded.
+    """
+    if os.path.isdir(model_id):
+        return os.path.abspath(model_id)
+    from huggingface_hub import snapshot_download
+    return snapshot_download(model_id, local_files_only=True)
+
+def _cache_slug(model_id, outtype):
+    return model_id.strip("/\\").replace("/", "--").replace("\\", "--").replace(":", "_") + f".{outtype}"
+
+def ollama_model_exists(name):
+    """Checks whether a model with this name is already present in the local Ollama store."""
+    try:
+        result = subprocess.run(['ollama', 'show', name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+    except FileNotFoundError:
+        return False
+
+def ensure_base_gguf(base_model_name, status_callback=None, progress_callback=None, cancel_event=None, outtype='f16'):
+    """
+    Returns (base_dir, gguf_path, ollama_base_name) for a base model, converting it to GGUF and importing
+    it into Ollama only the first time. Results are recorded in a manifest next to the cached GGUF, so
+    every later adapter import for the same base model reuses them.
+    Returns (None, None, None) on failure.
+    """
+    llama_cpp_path = get_llama_cpp_path(status_callback)
+    if not llama_cpp_path:
+        log_status(status_callback, "ERROR: Could not find the 'llama.cpp' repository.")
+        return None, None, None
+
+    base_dir = resolve_local_model_dir(base_model_name)
+    slug = _cache_slug(base_model_name, outtype)
+    cache_dir = get_gguf_cache_dir()
+    gguf_path = os.path.join(cache_dir, f"{slug}.gguf")
+    manifest_path = os.path.join(cache_dir, f"{slug}.json")
+    ollama_base_name = "base-" + slug.lower().replace("--", "-").replace(".", "-").replace("_", "-")
+
+    if os.path.exists(gguf_path) and os.path.exists(manifest_path):
+        log_status(status_callback, f"Reusing cached base GGUF: {gguf_path}")
+    else:
+        log_status(status_callback, f"Base GGUF not cached yet, converting '{base_model_name}' once...")
+        partial_path = gguf_path + ".partial"
+        convert_command = [
+            sys.executable, os.path.join(llama_cpp_path, 'convert_hf_to_gguf.py'), base_dir,
+            '--outfile', partial_path,
+            '--outtype', outtype
+        ]
+        exit_code = run_command(convert_command, status_callback, progress_callback=progress_callback,
+                                timeout=command_timeout('convert'), cancel_event=cancel_event, stage='convert')
+        if exit_code != 0:
+            log_status(status_callback, f"ERROR: Base GGUF conversion failed with exit code {exit_code}.")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return None, None, None
+        os.replace(partial_path, gguf_path)
+        with open(manifest_path, 'w') as f:
+            json.dump({"base_model": base_model_name, "base_dir": base_dir, "outtype": outtype,
+                       "gguf_path": gguf_path, "ollama_base_name": ollama_base_name}, f, indent=4)
+
+    # Import the base GGUF into Ollama once; adapters then reference it by name, so Ollama
+    # does not have to re-hash gigabytes of base weights for every adapter.
+    if not ollama_model_exists(ollama_base_name):
+        log_status(status_callback, f"Importing base GGUF into Ollama as '{ollama_base_name}'...")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, 'Modelfile'), 'w') as f:
+                f.write(f"FROM {gguf_path}")
+            exit_code = run_command(['ollama', 'create', ollama_base_name, '-f', 'Modelfile'], status_callback,
+                                    cwd=temp_dir, progress_callback=progress_callback,
+                                    timeout=command_timeout('import'), cancel_event=cancel_event, stage='import')
+        if exit_code != 0:
+            log_status(status_callback, f"ERROR: Ollama import of the base model failed with exit code {exit_code}.")
+            return None, None, None
+
+    return base_dir, gguf_path, ollama_base_name
+
+def do_adapter_import(adapter_dir, ollama_model_name, status_callback=None, progress_callback=None, cancel_event=None,
+                      base_gguf=None):
+    """
+    Adapter-only import: converts just the LoRA adapter to a GGUF LoRA file and creates an Ollama model
+    with 'FROM <base>' + 'ADAPTER <lora.gguf>'. The base model GGUF comes from the shared cache;
+    `base_gguf` is the result of ensure_base_gguf when the caller already looked it up.
+    """
+    try:
+        # --- 1. Get llama.cpp path from config ---
+        log_status(status_callback, "Step 1: Finding llama.cpp path...")
+        llama_cpp_path = get_llama_cpp_path(status_callback)
+        if not llama_cpp_path:
+            log_status(status_callback, "ERROR: Could not find the 'llama.cpp' repository.")
+            log_status(status_callback, "Please set the correct path in the 'Settings' tab or place it in the project's parent directory.")
+            return False
+        convert_lora_script = os.path.join(llama_cpp_path, 'convert_lora_to_gguf.py')
+        if not os.path.exists(convert_lora_script):
+            log_status(status_callback, f"ERROR: '{convert_lora_script}' not found, please update llama.cpp.")
+            return False
+
+        # --- 2. Read the base model from the adapter config ---
+        base_model_name = model_registry.adapter_base_model(adapter_dir)
+        if not base_model_name:
+            log_status(status_callback, "ERROR: 'base_model_name_or_path' missing from adapter_config.json.")
+            return False
+        log_status(status_callback, f"Step 2: Base model: {base_model_name}")
+
+        # --- 3. Get (or build once) the cached base GGUF ---
+        log_status(status_callback, "Step 3: Looking up base model GGUF in the shared cache...")
+        if base_gguf is None:
+            base_gguf = ensure_base_gguf(base_model_name, status_callback, progress_callback, cancel_event)
+        base_dir, _, ollama_base_name = base_gguf
+        if not base_dir:
+            return False
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # --- 4. Convert only the adapter to GGUF ---
+            log_status(status_callback, "Step 4: Converting LoRA adapter to GGUF...")
+            lora_gguf_path = os.path.join(temp_dir, "adapter.gguf")
+            convert_command = [
+                sys.executable, convert_lora_script,
+                '--base', base_dir,
+                '--outfile', lora_gguf_path,
+                '--outtype', 'f16',
+                adapter_dir
+            ]
+            exit_code = run_command(convert_command, status_callback, progress_callback=progress_callback,
+                                    timeout=command_timeout('convert'), cancel_event=cancel_event, stage='convert')
+            if exit_code != 0:
+                log_status(status_callback, f"ERROR: LoRA GGUF conversion failed with exit code {exit_code}.")
+                return False
+            log_status(status_callback, f"LoRA GGUF written ({os.path.getsize(lora_gguf_path) / 1e6:.1f} MB).")
+
+            # --- 5. Create Ollama Modelfile ---
+            log_status(status_callback, "Step 5: Creating Ollama Modelfile...")
+            modelfile_content = f"FROM {ollama_base_name}\nADAPTER {os.path.basename(lora_gguf_path)}\n"
+            modelfile_path = os.path.join(temp_dir, 'Modelfile')
+            with open(modelfile_path, 'w') as f:
+                f.write(modelfile_content)
+
+            # --- 6. Import into Ollama ---
+            log_status(status_callback, f"Step 6: Importing model '{ollama_model_name}' into Ollama...")
+            import_command = [
+                'ollama', 'create', ollama_model_name, '-f', 'Modelfile'
+            ]
+            exit_code = run_command(import_command, status_callback, cwd=temp_dir, progress_callback=progress_callback,
+                                    timeout=command_timeout('import'), cancel_event=cancel_event, stage='import')
+            if exit_code != 0:
+                log_status(status_callback, f"ERROR: Ollama import failed with exit code {exit_code}.")
+                return False
+
+        log_status(status_callback, f"SUCCESS: Adapter '{ollama_model_name}' has been successfully imported into Ollama!")
+        return True
+
+    except Exception as e:
+        log_status(status_callback, f"An unexpected error occurred: {e}")
+        import traceback
+        log_status(status_callback, traceback.format_exc())
+        return False
 
-# --- Command-Line Interface (for testing) ---
+# --- Command-Line Interface ---
 if __name__ == "__main__":
-    # This part is now primarily for testing the backend functions
-    # The main application is main_app.py
-    print("This script is not meant to be run directly. Use main_app.py")
+    # 等同于 `python cli.py merge <adapter> <ollama_name> [--adapter-only]`
+    from cli import main
+    sys.exit(main(["merge"] + sys.argv[1:]))
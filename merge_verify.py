@@ -0,0 +1,321 @@
+import hashlib
+import json
+import os
+import struct
+import time
+
+import torch
+
+PEFT_PREFIX = "base_model.model."
+DEFAULT_REFERENCE_PROMPTS = [
+    "你好，请介绍一下你自己。",
+    "What is the capital of France?",
+]
+# 适配器对参考 logits 的最大影响不超过这个值时视为没有生效
+ADAPTER_EFFECT_TOLERANCE = 1e-5
+BASE_FINGERPRINT_FILE = "base_fingerprint.json"
+FINGERPRINT_TOKENIZER_FILES = ("tokenizer_config.json", "tokenizer.json", "special_tokens_map.json", "vocab.json",
+                               "merges.txt", "tokenizer.model")
+FINGERPRINT_WEIGHTS = 4
+FINGERPRINT_WEIGHT_BYTES = 64 * 1024
+# 重新保存同一个模型时会变化、与权重无关的 config 字段
+VOLATILE_CONFIG_KEYS = ("_name_or_path", "transformers_version", "torch_dtype", "quantization_config", "use_cache")
+
+
+def _lora_modules(peft_model, adapter_name):
+    """Lists (name, module) for every LoRA layer of the given adapter."""
+    modules = []
+    for name, module in peft_model.named_modules():
+        lora_a = getattr(module, "lora_A", None)
+        if lora_a is not None and hasattr(lora_a, "keys") and adapter_name in lora_a.keys():
+            modules.append((name, module))
+    return modules
+
+
+def _base_weight(module):
+    base_layer = getattr(module, "base_layer", None)
+    return base_layer.weight if base_layer is not None else module.weight
+
+
+def snapshot_lora_layers(peft_model, num_layers=8, max_rows=256, adapter_name="default", seed=0):
+    """
+    Before merging: copies a bounded sample of base weights and LoRA factors to the CPU.
+    Samples `num_layers` LoRA layers spread evenly over the model and at most `max_rows` output rows
+    of each, so memory stays at roughly num_layers * max_rows * in_features values.
+    """
+    modules = _lora_modules(peft_model, adapter_name)
+    if not modules:
+        return []
+    step = max(1, len(modules) // num_layers)
+    generator = torch.Generator().manual_seed(seed)
+
+    samples = []
+    for name, module in modules[::step][:num_layers]:
+        weight = _base_weight(module)
+        if weight.device.type == "meta":
+            samples.append({'name': name, 'skipped': "weight offloaded"})
+            continue
+        out_features = weight.shape[1] if module.fan_in_fan_out else weight.shape[0]
+        rows = torch.randperm(out_features, generator=generator)[:max_rows].sort().values
+        device_rows = rows.to(weight.device)
+        base_rows = weight.T[device_rows] if module.fan_in_fan_out else weight[device_rows]
+        samples.append({
+            'name': name,
+            'rows': rows,
+            'base_rows': base_rows.detach().float().cpu(),
+            'lora_a': module.lora_A[adapter_name].weight.detach().float().cpu(),
+            'lora_b_rows': module.lora_B[adapter_name].weight[rows.to(module.lora_B[adapter_name].weight.device)].detach().float().cpu(),
+            'scaling': float(module.scaling[adapter_name]),
+            'fan_in_fan_out': bool(module.fan_in_fan_out),
+        })
+    return samples
+
+
+def verify_merged_weights(merged_model, samples, chunk_rows=64, tolerance=5e-3):
+    """
+    After merging: checks sampled merged rows against W + scale·B@A, computed in chunks of rows.
+    Returns a list of per-layer results with the relative Frobenius error.
+    """
+    merged_modules = dict(merged_model.named_modules())
+    results = []
+    for sample in samples:
+        if 'skipped' in sample:
+            results.append({'layer': sample['name'], 'ok': None, 'skipped': sample['skipped']})
+            continue
+        module = merged_modules.get(sample['name'][len(PEFT_PREFIX):] if sample['name'].startswith(PEFT_PREFIX) else sample['name'])
+        if module is None or module.weight.device.type == "meta":
+            results.append({'layer': sample['name'], 'ok': None, 'skipped': "merged weight unavailable"})
+            continue
+
+        weight = module.weight.T if sample['fan_in_fan_out'] else module.weight
+        rows = sample['rows']
+        error_sq, expected_sq = 0.0, 0.0
+        for start in range(0, len(rows), chunk_rows):
+            end = start + chunk_rows
+            expected = sample['base_rows'][start:end] + sample['scaling'] * (sample['lora_b_rows'][start:end] @ sample['lora_a'])
+            merged_rows = weight[rows[start:end].to(weight.device)].detach().float().cpu()
+            error_sq += torch.sum((merged_rows - expected) ** 2).item()
+            expected_sq += torch.sum(expected ** 2).item()
+        relative_error = (error_sq ** 0.5) / max(expected_sq ** 0.5, 1e-12)
+        results.append({'layer': sample['name'], 'ok': relative_error <= tolerance, 'relative_error': relative_error})
+    return results
+
+
+def reference_logits(model, tokenizer, prompts=None):
+    """Last-token logits (float32, CPU) for each reference prompt; only one vocab-sized row is kept per prompt."""
+    prompts = prompts or DEFAULT_REFERENCE_PROMPTS
+    device = next(p.device for p in model.parameters() if p.device.type != "meta")
+    logits = []
+    with torch.no_grad():
+        for prompt in prompts:
+            input_ids = tokenizer.apply_chat_template(
+                [{"role": "user", "content": prompt}],
+                tokenize=True,
+                add_generation_prompt=True,
+                return_tensors="pt"
+            ).to(device)
+            output = model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids))
+            logits.append(output.logits[0, -1].float().cpu())
+    return logits
+
+
+def compare_logits(reference, candidate, tolerance=0.1):
+    """Compares two lists of last-token logits: max abs diff, cosine similarity and top-1 agreement."""
+    results = []
+    for ref, cand in zip(reference, candidate):
+        max_abs_diff = torch.max(torch.abs(ref - cand)).item()
+        cosine = torch.nn.functional.cosine_similarity(ref, cand, dim=0).item()
+        top1_match = int(torch.argmax(ref)) == int(torch.argmax(cand))
+        results.append({
+            'max_abs_diff': max_abs_diff,
+            'cosine': cosine,
+            'top1_match': top1_match,
+            'ok': top1_match and cosine > 1 - tolerance,
+        })
+    return results
+
+
+def check_tokenizer_matches(adapter_tokenizer, base_tokenizer):
+    """
+    A cheap guard against a wrong base_model_name_or_path: the adapter was saved with the tokenizer it was
+    trained with, so its vocabulary must match the base model's tokenizer.
+    """
+    adapter_vocab, base_vocab = len(adapter_tokenizer), len(base_tokenizer)
+    return {'ok': adapter_vocab == base_vocab, 'adapter_vocab_size': adapter_vocab, 'base_vocab_size': base_vocab}
+
+
+def _base_file(base_model_name, filename):
+    """Local path of one file of the base model (a directory or the hub cache), None if it is not available."""
+    if os.path.isdir(base_model_name):
+        path = os.path.join(base_model_name, filename)
+        return path if os.path.isfile(path) else None
+    from transformers.utils import cached_file
+    # 只读本地缓存: 基座在训练 / 合并时刚加载过，不发网络请求
+    return cached_file(base_model_name, filename, local_files_only=True, _raise_exceptions_for_missing_entries=False,
+                       _raise_exceptions_for_connection_errors=False)
+
+
+def _sha1_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _safetensors_files(base_model_name):
+    """{tensor name: safetensors file} of the base checkpoint (empty for .bin checkpoints)."""
+    index_path = _base_file(base_model_name, "model.safetensors.index.json")
+    if index_path is not None:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            weight_map = json.load(f)['weight_map']
+        paths = {name: _base_file(base_model_name, name) for name in set(weight_map.values())}
+        return {tensor: paths[name] for tensor, name in weight_map.items() if paths[name] is not None}
+    path = _base_file(base_model_name, "model.safetensors")
+    if path is None:
+        return {}
+    with open(path, 'rb') as f:
+        header = json.loads(f.read(struct.unpack("<Q", f.read(8))[0]))
+    return {name: path for name in header if name != "__metadata__"}
+
+
+def _weight_checksum(path, name):
+    """SHA-1 of the first FINGERPRINT_WEIGHT_BYTES bytes of one tensor, read straight from the safetensors file."""
+    with open(path, 'rb') as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        start, end = json.loads(f.read(header_size))[name]['data_offsets']
+        f.seek(8 + header_size + start)
+        return hashlib.sha1(f.read(min(end - start, FINGERPRINT_WEIGHT_BYTES))).hexdigest()
+
+
+def base_fingerprint(base_model_name, weight_names=None):
+    """
+    Identifies a base checkpoint by its files, independent of how it is loaded (dtype, quantization, device):
+    a hash of config.json (without fields that change on re-save), a hash of each tokenizer file and checksums
+    of FINGERPRINT_WEIGHTS tensors spread over the checkpoint (or of `weight_names`; missing ones map to None).
+    """
+    fingerprint = {'base_model': base_model_name, 'config': None, 'tokenizer': {}, 'weights': {}}
+    config_path = _base_file(base_model_name, "config.json")
+    if config_path is not None:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = {k: v for k, v in json.load(f).items() if k not in VOLATILE_CONFIG_KEYS}
+        fingerprint['config'] = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+    for filename in FINGERPRINT_TOKENIZER_FILES:
+        path = _base_file(base_model_name, filename)
+        if path is not None:
+            fingerprint['tokenizer'][filename] = _sha1_file(path)
+    files = _safetensors_files(base_model_name)
+    if weight_names is None:
+        names = sorted(files)
+        weight_names = names[::max(1, len(names) // FINGERPRINT_WEIGHTS)][:FINGERPRINT_WEIGHTS]
+    if files:
+        for name in weight_names:
+            fingerprint['weights'][name] = _weight_checksum(files[name], name) if name in files else None
+    return fingerprint
+
+
+def write_base_fingerprint(adapter_dir, base_model_name):
+    """Records the fingerprint of the base an adapter was trained on next to adapter_config.json."""
+    with open(os.path.join(adapter_dir, BASE_FINGERPRINT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(base_fingerprint(base_model_name), f, ensure_ascii=False, indent=2)
+
+
+def check_base_fingerprint(adapter_dir, base_model_name):
+    """
+    Compares the base about to be merged with the fingerprint recorded when the adapter was saved.
+    Only parts present on both sides are compared; 'ok' is None when the adapter has no fingerprint (trained
+    before it was recorded) or nothing could be compared, False on any mismatch.
+    """
+    path = os.path.join(adapter_dir, BASE_FINGERPRINT_FILE)
+    if not os.path.exists(path):
+        return {'ok': None, 'reason': "adapter has no recorded base fingerprint"}
+    with open(path, 'r', encoding='utf-8') as f:
+        recorded = json.load(f)
+    current = base_fingerprint(base_model_name, weight_names=list(recorded.get('weights', {})))
+
+    compared, mismatches = [], []
+    if recorded.get('config') and current['config']:
+        compared.append("config.json")
+        if recorded['config'] != current['config']:
+            mismatches.append("config.json")
+    for kind in ('tokenizer', 'weights'):
+        for name, digest in recorded.get(kind, {}).items():
+            if name in current[kind]:
+                compared.append(name)
+                if current[kind][name] != digest:
+                    mismatches.append(name)
+    return {'ok': not mismatches if compared else None, 'recorded_base_model': recorded.get('base_model'),
+            'compared': compared, 'mismatches': mismatches}
+
+
+class MergeVerifier:
+    """
+    Runs the verification stage around `merge_and_unload()`:
+        verifier.before_merge(peft_model)   # snapshot samples + reference logits (with and without adapter)
+        merged = peft_model.merge_and_unload()
+        report = verifier.after_merge(merged)
+
+    The merge fails verification when a sampled layer differs from W + scale·B@A, when no sampled layer
+    could be checked (all offloaded), or when the adapter does not change the reference logits at all.
+    Both the weight and the logit checks compare against whatever base was loaded, so they cannot detect
+    a wrong base model; check_base_fingerprint (the base recorded at training time) guards against that.
+    """
+    def __init__(self, tokenizer, num_layers=8, max_rows=256, prompts=None, check_logits=True):
+        self.tokenizer = tokenizer
+        self.num_layers = num_layers
+        self.max_rows = max_rows
+        self.prompts = prompts or DEFAULT_REFERENCE_PROMPTS
+        self.check_logits = check_logits
+        self.samples = []
+        self.peft_logits = None
+        self.adapter_effect = None
+        self.timings = {}
+
+    def before_merge(self, peft_model):
+        start = time.time()
+        self.samples = snapshot_lora_layers(peft_model, self.num_layers, self.max_rows)
+        self.timings['snapshot_seconds'] = time.time() - start
+
+        if self.check_logits:
+            start = time.time()
+            self.peft_logits = reference_logits(peft_model, self.tokenizer, self.prompts)
+            with peft_model.disable_adapter():
+                base_logits = reference_logits(peft_model, self.tokenizer, self.prompts)
+            # 适配器完全不改变输出通常意味着训练或加载出了问题
+            self.adapter_effect = [torch.max(torch.abs(a - b)).item() for a, b in zip(self.peft_logits, base_logits)]
+            self.timings['peft_logits_seconds'] = time.time() - start
+
+    def after_merge(self, merged_model):
+        start = time.time()
+        weight_results = verify_merged_weights(merged_model, self.samples)
+        self.timings['weight_check_seconds'] = time.time() - start
+
+        logit_results = None
+        if self.check_logits and self.peft_logits is not None:
+            start = time.time()
+            logit_results = compare_logits(self.peft_logits, reference_logits(merged_model, self.tokenizer, self.prompts))
+            self.timings['merged_logits_seconds'] = time.time() - start
+
+        checked = [r for r in weight_results if r['ok'] is not None]
+        # fp16 合并在数值上存在微小误差，logits 检查只作为警告，权重检查失败才算校验失败
+        problems = []
+        if not checked:
+            problems.append("no LoRA layer could be checked" + (" (all sampled weights offloaded)" if weight_results else ""))
+        elif not all(r['ok'] for r in checked):
+            problems.append("merged weights differ from W + scale·B@A")
+        adapter_effect_ok = self.adapter_effect is None or max(self.adapter_effect, default=0.0) > ADAPTER_EFFECT_TOLERANCE
+        if not adapter_effect_ok:
+            problems.append("the adapter does not change the model's outputs")
+        return {
+            'ok': not problems,
+            'problems': problems,
+            'adapter_effect_ok': adapter_effect_ok,
+            'logits_ok': logit_results is None or all(r['ok'] for r in logit_results),
+            'layers_checked': len(checked),
+            'layers_skipped': len(weight_results) - len(checked),
+            'max_relative_error': max((r['relative_error'] for r in checked), default=None),
+            'weights': weight_results,
+            'logits': logit_results,
+            'adapter_effect_max_abs': self.adapter_effect,
+            'timings': self.timings,
+        }
@@ -0,0 +1,269 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+import profiling
+
+CATALOG_FILE = "model_catalog.json"
+CATALOG_VERSION = 2
+ADAPTER_SUBDIR = "final_lora_adapter"
+ONNX_MANIFEST_FILE = "onnx_export.json"  # 与 onnx_backend.MANIFEST_FILE 保持一致
+# 这些目录永远不会包含 LoRA 模型目录，扫描时直接跳过
+PRUNED_DIR_NAMES = {
+    ".git", ".gradio", "__pycache__", ".venv", "venv", "node_modules", ".pytest_cache", ".mypy_cache",
+    "gguf_cache", "eval_cache", "offload_cache", "profiles", "token_cache", "runs", "wandb", ADAPTER_SUBDIR,
+}
+PRUNED_DIR_PREFIXES = ("checkpoint-", ".")
+
+
+def is_pruned_dir(name):
+    return name in PRUNED_DIR_NAMES or name.startswith(PRUNED_DIR_PREFIXES)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            total += entry.stat().st_size
+    return total
+
+
+def _final_loss(model_dir):
+    """Reads the last logged loss from the newest checkpoint's trainer_state.json, if any."""
+    states = glob.glob(os.path.join(model_dir, "checkpoint-*", "trainer_state.json"))
+    if not states:
+        return None
+    def step_of(path):
+        try:
+            return int(os.path.basename(os.path.dirname(path)).split("-")[-1])
+        except ValueError:
+            return -1
+    try:
+        with open(max(states, key=step_of), 'r', encoding='utf-8') as f:
+            log_history = json.load(f).get("log_history", [])
+    except (OSError, ValueError):
+        return None
+    losses = [entry["loss"] for entry in log_history if "loss" in entry]
+    return losses[-1] if losses else None
+
+
+def read_lora_metadata(model_dir):
+    """Metadata for one LoRA model directory (the parent of final_lora_adapter)."""
+    adapter_dir = os.path.join(model_dir, ADAPTER_SUBDIR)
+    config_path = os.path.join(adapter_dir, "adapter_config.json")
+    with open(config_path, 'r', encoding='utf-8') as f:
+        adapter_config = json.load(f)
+    return {
+        'path': model_dir,
+        'base_model': adapter_config.get("base_model_name_or_path"),
+        'lora_r': adapter_config.get("r"),
+        'adapter_size_bytes': _dir_size(adapter_dir),
+        'trained_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getmtime(config_path))),
+        'final_loss': _final_loss(model_dir),
+        'config_mtime': os.path.getmtime(config_path),
+    }
+
+
+class ModelCatalog:
+    """
+    Persistent, incrementally refreshed index of local LoRA model directories and HF cache base models.
+
+    Queries (`lora_dirs`, `base_models`, `lora_metadata`) only read the in-memory index, so the GUI can call
+    them on the Tk main thread. `refresh` re-walks the file system, but:
+    - directories like .git, checkpoint-*, final_lora_adapter are pruned;
+    - a directory whose mtime is unchanged reuses its cached sub-directory list instead of listing it again;
+    - LoRA metadata is only re-read when adapter_config.json changes.
+    """
+    def __init__(self, catalog_file=CATALOG_FILE, scan_root=".", hf_home=None):
+        self.catalog_file = catalog_file
+        self.scan_root = os.path.abspath(scan_root)
+        self.hf_home = hf_home or os.environ.get("HF_HOME", os.path.expanduser("~/.cache/huggingface"))
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.data = {'version': CATALOG_VERSION, 'dirs': {}, 'loras': {}, 'onnx': [], 'hub': {}, 'hub_mtime': None,
+                     'last_refresh': None}
+        self.load()
+
+    # --- Persistence ---
+    def load(self):
+        if not os.path.exists(self.catalog_file):
+            return
+        try:
+            with open(self.catalog_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CATALOG_VERSION:
+                self.data = data
+        except (OSError, ValueError) as e:
+            logging.warning(f"模型目录索引读取失败，将重新扫描: {e}")
+
+    def save(self):
+        temp_path = self.catalog_file + ".tmp"
+        with self.lock:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False)
+        os.replace(temp_path, self.catalog_file)
+
+    # --- Queries (instant, no file system access) ---
+    def lora_dirs(self):
+        with self.lock:
+            return sorted(self.data['loras'].keys())
+
+    def lora_metadata(self, model_dir):
+        with self.lock:
+            return dict(self.data['loras'].get(model_dir, {}))
+
+    def onnx_dirs(self):
+        with self.lock:
+            return list(self.data['onnx'])
+
+    def ollama_models(self):
+        with self.lock:
+            return list(self.data.get('ollama', []))
+
+    def base_models(self):
+        with self.lock:
+            return sorted({model_id for model_id in self.data['hub'].values() if model_id})
+
+    @property
+    def is_empty(self):
+        return self.data['last_refresh'] is None
+
+    # --- Scanning ---
+    def _scan_loras(self):
+        old_dirs = self.data['dirs']
+        new_dirs, found, onnx_found = {}, [], []
+        stack = [self.scan_root]
+        while stack:
+            path = stack.pop()
+            mtime = _mtime(path)
+            if mtime is None:
+                continue
+            cached = old_dirs.get(path)
+            if cached and cached['mtime'] == mtime:
+                subdirs, has_adapter, has_onnx = cached['subdirs'], cached['has_adapter'], cached['has_onnx']
+            else:
+                subdirs, has_adapter, has_onnx = [], False, False
+                try:
+                    for entry in os.scandir(path):
+                        if entry.name == ONNX_MANIFEST_FILE:
+                            has_onnx = True
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                        if entry.name == ADAPTER_SUBDIR:
+                            has_adapter = True
+                        elif not is_pruned_dir(entry.name):
+                            subdirs.append(entry.name)
+                except OSError:
+                    continue
+            new_dirs[path] = {'mtime': mtime, 'subdirs': subdirs, 'has_adapter': has_adapter, 'has_onnx': has_onnx}
+            if has_adapter:
+                found.append(path)
+            if has_onnx:
+                onnx_found.append(path)
+            stack.extend(os.path.join(path, name) for name in subdirs)
+
+        old_loras = self.data['loras']
+        loras = {}
+        for model_dir in found:
+            config_mtime = _mtime(os.path.join(model_dir, ADAPTER_SUBDIR, "adapter_config.json"))
+            if config_mtime is None:
+                continue
+            cached = old_loras.get(model_dir)
+            if cached and cached.get('config_mtime') == config_mtime:
+                loras[model_dir] = cached
+                continue
+            try:
+                loras[model_dir] = read_lora_metadata(model_dir)
+            except (OSError, ValueError) as e:
+                logging.warning(f"读取 LoRA 元数据失败 {model_dir}: {e}")
+        return new_dirs, loras, sorted(onnx_found)
+
+    def _scan_hub(self):
+        hub_path = os.path.join(self.hf_home, "hub")
+        hub_mtime = _mtime(hub_path)
+        if hub_mtime is None:
+            return {}, None
+        old_hub = self.data['hub'] if self.data.get('hub_mtime') is not None else {}
+        hub = {}
+        for item in os.listdir(hub_path):
+            if not item.startswith("models--"):
+                continue
+            model_dir = os.path.join(hub_path, item)
+            # 以 snapshots 目录的 mtime 作为缓存键: 新下载的版本会改变它
+            key = f"{item}@{_mtime(os.path.join(model_dir, 'snapshots')) or _mtime(model_dir)}"
+            if key in old_hub:
+                hub[key] = old_hub[key]
+                continue
+            hub[key] = _hub_model_id(model_dir, item)
+        return hub, hub_mtime
+
+    def refresh(self):
+        """Incrementally rescans LoRA directories and the HF hub cache, then persists the index."""
+        with self.refresh_lock, profiling.session(profiling.profile_dir("catalog"), "catalog_scan") as prof:
+            start = time.time()
+            with prof.stage("scan_loras"):
+                dirs, loras, onnx = self._scan_loras()
+            with prof.stage("scan_hub"):
+                hub, hub_mtime = self._scan_hub()
+            with prof.stage("scan_ollama"):
+                # 本地 Ollama 服务中的模型 ("ollama:<名称>")；服务未启动时为空
+                import ollama_backend
+                ollama = ollama_backend.list_models()
+            with self.lock:
+                self.data.update({'dirs': dirs, 'loras': loras, 'onnx': onnx, 'ollama': ollama, 'hub': hub, 'hub_mtime': hub_mtime,
+                                  'last_refresh': time.time()})
+            try:
+                self.save()
+            except OSError as e:
+                logging.warning(f"模型目录索引保存失败: {e}")
+            return time.time() - start
+
+    def refresh_async(self, callback=None):
+        """Refreshes in a daemon thread; `callback(seconds)` runs in that thread when finished."""
+        def worker():
+            try:
+                seconds = self.refresh()
+            except Exception as e:
+                logging.warning(f"模型目录后台刷新失败: {e}")
+                seconds = None
+            if callback:
+                callback(seconds)
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
+
+
+def _hub_model_id(model_dir, item):
+    """Returns the model ID for an HF hub cache folder if it holds a usable config.json, else None."""
+    model_name = item.replace("models--", "").replace("--", "/")
+    if os.path.exists(os.path.join(model_dir, "config.json")):
+        return model_name
+    snapshots_dir = os.path.join(model_dir, "snapshots")
+    if os.path.isdir(snapshots_dir):
+        for snapshot_version in os.listdir(snapshots_dir):
+            if os.path.exists(os.path.join(snapshots_dir, snapshot_version, "config.json")):
+                return model_name
+    return None
+
+
+_default_catalog = None
+_default_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """The process-wide catalog instance."""
+    global _default_catalog
+    with _default_catalog_lock:
+        if _default_catalog is None:
+            _default_catalog = ModelCatalog()
+        return _default_catalog
@@ -0,0 +1,163 @@
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CONFIG_FILE = "config.json"
+DEFAULT_SHARD_SIZE_MB = 2048
+DEFAULT_SAVE_THREADS = 4
+READ_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def load_io_settings():
+    """
+    Reads the save/scratch settings from config.json:
+    - scratch_dir: fast volume (tmpfs/NVMe) for temporary merged models, empty = system temp dir
+    - save_shard_size_mb: safetensors shard size
+    - save_threads: number of threads writing shards in parallel
+    """
+    config = {}
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, 'r') as f:
+            config = json.load(f)
+    return {
+        'scratch_dir': config.get("scratch_dir") or None,
+        'shard_size_mb': int(config.get("save_shard_size_mb") or DEFAULT_SHARD_SIZE_MB),
+        'num_threads': int(config.get("save_threads") or DEFAULT_SAVE_THREADS),
+    }
+
+
+def scratch_temp_dir(scratch_dir=None):
+    """A TemporaryDirectory on the configured scratch volume (or the system temp dir)."""
+    if scratch_dir:
+        os.makedirs(scratch_dir, exist_ok=True)
+    return tempfile.TemporaryDirectory(dir=scratch_dir or None)
+
+
+def _plan_shards(state_dict, max_shard_bytes):
+    """Groups tensors into shards of at most max_shard_bytes, keeping the state_dict order."""
+    shards, current, current_size = [], {}, 0
+    for name, tensor in state_dict.items():
+        size = tensor.numel() * tensor.element_size()
+        if current and current_size + size > max_shard_bytes:
+            shards.append(current)
+            current, current_size = {}, 0
+        current[name] = tensor
+        current_size += size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def _dedupe_shared_tensors(state_dict):
+    """
+    safetensors refuses tensors that share storage (e.g. tied embeddings / lm_head).
+    Keeps the first occurrence; tied weights are restored from the config on load.
+    Only detects the duplicates: the tensors stay where they are until their shard is written.
+    """
+    seen, result = set(), {}
+    for name, tensor in state_dict.items():
+        key = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape))
+        if key in seen:
+            continue
+        seen.add(key)
+        result[name] = tensor.detach()
+    return result
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass # 某些文件系统 (如 Windows 目录) 不支持 fsync
+    finally:
+        os.close(fd)
+
+
+def save_model_sharded(model, output_dir, shard_size_mb=DEFAULT_SHARD_SIZE_MB, num_threads=DEFAULT_SAVE_THREADS,
+                       log=print):
+    """
+    Saves a model as safetensors shards written in parallel, plus config and index files,
+    in the same layout as `save_pretrained`. Files are fsynced once at the end, not per shard.
+    Falls back to `save_pretrained` when weights are offloaded (meta tensors).
+    Returns a stats dict: bytes, seconds, mb_per_s, shards.
+    """
+    from safetensors.torch import save_file
+
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.time()
+    state_dict = model.state_dict()
+
+    if any(tensor.device.type == "meta" for tensor in state_dict.values()):
+        log("Weights are offloaded, falling back to save_pretrained.")
+        model.save_pretrained(output_dir, max_shard_size=f"{shard_size_mb}MB", safe_serialization=True)
+        total_bytes = sum(os.path.getsize(os.path.join(output_dir, f)) for f in os.listdir(output_dir))
+        seconds = time.time() - start
+        return {'bytes': total_bytes, 'seconds': seconds, 'mb_per_s': total_bytes / 1e6 / max(seconds, 1e-9), 'shards': None}
+
+    state_dict = _dedupe_shared_tensors(state_dict)
+    shards = _plan_shards(state_dict, shard_size_mb * 1024 * 1024)
+    total_shards = len(shards)
+    filenames = [
+        "model.safetensors" if total_shards == 1 else f"model-{i:05d}-of-{total_shards:05d}.safetensors"
+        for i in range(1, total_shards + 1)
+    ]
+
+    def write_shard(index):
+        # 每个线程只把自己正在写的分片复制到内存，峰值内存约为 num_threads 个分片
+        tensors = {name: tensor.to("cpu").contiguous() for name, tensor in shards[index].items()}
+        save_file(tensors, os.path.join(output_dir, filenames[index]), metadata={"format": "pt"})
+        return filenames[index]
+
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+        for name in pool.map(write_shard, range(total_shards)):
+            log(f"Shard written: {name}")
+
+    total_bytes = sum(t.numel() * t.element_size() for t in state_dict.values())
+    if total_shards > 1:
+        weight_map = {name: filenames[i] for i, shard in enumerate(shards) for name in shard}
+        with open(os.path.join(output_dir, "model.safetensors.index.json"), 'w') as f:
+            json.dump({"metadata": {"total_size": total_bytes}, "weight_map": weight_map}, f, indent=2)
+
+    model.config.save_pretrained(output_dir)
+    if getattr(model, "generation_config", None) is not None:
+        try:
+            model.generation_config.save_pretrained(output_dir)
+        except Exception:
+            pass # generation_config 保存失败不影响转换
+
+    # fsync 只在最后统一做一次
+    for name in os.listdir(output_dir):
+        _fsync_path(os.path.join(output_dir, name))
+    if os.name != "nt":
+        _fsync_path(output_dir)
+
+    seconds = time.time() - start
+    return {'bytes': total_bytes, 'seconds': seconds, 'mb_per_s': total_bytes / 1e6 / max(seconds, 1e-9),
+            'shards': total_shards}
+
+
+def measure_reload_throughput(model_dir, num_threads=DEFAULT_SAVE_THREADS):
+    """
+    Reads every safetensors shard in parallel and reports the read throughput.
+    This also warms the page cache right before the GGUF converter re-reads the files.
+    """
+    paths = [os.path.join(model_dir, f) for f in os.listdir(model_dir) if f.endswith(".safetensors")]
+
+    def read_file(path):
+        read_bytes = 0
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                read_bytes += len(chunk)
+        return read_bytes
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+        total_bytes = sum(pool.map(read_file, paths))
+    seconds = time.time() - start
+    return {'bytes': total_bytes, 'seconds': seconds, 'mb_per_s': total_bytes / 1e6 / max(seconds, 1e-9)}
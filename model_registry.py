@@ -0,0 +1,210 @@
+"""
+Process-wide registry of tokenizers, model configs, adapter configs and compiled chat templates.
+
+Loading a tokenizer (AutoTokenizer.from_pretrained) costs from a few hundred ms to seconds, with hub
+requests for remote IDs, and the same tokenizer / config.json / adapter_config.json used to be loaded again by
+every training run, pre-flight plan, model load and merge of a session. The getters here memoize them:
+
+- keys are (name or absolute path, revision, options); for local directories the modification times of
+  the files that were read are part of the key, so an edited or re-trained directory is loaded again;
+- each kind has its own LRU cache (the least recently used entries are dropped beyond `maxsize`);
+- thread-safe: concurrent requests for the same key load it once, the others wait for that result.
+
+Cached objects are shared. Callers must not mutate them beyond what get_tokenizer already does (pad_token
+falls back to eos_token); take a copy.deepcopy when a modified tokenizer is needed.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+TOKENIZER_CACHE_SIZE = 8
+CONFIG_CACHE_SIZE = 32
+ADAPTER_CONFIG_CACHE_SIZE = 128
+TEMPLATE_CACHE_SIZE = 16
+TOKENIZER_FILES = ("tokenizer_config.json", "tokenizer.json", "special_tokens_map.json", "vocab.json",
+                   "tokenizer.model", "chat_template.jinja")
+
+
+class LRUCache:
+    """Thread-safe LRU map with single-flight loading (get_or_load)."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {}  # key -> Lock held by the thread that is loading it
+        self.hits = self.misses = 0
+
+    def get_or_load(self, key, loader):
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key]
+                pending = self.loading.get(key)
+                if pending is None:
+                    pending = self.loading[key] = threading.Lock()
+                    pending.acquire()
+                    self.misses += 1
+                    break
+            # 另一个线程正在加载同一个键：等它完成后再查缓存 (加载失败时由本线程重试)
+            with pending:
+                pass
+        try:
+            value = loader()
+            with self.lock:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            return value
+        finally:
+            with self.lock:
+                del self.loading[key]
+            pending.release()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+_tokenizers = LRUCache(TOKENIZER_CACHE_SIZE)
+_configs = LRUCache(CONFIG_CACHE_SIZE)
+_adapter_configs = LRUCache(ADAPTER_CONFIG_CACHE_SIZE)
+_templates = LRUCache(TEMPLATE_CACHE_SIZE)
+
+
+def _source_key(name, files):
+    """(absolute path, mtimes of `files`) for a local directory, (name, None) for a hub model ID."""
+    if os.path.isdir(name):
+        stamps = []
+        for file_name in files:
+            try:
+                stamps.append(os.path.getmtime(os.path.join(name, file_name)))
+            except OSError:
+                stamps.append(None)
+        return os.path.abspath(name), tuple(stamps)
+    return name, None
+
+
+def get_tokenizer(name, revision=None, local_files_only=False, retries=1, on_retry=None):
+    """
+    AutoTokenizer for a model ID or directory (trust_remote_code, pad_token = eos_token if unset).
+    Loading is attempted `retries` times (at least once) with exponential backoff after network errors;
+    `on_retry(message)` reports them.
+    """
+    attempts = max(1, retries)
+
+    def load():
+        from transformers import AutoTokenizer
+        from requests.exceptions import ConnectionError, Timeout
+
+        for attempt in range(attempts):
+            try:
+                tokenizer = AutoTokenizer.from_pretrained(name, revision=revision, trust_remote_code=True,
+                                                          local_files_only=local_files_only)
+                break
+            except (ConnectionError, Timeout) as e:
+                if on_retry is not None:
+                    on_retry(f"网络连接错误 (尝试 {attempt + 1}/{attempts}): {e}")
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(2 ** attempt)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        return tokenizer
+
+    key = _source_key(name, TOKENIZER_FILES) + (revision, local_files_only)
+    return _tokenizers.get_or_load(key, load)
+
+
+def get_config_dict(name, revision=None):
+    """config.json of a local model directory or a Hugging Face model (from the hub cache if downloaded)."""
+    def load():
+        path = os.path.join(name, "config.json")
+        if not os.path.isfile(path):
+            from huggingface_hub import hf_hub_download
+            path = hf_hub_download(name, "config.json", revision=revision)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    key = _source_key(name, ("config.json",)) + (revision,)
+    return dict(_configs.get_or_load(key, load))
+
+
+def get_adapter_config(adapter_dir):
+    """adapter_config.json of a LoRA adapter directory as a dict (a copy; edit freely)."""
+    def load():
+        with open(os.path.join(adapter_dir, "adapter_config.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    return dict(_adapter_configs.get_or_load(_source_key(adapter_dir, ("adapter_config.json",)), load))
+
+
+def adapter_base_model(adapter_dir):
+    """base_model_name_or_path of a LoRA adapter directory (None if missing)."""
+    return get_adapter_config(adapter_dir).get("base_model_name_or_path")
+
+
+def chat_template(tokenizer):
+    """The tokenizer's chat template compiled once per template text (jinja2, as transformers does)."""
+    source = tokenizer.chat_template
+    if not isinstance(source, str):
+        raise ValueError("Tokenizer has no single chat template; use tokenizer.apply_chat_template.")
+
+    def load():
+        try:
+            from transformers.utils.chat_template_utils import _compile_jinja_template
+            return _compile_jinja_template(source)
+        except ImportError:
+            from jinja2.exceptions import TemplateError
+            from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+            def raise_exception(message):
+                # HF 对话模板用它拒绝不支持的消息 (如角色顺序错误)
+                raise TemplateError(message)
+
+            environment = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True)
+            environment.globals['raise_exception'] = raise_exception
+            return environment.from_string(source)
+
+    return _templates.get_or_load(source, load)
+
+
+def render_chat(tokenizer, messages, add_generation_prompt=False):
+    """Chat-template text of `messages`, the same as apply_chat_template(tokenize=False)."""
+    return chat_template(tokenizer).render(messages=messages, add_generation_prompt=add_generation_prompt,
+                                           **tokenizer.special_tokens_map)
+
+
+def encode_chats(tokenizer, conversations, add_generation_prompt=False):
+    """
+    Token ids (lists) of several conversations, the same as apply_chat_template(tokenize=True) on each, but
+    with the template compiled once and one batched tokenizer call.
+    """
+    from jinja2.exceptions import TemplateError
+
+    try:
+        texts = [render_chat(tokenizer, messages, add_generation_prompt) for messages in conversations]
+    except (ValueError, TemplateError):
+        return [tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=add_generation_prompt)
+                for messages in conversations]
+    if not texts:
+        return []
+    return tokenizer(texts, add_special_tokens=False)['input_ids']
+
+
+def clear():
+    for cache in (_tokenizers, _configs, _adapter_configs, _templates):
+        cache.clear()
+
+
+def stats():
+    return {'tokenizers': _tokenizers.stats(), 'configs': _configs.stats(),
+            'adapter_configs': _adapter_configs.stats(), 'chat_templates': _templates.stats()}
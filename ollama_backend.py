@@ -0,0 +1,284 @@
+"""
+Chat backend for models served by a local Ollama (its REST API, /api/chat).
+
+A model path of the form "ollama:<name>" (e.g. "ollama:zhexuejia:latest", what do_merge_and_import created)
+loads an OllamaChatModel instead of weights: inference_core.load_model_and_tokenizer / generate_response
+delegate here, so the chat tab, cli.py chat / bench / batch-infer and pipeline_api.compare_models can use an
+imported GGUF next to the in-process PEFT model.
+
+HTTP connections are kept alive in a small pool (http.client, no extra dependency) shared by all threads of
+the process, so concurrent requests (compare_models, Gradio) do not pay a TCP handshake each and at most
+`pool_size` requests are in flight; Ollama itself runs OLLAMA_NUM_PARALLEL of them at once.
+Responses are streamed (NDJSON) and every text chunk goes to the `on_text` callback as it arrives.
+
+Settings (config.json): ollama_host (default: $OLLAMA_HOST or http://127.0.0.1:11434), ollama_keep_alive
+(how long Ollama keeps the model loaded after a request, e.g. "5m", "1h", -1 = forever, 0 = unload now),
+ollama_pool_size (default 4), ollama_timeout (seconds, default 300).
+"""
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+import types
+from urllib.parse import urlsplit
+
+CONFIG_FILE = "config.json"
+MODEL_PREFIX = "ollama:"
+DEFAULT_HOST = "http://127.0.0.1:11434"
+DEFAULT_KEEP_ALIVE = "5m"
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 300
+# 服务端会关闭空闲的 keep-alive 连接；复用到这样的连接时重试一次
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError,
+                            ConnectionResetError)
+
+
+class OllamaError(RuntimeError):
+    pass
+
+
+def is_ollama_model(model_path):
+    return isinstance(model_path, str) and model_path.startswith(MODEL_PREFIX)
+
+
+def model_name(model_path):
+    return model_path[len(MODEL_PREFIX):] if is_ollama_model(model_path) else model_path
+
+
+def load_ollama_settings():
+    config = {}
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, 'r') as f:
+            config = json.load(f)
+    return {
+        'host': config.get("ollama_host") or os.environ.get("OLLAMA_HOST") or DEFAULT_HOST,
+        'keep_alive': config.get("ollama_keep_alive", DEFAULT_KEEP_ALIVE),
+        'pool_size': int(config.get("ollama_pool_size") or DEFAULT_POOL_SIZE),
+        'timeout': float(config.get("ollama_timeout") or DEFAULT_TIMEOUT),
+    }
+
+
+class ConnectionPool:
+    """Keep-alive HTTPConnections to one host; acquire() blocks while `size` connections are in use."""
+    def __init__(self, host, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        # OLLAMA_HOST 也允许不带协议的 "0.0.0.0:11434"
+        parts = urlsplit(host if "://" in host else "http://" + host)
+        self.scheme = parts.scheme
+        self.hostname = parts.hostname or "127.0.0.1"
+        if self.hostname == "0.0.0.0":
+            self.hostname = "127.0.0.1"
+        self.port = parts.port or (443 if self.scheme == "https" else 11434)
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.created = 0
+
+    def _new_connection(self):
+        self.created += 1
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.hostname, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def release(self, connection, reusable=True):
+        if reusable:
+            self.idle.put(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class OllamaClient:
+    """Minimal client for the Ollama REST API on top of a ConnectionPool."""
+    def __init__(self, host=None, keep_alive=None, pool_size=None, timeout=None):
+        settings = load_ollama_settings()
+        self.host = host or settings['host']
+        self.keep_alive = settings['keep_alive'] if keep_alive is None else keep_alive
+        self.pool = ConnectionPool(self.host, pool_size or settings['pool_size'], timeout or settings['timeout'])
+
+    def _send(self, method, path, payload):
+        """Returns (connection, response) with the response headers read; the caller reads the body."""
+        body = None if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        connection, reused = self.pool.acquire()
+        try:
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                connection.close()
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            self.pool.release(connection, reusable=False)
+            raise OllamaError(f"无法连接 Ollama 服务 {self.host}: {e}。请确认 Ollama 已启动 (ollama serve)。")
+        if response.status != 200:
+            detail = response.read().decode('utf-8', 'replace')
+            self.pool.release(connection, reusable=not response.will_close)
+            try:
+                detail = json.loads(detail).get('error', detail)
+            except ValueError:
+                pass
+            raise OllamaError(f"Ollama {path} 返回 HTTP {response.status}: {detail}")
+        return connection, response
+
+    def _request_json(self, method, path, payload=None):
+        connection, response = self._send(method, path, payload)
+        try:
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.pool.release(connection, reusable=False)
+            raise OllamaError(f"读取 Ollama 响应失败: {e}")
+        self.pool.release(connection, reusable=not response.will_close)
+        return json.loads(data) if data else {}
+
+    def list_models(self):
+        return sorted(model['name'] for model in self._request_json("GET", "/api/tags").get('models', []))
+
+    def load(self, model):
+        """Loads the model into memory (a chat request without messages) so the first answer is not slowed down."""
+        return self._request_json("POST", "/api/chat", {'model': model, 'messages': [], 'stream': False,
+                                                         'keep_alive': self.keep_alive})
+
+    def unload(self, model):
+        return self._request_json("POST", "/api/chat", {'model': model, 'messages': [], 'stream': False,
+                                                         'keep_alive': 0})
+
+    def chat(self, model, messages, options=None, on_text=None, cancel_event=None):
+        """
+        Streams one /api/chat answer. Returns {'text', 'seconds', 'ttft_seconds', 'eval_count',
+        'prompt_eval_count', 'tokens_per_s', 'cancelled'}; tokens/s is Ollama's own decode rate.
+        """
+        payload = {'model': model, 'messages': messages, 'stream': True, 'keep_alive': self.keep_alive}
+        if options:
+            payload['options'] = options
+        start = time.perf_counter()
+        connection, response = self._send("POST", "/api/chat", payload)
+        chunks, first_chunk_at, final, cancelled = [], None, {}, False
+        reusable = not response.will_close
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    # 关闭连接即让 Ollama 停止生成；这个连接不再复用
+                    cancelled, reusable = True, False
+                    break
+                line = response.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event.get('error'):
+                    reusable = False
+                    raise OllamaError(f"Ollama 生成失败: {event['error']}")
+                text = event.get('message', {}).get('content', "")
+                if text:
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                    chunks.append(text)
+                    if on_text is not None:
+                        on_text(text)
+                if event.get('done'):
+                    final = event
+                    break
+            if reusable and final:
+                response.read()  # 读完 chunked 结尾，连接才能复用
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            reusable = False
+            raise OllamaError(f"读取 Ollama 流式响应失败: {e}")
+        finally:
+            self.pool.release(connection, reusable=reusable and bool(final))
+        end = time.perf_counter()
+        eval_count = final.get('eval_count', len(chunks))
+        eval_seconds = final.get('eval_duration', 0) / 1e9
+        return {
+            'text': "".join(chunks),
+            'seconds': end - start,
+            'ttft_seconds': (first_chunk_at or end) - start,
+            'eval_count': eval_count,
+            'prompt_eval_count': final.get('prompt_eval_count'),
+            'tokens_per_s': eval_count / eval_seconds if eval_seconds > 0 else eval_count / max(end - start, 1e-9),
+            'cancelled': cancelled,
+        }
+
+    def close(self):
+        self.pool.close()
+
+
+class OllamaChatModel:
+    """Stands in for a loaded model: generate_response sends the conversation to Ollama."""
+    backend = "ollama"
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.config = types.SimpleNamespace(_name_or_path=MODEL_PREFIX + name)
+        self._local = threading.local()
+
+    @property
+    def last_stats(self):
+        """Stats of the last answer generated in the calling thread (see OllamaClient.chat)."""
+        return getattr(self._local, 'stats', {})
+
+    @last_stats.setter
+    def last_stats(self, stats):
+        self._local.stats = stats
+
+
+def list_models(client=None, timeout=2.0):
+    """Names of the models in the local Ollama store as "ollama:<name>" paths ([] if Ollama is not running)."""
+    client = client or OllamaClient(timeout=timeout)
+    try:
+        return [MODEL_PREFIX + name for name in client.list_models()]
+    except OllamaError:
+        return []
+    finally:
+        client.close()
+
+
+def load_model_and_tokenizer(model_path, status_queue):
+    """Same contract as inference_core.load_model_and_tokenizer; the tokenizer is None (Ollama tokenizes)."""
+    name = model_name(model_path)
+    try:
+        client = OllamaClient()
+        status_queue.put(f"连接 Ollama 服务 {client.host}，加载模型 {name} (keep_alive={client.keep_alive})...")
+        start = time.time()
+        client.load(name)
+        status_queue.put(f"Ollama 模型已加载 ({time.time() - start:.1f}s)。")
+        status_queue.put("模型准备就绪！")
+        return OllamaChatModel(name, client), None
+    except OllamaError as e:
+        status_queue.put(f"错误: {e}")
+        return None, None
+
+
+def generate_response(model, tokenizer, instruction, input_text, history, temperature=0.8, max_new_tokens=1000,
+                      on_text=None, cancel_event=None):
+    """inference_core.generate_response for an OllamaChatModel; the stats of the answer go to model.last_stats."""
+    messages = [{"role": "system", "content": instruction}]
+    for user_turn, assistant_turn in history:
+        messages.append({"role": "user", "content": user_turn})
+        messages.append({"role": "assistant", "content": assistant_turn})
+    messages.append({"role": "user", "content": input_text})
+    # 与 transformers 生成时的采样设置保持一致，便于对比
+    options = {'temperature': temperature, 'num_predict': max_new_tokens, 'top_k': 50, 'top_p': 0.95}
+    stats = model.client.chat(model.name, messages, options=options, on_text=on_text, cancel_event=cancel_event)
+    model.last_stats = stats
+    return stats['text']
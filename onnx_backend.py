@@ -0,0 +1,287 @@
+"""
+ONNX Runtime inference backend for CPU-only serving.
+
+`export_onnx` turns a model into an ONNX decoder graph with KV-cache inputs and outputs
+(past_key_values.<layer>.key/value -> present.<layer>.key/value, exported with optimum's
+text-generation-with-past task). A LoRA model directory is first merged into its base model in float32 on
+the CPU (the same merge_and_unload step as the merge pipeline), a merged model directory or hub ID is
+exported as is. The export directory also holds the tokenizer and onnx_export.json; with `quantize` the
+MatMul weights are additionally quantized to int8 (onnxruntime dynamic quantization).
+
+`OnnxCausalLM` runs the graph with ONNX Runtime: one prefill pass over the prompt, then one token per
+pass with the cache fed back, sampling in NumPy with the same settings as inference_core.generate_response
+(top_k 50, top_p 0.95, temperature). `generate_response` has the same signature as
+inference_core.generate_response, which delegates to it for ONNX models, so the chat tab, the CLI and
+Gradio sharing can load an export directory like any other model.
+
+Thread settings (config.json, or arguments): onnx_intra_op_threads (threads inside one operator, default:
+ONNX Runtime's choice = physical cores) and onnx_inter_op_threads (parallel operators, only used with
+onnx_parallel_execution). On a serving host with several model processes, give each a share of the cores.
+
+    python cli.py export-onnx ./lora_zhexuejia ./onnx_zhexuejia [--quantize]
+    python cli.py chat ./onnx_zhexuejia --message "你好"
+
+Dependencies (optional, only for this backend): onnxruntime, and optimum[exporters] for the export.
+"""
+import json
+import os
+import time
+import types
+
+MANIFEST_FILE = "onnx_export.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+DEFAULT_OPSET = 17
+CONFIG_FILE = "config.json"
+
+
+def log_status(callback, message):
+    print(message)
+    if callback:
+        callback(message)
+
+
+def is_onnx_model_dir(path):
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def load_onnx_settings():
+    """Thread settings from config.json (None = ONNX Runtime default)."""
+    config = {}
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, 'r') as f:
+            config = json.load(f)
+    return {
+        'intra_op_threads': config.get("onnx_intra_op_threads") or None,
+        'inter_op_threads': config.get("onnx_inter_op_threads") or None,
+        'parallel_execution': bool(config.get("onnx_parallel_execution", False)),
+    }
+
+
+# --- Export ---
+def _merge_lora(adapter_dir, output_dir, status_callback=None):
+    """Merges a LoRA adapter into its float32 base model on the CPU and saves the result to output_dir."""
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from peft import PeftModel
+
+    import model_registry
+    base_model_name = model_registry.adapter_base_model(adapter_dir)
+    log_status(status_callback, f"Merging LoRA adapter into {base_model_name} (float32, CPU)...")
+    base_model = AutoModelForCausalLM.from_pretrained(base_model_name, torch_dtype=torch.float32, trust_remote_code=True)
+    merged_model = PeftModel.from_pretrained(base_model, adapter_dir).merge_and_unload()
+    merged_model.save_pretrained(output_dir)
+    tokenizer_dir = adapter_dir if os.path.exists(os.path.join(adapter_dir, "tokenizer_config.json")) else base_model_name
+    AutoTokenizer.from_pretrained(tokenizer_dir, trust_remote_code=True).save_pretrained(output_dir)
+    return base_model_name
+
+
+def export_onnx(model_path, output_dir, opset=DEFAULT_OPSET, quantize=False, status_callback=None):
+    """
+    Exports a LoRA model directory / adapter directory (merged first), a merged model directory or a hub
+    ID to `output_dir` and checks the graph's first-step logits against PyTorch. Returns the manifest dict.
+    """
+    from optimum.exporters.onnx import main_export
+    from model_io import load_io_settings, scratch_temp_dir
+    from pipeline_api import resolve_adapter_dir
+
+    start = time.time()
+    adapter_dir = resolve_adapter_dir(model_path)
+    manifest = {'source': model_path, 'opset': opset, 'quantized': bool(quantize),
+                'exported_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+    os.makedirs(output_dir, exist_ok=True)
+    with scratch_temp_dir(load_io_settings()['scratch_dir']) as temp_dir:
+        source = model_path
+        if os.path.exists(os.path.join(adapter_dir, "adapter_config.json")):
+            source = os.path.join(temp_dir, "merged_model")
+            manifest['base_model'] = _merge_lora(adapter_dir, source, status_callback)
+        log_status(status_callback, f"Exporting ONNX graph with KV cache (opset {opset})...")
+        main_export(source, output=output_dir, task="text-generation-with-past", opset=opset, device="cpu",
+                    trust_remote_code=True)
+        manifest['export_seconds'] = time.time() - start
+        log_status(status_callback, "Checking ONNX logits against PyTorch...")
+        manifest['logits_check'] = check_logits(source, output_dir)
+    log_status(status_callback, f"Logits check: {manifest['logits_check']}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        log_status(status_callback, "Quantizing MatMul weights to int8...")
+        quantize_dynamic(os.path.join(output_dir, MODEL_FILE), os.path.join(output_dir, QUANTIZED_MODEL_FILE),
+                         weight_type=QuantType.QInt8, use_external_data_format=True)
+        manifest['model_file'] = QUANTIZED_MODEL_FILE
+    else:
+        manifest['model_file'] = MODEL_FILE
+    manifest['seconds'] = time.time() - start
+    manifest['bytes'] = sum(os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir))
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    log_status(status_callback, f"SUCCESS: ONNX model exported to {output_dir} ({manifest['bytes'] / 1e9:.2f} GB, "
+                                f"{manifest['seconds']:.0f}s).")
+    return manifest
+
+
+def check_logits(torch_model_path, onnx_dir, prompt="你好，请介绍一下你自己。"):
+    """Last-token logits of the prompt from PyTorch and from the exported graph: max abs diff and top-1 match."""
+    import numpy as np
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(onnx_dir, trust_remote_code=True)
+    input_ids = tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=True,
+                                              add_generation_prompt=True)
+    model = AutoModelForCausalLM.from_pretrained(torch_model_path, torch_dtype=torch.float32, trust_remote_code=True)
+    with torch.no_grad():
+        expected = model(input_ids=torch.tensor([input_ids])).logits[0, -1].numpy()
+    del model
+    onnx_model = OnnxCausalLM(onnx_dir, model_file=MODEL_FILE)
+    actual = onnx_model.forward(np.asarray([input_ids], dtype=np.int64), onnx_model.empty_cache())[0][0, -1]
+    return {'max_abs_diff': float(np.max(np.abs(expected - actual))),
+            'top1_match': int(np.argmax(expected)) == int(np.argmax(actual))}
+
+
+# --- Inference ---
+class OnnxCausalLM:
+    """A decoder graph with KV cache in an ONNX Runtime session."""
+    backend = "onnx"
+
+    def __init__(self, model_dir, intra_op_threads=None, inter_op_threads=None, parallel_execution=False,
+                 model_file=None):
+        import onnxruntime as ort
+
+        with open(os.path.join(model_dir, "config.json"), 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        if model_file is None and is_onnx_model_dir(model_dir):
+            with open(os.path.join(model_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                model_file = json.load(f).get('model_file')
+        self.model_dir = model_dir
+        # 与 transformers 模型一样可通过 model.config 读取 (如 Gradio 界面显示模型名)
+        self.config = types.SimpleNamespace(_name_or_path=model_dir, **config)
+        heads = config['num_attention_heads']
+        self.num_layers = config['num_hidden_layers']
+        self.num_kv_heads = config.get('num_key_value_heads', heads)
+        self.head_dim = config.get('head_dim') or config['hidden_size'] // heads
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = int(intra_op_threads)
+        if inter_op_threads:
+            options.inter_op_num_threads = int(inter_op_threads)
+        options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if parallel_execution
+                                  else ort.ExecutionMode.ORT_SEQUENTIAL)
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file or MODEL_FILE), options,
+                                            providers=["CPUExecutionProvider"])
+        inputs = {i.name: i for i in self.session.get_inputs()}
+        self.input_names = set(inputs)
+        # 缓存的精度与导出时一致 (float32，或 fp16 导出时为 float16)
+        self.cache_dtype = "float16" if inputs.get("past_key_values.0.key") is not None and \
+            "float16" in inputs["past_key_values.0.key"].type else "float32"
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        self.threads = {'intra_op': intra_op_threads, 'inter_op': inter_op_threads}
+
+    def empty_cache(self):
+        import numpy as np
+        shape = (1, self.num_kv_heads, 0, self.head_dim)
+        return [(np.zeros(shape, dtype=self.cache_dtype), np.zeros(shape, dtype=self.cache_dtype))
+                for _ in range(self.num_layers)]
+
+    def forward(self, input_ids, cache):
+        """(logits, new cache) for `input_ids` (1, n) appended after the cached positions."""
+        import numpy as np
+
+        past_length = cache[0][0].shape[2]
+        length = input_ids.shape[1]
+        feed = {'input_ids': input_ids,
+                'attention_mask': np.ones((1, past_length + length), dtype=np.int64)}
+        if 'position_ids' in self.input_names:
+            feed['position_ids'] = np.arange(past_length, past_length + length, dtype=np.int64)[None, :]
+        for layer, (key, value) in enumerate(cache):
+            feed[f"past_key_values.{layer}.key"] = key
+            feed[f"past_key_values.{layer}.value"] = value
+        outputs = dict(zip(self.output_names, self.session.run(None, feed)))
+        new_cache = [(outputs[f"present.{layer}.key"], outputs[f"present.{layer}.value"])
+                     for layer in range(self.num_layers)]
+        return outputs['logits'], new_cache
+
+    def generate(self, input_ids, max_new_tokens=1000, temperature=0.8, top_k=50, top_p=0.95, eos_token_id=None,
+                 streamer=None, seed=None):
+        """Generated token ids after `input_ids` (a list); `streamer` gets the prompt, then each new token."""
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        prompt = np.asarray([input_ids], dtype=np.int64)
+        if streamer is not None:
+            streamer.put(prompt)
+        logits, cache = self.forward(prompt, self.empty_cache())
+        generated = []
+        for _ in range(max_new_tokens):
+            token = sample_token(logits[0, -1], temperature, top_k, top_p, rng)
+            generated.append(token)
+            if streamer is not None:
+                streamer.put(np.asarray([token], dtype=np.int64))
+            if token == eos_token_id or len(generated) == max_new_tokens:
+                break
+            logits, cache = self.forward(np.asarray([[token]], dtype=np.int64), cache)
+        if streamer is not None:
+            streamer.end()
+        return generated
+
+
+def sample_token(logits, temperature=0.8, top_k=50, top_p=0.95, rng=None):
+    """Temperature + top-k + top-p (nucleus) sampling of one token, as in transformers' generate."""
+    import numpy as np
+
+    if not temperature or temperature <= 0:
+        return int(np.argmax(logits))
+    logits = logits.astype(np.float64) / temperature
+    k = min(top_k or len(logits), len(logits))
+    candidates = np.argpartition(-logits, k - 1)[:k]
+    candidates = candidates[np.argsort(-logits[candidates])]
+    probs = np.exp(logits[candidates] - logits[candidates[0]])
+    probs /= probs.sum()
+    # 保留累计概率达到 top_p 所需的最少 token (至少一个)
+    keep = (np.cumsum(probs) - probs) < top_p
+    probs = probs[keep] / probs[keep].sum()
+    rng = rng or np.random.default_rng()
+    return int(rng.choice(candidates[keep], p=probs))
+
+
+def load_model_and_tokenizer(model_dir, status_queue, intra_op_threads=None, inter_op_threads=None):
+    """Same contract as inference_core.load_model_and_tokenizer for an ONNX export directory."""
+    try:
+        from transformers import AutoTokenizer
+        settings = load_onnx_settings()
+        status_queue.put(f"检测到 ONNX 模型: {model_dir}")
+        tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True, local_files_only=True)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        status_queue.put("分词器加载成功。")
+        model = OnnxCausalLM(model_dir, intra_op_threads or settings['intra_op_threads'],
+                             inter_op_threads or settings['inter_op_threads'], settings['parallel_execution'])
+        status_queue.put(f"ONNX Runtime 会话已创建 (线程: {model.threads})。")
+        status_queue.put("模型准备就绪！")
+        return model, tokenizer
+    except Exception as e:
+        status_queue.put(f"错误: {e}")
+        import traceback
+        status_queue.put(traceback.format_exc())
+        return None, None
+
+
+def generate_response(model, tokenizer, instruction, input_text, history, temperature=0.8, max_new_tokens=1000,
+                      streamer=None):
+    """inference_core.generate_response for an OnnxCausalLM."""
+    import profiling
+
+    messages = [{"role": "system", "content": instruction}]
+    for user_turn, assistant_turn in history:
+        messages.append({"role": "user", "content": user_turn})
+        messages.append({"role": "assistant", "content": assistant_turn})
+    messages.append({"role": "user", "content": input_text})
+    input_ids = tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True)
+
+    prof = profiling.session(profiling.profile_dir("inference"), "generate_onnx")
+    with prof, prof.stage("generate"):
+        generated = model.generate(input_ids, max_new_tokens=max_new_tokens, temperature=temperature,
+                                   eos_token_id=tokenizer.eos_token_id, streamer=streamer)
+    return tokenizer.decode(generated, skip_special_tokens=True)
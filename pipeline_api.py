@@ -0,0 +1,386 @@
+"""
+Queue-free Python API for the training, inference and export pipelines.
+
+The core modules (train_core, inference_core, merge_and_import) report through GUI-style queues and
+callbacks. The functions here wrap them behind one optional `on_event(kind, payload)` callback and
+raise PipelineError on failure, so they can be used from scripts, the CLI (cli.py) and the GUI alike.
+
+Event kinds:
+- 'progress'      training progress dict (progress, eta_seconds, loss)
+- 'log'           training log line
+- 'status'        status line of model loading / merge / convert
+- 'task_progress' progress event of a GGUF conversion / Ollama import subprocess
+- 'item'          one finished batch inference / comparison record (index, total)
+- 'status'        also used by evaluate() for its stage messages
+"""
+import json
+import os
+import time
+
+ADAPTER_SUBDIR = "final_lora_adapter"
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+class PipelineError(RuntimeError):
+    pass
+
+
+class EventSink:
+    """Adapts `on_event(kind, payload)` to the queue (.put) and callback interfaces the core functions take."""
+    def __init__(self, on_event, kind, on_item=None):
+        self.on_event = on_event
+        self.kind = kind
+        self.on_item = on_item
+
+    def put(self, item):
+        if self.on_item is not None:
+            self.on_item(item)
+        if self.on_event is not None:
+            self.on_event(self.kind, item)
+
+    put_nowait = put
+    __call__ = put
+
+
+class _LastError:
+    """Remembers the last 'ERROR:' status line, used as the PipelineError message."""
+    def __init__(self):
+        self.message = None
+
+    def status(self, line):
+        if isinstance(line, str) and ("ERROR:" in line or line.startswith("错误:")):
+            self.message = line
+
+    def progress(self, data):
+        if isinstance(data, dict) and 'error' in data:
+            self.message = data['error']
+
+
+def resolve_adapter_dir(path):
+    """Accepts either a LoRA model directory (containing final_lora_adapter) or the adapter directory itself."""
+    if os.path.exists(os.path.join(path, ADAPTER_SUBDIR, "adapter_config.json")):
+        return os.path.join(path, ADAPTER_SUBDIR)
+    return path
+
+
+def read_adapter_base_model(adapter_dir):
+    import model_registry
+    base_model_name = model_registry.adapter_base_model(adapter_dir)
+    if not base_model_name:
+        raise PipelineError(f"'base_model_name_or_path' missing from {adapter_dir}/adapter_config.json")
+    return base_model_name
+
+
+# --- Training ---
+def train(data_path, output_dir, base_model=None, lora_adapter_path=None, on_event=None, cancel_event=None,
+          pause_event=None, hyperparams=None, tokenized_data_path=None, eval_data_path=None, num_processes=1, nnodes=1,
+          node_rank=0, master_addr="127.0.0.1", master_port=None):
+    """
+    Trains a new LoRA on `base_model`, or continues training `lora_adapter_path` (a LoRA model directory or
+    adapter directory; its base model is read from adapter_config.json).
+    `hyperparams` overrides train_core.DEFAULT_HYPERPARAMS; `tokenized_data_path` reuses a dataset saved by
+    train_core.prepare_tokenized_dataset instead of tokenizing `data_path` again. `eval_data_path` is a
+    separate validation set; without it a validation split is taken from the training data only when
+    hyperparams eval_split is set (off by default). With validation, the best checkpoint becomes final_lora_adapter.
+    Plain-text data (.txt/.md, a directory of them, or a .bin token file from pretrain_data) trains in
+    continued-pretraining mode on fixed-length windows (hyperparams data_format / max_length).
+    `data_path` may also be a weighted mixture such as "a.jsonl=0.7,b.jsonl=0.3" (see data_mixing).
+    `num_processes` > 1 (or `nnodes` > 1) trains data-parallel over that many processes per node with the
+    gloo backend (see distributed_train); events then come from rank 0.
+    Returns {'adapter_dir', 'seconds', 'cancelled'}; raises PipelineError on failure.
+    """
+    from train_core import resolve_hyperparams
+
+    try:
+        resolve_hyperparams(hyperparams)
+    except ValueError as e:
+        raise PipelineError(str(e))
+    if lora_adapter_path:
+        lora_adapter_path = resolve_adapter_dir(lora_adapter_path)
+        base_model = base_model or read_adapter_base_model(lora_adapter_path)
+    if not base_model:
+        raise PipelineError("A base model or an existing LoRA adapter is required.")
+
+    if num_processes * nnodes > 1:
+        import functools
+        from distributed_train import launch
+        train_fn = functools.partial(launch, num_processes=num_processes, nnodes=nnodes, node_rank=node_rank,
+                                     master_addr=master_addr, master_port=master_port)
+    else:
+        from train_core import start_training as train_fn
+
+    errors = _LastError()
+    start = time.time()
+    ok = train_fn(
+        base_model, data_path, output_dir,
+        EventSink(on_event, 'progress', errors.progress), EventSink(on_event, 'log'),
+        lora_adapter_path, cancel_event=cancel_event, pause_event=pause_event, hyperparams=hyperparams,
+        tokenized_data_path=tokenized_data_path, eval_data_path=eval_data_path
+    )
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    if not ok and not cancelled:
+        raise PipelineError(errors.message or "Training failed, see training_log.log in the output directory.")
+    return {'adapter_dir': os.path.join(output_dir, ADAPTER_SUBDIR) if ok else None,
+            'seconds': time.time() - start, 'cancelled': cancelled}
+
+
+# --- Inference ---
+def load_model(model_path, on_event=None, quantization=None):
+    """
+    Loads a base model ID or LoRA model directory for inference. Returns (model, tokenizer).
+    `quantization` is one of inference_core.QUANTIZATIONS (default: 4bit).
+    """
+    from inference_core import load_model_and_tokenizer, DEFAULT_QUANTIZATION
+
+    errors = _LastError()
+    model, tokenizer = load_model_and_tokenizer(resolve_adapter_dir(model_path), EventSink(on_event, 'status', errors.status),
+                                                quantization or DEFAULT_QUANTIZATION)
+    if model is None:
+        raise PipelineError(errors.message or f"Could not load model '{model_path}'.")
+    return model, tokenizer
+
+
+def chat(model, tokenizer, message, history=(), system_prompt=DEFAULT_SYSTEM_PROMPT, temperature=0.8, on_text=None,
+         max_new_tokens=1000):
+    """One chat turn. `history` is a list of (user, assistant) pairs; `on_text` receives the answer as it streams."""
+    from inference_core import generate_response
+    return generate_response(model, tokenizer, system_prompt, message, list(history), temperature,
+                             max_new_tokens=max_new_tokens, on_text=on_text)
+
+
+def count_new_tokens(model, tokenizer, response):
+    """Tokens of a generated answer; Ollama models report their own count (no local tokenizer)."""
+    if getattr(model, 'backend', None) == "ollama":
+        return model.last_stats.get('eval_count', 0)
+    return len(tokenizer(response, add_special_tokens=False)['input_ids'])
+
+
+def read_jsonl(path):
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as e:
+                raise PipelineError(f"{path}:{line_number}: invalid JSON: {e}")
+    return records
+
+
+def batch_infer(model_path, input_path, output_path, system_prompt=None, temperature=0.8, on_event=None,
+                cancel_event=None, model=None, tokenizer=None):
+    """
+    Runs every record of a JSONL file in the training format (instruction / input) through the model and
+    writes the records with an added 'response' field to `output_path`.
+    The record's own instruction is used as system prompt unless `system_prompt` is given.
+    Returns {'count', 'seconds', 'output_path'}.
+    """
+    records = read_jsonl(input_path)
+    if model is None:
+        model, tokenizer = load_model(model_path, on_event)
+
+    start = time.time()
+    written = 0
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for index, record in enumerate(records):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            item_start = time.time()
+            instruction = system_prompt or record.get('instruction') or DEFAULT_SYSTEM_PROMPT
+            response = chat(model, tokenizer, record.get('input', ""), system_prompt=instruction, temperature=temperature)
+            f.write(json.dumps(dict(record, response=response), ensure_ascii=False) + "\n")
+            f.flush()
+            written += 1
+            if on_event is not None:
+                on_event('item', {'index': index, 'total': len(records), 'seconds': time.time() - item_start,
+                                  'progress': written / len(records) * 100})
+    return {'count': written, 'seconds': time.time() - start, 'output_path': output_path}
+
+
+def bench_generation(model_path, prompts=None, repeat=3, temperature=0.8, on_event=None, model=None, tokenizer=None):
+    """
+    Measures generation latency and throughput (generated tokens per second) of one model.
+    Returns {'load_seconds', 'runs': [...], 'median_tokens_per_s', 'median_latency_seconds'}.
+    """
+    import statistics
+
+    prompts = prompts or ["你好，请介绍一下你自己。"]
+    load_seconds = 0.0
+    if model is None:
+        load_start = time.time()
+        model, tokenizer = load_model(model_path, on_event)
+        load_seconds = time.time() - load_start
+
+    runs = []
+    for _ in range(max(1, repeat)):
+        for prompt in prompts:
+            start = time.time()
+            response = chat(model, tokenizer, prompt, temperature=temperature)
+            seconds = time.time() - start
+            tokens = count_new_tokens(model, tokenizer, response)
+            run = {'prompt': prompt, 'seconds': seconds, 'new_tokens': tokens,
+                   'tokens_per_s': tokens / max(seconds, 1e-9)}
+            runs.append(run)
+            if on_event is not None:
+                on_event('item', dict(run, index=len(runs) - 1, total=len(prompts) * max(1, repeat)))
+    return {
+        'model': model_path,
+        'load_seconds': load_seconds,
+        'runs': runs,
+        'median_tokens_per_s': statistics.median(r['tokens_per_s'] for r in runs),
+        'median_latency_seconds': statistics.median(r['seconds'] for r in runs),
+    }
+
+
+def _timed_chat(model, tokenizer, record, system_prompt, temperature, max_new_tokens):
+    first_text_at = []
+
+    def on_text(text):
+        if not first_text_at:
+            first_text_at.append(time.perf_counter())
+
+    start = time.perf_counter()
+    instruction = system_prompt or record.get('instruction') or DEFAULT_SYSTEM_PROMPT
+    response = chat(model, tokenizer, record.get('input', ""), system_prompt=instruction, temperature=temperature,
+                    max_new_tokens=max_new_tokens, on_text=on_text)
+    end = time.perf_counter()
+    tokens = count_new_tokens(model, tokenizer, response)
+    ttft = (first_text_at[0] if first_text_at else end) - start
+    # 解码速度不含首段文本之前的预填充时间
+    decode_seconds = end - (first_text_at[0] if first_text_at else start)
+    return response, {'seconds': end - start, 'ttft_seconds': ttft, 'new_tokens': tokens,
+                      'tokens_per_s': max(tokens - 1, 1) / max(decode_seconds, 1e-9)}
+
+
+def compare_models(model_paths, input_path, output_path=None, system_prompt=None, temperature=0.8, max_new_tokens=512,
+                   concurrency=1, max_samples=None, on_event=None, cancel_event=None):
+    """
+    Runs the same JSONL records (instruction / input, as in batch_infer) through several models one after
+    another, e.g. a LoRA directory in-process and its GGUF import "ollama:<name>", and compares latency,
+    time to first text and tokens/s. Ollama models answer up to `concurrency` records at once over pooled
+    HTTP connections (aggregate throughput under concurrent load); in-process models answer one at a time.
+    With `output_path`, writes each record with a 'responses' dict {model: answer} for side-by-side review.
+    Returns {'count', 'models': {model: summary}, 'output_path'}.
+    """
+    import gc
+    import statistics
+    from concurrent.futures import ThreadPoolExecutor
+
+    records = read_jsonl(input_path)[:max_samples or None]
+    if not records:
+        raise PipelineError(f"No records in {input_path}.")
+    answers = [{} for _ in records]
+    summaries = {}
+    for model_path in model_paths:
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        load_start = time.time()
+        model, tokenizer = load_model(model_path, on_event)
+        load_seconds = time.time() - load_start
+        workers = max(1, concurrency) if getattr(model, 'backend', None) == "ollama" else 1
+        timings, done = [], 0
+        start = time.time()
+
+        def answer(index, model=model, tokenizer=tokenizer):
+            if cancel_event is not None and cancel_event.is_set():
+                return index, None, None
+            return (index,) + _timed_chat(model, tokenizer, records[index], system_prompt, temperature, max_new_tokens)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for index, response, timing in pool.map(answer, range(len(records))):
+                if response is None:
+                    continue
+                answers[index][model_path] = dict(timing, response=response)
+                timings.append(timing)
+                done += 1
+                if on_event is not None:
+                    on_event('item', dict(timing, model=model_path, index=index, total=len(records),
+                                          progress=done / len(records) * 100))
+        wall_seconds = time.time() - start
+        if timings:
+            summaries[model_path] = {
+                'load_seconds': load_seconds,
+                'concurrency': workers,
+                'count': len(timings),
+                'median_latency_seconds': statistics.median(t['seconds'] for t in timings),
+                'median_ttft_seconds': statistics.median(t['ttft_seconds'] for t in timings),
+                'median_tokens_per_s': statistics.median(t['tokens_per_s'] for t in timings),
+                # 并发时各请求的时间重叠，总吞吐按墙钟时间计算
+                'aggregate_tokens_per_s': sum(t['new_tokens'] for t in timings) / max(wall_seconds, 1e-9),
+                'wall_seconds': wall_seconds,
+            }
+            if on_event is not None:
+                on_event('status', f"{model_path}: " + ", ".join(f"{k}={v:.3g}" for k, v in summaries[model_path].items()))
+        # 依次加载各模型，释放前一个模型的显存 / 内存
+        del model, tokenizer
+        gc.collect()
+
+    if output_path:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for record, by_model in zip(records, answers):
+                f.write(json.dumps(dict(record, responses={m: a['response'] for m, a in by_model.items()},
+                                        timings={m: {k: v for k, v in a.items() if k != 'response'}
+                                                 for m, a in by_model.items()}), ensure_ascii=False) + "\n")
+    return {'count': len(records), 'models': summaries, 'output_path': output_path}
+
+
+# --- Evaluation ---
+def evaluate(model_dir, eval_path, batch_size=4, max_new_tokens=256, max_samples=None, use_cache=True, on_event=None,
+             quantization=None):
+    """
+    Perplexity and generation metrics of a trained LoRA and its base model on held-out JSONL (see eval_harness).
+    Results are also written to <model_dir>/eval_results.json. `quantization`: see eval_harness.evaluate_adapter.
+    """
+    from eval_harness import evaluate_adapter
+    return evaluate_adapter(model_dir, eval_path, batch_size=batch_size, max_new_tokens=max_new_tokens,
+                            max_samples=max_samples, use_cache=use_cache, quantization=quantization,
+                            on_status=EventSink(on_event, 'status'))
+
+
+# --- Export to Ollama ---
+def _run_export(function, args, on_event, cancel_event):
+    errors = _LastError()
+    start = time.time()
+    ok = function(*args, status_callback=EventSink(on_event, 'status', errors.status),
+                  progress_callback=EventSink(on_event, 'task_progress'), cancel_event=cancel_event)
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    if not ok and not cancelled:
+        raise PipelineError(errors.message or f"{function.__name__} failed.")
+    return {'seconds': time.time() - start, 'cancelled': cancelled}
+
+
+def merge(adapter_path, ollama_model_name, adapter_only=False, on_event=None, cancel_event=None):
+    """
+    Imports a trained LoRA into Ollama: either merged into its base model (full GGUF), or with
+    `adapter_only` as a GGUF adapter on top of the cached base model.
+    """
+    from merge_and_import import do_merge_and_import, do_adapter_import
+
+    function = do_adapter_import if adapter_only else do_merge_and_import
+    result = _run_export(function, (resolve_adapter_dir(adapter_path), ollama_model_name), on_event, cancel_event)
+    return dict(result, ollama_model_name=ollama_model_name)
+
+
+def export_onnx(model_path, output_dir, quantize=False, on_event=None):
+    """
+    Exports a LoRA model (merged into its base model first) or a merged / base model to an ONNX graph with
+    KV cache for CPU serving with ONNX Runtime (see onnx_backend). load_model() accepts the result.
+    """
+    from onnx_backend import export_onnx as run_export
+
+    try:
+        return run_export(model_path, output_dir, quantize=quantize, status_callback=EventSink(on_event, 'status'))
+    except ImportError as e:
+        raise PipelineError(f"ONNX export needs onnxruntime and optimum[exporters]: {e}")
+
+
+def export(base_model_id, ollama_model_name, on_event=None, cancel_event=None):
+    """Converts a Hugging Face base model to GGUF and imports it into Ollama."""
+    from merge_and_import import convert_base_model_to_ollama
+
+    result = _run_export(convert_base_model_to_ollama, (base_model_id, ollama_model_name), on_event, cancel_event)
+    return dict(result, ollama_model_name=ollama_model_name)
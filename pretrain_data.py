@@ -0,0 +1,250 @@
+"""
+Plain-text corpora for continued pretraining.
+
+Text files (.txt / .md, or a directory of them) are tokenized once, by several worker processes, into a flat
+token file: the token ids of all documents back to back, each document followed by EOS, stored as uint16
+(vocabularies up to 65535 tokens) or uint32. A JSON sidecar (<file>.bin.json) records the dtype, token count
+and the source files' sizes and mtimes, so the same corpus + tokenizer is never tokenized twice.
+
+Training reads fixed-length windows straight from the file through np.memmap: only the windows of the
+current batch are paged in, so corpora far larger than RAM train without a loading step.
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import time
+
+TOKEN_CACHE_DIR = "./token_cache"
+TOKEN_FILE_SUFFIX = ".bin"
+TEXT_SUFFIXES = (".txt", ".md")
+CHUNK_CHARS = 1 << 20 # 每个分词任务约 1M 字符
+MAX_EVAL_WINDOWS = 1000
+
+
+def meta_path(token_path):
+    return token_path + ".json"
+
+
+def read_token_meta(token_path):
+    with open(meta_path(token_path), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def token_dtype(vocab_size):
+    return "uint16" if vocab_size <= 65535 else "uint32"
+
+
+def list_text_files(path):
+    """A text file, or every .txt / .md file below a directory (sorted, so the token order is stable)."""
+    if os.path.isfile(path):
+        return [os.path.abspath(path)]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(TEXT_SUFFIXES))
+    return [os.path.abspath(f) for f in files]
+
+
+def is_text_data(path):
+    """True for token files, text files and directories of text files; False for JSONL (instruction data)."""
+    if not path:
+        return False
+    if os.path.isdir(path):
+        return bool(list_text_files(path))
+    return path.lower().endswith(TEXT_SUFFIXES + (TOKEN_FILE_SUFFIX,))
+
+
+def read_text_chunks(path, chunk_chars=CHUNK_CHARS):
+    """Yields pieces of about `chunk_chars` characters, cut at line ends so no word is split across chunks."""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        pending = ""
+        while True:
+            block = f.read(chunk_chars)
+            if not block:
+                break
+            block = pending + block
+            cut = block.rfind("\n")
+            if cut == -1 and len(block) < 4 * chunk_chars:
+                pending = block
+                continue
+            cut = cut if cut != -1 else len(block) - 1 # 超长的单行只能硬切
+            yield block[:cut + 1]
+            pending = block[cut + 1:]
+        if pending:
+            yield pending
+
+
+def _corpus_key(tokenizer_name, files):
+    digest = hashlib.sha1(tokenizer_name.encode('utf-8'))
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def encode_chunk(tokenizer, text, append_eos, dtype):
+    """Token ids of one chunk as a compact numpy array; lines are encoded as one batch."""
+    import itertools
+    import numpy as np
+    ids = list(itertools.chain.from_iterable(
+        tokenizer(text.splitlines(keepends=True), add_special_tokens=False)['input_ids']))
+    if append_eos and tokenizer.eos_token_id is not None:
+        ids.append(tokenizer.eos_token_id)
+    # 数组的进程间传输量只有 Python 列表的一小部分
+    return np.asarray(ids, dtype=dtype)
+
+
+# --- Worker processes ---
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer_name):
+    global _worker_tokenizer
+    # 并行来自多个进程，关闭每个进程内分词器的线程池，避免超额订阅 CPU
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    import model_registry
+    _worker_tokenizer = model_registry.get_tokenizer(tokenizer_name)
+
+
+def _tokenize_chunk(text, append_eos, dtype):
+    return encode_chunk(_worker_tokenizer, text, append_eos, dtype)
+
+
+def _chunk_tasks(files, chunk_chars):
+    """(text, append_eos) per chunk; the last chunk of every file gets an EOS so documents stay separated."""
+    for path in files:
+        previous = None
+        for chunk in read_text_chunks(path, chunk_chars):
+            if previous is not None:
+                yield previous, False
+            previous = chunk
+        if previous is not None:
+            yield previous, True
+
+
+def tokenize_text_files(tokenizer_name, data_path, output_path=None, num_workers=None, cache_dir=TOKEN_CACHE_DIR,
+                        chunk_chars=CHUNK_CHARS, log=print):
+    """
+    Tokenizes a text file or directory into a flat token file and returns its path. A token file
+    (.bin) is returned unchanged. Without `output_path` the file goes to `cache_dir`, keyed by tokenizer
+    and source files, and is reused as long as neither changes.
+    """
+    if data_path.lower().endswith(TOKEN_FILE_SUFFIX):
+        read_token_meta(data_path)
+        return data_path
+    files = list_text_files(data_path)
+    if not files:
+        raise ValueError(f"未找到文本文件 ({', '.join(TEXT_SUFFIXES)}): {data_path}")
+    key = _corpus_key(tokenizer_name, files)
+    if output_path is None:
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", os.path.basename(os.path.normpath(data_path)))
+        output_path = os.path.join(cache_dir, f"{slug}-{key}{TOKEN_FILE_SUFFIX}")
+    if os.path.exists(output_path) and os.path.exists(meta_path(output_path)):
+        meta = read_token_meta(output_path)
+        if meta.get('key') == key:
+            log(f"复用已分词的语料: {output_path} ({meta['num_tokens']} tokens)")
+            return output_path
+
+    import multiprocessing
+    import model_registry
+
+    tokenizer = model_registry.get_tokenizer(tokenizer_name)
+    dtype = token_dtype(len(tokenizer))
+    num_workers = num_workers or max(1, min(8, (os.cpu_count() or 2) - 1))
+    # 训练任务本身运行在守护子进程中，不能再创建进程池；此时由分词器 (Rust) 的线程池并行批量分词
+    if num_workers > 1 and multiprocessing.current_process().daemon:
+        log("在任务子进程中运行，改用分词器自带的多线程批量分词。")
+        num_workers = 1
+    log(f"正在分词 {len(files)} 个文本文件 ({num_workers} 个进程，{dtype})...")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    start = time.time()
+    num_tokens = 0
+    temp_path = output_path + ".tmp"
+    pool = None
+    if num_workers > 1:
+        pool = multiprocessing.get_context("spawn").Pool(num_workers, initializer=_init_worker, initargs=(tokenizer_name,))
+    try:
+        with open(temp_path, 'wb') as out:
+            if pool is None:
+                for text, append_eos in _chunk_tasks(files, chunk_chars):
+                    ids = encode_chunk(tokenizer, text, append_eos, dtype)
+                    out.write(ids.tobytes())
+                    num_tokens += len(ids)
+            else:
+                # 按顺序写出，同时最多有 2 * num_workers 个任务在途，内存占用与语料大小无关
+                pending = collections.deque()
+                for text, append_eos in _chunk_tasks(files, chunk_chars):
+                    pending.append(pool.apply_async(_tokenize_chunk, (text, append_eos, dtype)))
+                    if len(pending) >= 2 * num_workers:
+                        ids = pending.popleft().get()
+                        out.write(ids.tobytes())
+                        num_tokens += len(ids)
+                while pending:
+                    ids = pending.popleft().get()
+                    out.write(ids.tobytes())
+                    num_tokens += len(ids)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    os.replace(temp_path, output_path)
+
+    meta = {'key': key, 'tokenizer': tokenizer_name, 'dtype': dtype, 'num_tokens': num_tokens,
+            'vocab_size': len(tokenizer), 'eos_token_id': tokenizer.eos_token_id,
+            'sources': [{'path': p, 'bytes': os.path.getsize(p)} for p in files],
+            'seconds': time.time() - start}
+    with open(meta_path(output_path), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    log(f"分词完成: {num_tokens} tokens，用时 {meta['seconds']:.1f}s -> {output_path}")
+    return output_path
+
+
+class TokenWindowDataset:
+    """
+    Map-style dataset of non-overlapping `block_size` windows of a token file (windows [start, end)).
+    Windows are sliced from the memmap on access; labels equal input_ids (the model shifts them).
+    """
+    def __init__(self, token_path, block_size, start=0, end=None):
+        import numpy as np
+        meta = read_token_meta(token_path)
+        self.token_path = token_path
+        self.block_size = block_size
+        self.tokens = np.memmap(token_path, dtype=meta['dtype'], mode='r')
+        total = len(self.tokens) // block_size
+        self.start = start
+        self.end = total if end is None else min(end, total)
+
+    def __len__(self):
+        return max(0, self.end - self.start)
+
+    def __getitem__(self, index):
+        import numpy as np
+        import torch
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        offset = (self.start + index) * self.block_size
+        # 切片是 memmap 上的视图 (不复制)；只有转换为 embedding 需要的 int64 时复制这一个窗口
+        input_ids = torch.from_numpy(self.tokens[offset:offset + self.block_size].astype(np.int64))
+        return {'input_ids': input_ids, 'labels': input_ids.clone()}
+
+
+def window_datasets(token_path, block_size, eval_split=0.0, eval_token_path=None):
+    """
+    (train_dataset, eval_dataset) of windows. Without a separate eval token file, the last `eval_split`
+    of the windows (at most MAX_EVAL_WINDOWS) is held out; no split with fewer than 10 windows.
+    """
+    train_dataset = TokenWindowDataset(token_path, block_size)
+    if len(train_dataset) == 0:
+        raise ValueError(f"语料不足一个长度为 {block_size} 的窗口，请减小 max_length: {token_path}")
+    if eval_token_path:
+        return train_dataset, TokenWindowDataset(eval_token_path, block_size, end=MAX_EVAL_WINDOWS)
+    if not eval_split or len(train_dataset) < 10:
+        return train_dataset, None
+    num_eval = min(MAX_EVAL_WINDOWS, max(1, int(len(train_dataset) * eval_split)))
+    split = train_dataset.end - num_eval
+    return TokenWindowDataset(token_path, block_size, end=split), TokenWindowDataset(token_path, block_size, start=split)
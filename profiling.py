@@ -0,0 +1,292 @@
+"""
+Opt-in profiling of training, generation, merge and model catalog scans.
+
+Nothing is profiled unless modes are enabled, either with `set_modes` (Settings tab, `cli.py --profile`) or
+the LORA_PROFILE environment variable, e.g. LORA_PROFILE=timings,torch. `set_modes` also sets the variable,
+so training / merge / inference processes started afterwards inherit it.
+
+Modes:
+- timings   per-stage wall-clock breakdown, one JSON line per run in <dir>/<run>_timings.jsonl
+- cprofile  Python-level hot spots of the whole run: <run>_<time>.prof (pstats / snakeviz) + a text summary
+- torch     torch.profiler around the heavy stages (trainer.train, model.generate, merge_and_unload),
+            exported as Chrome traces (<run>_<time>_<stage>.pt.trace.json, open in chrome://tracing or Perfetto)
+- pyspy     samples the process with py-spy (must be on PATH) into a speedscope file
+
+The timings file always records the pid and wall-clock start of every stage, so an external
+`py-spy record --pid <pid>` can be lined up with the stages.
+
+When no mode is enabled `session()` returns a shared no-op object: no imports, timers or files.
+"""
+import contextlib
+import json
+import os
+import time
+
+PROFILE_ENV = "LORA_PROFILE"
+MODES = ("timings", "cprofile", "torch", "pyspy")
+DEFAULT_PROFILE_DIR = "./profiles"
+# torch.profiler 对训练只记录少量步 (跳过 1 步，预热 1 步，记录 3 步)，完整训练的 trace 会非常大
+TORCH_SCHEDULE = {'wait': 1, 'warmup': 1, 'active': 3}
+CPROFILE_SUMMARY_LINES = 40
+
+
+def parse_modes(value):
+    """'timings,torch' or an iterable of mode names -> tuple of modes; raises ValueError for unknown ones."""
+    if isinstance(value, str):
+        value = value.split(",")
+    modes = tuple(m.strip().lower() for m in value or () if m and m.strip())
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise ValueError(f"未知的性能分析模式: {', '.join(sorted(unknown))} (可选: {', '.join(MODES)})")
+    return modes
+
+
+def set_modes(modes):
+    modes = parse_modes(modes)
+    if modes:
+        os.environ[PROFILE_ENV] = ",".join(modes)
+    else:
+        os.environ.pop(PROFILE_ENV, None)
+    return modes
+
+
+def enabled_modes():
+    value = os.environ.get(PROFILE_ENV)
+    if not value:
+        return ()
+    try:
+        return parse_modes(value)
+    except ValueError:
+        return ()
+
+
+def profile_dir(kind):
+    """Default output directory for runs without an output directory of their own (inference, catalog)."""
+    return os.path.join(DEFAULT_PROFILE_DIR, kind)
+
+
+class _NullSession:
+    active = False
+    _stage = contextlib.nullcontext()
+
+    def start(self):
+        return self
+
+    def close(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def stage(self, name, trace=False, stepped=False):
+        return self._stage
+
+    def step(self):
+        pass
+
+
+NULL_SESSION = _NullSession()
+
+
+def session(output_dir, run_name):
+    """Profiling session for one run; a no-op object when profiling is disabled."""
+    modes = enabled_modes()
+    if not modes:
+        return NULL_SESSION
+    return ProfileSession(output_dir, run_name, modes)
+
+
+class ProfileSession:
+    """
+    Collects stage timings and profiler output of one run. Use as a context manager, or call start() and
+    close() when wrapping a long function body.
+    """
+    active = True
+
+    def __init__(self, output_dir, run_name, modes):
+        self.output_dir = output_dir
+        self.run_name = run_name
+        self.modes = modes
+        self.stamp = time.strftime('%Y%m%d-%H%M%S')
+        self.stages = []
+        self.files = []
+        self.notes = []
+        self.started_at = None
+        self._start = None
+        self._cprofile = None
+        self._pyspy = None
+        self._stepped_profiler = None
+        self._closed = False
+
+    def _path(self, suffix):
+        return os.path.join(self.output_dir, f"{self.run_name}_{self.stamp}{suffix}")
+
+    # --- Session ---
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        if 'pyspy' in self.modes:
+            self._start_pyspy()
+        if 'cprofile' in self.modes:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            try:
+                self._cprofile.enable()
+            except ValueError:
+                # 同一线程中已有其他 profiler (例如嵌套的会话) 时只记录阶段耗时
+                self._cprofile = None
+                self.notes.append("已有其他 cProfile 在运行，跳过 cProfile")
+        return self
+
+    def close(self, error=None):
+        if self._closed or self._start is None:
+            return
+        self._closed = True
+        total = time.perf_counter() - self._start
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._write_cprofile()
+        if self._pyspy is not None:
+            self._stop_pyspy()
+        line = {'run': self.run_name, 'pid': os.getpid(), 'started_at': self.started_at, 'total_seconds': total,
+                'stages': self.stages, 'modes': list(self.modes), 'files': self.files}
+        if error:
+            line['error'] = error
+        if self.notes:
+            line['notes'] = self.notes
+        with open(os.path.join(self.output_dir, f"{self.run_name}_timings.jsonl"), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(error=f"{exc_type.__name__}: {exc}" if exc_type else None)
+        return False
+
+    # --- Stages ---
+    @contextlib.contextmanager
+    def stage(self, name, trace=False, stepped=False):
+        """
+        Times one stage. `trace` runs torch.profiler around it when the torch mode is on; `stepped` stages
+        (training) call `step()` once per step so only a few steps are recorded.
+        """
+        profiler = self._start_torch(name, stepped) if trace and 'torch' in self.modes else None
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                self._stop_torch(profiler, name, stepped)
+            self.stages.append({'stage': name, 'start': started_at, 'seconds': seconds})
+
+    def step(self):
+        if self._stepped_profiler is not None:
+            self._stepped_profiler.step()
+
+    # --- torch.profiler ---
+    def _start_torch(self, name, stepped):
+        try:
+            import torch
+            from torch.profiler import profile, schedule, ProfilerActivity
+        except ImportError:
+            self.notes.append("torch 未安装，跳过 torch.profiler")
+            return None
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        trace_path = self._path(f"_{name}.pt.trace.json")
+        kwargs = {'activities': activities, 'record_shapes': True, 'profile_memory': True}
+        if stepped:
+            kwargs['schedule'] = schedule(repeat=1, **TORCH_SCHEDULE)
+            kwargs['on_trace_ready'] = lambda p: p.export_chrome_trace(trace_path)
+        profiler = profile(**kwargs)
+        profiler.__enter__()
+        profiler.trace_path = trace_path
+        if stepped:
+            self._stepped_profiler = profiler
+        return profiler
+
+    def _stop_torch(self, profiler, name, stepped):
+        try:
+            profiler.__exit__(None, None, None)
+            if stepped:
+                self._stepped_profiler = None
+            else:
+                profiler.export_chrome_trace(profiler.trace_path)
+            if not os.path.exists(profiler.trace_path):
+                self.notes.append(f"{name}: 步数不足，未生成 torch trace")
+                return
+            self.files.append(profiler.trace_path)
+            sort_by = "self_cuda_time_total" if len(profiler.activities) > 1 else "self_cpu_time_total"
+            table_path = self._path(f"_{name}.ops.txt")
+            with open(table_path, 'w', encoding='utf-8') as f:
+                f.write(profiler.key_averages().table(sort_by=sort_by, row_limit=40))
+            self.files.append(table_path)
+        except Exception as e:
+            self.notes.append(f"{name}: torch.profiler 输出失败: {e}")
+
+    # --- cProfile ---
+    def _write_cprofile(self):
+        import io
+        import pstats
+
+        stats_path = self._path(".prof")
+        self._cprofile.dump_stats(stats_path)
+        summary = io.StringIO()
+        pstats.Stats(self._cprofile, stream=summary).sort_stats("cumulative").print_stats(CPROFILE_SUMMARY_LINES)
+        summary_path = self._path(".prof.txt")
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            f.write(summary.getvalue())
+        self.files.extend([stats_path, summary_path])
+
+    # --- py-spy ---
+    def _start_pyspy(self):
+        import shutil
+        import subprocess
+
+        executable = shutil.which("py-spy")
+        if not executable:
+            self.notes.append("未找到 py-spy，跳过采样")
+            return
+        output_path = self._path(".speedscope.json")
+        self._pyspy = subprocess.Popen(
+            [executable, "record", "--pid", str(os.getpid()), "--format", "speedscope", "--output", output_path,
+             "--rate", "100", "--nonblocking"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._pyspy.output_path = output_path
+
+    def _stop_pyspy(self):
+        import signal
+        import subprocess
+
+        # py-spy 收到 SIGINT 后写出结果文件；Windows 上只能结束进程
+        if os.name == "nt":
+            self._pyspy.terminate()
+        else:
+            self._pyspy.send_signal(signal.SIGINT)
+        try:
+            self._pyspy.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._pyspy.kill()
+        if os.path.exists(self._pyspy.output_path):
+            self.files.append(self._pyspy.output_path)
+        else:
+            self.notes.append("py-spy 未写出结果 (可能缺少 ptrace 权限)")
+
+
+def trainer_callback(profile_session):
+    """TrainerCallback that advances the session's stepped torch.profiler after every optimizer step."""
+    from transformers.trainer_callback import TrainerCallback
+
+    class ProfilerStepCallback(TrainerCallback):
+        def on_step_end(self, args, state, control, **kwargs):
+            profile_session.step()
+
+    return ProfilerStepCallback()
@@ -0,0 +1,375 @@
+"""
+Hyperparameter sweeps over LoRA training.
+
+A sweep config (JSON) names the base model, the data, a search space and fixed overrides:
+
+    {
+        "base_model": "Qwen/Qwen2.5-0.5B-Instruct",
+        "data": "zhexuejia.jsonl",
+        "output_dir": "./sweeps/zhexuejia",
+        "strategy": "random",            # "grid" (all combinations of list values) or "random"
+        "num_trials": 8,                 # random only
+        "max_parallel": 1,               # trials running at once; keep 1 on a single GPU
+        "space": {
+            "lora_r": [8, 16, 32],
+            "lora_alpha": [16, 32, 64],
+            "learning_rate": {"log_uniform": [1e-5, 5e-4]},
+            "num_train_epochs": [1, 2, 3]
+        },
+        "fixed": {"save_strategy": "no"},
+        "prune": {"warmup_fraction": 0.25, "min_trials": 2, "window": 5},
+        "metric": "eval_loss"            # ranking metric: "eval_loss" or "train_loss" (default: see below)
+    }
+
+"data" may also be a plain-text corpus (continued pretraining) or a weighted mixture, e.g.
+"zhexuejia.jsonl=0.7,shangganwenxue.jsonl=0.3" or {"zhexuejia.jsonl": 0.7, "shangganwenxue.jsonl": 0.3}.
+
+The data is tokenized once and shared by all trials. Every trial runs in its own process (job_executor)
+and streams its loss curve back from ProgressCallback; MedianPruner cancels trials whose smoothed loss is
+worse than the median of the other trials at the same point of training. Results are written to
+leaderboard.json / leaderboard.csv in the sweep directory. All trials are ranked on one metric: the best
+validation loss ("eval_loss") or the mean of the last training losses ("train_loss"); without "metric" it is
+eval_loss once any trial has evaluated, else train_loss. Trials without a value for it rank last.
+
+For a quick CPU-only check of the sweep machinery use a tiny model, e.g.
+"base_model": "hf-internal-testing/tiny-random-LlamaForCausalLM", "fixed": {"max_steps": 10, "save_strategy": "no"}.
+"""
+import csv
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import time
+
+from job_executor import JobExecutor, EVENTS, CANCEL_EVENT
+
+SWEEP_DEFAULTS = {
+    'strategy': "grid",
+    'num_trials': 8,
+    'max_parallel': 1,
+    'seed': 0,
+    'fixed': {},
+    'prune': {},
+    'max_length': 1024,
+    'metric': None,
+}
+METRICS = ("eval_loss", "train_loss")
+PENDING, RUNNING, COMPLETED, PRUNED, FAILED = "pending", "running", "completed", "pruned", "failed"
+
+
+# --- Search space ---
+def sample_value(spec, rng):
+    """A list is a categorical choice; dicts describe distributions: uniform, log_uniform, int_uniform."""
+    if isinstance(spec, list):
+        return rng.choice(spec)
+    if isinstance(spec, dict) and len(spec) == 1:
+        (kind, (low, high)), = spec.items()
+        if kind == "uniform":
+            return rng.uniform(low, high)
+        if kind == "log_uniform":
+            return math.exp(rng.uniform(math.log(low), math.log(high)))
+        if kind == "int_uniform":
+            return rng.randint(low, high)
+    raise ValueError(f"Unsupported search space entry: {spec!r}")
+
+
+def expand_search_space(space, strategy="grid", num_trials=8, seed=0):
+    """Returns the list of hyperparameter dicts to try."""
+    names = sorted(space)
+    if strategy == "grid":
+        for name in names:
+            if not isinstance(space[name], list):
+                raise ValueError(f"Grid search needs a list of values for '{name}'")
+        return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+    if strategy == "random":
+        rng = random.Random(seed)
+        return [{name: sample_value(space[name], rng) for name in names} for _ in range(num_trials)]
+    raise ValueError(f"Unknown sweep strategy: {strategy}")
+
+
+# --- Pruning ---
+class MedianPruner:
+    """
+    Median stopping rule on the training loss curve.
+
+    Curves are indexed by the fraction of training done, so trials with different step counts compare at
+    the same point. After `warmup_fraction`, a trial is pruned when the mean of its last `window` losses is
+    worse than the median of the other trials' smoothed losses at that fraction, provided at least
+    `min_trials` other trials have reached it.
+    """
+    def __init__(self, warmup_fraction=0.25, min_trials=2, window=5, enabled=True):
+        self.warmup_fraction = warmup_fraction
+        self.min_trials = min_trials
+        self.window = window
+        self.enabled = enabled
+        self.curves = {}
+
+    def report(self, trial_id, fraction, loss):
+        self.curves.setdefault(trial_id, []).append((fraction, loss))
+
+    def smoothed_at(self, trial_id, fraction):
+        losses = [loss for f, loss in self.curves.get(trial_id, []) if f <= fraction]
+        if not losses:
+            return None
+        recent = losses[-self.window:]
+        return sum(recent) / len(recent)
+
+    def reached(self, trial_id, fraction):
+        curve = self.curves.get(trial_id)
+        return bool(curve) and curve[-1][0] >= fraction
+
+    def should_prune(self, trial_id):
+        curve = self.curves.get(trial_id)
+        if not self.enabled or not curve:
+            return False
+        fraction = curve[-1][0]
+        if fraction < self.warmup_fraction:
+            return False
+        others = [self.smoothed_at(other, fraction) for other in self.curves
+                  if other != trial_id and self.reached(other, fraction)]
+        others = [value for value in others if value is not None]
+        if len(others) < self.min_trials:
+            return False
+        return self.smoothed_at(trial_id, fraction) > statistics.median(others)
+
+
+def tokenized_data_key(base_model, data_path, max_length, dedup):
+    """Cache key of a tokenized training set: tokenizer, data file (path, size, mtime), max_length and dedup."""
+    stat = os.stat(data_path)
+    digest = hashlib.sha1(base_model.encode('utf-8'))
+    digest.update(f"{os.path.abspath(data_path)}|{stat.st_size}|{stat.st_mtime_ns}|{max_length}|{dedup}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+# --- Trials ---
+class Trial:
+    def __init__(self, trial_id, hyperparams, output_dir):
+        self.trial_id = trial_id
+        self.hyperparams = hyperparams
+        self.output_dir = output_dir
+        self.status = PENDING
+        self.job = None
+        self.losses = []
+        self.best_eval_loss = None
+        self.steps = 0
+        self.max_steps = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def final_loss(self):
+        """Mean of the last 5 logged training losses: less noisy than the very last step."""
+        recent = self.losses[-5:]
+        return sum(recent) / len(recent) if recent else None
+
+    def score(self, metric):
+        """The trial's value of the sweep's ranking metric (None if it has none, e.g. it never evaluated)."""
+        return self.best_eval_loss if metric == "eval_loss" else self.final_loss
+
+    def to_dict(self, metric="train_loss"):
+        return {
+            'trial_id': self.trial_id,
+            'status': self.status,
+            'metric': metric,
+            'score': self.score(metric),
+            'best_eval_loss': self.best_eval_loss,
+            'final_loss': self.final_loss,
+            'steps': self.steps,
+            'max_steps': self.max_steps,
+            'seconds': (self.finished_at or time.time()) - self.started_at if self.started_at else None,
+            'hyperparams': self.hyperparams,
+            'output_dir': self.output_dir,
+            'error': self.error,
+        }
+
+
+class SweepRunner:
+    """
+    Runs the trials of one sweep config. `on_event(kind, payload)` receives 'status', 'trial' (a trial
+    started/finished) and 'trial_progress' events; `train_fn` is the per-trial training function
+    (pipeline_api.train by default) and is replaceable for tests of the scheduling and pruning logic.
+    """
+    def __init__(self, config, on_event=None, train_fn=None, cancel_event=None, poll_interval=0.2):
+        self.config = dict(SWEEP_DEFAULTS, **config)
+        for key in ('base_model', 'data', 'output_dir', 'space'):
+            if key not in self.config:
+                raise ValueError(f"Sweep config is missing '{key}'")
+        if self.config['metric'] not in (None,) + METRICS:
+            raise ValueError(f"Unknown sweep metric: {self.config['metric']} (expected one of {', '.join(METRICS)})")
+        self.on_event = on_event
+        self.cancel_event = cancel_event
+        self.poll_interval = poll_interval
+        if train_fn is None:
+            import pipeline_api
+            train_fn = pipeline_api.train
+        self.train_fn = train_fn
+        self.output_dir = self.config['output_dir']
+        self.pruner = MedianPruner(**self.config['prune'])
+        self.executor = JobExecutor()
+        combos = expand_search_space(self.config['space'], self.config['strategy'], self.config['num_trials'],
+                                     self.config['seed'])
+        self.trials = [Trial(i, dict(self.config['fixed'], **combo), os.path.join(self.output_dir, f"trial_{i:03d}"))
+                       for i, combo in enumerate(combos)]
+
+    @property
+    def metric(self):
+        """The one metric all trials are ranked on: the configured one, else eval_loss once any trial evaluated."""
+        if self.config['metric']:
+            return self.config['metric']
+        return "eval_loss" if any(trial.best_eval_loss is not None for trial in self.trials) else "train_loss"
+
+    def _emit(self, kind, payload):
+        if self.on_event is not None:
+            self.on_event(kind, payload)
+
+    def prepare_data(self):
+        """Tokenizes the data once; trials load the saved dataset instead of tokenizing again."""
+        import data_mixing
+        import pretrain_data
+        mixture = data_mixing.parse_mixture(self.config['data'])
+        if mixture:
+            # 多数据源: 预先填充各数据源的分词缓存，trial 各自按权重抽样 (不传 tokenized_data_path)
+            self._emit('status', "Tokenizing every data source once for all trials...")
+            max_length = self.config['fixed'].get('max_length', self.config['max_length'])
+            data_mixing.prepare_sources(self.config['base_model'], mixture, max_length,
+                                        dedup=self.config['fixed'].get('dedup', False),
+                                        log=lambda line: self._emit('status', line))
+            return None
+        if pretrain_data.is_text_data(self.config['data']):
+            # 纯文本语料: 共享同一个 token 文件 (已分词过的语料直接复用缓存)
+            self._emit('status', "Tokenizing text corpus once for all trials...")
+            return pretrain_data.tokenize_text_files(self.config['base_model'], self.config['data'],
+                                                     log=lambda line: self._emit('status', line))
+        max_length = self.config['fixed'].get('max_length', self.config['max_length'])
+        dedup = bool(self.config['fixed'].get('dedup'))
+        # 缓存目录按 (基座模型, 数据文件, max_length, dedup) 区分，改动任何一项都会重新分词
+        key = tokenized_data_key(self.config['base_model'], self.config['data'], max_length, dedup)
+        path = os.path.join(self.output_dir, f"tokenized-{key}")
+        if os.path.isdir(path):
+            self._emit('status', f"Reusing tokenized data: {path}")
+            return path
+        import data_dedup
+        from train_core import prepare_tokenized_dataset
+        self._emit('status', "Tokenizing training data once for all trials...")
+        start = time.time()
+        data_path = self.config['data']
+        if dedup:
+            data_path = data_dedup.cached_dedup(data_path, self.config['base_model'], max_length,
+                                                log=lambda line: self._emit('status', line))
+        prepare_tokenized_dataset(self.config['base_model'], data_path, path, max_length)
+        self._emit('status', f"Tokenized data saved to {path} in {time.time() - start:.1f}s")
+        return path
+
+    def _start(self, trial, tokenized_path):
+        trial.status = RUNNING
+        trial.started_at = time.time()
+        trial.job = self.executor.submit(
+            f"trial-{trial.trial_id}", self.train_fn,
+            args=(self.config['data'], trial.output_dir),
+            kwargs={'base_model': self.config['base_model'], 'hyperparams': trial.hyperparams,
+                    'tokenized_data_path': tokenized_path, 'on_event': EVENTS, 'cancel_event': CANCEL_EVENT}
+        )
+        self._emit('trial', trial.to_dict(self.metric))
+
+    def _on_progress(self, trial, data):
+        if 'error' in data:
+            if trial.status != PRUNED:
+                trial.error = data['error']
+            return
+        if 'eval_loss' in data:
+            if trial.best_eval_loss is None or data['eval_loss'] < trial.best_eval_loss:
+                trial.best_eval_loss = data['eval_loss']
+            self._emit('trial_progress', {'trial_id': trial.trial_id, 'step': data.get('step'),
+                                          'eval_loss': data['eval_loss']})
+            return
+        loss = data.get('loss')
+        if not isinstance(loss, (int, float)):
+            return
+        trial.steps = data.get('step', trial.steps)
+        trial.max_steps = data.get('max_steps', trial.max_steps)
+        trial.losses.append(loss)
+        fraction = trial.steps / trial.max_steps if trial.max_steps else data.get('progress', 0) / 100
+        self.pruner.report(trial.trial_id, fraction, loss)
+        self._emit('trial_progress', {'trial_id': trial.trial_id, 'step': trial.steps, 'max_steps': trial.max_steps,
+                                      'loss': loss})
+        if trial.status == RUNNING and self.pruner.should_prune(trial.trial_id):
+            trial.status = PRUNED
+            trial.job.cancel()
+            self._emit('status', f"Pruning trial {trial.trial_id} at step {trial.steps} (loss {loss:.4f})")
+
+    def _finish(self, trial):
+        job = trial.job
+        trial.finished_at = time.time()
+        if trial.status != PRUNED:
+            if job.error:
+                trial.status = FAILED
+                trial.error = trial.error or job.error.strip().splitlines()[-1]
+            elif self.cancel_event is not None and self.cancel_event.is_set():
+                trial.status = FAILED
+                trial.error = "cancelled"
+            else:
+                trial.status = COMPLETED
+        job.join(timeout=1.0)
+        self.executor.jobs.remove(job)
+        trial.job = None
+        self._emit('trial', trial.to_dict(self.metric))
+        self.write_leaderboard()
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, "sweep_config.json"), 'w', encoding='utf-8') as f:
+            json.dump(self.config, f, ensure_ascii=False, indent=2)
+        tokenized_path = self.prepare_data()
+        self._emit('status', f"Running {len(self.trials)} trials, {self.config['max_parallel']} at a time")
+
+        pending = list(self.trials)
+        try:
+            while pending or self.executor.jobs:
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    pending.clear()
+                    for trial in self.trials:
+                        if trial.status == RUNNING:
+                            trial.job.cancel()
+                while pending and len(self.executor.jobs) < max(1, self.config['max_parallel']):
+                    self._start(pending.pop(0), tokenized_path)
+                for trial in [t for t in self.trials if t.job is not None]:
+                    trial.job.poll({'progress': lambda data, trial=trial: self._on_progress(trial, data)})
+                    if trial.job.finished:
+                        self._finish(trial)
+                time.sleep(self.poll_interval)
+        finally:
+            self.executor.shutdown()
+        return self.write_leaderboard()
+
+    def leaderboard(self):
+        """Completed trials by score first, then pruned trials (by the score they reached), then the rest."""
+        rank = {COMPLETED: 0, PRUNED: 1}
+        metric = self.metric
+        def key(trial):
+            loss = trial.score(metric)
+            return (rank.get(trial.status, 2), loss if loss is not None else float('inf'))
+        return [trial.to_dict(metric) for trial in sorted(self.trials, key=key)]
+
+    def write_leaderboard(self):
+        board = self.leaderboard()
+        with open(os.path.join(self.output_dir, "leaderboard.json"), 'w', encoding='utf-8') as f:
+            json.dump(board, f, ensure_ascii=False, indent=2)
+        param_names = sorted({name for entry in board for name in entry['hyperparams']})
+        with open(os.path.join(self.output_dir, "leaderboard.csv"), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["rank", "trial_id", "status", "metric", "score", "best_eval_loss", "final_loss", "steps", "seconds"]
+                            + param_names)
+            for rank, entry in enumerate(board, start=1):
+                writer.writerow([rank, entry['trial_id'], entry['status'], entry['metric'], entry['score'], entry['best_eval_loss'],
+                                 entry['final_loss'], entry['steps'], entry['seconds']]
+                                + [entry['hyperparams'].get(name) for name in param_names])
+        return board
+
+
+def load_sweep_config(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
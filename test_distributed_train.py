@@ -0,0 +1,93 @@
+"""
+Two-process smoke test of the distributed_train collectives on CPU with the gloo backend (no model, no GPU).
+
+    python -m pytest test_distributed_train.py
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import distributed_train
+
+WORLD_SIZE = 2
+TIMEOUT_SECONDS = 120
+
+
+def rank_main(rank, port, results_dir):
+    """One rank: runs each collective helper once and writes what it saw to rank<N>.json."""
+    os.environ.update(RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(WORLD_SIZE), MASTER_ADDR="127.0.0.1",
+                      MASTER_PORT=str(port))
+    import torch
+    import torch.distributed as dist
+
+    distributed_train.init_process_group()
+    try:
+        reduced = distributed_train.reduce_counts({'source_tokens': {'a': rank + 1, 'b': 10 * (rank + 1)}})
+
+        # rank r 处理 r + 1 条样本，每条 4 个 token
+        counter = distributed_train.TokenCounter(lambda features: {
+            'input_ids': torch.ones(len(features), 4, dtype=torch.long),
+            'attention_mask': torch.ones(len(features), 4, dtype=torch.long)})
+        counter([{}] * (rank + 1))
+        metrics = distributed_train.rank_metrics(counter)()
+
+        # 只有 rank 0 的取消事件被设置，广播后所有进程看到相同的状态
+        cancel_event = threading.Event()
+        if rank == 0:
+            cancel_event.set()
+        control = distributed_train.ControlSync(cancel_event)._state()
+
+        # DDP 对各进程的梯度求平均: 输入为 rank + 1 时，平均梯度为 1.5
+        model = torch.nn.Linear(2, 1, bias=False)
+        ddp_model = torch.nn.parallel.DistributedDataParallel(model)
+        ddp_model(torch.full((1, 2), float(rank + 1))).sum().backward()
+
+        with open(os.path.join(results_dir, f"rank{rank}.json"), 'w') as f:
+            json.dump({'world_info': distributed_train.world_info(), 'reduced': reduced, 'metrics': metrics,
+                       'control': control, 'grad': model.weight.grad.tolist()}, f)
+    finally:
+        dist.destroy_process_group()
+
+
+class GlooSmokeTest(unittest.TestCase):
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir, ignore_errors=True)
+
+    def test_two_ranks_on_cpu(self):
+        import torch.multiprocessing as mp
+
+        context = mp.spawn(rank_main, args=(distributed_train.free_port(), self.results_dir), nprocs=WORLD_SIZE,
+                           join=False)
+        deadline = time.time() + TIMEOUT_SECONDS
+        try:
+            while not context.join(timeout=1):
+                self.assertLess(time.time(), deadline, "gloo ranks did not finish in time")
+        finally:
+            for process in context.processes:
+                if process.is_alive():
+                    process.kill()
+
+        results = []
+        for rank in range(WORLD_SIZE):
+            with open(os.path.join(self.results_dir, f"rank{rank}.json")) as f:
+                results.append(json.load(f))
+        for rank, result in enumerate(results):
+            self.assertEqual(result['world_info'], [rank, rank, WORLD_SIZE])
+            self.assertEqual(result['reduced'], {'source_tokens': {'a': 3, 'b': 30}})
+            self.assertEqual(result['metrics']['world_size'], WORLD_SIZE)
+            self.assertEqual(result['metrics']['samples'], 3)
+            self.assertEqual(result['metrics']['tokens'], 12)
+            self.assertEqual(len(result['metrics']['rank_tokens_per_s']), WORLD_SIZE)
+            self.assertEqual(result['control'], [1, 0])
+            self.assertEqual(result['grad'], [[1.5, 1.5]])
+
+
+if __name__ == "__main__":
+    unittest.main()
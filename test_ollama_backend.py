@@ -0,0 +1,191 @@
+"""
+Tests for ollama_backend against a local stub of the Ollama REST API (no Ollama needed).
+
+    python -m pytest test_ollama_backend.py
+"""
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ollama_backend
+from ollama_backend import OllamaClient, OllamaError
+
+STREAM_CHUNKS = ["你好", "，", "世界"]
+
+
+class StubOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.in_flight = self.max_in_flight = 0
+        self.chunk_delay = 0.0
+        self.close_after_response = False  # 模拟服务端关闭空闲的 keep-alive 连接
+        self.requests = []
+
+    @property
+    def host(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({'models': [{'name': "qwen:latest"}, {'name': "lora-a:latest"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(payload)
+        if not payload.get('stream'):
+            self._send_json({'model': payload['model'], 'done': True})
+        else:
+            with self.server.lock:
+                self.server.in_flight += 1
+                self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for text in STREAM_CHUNKS:
+                    time.sleep(self.server.chunk_delay)
+                    event = {'model': payload['model'], 'message': {'role': "assistant", 'content': text}, 'done': False}
+                    self._write_chunk(json.dumps(event, ensure_ascii=False).encode('utf-8') + b"\n")
+                final = {'model': payload['model'], 'message': {'role': "assistant", 'content': ""}, 'done': True,
+                         'eval_count': len(STREAM_CHUNKS), 'eval_duration': 2 * 10 ** 8, 'prompt_eval_count': 7}
+                self._write_chunk(json.dumps(final).encode('utf-8') + b"\n")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # 客户端取消时关闭了连接
+            finally:
+                with self.server.lock:
+                    self.server.in_flight -= 1
+        if self.server.close_after_response:
+            self.close_connection = True
+
+
+class OllamaBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubOllama()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = OllamaClient(host=self.server.host, keep_alive="1m", pool_size=2, timeout=10)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def chat(self, **kwargs):
+        return self.client.chat("qwen:latest", [{'role': "user", 'content': "hi"}], **kwargs)
+
+    def test_streaming_and_stats(self):
+        received = []
+        stats = self.chat(options={'temperature': 0.8}, on_text=received.append)
+        self.assertEqual(received, STREAM_CHUNKS)
+        self.assertEqual(stats['text'], "".join(STREAM_CHUNKS))
+        self.assertEqual(stats['eval_count'], len(STREAM_CHUNKS))
+        self.assertEqual(stats['prompt_eval_count'], 7)
+        self.assertAlmostEqual(stats['tokens_per_s'], len(STREAM_CHUNKS) / 0.2)
+        self.assertLessEqual(stats['ttft_seconds'], stats['seconds'])
+        self.assertFalse(stats['cancelled'])
+        request = self.server.requests[-1]
+        self.assertEqual(request['keep_alive'], "1m")
+        self.assertEqual(request['options'], {'temperature': 0.8})
+
+    def test_keep_alive_reuses_connection(self):
+        for _ in range(3):
+            self.chat()
+        self.assertEqual(self.client.list_models(), ["lora-a:latest", "qwen:latest"])
+        self.assertEqual(self.client.pool.created, 1)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_pool_bounds_concurrent_requests(self):
+        self.server.chunk_delay = 0.05
+        results, errors = [], []
+
+        def worker():
+            try:
+                results.append(self.chat()['text'])
+            except Exception as e:  # 在主线程中报告
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        self.assertEqual(errors, [])
+        self.assertEqual(results, ["".join(STREAM_CHUNKS)] * 6)
+        self.assertLessEqual(self.server.max_in_flight, 2)
+        self.assertLessEqual(self.client.pool.created, 2)
+
+    def test_stale_connection_is_retried(self):
+        self.server.close_after_response = True
+        self.assertEqual(self.chat()['text'], "".join(STREAM_CHUNKS))
+        # 池中的连接已被服务端关闭：第二次请求失败后重新打开同一个连接对象重试一次
+        self.assertEqual(self.chat()['text'], "".join(STREAM_CHUNKS))
+        self.assertEqual(self.client.pool.created, 1)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_cancel_event_stops_stream(self):
+        self.server.chunk_delay = 0.05
+        cancel_event = threading.Event()
+        received = []
+
+        def on_text(text):
+            received.append(text)
+            cancel_event.set()
+
+        stats = self.chat(on_text=on_text, cancel_event=cancel_event)
+        self.assertTrue(stats['cancelled'])
+        self.assertEqual(received, STREAM_CHUNKS[:1])
+        self.assertEqual(stats['text'], STREAM_CHUNKS[0])
+        # 取消的连接不再复用，之后的请求照常完成
+        self.assertEqual(self.chat()['text'], "".join(STREAM_CHUNKS))
+        self.assertEqual(self.client.pool.created, 2)
+
+    def test_list_models_when_server_is_down(self):
+        host = self.server.host
+        self.server.shutdown()
+        self.server.server_close()
+        client = OllamaClient(host=host, timeout=1)
+        self.assertEqual(ollama_backend.list_models(client), [])
+        with self.assertRaises(OllamaError):
+            OllamaClient(host=host, timeout=1).list_models()
+        # tearDown 关闭的是一个新的空服务
+        self.server = StubOllama()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+if __name__ == "__main__":
+    unittest.main()
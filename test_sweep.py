@@ -0,0 +1,83 @@
+"""
+Tests for the sweep scheduler, median pruning and leaderboard with a fake training function (no model, no GPU).
+
+    python -m pytest test_sweep.py
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import sweep
+
+MAX_STEPS = 20
+
+
+def fake_train(data_path, output_dir, base_model=None, hyperparams=None, tokenized_data_path=None, on_event=None,
+               cancel_event=None):
+    """Streams a flat loss curve at hyperparams['loss'] like ProgressCallback; stops when cancelled."""
+    for step in range(1, MAX_STEPS + 1):
+        if cancel_event.is_set():
+            return {'cancelled': True}
+        on_event('progress', {'step': step, 'max_steps': MAX_STEPS, 'loss': hyperparams['loss']})
+        time.sleep(0.02)
+    return {'cancelled': False}
+
+
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.events = []
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def runner(self, space, **config):
+        runner = sweep.SweepRunner(dict({'base_model': "tiny", 'data': "data.jsonl", 'output_dir': self.output_dir,
+                                         'space': space, 'prune': {'min_trials': 2}}, **config),
+                                   on_event=lambda kind, payload: self.events.append((kind, payload)),
+                                   train_fn=fake_train, poll_interval=0.01)
+        runner.prepare_data = lambda: None
+        return runner
+
+    def test_prunes_worse_than_median_and_ranks(self):
+        # 顺序运行: trial 2 开始时已有两个完成的 trial (中位数 1.5)，它的损失 3.0 在预热后被剪枝
+        board = self.runner({'loss': [1.0, 2.0, 3.0, 0.5]}).run()
+        statuses = {entry['trial_id']: entry['status'] for entry in board}
+        self.assertEqual(statuses, {0: sweep.COMPLETED, 1: sweep.COMPLETED, 2: sweep.PRUNED, 3: sweep.COMPLETED})
+        self.assertEqual([entry['trial_id'] for entry in board], [3, 0, 1, 2])
+        self.assertEqual([entry['metric'] for entry in board], ["train_loss"] * 4)
+        self.assertEqual(board[0]['score'], 0.5)
+        pruned = board[-1]
+        self.assertLess(pruned['steps'], MAX_STEPS)
+        self.assertGreaterEqual(pruned['steps'] / MAX_STEPS, 0.25)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "leaderboard.csv")))
+        self.assertTrue(any(kind == 'status' and "Pruning trial 2" in payload for kind, payload in self.events))
+
+    def test_parallel_trials_all_complete_without_pruning(self):
+        board = self.runner({'loss': [1.0, 2.0, 3.0]}, max_parallel=3, prune={'enabled': False}).run()
+        self.assertEqual([entry['status'] for entry in board], [sweep.COMPLETED] * 3)
+        self.assertEqual([entry['trial_id'] for entry in board], [0, 1, 2])
+        self.assertEqual([entry['steps'] for entry in board], [MAX_STEPS] * 3)
+
+    def test_ranks_on_one_metric(self):
+        # 有验证损失时所有 trial 按验证损失排名，没有验证损失的 trial 不与之混排
+        runner = self.runner({'loss': [0.1, 0.5, 0.9]})
+        trials = runner.trials
+        for trial, losses, eval_loss in [(trials[0], [0.1], 0.7), (trials[1], [0.5], None), (trials[2], [0.9], 0.4)]:
+            trial.status, trial.losses, trial.best_eval_loss = sweep.COMPLETED, losses, eval_loss
+        self.assertEqual(runner.metric, "eval_loss")
+        self.assertEqual([entry['trial_id'] for entry in runner.leaderboard()], [2, 0, 1])
+        self.assertEqual([entry['score'] for entry in runner.leaderboard()], [0.4, 0.7, None])
+
+        runner.config['metric'] = "train_loss"
+        self.assertEqual([entry['trial_id'] for entry in runner.leaderboard()], [0, 1, 2])
+
+    def test_rejects_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            self.runner({'loss': [1.0]}, metric="accuracy")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,15 @@
 import time
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, TrainingArguments, Trainer, DataCollatorForLanguageModeling, BitsAndBytesConfig
-from peft import LoraConfig, get_peft_model, TaskType, prepare_model_for_kbit_training
-from datasets import Dataset, load_dataset
-from transformers.trainer_callback import TrainerCallback
 import os
 import logging
 import json
-from peft import PeftConfig # 导入 PeftConfig
+import math
+import profiling
+import pretrain_data
+import data_mixing
+import data_dedup
+import distributed_train
+import model_registry
+# torch / transformers / peft / datasets 在 start_training 中延迟导入，保证 GUI 启动时无需加载这些重量级框架
 
 # --- Local LoRA Model Integration ---
 def get_local_lora_base_models(base_path="."):
@@ -62,9 +64,13 @@ def get_existing_lora_dirs(base_path="."):
     """
     扫描指定路径下所有包含 'final_lora_adapter' 子目录的父目录路径。
     返回一个包含这些 LoRA 模型目录路径的列表。
+    GUI 使用 model_catalog 中带增量索引的版本，这里保留一次性完整扫描的接口。
     """
+    from model_catalog import is_pruned_dir
     existing_lora_dirs = []
     for root, dirs, files in os.walk(base_path):
+        # 跳过 .git、checkpoint-* 等不可能包含 LoRA 模型目录的子目录
+        dirs[:] = [d for d in dirs if d == "final_lora_adapter" or not is_pruned_dir(d)]
         if "final_lora_adapter" in dirs:
             lora_model_path = os.path.abspath(root)
             # 再次检查 adapter_config.json 确保是有效的 LoRA 模型目录
@@ -72,30 +78,269 @@ def get_existing_lora_dirs(base_path="."):
                 existing_lora_dirs.append(lora_model_path)
     return sorted(existing_lora_dirs), None # 返回排序后的列表和None
 
-# 定义一个自定义的回调类，用于将进度更新传给GUI
-class ProgressCallback(TrainerCallback):
-    def __init__(self, progress_queue):
-        self.progress_queue = progress_queue
-        self.start_time = time.time()
-
-    def on_step_begin(self, args, state, control, **kwargs):
-        # 计算进度百分比
-        progress = (state.global_step / state.max_steps) * 100
-        # 计算预估剩余时间
-        elapsed_time = time.time() - self.start_time
-        if state.global_step > 0:
-            time_per_step = elapsed_time / state.global_step
-            remaining_steps = state.max_steps - state.global_step
-            eta = time_per_step * remaining_steps
+def build_process_func(tokenizer, max_length=1024):
+    """
+    返回把一条 instruction/input/output 样本转换为 input_ids + labels 的处理函数，
+    提示部分 (system + user) 的标签被设为 -100，只在 output 上计算损失。
+    """
+    import torch
+
+    def process_func(example):
+        # 构建符合Qwen-Chat模板的消息列表
+        messages = [
+            {"role": "system", "content": example['instruction']},
+            {"role": "user", "content": example['input']},
+            {"role": "assistant", "content": example['output']}
+        ]
+        
+        # 对完整的对话进行分词
+        tokenized_full = tokenizer.apply_chat_template(
+            messages,
+            tokenize=True,
+            add_generation_prompt=False, # 训练时不需要额外的生成提示
+            truncation=True,
+            max_length=max_length,
+            return_tensors="pt"
+        )
+        
+        # 确保 tokenized_full 是一个 BatchEncoding 对象，并且有 input_ids 属性
+        # 或者是一个非空的 Tensor
+        labels = None
+        if isinstance(tokenized_full, dict) and 'input_ids' in tokenized_full:
+            labels = tokenized_full['input_ids'].clone()
+        elif isinstance(tokenized_full, torch.Tensor) and tokenized_full.numel() > 0:
+            labels = tokenized_full.clone()
         else:
-            eta = float('inf')
+            raise ValueError("Unexpected type or empty output for tokenized_full from tokenizer.apply_chat_template")
+        
+        # 对提示部分（system + user）进行分词，用于计算标签的忽略位置
+        prompt_messages = [
+            {"role": "system", "content": example['instruction']},
+            {"role": "user", "content": example['input']}
+        ]
+        
+        # 使用 apply_chat_template 处理提示部分
+        tokenized_prompt_output = tokenizer.apply_chat_template(
+            prompt_messages,
+            tokenize=True,
+            add_generation_prompt=True, # 确保这里包含 assistant 提示，与推理时一致
+            truncation=True,
+            max_length=max_length, # 确保截断，避免过长序列
+            return_tensors="pt"
+        )
         
-        # 将进度和ETA放入队列
-        self.progress_queue.put({'progress': progress, 'eta_seconds': eta, 'loss': state.log_history[-1]['loss'] if state.log_history else 'N/A'})
+        # 确保 tokenized_prompt_output 是一个 BatchEncoding 对象，并且有 input_ids 属性
+        # 或者是一个非空的 Tensor
+        prompt_len = 0
+        if isinstance(tokenized_prompt_output, dict) and 'input_ids' in tokenized_prompt_output:
+            # 如果是 BatchEncoding 字典形式
+            prompt_len = tokenized_prompt_output['input_ids'].shape[1]
+        elif isinstance(tokenized_prompt_output, torch.Tensor) and tokenized_prompt_output.numel() > 0:
+            # 如果是 Tensor 形式且非空
+            prompt_len = tokenized_prompt_output.shape[1]
+        
+        # 创建标签，将提示部分的标签设为-100
+        # 确保 prompt_len 不会超出 labels 的维度
+        if prompt_len > 0 and labels is not None and prompt_len <= labels.shape[1]:
+            labels[:, :prompt_len] = -100
+        
+        return {
+            "input_ids": tokenized_full.input_ids.squeeze(0) if isinstance(tokenized_full, dict) else tokenized_full.squeeze(0), # 移除批次维度
+            "labels": labels.squeeze(0) # 移除批次维度
+        }
+
+    return process_func
+
+def tokenize_dataset(raw_dataset, tokenizer, max_length=1024):
+    return raw_dataset.map(build_process_func(tokenizer, max_length), remove_columns=raw_dataset.column_names)
+
+def prepare_tokenized_dataset(base_model_name, data_path, output_path, max_length=1024):
+    """
+    分词一次并保存到磁盘 (Arrow 格式，按需内存映射)，供多个训练任务 (如超参数搜索的各个 trial) 共享。
+    返回 output_path。
+    """
+    from datasets import load_dataset
+
+    tokenizer = model_registry.get_tokenizer(base_model_name)
+    raw_dataset = load_dataset("json", data_files=data_path, split="train")
+    tokenize_dataset(raw_dataset, tokenizer, max_length).save_to_disk(output_path)
+    return output_path
+
+_progress_callback_class = None
+
+def get_progress_callback_class():
+    """
+    返回 ProgressCallback 类。该类继承自 transformers 的 TrainerCallback，
+    因此在第一次使用时才创建，避免导入本模块时就加载 transformers。
+    """
+    global _progress_callback_class
+    if _progress_callback_class is not None:
+        return _progress_callback_class
+
+    from transformers.trainer_callback import TrainerCallback
+
+    # 定义一个自定义的回调类，用于将进度更新传给GUI
+    class ProgressCallback(TrainerCallback):
+        def __init__(self, progress_queue, extra_metrics=None):
+            self.progress_queue = progress_queue
+            self.extra_metrics = extra_metrics # 可选: 返回附加到进度事件中的字典 (如各数据源的 token 数)
+            self.start_time = time.time()
+
+        def on_step_begin(self, args, state, control, **kwargs):
+            # 计算进度百分比
+            progress = (state.global_step / state.max_steps) * 100
+            # 计算预估剩余时间
+            elapsed_time = time.time() - self.start_time
+            if state.global_step > 0:
+                time_per_step = elapsed_time / state.global_step
+                remaining_steps = state.max_steps - state.global_step
+                eta = time_per_step * remaining_steps
+            else:
+                eta = float('inf')
+            
+            # 将进度和ETA放入队列 (最近一条日志可能不含 loss，例如评估记录)
+            losses = [entry['loss'] for entry in state.log_history[-3:] if 'loss' in entry]
+            data = {'progress': progress, 'eta_seconds': eta, 'loss': losses[-1] if losses else 'N/A',
+                    'step': state.global_step, 'max_steps': state.max_steps}
+            if self.extra_metrics is not None:
+                data.update(self.extra_metrics())
+            self.progress_queue.put(data)
+
+        def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+            # 周期性评估的结果也通过同一个队列上报
+            if metrics and 'eval_loss' in metrics:
+                self.progress_queue.put({'progress': (state.global_step / state.max_steps) * 100,
+                                         'eta_seconds': float('inf'), 'loss': 'N/A',
+                                         'step': state.global_step, 'max_steps': state.max_steps,
+                                         'eval_loss': metrics['eval_loss'], 'best_eval_loss': state.best_metric})
+
+    _progress_callback_class = ProgressCallback
+    return _progress_callback_class
+
+_control_callback_class = None
+
+def get_control_callback_class():
+    """
+    返回 ControlCallback 类：在每个训练步之间检查取消/暂停事件 (threading.Event 或 multiprocessing.Event)。
+    与 ProgressCallback 一样延迟创建。
+    """
+    global _control_callback_class
+    if _control_callback_class is not None:
+        return _control_callback_class
+
+    from transformers.trainer_callback import TrainerCallback
+
+    class ControlCallback(TrainerCallback):
+        def __init__(self, cancel_event=None, pause_event=None):
+            self.cancel_event = cancel_event
+            self.pause_event = pause_event
+            self.cancelled = False
+
+        def on_step_end(self, args, state, control, **kwargs):
+            # 暂停：在两个训练步之间等待，直到恢复或取消
+            while self.pause_event is not None and self.pause_event.is_set():
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    break
+                time.sleep(0.2)
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                self.cancelled = True
+                control.should_training_stop = True
+                control.should_save = False
+
+    _control_callback_class = ControlCallback
+    return _control_callback_class
+
+def __getattr__(name):
+    # 兼容 `from train_core import ProgressCallback` 的写法
+    if name == "ProgressCallback":
+        return get_progress_callback_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def split_eval_dataset(tokenized_dataset, tokenizer, hp, eval_data_path=None, logger=logging):
+    """
+    返回 (train_dataset, eval_dataset)。验证集按长度降序排列：评估时同一批次的样本长度相近，补齐的 token 最少。
+    数据太少 (不足 10 条) 时不自动划分验证集。
+    """
+    if eval_data_path:
+        from datasets import load_dataset
+        raw_eval = load_dataset("json", data_files=eval_data_path, split="train")
+        train_dataset, eval_dataset = tokenized_dataset, tokenize_dataset(raw_eval, tokenizer, hp['max_length'])
+        logger.info(f"使用独立验证集: {eval_data_path} ({len(eval_dataset)} 条)")
+    elif hp['eval_split'] and len(tokenized_dataset) >= 10:
+        split = tokenized_dataset.train_test_split(test_size=hp['eval_split'], seed=hp['seed'])
+        train_dataset, eval_dataset = split['train'], split['test']
+        logger.info(f"从训练数据中划分验证集: 训练 {len(train_dataset)} 条，验证 {len(eval_dataset)} 条")
+    else:
+        if hp['eval_split']:
+            logger.info("训练数据不足 10 条，不划分验证集。")
+        return tokenized_dataset, None
+    eval_dataset = eval_dataset.map(lambda example: {'length': len(example['input_ids'])})
+    eval_dataset = eval_dataset.sort('length', reverse=True).remove_columns('length')
+    return train_dataset, eval_dataset
+
+# 默认超参数；start_training 的 hyperparams 参数只需给出要覆盖的项
+DEFAULT_HYPERPARAMS = {
+    'lora_r': 16,
+    'lora_alpha': 32,
+    'lora_dropout': 0.1,
+    'target_modules': ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
+    'learning_rate': 2e-4,
+    'num_train_epochs': 8,
+    'max_steps': -1,
+    'per_device_train_batch_size': 1,
+    'gradient_accumulation_steps': 8,
+    'lr_scheduler_type': "cosine",
+    'warmup_ratio': 0.1,
+    'max_length': 1024,
+    'save_strategy': "epoch",
+    'save_total_limit': 2,
+    'seed': 42,
+    # 周期性评估 (需显式开启): 未提供评估文件时从训练数据中划出 eval_split 比例作验证集，如 0.1 (0 = 不评估)
+    'eval_split': 0,
+    'eval_steps': None, # None = 每个 epoch 评估一次
+    'per_device_eval_batch_size': 4,
+    # 验证损失连续 N 次评估没有改善时提前停止 (None/0 = 不提前停止)；有验证集时最终适配器始终是验证损失最低的检查点
+    'early_stopping_patience': None,
+    'early_stopping_threshold': 0.0,
+    # None 表示自动: 有 CUDA 时启用。在 CPU 上用小模型训练 (如测试超参数搜索) 时它们会自动关闭
+    'load_in_4bit': None,
+    'bf16': None,
+    'tf32': None,
+    # 数据格式: "chat" = instruction/input/output JSONL；"text" = 纯文本继续预训练 (.txt/.md、其目录或已分词的 .bin)；
+    # "auto" 按路径判断。纯文本按 max_length 切成定长窗口，分词使用 tokenize_workers 个进程 (None = 自动)
+    'data_format': "auto",
+    'tokenize_workers': None,
+    # 多数据源混合 (data_path 为 "a.jsonl=0.7,b.jsonl=0.3") 时每个 epoch 的抽样条数 (None = 各数据源条数之和)
+    'mix_samples': None,
+    # 指令数据训练前先做去重与质量预处理 (data_dedup.py): 精确/近似重复、空回答与超过 max_length 的样本被丢弃而不是截断
+    'dedup': False,
+}
+
+DATA_FORMATS = ("auto", "chat", "text")
+
+def resolve_hyperparams(hyperparams=None):
+    unknown = set(hyperparams or {}) - set(DEFAULT_HYPERPARAMS)
+    if unknown:
+        raise ValueError(f"未知的超参数: {', '.join(sorted(unknown))}")
+    hp = dict(DEFAULT_HYPERPARAMS, **(hyperparams or {}))
+    if hp['data_format'] not in DATA_FORMATS:
+        raise ValueError(f"data_format 必须是 {', '.join(DATA_FORMATS)} 之一: {hp['data_format']}")
+    return hp
+
+def resolve_data_format(data_path, tokenized_data_path=None, data_format="auto"):
+    """返回 "chat" 或 "text"。"""
+    if data_format != "auto":
+        return data_format
+    return "text" if pretrain_data.is_text_data(tokenized_data_path or data_path) else "chat"
 
 # 主训练函数，接收GUI传来的参数和回调
-def start_training(base_model_name, data_path, output_dir, progress_queue, log_queue, lora_adapter_path=None):
-    
+def start_training(base_model_name, data_path, output_dir, progress_queue, log_queue, lora_adapter_path=None,
+                   cancel_event=None, pause_event=None, hyperparams=None, tokenized_data_path=None, eval_data_path=None):
+    """
+    hyperparams: 覆盖 DEFAULT_HYPERPARAMS 中的项。
+    tokenized_data_path: prepare_tokenized_dataset 保存的已分词数据集，给出时跳过加载与分词 data_path。
+    eval_data_path: 独立的验证集 (与训练数据格式相同)；不给出时按 eval_split 从训练数据中划分。
+    """
     # --- 日志重定向 ---
     # 创建一个处理器，将日志消息发送到队列
     class QueueHandler(logging.Handler):
@@ -114,120 +359,119 @@ def start_training(base_model_name, data_path, output_dir, progress_queue, log_q
     if logger.hasHandlers():
         logger.handlers.clear()
 
+    # 数据并行训练时 (distributed_train.launch 启动的进程) 只有 rank 0 保存适配器与训练摘要
+    rank, _, world_size = distributed_train.world_info()
+    main_process = rank == 0
+
     # 添加我们的队列处理器和文件处理器
     logger.addHandler(QueueHandler(log_queue))
     os.makedirs(output_dir, exist_ok=True)
-    file_handler = logging.FileHandler(os.path.join(output_dir, "training_log.log"))
+    file_handler = logging.FileHandler(os.path.join(output_dir, "training_log.log" if main_process else f"training_log.rank{rank}.log"))
     file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
     logger.addHandler(file_handler)
 
+    # 性能分析默认关闭 (空操作)；启用时结果写入 <output_dir>/profile
+    prof = profiling.session(os.path.join(output_dir, "profile"), "train" if main_process else f"train_rank{rank}").start()
     try:
         logger.info("训练流程开始。")
+        # 延迟导入训练框架 (若已在后台预热，这里几乎不耗时)
+        import torch
+        from transformers import AutoModelForCausalLM, TrainingArguments, Trainer, DataCollatorForSeq2Seq, BitsAndBytesConfig, EarlyStoppingCallback, default_data_collator
+        from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
+        from datasets import load_dataset, load_from_disk
+        ProgressCallback = get_progress_callback_class()
+        hp = resolve_hyperparams(hyperparams)
+        if world_size > 1:
+            distributed_train.init_process_group()
+            logger.info(f"数据并行训练: rank {rank}/{world_size} ({distributed_train.BACKEND})")
+        cuda = torch.cuda.is_available()
+        load_in_4bit = cuda if hp['load_in_4bit'] is None else hp['load_in_4bit']
+        bf16 = (cuda and torch.cuda.is_bf16_supported()) if hp['bf16'] is None else hp['bf16']
+        tf32 = cuda if hp['tf32'] is None else hp['tf32']
+        ControlCallback = get_control_callback_class()
         logger.info(f"使用基础模型: {base_model_name}")
         if lora_adapter_path:
             logger.info(f"使用 LoRA 适配器: {lora_adapter_path}")
         logger.info(f"数据路径: {data_path}")
         logger.info(f"输出目录: {output_dir}")
+        logger.info(f"超参数: {json.dumps({k: v for k, v in hp.items() if v != DEFAULT_HYPERPARAMS[k]}, ensure_ascii=False)}")
 
         # 1. 加载数据集
         logger.info("步骤 1: 加载并处理数据集...")
-        raw_dataset = load_dataset("json", data_files=data_path, split="train")
-        logger.info(f"成功加载 {len(raw_dataset)} 条数据。")
+        mixture = None if tokenized_data_path else data_mixing.parse_mixture(data_path)
+        if mixture:
+            text_data = data_mixing.mixture_format(mixture, hp['data_format']) == "text"
+            logger.info(f"多数据源混合训练: {data_mixing.format_mixture(mixture)}")
+        else:
+            text_data = resolve_data_format(data_path, tokenized_data_path, hp['data_format']) == "text"
+        if text_data:
+            logger.info("纯文本继续预训练模式。")
+        elif not tokenized_data_path and not mixture:
+            if hp['dedup']:
+                with prof.stage("dedup"):
+                    data_path = data_dedup.cached_dedup(data_path, base_model_name, hp['max_length'], log=logger.info)
+            raw_dataset = load_dataset("json", data_files=data_path, split="train")
+            logger.info(f"成功加载 {len(raw_dataset)} 条数据。")
 
         # 2. 加载分词器
         logger.info(f"步骤 2: 加载分词器 ({base_model_name})...")
-        tokenizer = AutoTokenizer.from_pretrained(base_model_name, trust_remote_code=True)
-        if tokenizer.pad_token is None:
-            tokenizer.pad_token = tokenizer.eos_token
-            logger.info(f"Tokenizer's pad_token 设置为 eos_token: {tokenizer.eos_token}")
-
-        # 3. 定义处理函数
-        def process_func(example):
-            # 构建符合Qwen-Chat模板的消息列表
-            messages = [
-                {"role": "system", "content": example['instruction']},
-                {"role": "user", "content": example['input']},
-                {"role": "assistant", "content": example['output']}
-            ]
-            
-            # 对完整的对话进行分词
-            tokenized_full = tokenizer.apply_chat_template(
-                messages,
-                tokenize=True,
-                add_generation_prompt=False, # 训练时不需要额外的生成提示
-                truncation=True,
-                max_length=1024,
-                return_tensors="pt"
-            )
-            
-            # 确保 tokenized_full 是一个 BatchEncoding 对象，并且有 input_ids 属性
-            # 或者是一个非空的 Tensor
-            labels = None
-            if isinstance(tokenized_full, dict) and 'input_ids' in tokenized_full:
-                labels = tokenized_full['input_ids'].clone()
-            elif isinstance(tokenized_full, torch.Tensor) and tokenized_full.numel() > 0:
-                labels = tokenized_full.clone()
-            else:
-                raise ValueError("Unexpected type or empty output for tokenized_full from tokenizer.apply_chat_template")
-            
-            # 对提示部分（system + user）进行分词，用于计算标签的忽略位置
-            prompt_messages = [
-                {"role": "system", "content": example['instruction']},
-                {"role": "user", "content": example['input']}
-            ]
-            
-            # 使用 apply_chat_template 处理提示部分
-            tokenized_prompt_output = tokenizer.apply_chat_template(
-                prompt_messages,
-                tokenize=True,
-                add_generation_prompt=True, # 确保这里包含 assistant 提示，与推理时一致
-                truncation=True,
-                max_length=1024, # 确保截断，避免过长序列
-                return_tensors="pt"
-            )
-            
-            # 确保 tokenized_prompt_output 是一个 BatchEncoding 对象，并且有 input_ids 属性
-            # 或者是一个非空的 Tensor
-            prompt_len = 0
-            if isinstance(tokenized_prompt_output, dict) and 'input_ids' in tokenized_prompt_output:
-                # 如果是 BatchEncoding 字典形式
-                prompt_len = tokenized_prompt_output['input_ids'].shape[1]
-            elif isinstance(tokenized_prompt_output, torch.Tensor) and tokenized_prompt_output.numel() > 0:
-                # 如果是 Tensor 形式且非空
-                prompt_len = tokenized_prompt_output.shape[1]
-            
-            # 创建标签，将提示部分的标签设为-100
-            # 确保 prompt_len 不会超出 labels 的维度
-            if prompt_len > 0 and labels is not None and prompt_len <= labels.shape[1]:
-                labels[:, :prompt_len] = -100
-            
-            return {
-                "input_ids": tokenized_full.input_ids.squeeze(0) if isinstance(tokenized_full, dict) else tokenized_full.squeeze(0), # 移除批次维度
-                "labels": labels.squeeze(0) # 移除批次维度
-            }
+        tokenizer = model_registry.get_tokenizer(base_model_name)
+        logger.info(f"pad_token: {tokenizer.pad_token}")
 
         # 5. 处理数据集
-        tokenized_dataset = raw_dataset.map(process_func, remove_columns=raw_dataset.column_names)
+        if mixture:
+            # 每个数据源单独分词并缓存 (与权重无关)，按权重惰性交错抽样
+            with prof.stage("tokenize"):
+                train_dataset, eval_dataset = data_mixing.build_mixture(mixture, base_model_name, tokenizer, hp, text_data,
+                                                                        eval_data_path, logger)
+        elif text_data:
+            # 分词一次写入 token 文件 (有缓存)，训练时通过 np.memmap 按窗口读取
+            with prof.stage("tokenize"):
+                token_path = pretrain_data.tokenize_text_files(base_model_name, tokenized_data_path or data_path,
+                                                               num_workers=hp['tokenize_workers'], log=logger.info)
+                eval_token_path = None
+                if eval_data_path:
+                    eval_token_path = pretrain_data.tokenize_text_files(base_model_name, eval_data_path,
+                                                                        num_workers=hp['tokenize_workers'], log=logger.info)
+            train_dataset, eval_dataset = pretrain_data.window_datasets(token_path, hp['max_length'], hp['eval_split'],
+                                                                        eval_token_path)
+            logger.info(f"训练窗口 {len(train_dataset)} 个 (每个 {hp['max_length']} tokens)"
+                        + (f"，验证窗口 {len(eval_dataset)} 个" if eval_dataset is not None else ""))
+        elif tokenized_data_path:
+            # 多个训练任务共享同一份已分词数据 (内存映射，不会重复分词)
+            tokenized_dataset = load_from_disk(tokenized_data_path)
+            logger.info(f"使用已分词的数据集: {tokenized_data_path} ({len(tokenized_dataset)} 条)")
+        else:
+            with prof.stage("tokenize"):
+                tokenized_dataset = tokenize_dataset(raw_dataset, tokenizer, hp['max_length'])
+        if not text_data and not mixture:
+            train_dataset, eval_dataset = split_eval_dataset(tokenized_dataset, tokenizer, hp, eval_data_path, logger)
         logger.info("数据集处理完毕。")
 
         # 6. 配置4-bit量化
-        logger.info("步骤 3: 配置4-bit量化...")
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.bfloat16
-        )
+        bnb_config = None
+        if load_in_4bit:
+            logger.info("步骤 3: 配置4-bit量化...")
+            bnb_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16
+            )
+        else:
+            logger.info("步骤 3: 未启用4-bit量化 (无 CUDA 或已在超参数中关闭)。")
 
         # 7. 加载基础模型
-        logger.info(f"步骤 4: 加载基础模型 ({base_model_name}) 并量化...")
-        model = AutoModelForCausalLM.from_pretrained(
-            base_model_name,
-            quantization_config=bnb_config,
-            trust_remote_code=True,
-            device_map="auto" # 自动选择设备
-        )
-        model = prepare_model_for_kbit_training(model)
-        logger.info("基础模型加载并量化完毕。")
+        logger.info(f"步骤 4: 加载基础模型 ({base_model_name})...")
+        with prof.stage("load_model"):
+            model = AutoModelForCausalLM.from_pretrained(
+                base_model_name,
+                quantization_config=bnb_config,
+                trust_remote_code=True,
+                device_map="auto" if world_size == 1 else distributed_train.device_map() # 自动选择设备；数据并行时每个进程一份完整模型
+            )
+        if load_in_4bit:
+            model = prepare_model_for_kbit_training(model)
+        logger.info("基础模型加载完毕。")
 
         # 8. 配置 LoRA
         logger.info("步骤 5: 配置 LoRA...")
@@ -238,10 +482,10 @@ def start_training(base_model_name, data_path, output_dir, progress_queue, log_q
         else:
             logger.info("从头开始创建新的 LoRA 适配器。")
             lora_config = LoraConfig(
-                r=16,
-                lora_alpha=32,
-                target_modules=["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
-                lora_dropout=0.1,
+                r=hp['lora_r'],
+                lora_alpha=hp['lora_alpha'],
+                target_modules=hp['target_modules'],
+                lora_dropout=hp['lora_dropout'],
                 bias="none",
                 task_type="CAUSAL_LM",
             )
@@ -250,42 +494,133 @@ def start_training(base_model_name, data_path, output_dir, progress_queue, log_q
 
         # 9. 配置训练参数
         logger.info("步骤 6: 配置训练参数...")
+        # save_strategy 只在这里给出一次，保留最佳检查点时由评估设置覆盖
+        eval_args = {'save_strategy': hp['save_strategy']}
+        keep_best = False
+        if eval_dataset is not None:
+            steps_per_epoch = max(1, math.ceil(len(train_dataset) / (hp['per_device_train_batch_size'] * hp['gradient_accumulation_steps'] * world_size)))
+            eval_steps = hp['eval_steps'] or steps_per_epoch
+            # 选择最佳检查点需要保存与评估同步；save_strategy="no" 时只评估、不保留最佳检查点
+            keep_best = hp['save_strategy'] != "no"
+            eval_args.update({
+                'eval_strategy': "steps",
+                'eval_steps': eval_steps,
+                'per_device_eval_batch_size': hp['per_device_eval_batch_size'],
+                'prediction_loss_only': True, # 评估只计算损失，不在显存中累积 logits
+            })
+            if keep_best:
+                eval_args.update({
+                    'save_strategy': "steps",
+                    'save_steps': eval_steps,
+                    'load_best_model_at_end': True,
+                    'metric_for_best_model': "eval_loss",
+                    'greater_is_better': False,
+                })
+            logger.info(f"每 {eval_steps} 步评估一次验证集 ({len(eval_dataset)} 条)。")
         training_args = TrainingArguments(
             output_dir=output_dir,
-            per_device_train_batch_size=1,
-            gradient_accumulation_steps=8,
+            per_device_train_batch_size=hp['per_device_train_batch_size'],
+            gradient_accumulation_steps=hp['gradient_accumulation_steps'],
             logging_steps=1,
-            num_train_epochs=8,
-            learning_rate=2e-4,
-            save_strategy="epoch",
-            save_total_limit=2,
-            lr_scheduler_type="cosine",
-            warmup_ratio=0.1,
-            bf16=True, 
-            tf32=True, 
+            num_train_epochs=hp['num_train_epochs'],
+            max_steps=hp['max_steps'],
+            learning_rate=hp['learning_rate'],
+            save_total_limit=hp['save_total_limit'],
+            lr_scheduler_type=hp['lr_scheduler_type'],
+            warmup_ratio=hp['warmup_ratio'],
+            seed=hp['seed'],
+            bf16=bf16,
+            tf32=tf32,
+            **eval_args,
+            **(distributed_train.training_args() if world_size > 1 else {})
         )
 
         # 10. 创建 Trainer
         logger.info("步骤 7: 创建 Trainer 并开始训练...")
-        data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+        # 按批次补齐 input_ids 和 labels，保留 process_func 中提示部分的 -100 掩码，只在 output 上计算损失；
+        # 纯文本窗口等长，直接堆叠
+        if text_data:
+            data_collator = default_data_collator
+        else:
+            data_collator = DataCollatorForSeq2Seq(tokenizer=tokenizer, padding=True, label_pad_token_id=-100)
+        source_collator = None
+        if mixture:
+            # 统计各数据源实际进入批次的 token 数，随进度事件与训练日志上报
+            data_collator = source_collator = data_mixing.SourceAccountingCollator(data_collator, train_dataset.names)
+        if world_size > 1:
+            # 取消/暂停由 rank 0 广播，所有进程在同一步停止；进度事件附带从所有进程汇总的吞吐量与各数据源 token 数
+            control_sync = distributed_train.ControlSync(cancel_event, pause_event)
+            control_callback = ControlCallback(control_sync.cancel)
+            data_collator = distributed_train.TokenCounter(data_collator)
+            extra_metrics = distributed_train.rank_metrics(data_collator, source_collator and source_collator.snapshot)
+            callbacks = [ProgressCallback(progress_queue, extra_metrics), control_sync.callback(), control_callback]
+        else:
+            control_callback = ControlCallback(cancel_event, pause_event)
+            callbacks = [ProgressCallback(progress_queue, source_collator and source_collator.snapshot), control_callback]
+        if mixture:
+            callbacks.append(data_mixing.source_tokens_callback(source_collator, logger))
+        if prof.active:
+            callbacks.append(profiling.trainer_callback(prof))
+        if keep_best and hp['early_stopping_patience']:
+            callbacks.append(EarlyStoppingCallback(early_stopping_patience=hp['early_stopping_patience'],
+                                                   early_stopping_threshold=hp['early_stopping_threshold']))
 
         trainer = Trainer(
             model=model,
             args=training_args,
-            train_dataset=tokenized_dataset,
+            train_dataset=train_dataset,
+            eval_dataset=eval_dataset,
             data_collator=data_collator,
-            callbacks=[ProgressCallback(progress_queue)]
+            callbacks=callbacks
         )
         
         # 11. 开始训练
-        trainer.train()
+        with prof.stage("train", trace=True, stepped=True):
+            trainer.train()
+        if control_callback.cancelled:
+            logger.info("训练已被用户取消，未保存最终适配器。")
+            progress_queue.put({'progress': -1, 'error': "训练已取消"})
+            return False
 
-        # 12. 保存最终的适配器
+        # 12. 保存最终的适配器 (启用评估时，Trainer 已在训练结束时载入验证损失最低的检查点)
         final_adapter_dir = os.path.join(output_dir, "final_lora_adapter")
-        model.save_pretrained(final_adapter_dir)
-        tokenizer.save_pretrained(final_adapter_dir)
+        source_snapshot = None
+        if mixture:
+            source_snapshot = source_collator.snapshot()
+            if world_size > 1:
+                source_snapshot = distributed_train.reduce_counts(source_snapshot) # 集合通信，所有进程都要调用
+        if not main_process:
+            logger.info("训练完成，适配器由 rank 0 保存。")
+            return True
+        with prof.stage("save"):
+            model.save_pretrained(final_adapter_dir)
+            tokenizer.save_pretrained(final_adapter_dir)
+            try:
+                import merge_verify
+                # 记录基座指纹，合并时据此发现 base_model_name_or_path 指向了别的模型
+                merge_verify.write_base_fingerprint(final_adapter_dir, base_model_name)
+            except Exception as e:
+                logger.warning(f"无法记录基座模型指纹: {e}")
+        summary = {'global_step': trainer.state.global_step, 'max_steps': trainer.state.max_steps,
+                   'best_eval_loss': trainer.state.best_metric, 'best_checkpoint': trainer.state.best_model_checkpoint,
+                   'stopped_early': keep_best and trainer.state.global_step < trainer.state.max_steps}
+        if world_size > 1:
+            summary['world_size'] = world_size
+        if mixture:
+            summary.update(source_snapshot)
+            logger.info(f"各数据源已训练的 tokens: {source_collator.describe()}")
+        with open(os.path.join(output_dir, "training_summary.json"), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        if summary['best_checkpoint']:
+            logger.info(f"最佳检查点: {summary['best_checkpoint']} (验证损失 {summary['best_eval_loss']:.4f})"
+                        + (f"，在第 {summary['global_step']}/{summary['max_steps']} 步提前停止" if summary['stopped_early'] else ""))
         logger.info(f"训练完成！最终适配器已保存至: {final_adapter_dir}")
-        progress_queue.put({'progress': 100, 'eta_seconds': 0, 'loss': 'N/A', 'done': True})
+        progress_queue.put({'progress': 100, 'eta_seconds': 0, 'loss': 'N/A', 'done': True,
+                            'best_eval_loss': summary['best_eval_loss']})
+        return True
     except Exception as e:
         logging.error(f"训练过程中发生错误: {e}", exc_info=True)
-        progress_queue.put({'progress': -1, 'error': str(e)})
\ No newline at end of file
+        progress_queue.put({'progress': -1, 'error': str(e)})
+        return False
+    finally:
+        prof.close()
@@ -0,0 +1,234 @@
+"""
+Virtualized chat transcript for the inference tab.
+
+A tk.Text holding every turn of a long session gets slow to insert into, scroll and lay out, so
+TranscriptView keeps only a window of about WINDOW_TURNS turns in the widget and fetches the others on
+demand from a paged source (ChatStore.turns / turn_count):
+
+- the scrollbar covers the whole session: its thumb is the visible part of the rendered window mapped onto
+  all turns, and dragging it to a turn outside the window renders the turns around that one;
+- scrolling (mouse wheel, keys) near the top or bottom edge of the window moves it by STEP_TURNS turns, the
+  view stays on the same turn;
+- the answer being generated is a "live" turn after the stored ones; it streams in with append_text and
+  becomes a normal turn with finish_turn, once the caller has stored it.
+
+Each rendered turn starts at the mark "turn<position>".
+"""
+import tkinter as tk
+from tkinter import ttk
+
+WINDOW_TURNS = 30
+STEP_TURNS = 10
+# 距离窗口边缘不到这个比例时加载相邻的轮次
+EDGE_FRACTION = 0.05
+HIGHLIGHT_MS = 2000
+
+
+class TranscriptView(ttk.Frame):
+    def __init__(self, parent, height=15, **kwargs):
+        ttk.Frame.__init__(self, parent, **kwargs)
+        self.text = tk.Text(self, state='disabled', wrap=tk.WORD, height=height)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.text.configure(yscrollcommand=self._on_text_scrolled)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.text.tag_config('highlight', background="#fff3b0")
+
+        # fetch(offset, limit) -> [{'user_text', 'assistant_text'}, ...]; count() -> 已保存的轮数
+        self.fetch = lambda offset, limit: []
+        self.count = lambda: 0
+        self.total = 0
+        self.first = self.last = 0  # 已渲染的轮次 [first, last)
+        self.live = None  # 正在生成的一轮: [用户消息, 已收到的回复]
+        self.shift_pending = False
+
+    def tag_config(self, *args, **kwargs):
+        return self.text.tag_config(*args, **kwargs)
+
+    # --- Source ---
+    def set_source(self, fetch, count, position=None):
+        """Shows another session; `position` is the turn to scroll to (default: the end)."""
+        self.fetch, self.count = fetch, count
+        self.live = None
+        self.total = count()
+        self.show_turn(self.total - 1 if position is None else position, highlight=position is not None)
+
+    def attach(self, fetch, count):
+        """Switches the source without rendering (the session of the turns on screen was just created)."""
+        self.fetch, self.count = fetch, count
+
+    def clear(self):
+        self.set_source(lambda offset, limit: [], lambda: 0)
+
+    # --- Rendering ---
+    def _insert_turn(self, position, user_text, assistant_text):
+        self.text.mark_set(f"turn{position}", tk.END + "-1c")
+        self.text.mark_gravity(f"turn{position}", tk.LEFT)
+        self.text.insert(tk.END, "User:\n", 'user_style')
+        self.text.insert(tk.END, f"{user_text}\n\n")
+        self.text.insert(tk.END, "Model:\n", 'model_style')
+        if assistant_text is not None:
+            self.text.insert(tk.END, f"{assistant_text}\n\n")
+
+    def _render(self, first, last):
+        self.first, self.last = first, last
+        self.text.config(state='normal')
+        self.text.delete("1.0", tk.END)
+        for mark in self.text.mark_names():
+            if mark.startswith("turn") or mark == "answer":
+                self.text.mark_unset(mark)
+        for offset, turn in enumerate(self.fetch(first, last - first) if last > first else []):
+            self._insert_turn(first + offset, turn['user_text'], turn['assistant_text'])
+        if self.live is not None and last == self.total:
+            self._insert_live()
+        self.text.config(state='disabled')
+
+    def _insert_live(self):
+        self._insert_turn(self.total, self.live[0], None)
+        self.text.mark_set("answer", tk.END + "-1c")
+        self.text.mark_gravity("answer", tk.LEFT)
+        self.text.insert(tk.END, self.live[1])
+
+    def _window_around(self, position):
+        first = max(0, min(position - WINDOW_TURNS // 2, self.total - WINDOW_TURNS))
+        return first, min(self.total, first + WINDOW_TURNS)
+
+    def show_turn(self, position, highlight=False):
+        """Renders the turns around `position` and scrolls it to the top (the end for the last turn)."""
+        if self.total == 0 and self.live is None:
+            self._render(0, 0)
+            return
+        position = max(0, min(position, self.total - 1))
+        self._render(*self._window_around(position))
+        if position >= self.total - 1 and not highlight:
+            self.text.yview(tk.END)
+            return
+        self.text.yview(f"turn{position}")
+        if highlight:
+            end = f"turn{position + 1}" if position + 1 < self.last else tk.END
+            self.text.tag_add('highlight', f"turn{position}", end)
+            self.after(HIGHLIGHT_MS, lambda: self.text.tag_remove('highlight', "1.0", tk.END))
+
+    def _top_turn(self):
+        """Position of the turn at the top of the view (None if nothing is rendered)."""
+        mark = self.text.mark_previous("@0,0 +1c")
+        while mark is not None and not mark.startswith("turn"):
+            mark = self.text.mark_previous(mark)
+        return int(mark[4:]) if mark is not None else (self.first if self.last > self.first else None)
+
+    def _shift(self, direction):
+        self.shift_pending = False
+        top = self._top_turn()
+        if direction < 0 and self.first > 0:
+            first = max(0, self.first - STEP_TURNS)
+            self._render(first, min(self.total, first + WINDOW_TURNS))
+        elif direction > 0 and self.last < self.total:
+            last = min(self.total, self.last + STEP_TURNS)
+            self._render(max(0, last - WINDOW_TURNS), last)
+        else:
+            return
+        if top is not None and self.first <= top < self.last:
+            self.text.yview(f"turn{top}")
+
+    # --- Scrolling ---
+    def _rows(self):
+        """Number of turns the scrollbar covers (stored + live)."""
+        return self.total + (1 if self.live is not None else 0)
+
+    def _on_text_scrolled(self, low, high):
+        low, high = float(low), float(high)
+        rows = self._rows()
+        rendered = self.last - self.first + (1 if self.live is not None and self.last == self.total else 0)
+        if rows and rendered:
+            # 已渲染窗口内的位置映射到整个会话
+            self.scrollbar.set((self.first + low * rendered) / rows, (self.first + high * rendered) / rows)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        if self.shift_pending:
+            return
+        if low < EDGE_FRACTION and self.first > 0:
+            self.shift_pending = True
+            self.after_idle(self._shift, -1)
+        elif high > 1 - EDGE_FRACTION and self.last < self.total:
+            self.shift_pending = True
+            self.after_idle(self._shift, 1)
+
+    def _on_scrollbar(self, *args):
+        if args[0] != 'moveto':
+            self.text.yview(*args)
+            return
+        rows = self._rows()
+        rendered = self.last - self.first + (1 if self.live is not None and self.last == self.total else 0)
+        target = float(args[1]) * rows
+        if not rendered or target < self.first or target > self.first + rendered or (
+                target < self.first + 1 and self.first > 0) or (target > self.last - 1 and self.last < self.total):
+            # 拖到窗口之外：渲染目标轮次附近的轮次
+            self.show_turn(int(target))
+            return
+        self.text.yview_moveto((target - self.first) / rendered)
+
+    def at_end(self):
+        return self.last == self.total and self.text.yview()[1] >= 0.999
+
+    # --- Streaming ---
+    def begin_turn(self, user_text):
+        """Adds the live turn for a new message; its answer follows with append_text."""
+        self.live = [user_text, ""]
+        if self.last < self.total:
+            self._render(*self._window_around(self.total))
+        else:
+            self.text.config(state='normal')
+            self._insert_live()
+            self.text.config(state='disabled')
+        self.text.yview(tk.END)
+
+    def append_text(self, text):
+        if self.live is None:
+            return
+        self.live[1] += text
+        if self.last == self.total:
+            follow = self.at_end()
+            self.text.config(state='normal')
+            self.text.insert(tk.END, text)
+            self.text.config(state='disabled')
+            if follow:
+                self.text.yview(tk.END)
+
+    def finish_turn(self, response, stored=True):
+        """
+        Replaces the streamed text with the final answer. With `stored` the turn is now part of the source
+        (the caller saved it); otherwise it stays on screen only until the next render.
+        """
+        if self.live is None:
+            return
+        self.live[1] = response
+        follow = self.at_end()
+        if self.last == self.total:
+            self.text.config(state='normal')
+            self.text.delete("answer", tk.END)
+            self.text.insert(tk.END, f"{response}\n\n")
+            self.text.mark_unset("answer")
+            self.text.config(state='disabled')
+            if stored:
+                self.last += 1
+        self.live = None
+        if stored:
+            self.total += 1
+        if follow:
+            self.text.yview(tk.END)
+            if self.last - self.first > WINDOW_TURNS + STEP_TURNS:
+                # 一直跟随到底部时，丢弃最上面的轮次，保持窗口大小
+                self._render(self.last - WINDOW_TURNS, self.last)
+                self.text.yview(tk.END)
+
+    def abort_turn(self):
+        """Removes the live turn (the request failed)."""
+        if self.live is None:
+            return
+        self.live = None
+        if self.last == self.total:
+            self.text.config(state='normal')
+            self.text.delete(f"turn{self.total}", tk.END)
+            self.text.mark_unset(f"turn{self.total}")
+            self.text.mark_unset("answer")
+            self.text.config(state='disabled')